@@ -1,13 +1,46 @@
 from __future__ import print_function, division, absolute_import, unicode_literals
 __author__ = 'sibirrer'
 
-from astropy.cosmology import FlatLambdaCDM
+import numpy as np
+
 import MultiLens.Utils.constants as const
 
+_COSMO_REGISTRY = {}
+
+
+def cosmology_from_config(config):
+    """
+    reads the cosmological parameters of a (pycosmo) configuration module, e.g.
+    get_cosmo(**cosmology_from_config(MultiLens.Cosmo.pycosmo_config_planck2013))
+
+    :param config: configuration module (or object) with the attributes h, omega_m and omega_b
+    :return: dictionary with H0, Om0 and Ob0
+    """
+    return {'H0': config.h*100, 'Om0': config.omega_m, 'Ob0': config.omega_b}
+
+
+def get_cosmo(H0=70, Om0=0.3, Ob0=0.05):
+    """
+    returns the shared CosmoProp instance of the given cosmological parameters (created on first request).
+    All lens objects and tracers with the same parameters share one instance and thereby its distance cache.
+
+    :param H0: Hubble constant [km/s/Mpc]
+    :param Om0: matter density
+    :param Ob0: baryon density
+    :return: CosmoProp instance
+    """
+    key = (float(H0), float(Om0), float(Ob0))
+    if key not in _COSMO_REGISTRY:
+        _COSMO_REGISTRY[key] = CosmoProp(*key)
+    return _COSMO_REGISTRY[key]
+
 
 class CosmoProp(object):
     """
     class to compute cosmological distances
+
+    The parameters are fixed at construction. The astropy cosmology is only imported and built at the first distance
+    computation and the comoving distances of scalar redshifts are cached. Use get_cosmo() to share instances.
     """
     def __init__(self, H0=70, Om0=0.3, Ob0=0.05):
         """
@@ -15,7 +48,34 @@ class CosmoProp(object):
         :param param_file: parameter file for pycosmo
         :return:
         """
-        self.cosmo = FlatLambdaCDM(H0=H0, Om0=Om0, Ob0=Ob0)
+        self._H0, self._Om0, self._Ob0 = H0, Om0, Ob0
+        self._cosmo = None
+        self._comoving_cache = {}
+
+    # shape of the distances of a scalar redshift (see CosmoBatch)
+    batch_shape = ()
+
+    @property
+    def H0(self):
+        return self._H0
+
+    @property
+    def Om0(self):
+        return self._Om0
+
+    @property
+    def Ob0(self):
+        return self._Ob0
+
+    @property
+    def cosmo(self):
+        """
+        astropy FlatLambdaCDM instance (built on first use)
+        """
+        if self._cosmo is None:
+            from astropy.cosmology import FlatLambdaCDM
+            self._cosmo = FlatLambdaCDM(H0=self._H0, Om0=self._Om0, Ob0=self._Ob0)
+        return self._cosmo
 
     def a_z(self, z):
         """
@@ -23,6 +83,18 @@ class CosmoProp(object):
         """
         return 1./(1+z)
 
+    def comoving_transverse_distance(self, z):
+        """
+        transverse comoving distance from the observer in units of Mpc (cached for scalar redshifts)
+        :param z: redshift
+        :return:
+        """
+        if isinstance(z, (int, float)):
+            if z not in self._comoving_cache:
+                self._comoving_cache[z] = self.cosmo.comoving_transverse_distance(z).value
+            return self._comoving_cache[z]
+        return self.cosmo.comoving_transverse_distance(z).value
+
     def D_xy(self, z_observer, z_source):
         """
         angular diamter distance in units of Mpc
@@ -31,8 +103,8 @@ class CosmoProp(object):
         :return:
         """
         a_S = self.a_z(z_source)
-        D_xy = (self.cosmo.comoving_transverse_distance(z_source) - self.cosmo.comoving_transverse_distance(z_observer))*a_S
-        return D_xy.value
+        D_xy = (self.comoving_transverse_distance(z_source) - self.comoving_transverse_distance(z_observer))*a_S
+        return D_xy
 
     def T_xy(self, z_observer, z_source):
         """
@@ -41,8 +113,8 @@ class CosmoProp(object):
         :param z_source: source
         :return:
         """
-        T_xy = self.cosmo.comoving_transverse_distance(z_source) - self.cosmo.comoving_transverse_distance(z_observer)
-        return T_xy.value
+        T_xy = self.comoving_transverse_distance(z_source) - self.comoving_transverse_distance(z_observer)
+        return T_xy
 
     def arcsec2phys(self, arcsec, z):
         """
@@ -51,4 +123,72 @@ class CosmoProp(object):
         :param z:
         :return:
         """
-        return self.D_xy(0, z)*arcsec*const.arcsec
\ No newline at end of file
+        return self.D_xy(0, z)*arcsec*const.arcsec
+
+
+class CosmoBatch(CosmoProp):
+    """
+    class to compute the cosmological distances of a batch of flat LambdaCDM cosmologies at once
+
+    The distances of a scalar redshift are columns of shape (number of cosmologies, 1), such that they broadcast
+    against flat arrays of rays and the tracers (MultiLens, AnalyticLens) trace the rays of all the cosmologies in a
+    single call, with a leading cosmology axis. The distances of arrays of redshifts have the shape
+    (number of cosmologies,) + shape of the redshifts. The comoving distances are integrated with Gauss-Legendre
+    quadrature for all the cosmologies together (without radiation, as the astropy FlatLambdaCDM used by CosmoProp).
+    """
+    def __init__(self, H0=70, Om0=0.3, Ob0=0.05, n_quad=48):
+        """
+
+        :param H0: Hubble constants [km/s/Mpc] (scalar or 1d array)
+        :param Om0: matter densities (scalar or 1d array)
+        :param Ob0: baryon densities (scalar or 1d array)
+        :param n_quad: number of nodes of the quadrature
+        :return:
+        """
+        H0, Om0, Ob0 = np.broadcast_arrays(np.atleast_1d(np.asarray(H0, dtype=float)),
+                                           np.atleast_1d(np.asarray(Om0, dtype=float)),
+                                           np.atleast_1d(np.asarray(Ob0, dtype=float)))
+        if H0.ndim != 1:
+            raise ValueError("cosmological parameters of shape %s not valid." % (H0.shape,))
+        super(CosmoBatch, self).__init__(H0.copy(), Om0.copy(), Ob0.copy())
+        self.batch_shape = (len(H0), 1)
+        self._nodes, self._weights = np.polynomial.legendre.leggauss(n_quad)
+
+    def __len__(self):
+        return len(self._H0)
+
+    def __getitem__(self, i):
+        """
+        shared CosmoProp instance of the i'th cosmology (see get_cosmo())
+        """
+        return get_cosmo(self._H0[i], self._Om0[i], self._Ob0[i])
+
+    @property
+    def cosmo(self):
+        raise ValueError("a batch of cosmologies has no astropy cosmology, use cosmo[i].cosmo for the i'th one.")
+
+    def comoving_transverse_distance(self, z):
+        """
+        transverse comoving distances from the observer in units of Mpc (cached for scalar redshifts)
+        :param z: redshift
+        :return: (number of cosmologies, 1) for scalar z, (number of cosmologies,) + shape of z otherwise
+        """
+        if isinstance(z, (int, float)):
+            if z not in self._comoving_cache:
+                self._comoving_cache[z] = self._comoving(np.array([float(z)])).reshape(self.batch_shape)
+            return self._comoving_cache[z]
+        z = np.asarray(z, dtype=float)
+        return self._comoving(z.ravel()).reshape((len(self),) + z.shape)
+
+    def _comoving(self, z):
+        """
+        comoving distances of a 1d array of redshifts (flat cosmologies)
+
+        :return: array of shape (number of cosmologies, len(z))
+        """
+        # quadrature nodes of the intervals [0, z]
+        z_quad = z[:, np.newaxis] * (self._nodes + 1) / 2.
+        Om0 = self._Om0[:, np.newaxis, np.newaxis]
+        E = np.sqrt(Om0 * (1 + z_quad)**3 + 1 - Om0)
+        integral = np.sum(self._weights / E, axis=-1) * z / 2.
+        return const.c / 1000. / self._H0[:, np.newaxis] * integral
@@ -12,96 +12,481 @@ import copy
 
 # MultiLens imports
 from MultiLens.analytic_lens import AnalyticLens
-from MultiLens.Cosmo.cosmo import CosmoProp
+from MultiLens.born import BornLens
+from MultiLens.Cosmo.cosmo import CosmoBatch, get_cosmo
+from MultiLens.gradient import GradientLens
+import MultiLens.ray_set as ray_set
+import MultiLens.Utils.constants as const
+from MultiLens.Utils.instrumentation import NULL_INSTRUMENTATION
+
+# minimal number of smooth lenses in a plane to evaluate them on the sub-grid of the multi-resolution mode
+_COARSE_MIN = 2
 
 class MultiLens(object):
     """
     this class aims to compute the lensing quantities of multi-plane lenses with full ray-tracing and approximation methods
+
+    With a CosmoBatch instance, the rays are traced for all the cosmologies of the batch at once: the distances are
+    columns along the cosmologies, the lenses are placed per cosmology and the source positions have the shape
+    (number of cosmologies,) + shape of the rays. The profile parameters are physical and shared by all the cosmologies.
+    full_ray_tracing() (without slabs, tiers, culling or multi-resolution), combined_ray_tracing(), born_ray_tracing(),
+    analytic_mapping() and analytic_matrices() support batches.
     """
 
-    def __init__(self):
-        self.analyticLens = AnalyticLens()
-        self.cosmo = CosmoProp()
+    def __init__(self, instrumentation=None, cosmo=None):
+        """
+
+        :param instrumentation: Instrumentation instance recording the time spent per plane, profile and section
+         (None for no instrumentation)
+        :param cosmo: CosmoProp or CosmoBatch instance (default: get_cosmo())
+        :return:
+        """
+        if cosmo is None:
+            cosmo = get_cosmo()
+        self.cosmo = cosmo
+        self.analyticLens = AnalyticLens(instrumentation=instrumentation, cosmo=cosmo)
+        if isinstance(cosmo, CosmoBatch):
+            cosmo = None
+        self.bornLens = BornLens(instrumentation=instrumentation, cosmo=cosmo)
+        self.gradientLens = GradientLens(instrumentation=instrumentation, cosmo=cosmo)
+        self.set_instrumentation(instrumentation)
 
-    def full_ray_tracing(self, lensAssembly, z_source, x_array, y_array, observer_frame=True):
+    def set_instrumentation(self, instrumentation=None):
+        """
+        enables (or disables with None) the instrumentation of the tracing routines
+        :param instrumentation: Instrumentation instance or None
+        :return:
+        """
+        if instrumentation is None:
+            instrumentation = NULL_INSTRUMENTATION
+        self.instrumentation = instrumentation
+        self.analyticLens.instrumentation = instrumentation
+        self.bornLens.instrumentation = instrumentation
+        self.gradientLens.instrumentation = instrumentation
+
+    def full_ray_tracing(self, lensAssembly, z_source, x_array, y_array=None, observer_frame=True, n_slabs=None,
+                         tiered=False, cull_tolerance=None, multi_resolution=None, coarse_factor=4, fermat=False):
         """
         full ray-tracing routine (eqn 10,11 in Birrer in prep), implemented with equation 12 in a recursive way
         (!assuming flat cosmology!)
+        Lens objects at identical redshift are treated as a single lens plane. With n_slabs, the lenses are binned into
+        redshift slabs of equal comoving depth and each slab is traced as a single lens plane (see slab_tracing_error()
+        for the error of this approximation).
+        With tiered=True, the approximation tier of each lens object is honoured (see LensObject.tier and
+        Tiering.assign()): only the 'full' lenses enter the recursion, the 'born' lenses are added in the Born
+        approximation, the 'tidal' lenses with their hessian at the origin and the 'skip' lenses are ignored.
+        With cull_tolerance, truncated lens objects (see LensObject.set_truncation()) far from the ray bundle are
+        approximated (see _cull()). Tracing the field in tiles then evaluates only the lenses near each tile exactly.
+        With multi_resolution, the rays need to be arranged on a regular grid (see ray_set.grid_shape()). The lens
+        objects whose deflection is smooth over the grid are then evaluated on a sub-grid of every coarse_factor'th ray
+        and expanded to the other rays (see _coarse()), the main deflector and lenses close to the rays are evaluated
+        at full resolution.
+        With fermat=True, the multi-plane arrival time (Fermat potential) of the rays is accumulated in the same
+        recursion: the geometric delay between each pair of consecutive planes (and the source) minus the (1+z)
+        weighted lensing potentials of the lenses (see LensObject.potential()).
         :param object_list: list of sources with specified physical deflection angles (sorted by redshift)
         :param z_source: redshift of the source
-        :param x_array: x-coords of the rays
-        :param y_array: y-coords of the rays
-        :return: deflections delta x_coords, delta y_coords such that x_source = x - delta x_source
+        :param x_array: x-coords of the rays (or RaySet instance)
+        :param y_array: y-coords of the rays (None if x_array is a RaySet)
+        :param n_slabs: number of redshift slabs (None for exact tracing)
+        :param tiered: bool, if True, honours the approximation tiers of the lens objects
+        :param cull_tolerance: tolerated error per culled lens in arc seconds (None for no culling)
+        :param multi_resolution: tolerated interpolation error per lens in arc seconds (None for evaluating all the
+         lenses at full resolution)
+        :param coarse_factor: spacing of the sub-grid in rays
+        :param fermat: bool, if True, also returns the arrival times of the rays
+        :return: deflections delta x_coords, delta y_coords such that x_source = x - delta x_source (and the arrival
+         times in days, modulo a constant, with fermat=True)
         """
+        if fermat and (tiered or cull_tolerance is not None or multi_resolution is not None):
+            raise ValueError("arrival times not valid with tiers, culling or multi-resolution.")
+        if self._batch and (n_slabs is not None or tiered or cull_tolerance is not None
+                            or multi_resolution is not None):
+            raise ValueError("slabs, tiers, culling and multi-resolution not valid for a batch of cosmologies.")
+        if multi_resolution is not None:
+            coarse_grid = _coarse_grid(ray_set.grid_shape(x_array, y_array), coarse_factor)
+        x_array, y_array = ray_set.coordinates(x_array, y_array)
+        shape = np.shape(x_array)
+        x_array, y_array = self._batch_rays(x_array, y_array)
+        instrumentation = self.instrumentation
         if observer_frame:
-            self._full_ray_tracing_observer(lensAssembly)
-        object_list = lensAssembly.object_array
+            with instrumentation.section('observer_frame'):
+                self._full_ray_tracing_observer(lensAssembly, tiered=tiered)
+        tiers = ('full',) if tiered else None
+        if n_slabs is None:
+            planes = self._lens_planes(lensAssembly, z_source, tiers=tiers)
+        else:
+            planes = self._slab_planes(lensAssembly, z_source, n_slabs, tiers=tiers)
         alpha_x_tot = copy.deepcopy(x_array)
         alpha_y_tot = copy.deepcopy(y_array)
         x_k = np.zeros_like(alpha_x_tot)
         y_k = np.zeros_like(alpha_x_tot)
-        z_last = 0
-        for lensObject in object_list:
-            z = lensObject.redshift
-            if z < z_source:
-                T_k_last = self.cosmo.T_xy(z_last, z)
-                x_k += alpha_x_tot*T_k_last
-                y_k += alpha_y_tot*T_k_last
-                x_k_phys, y_k_phys = x_k/(1+z), y_k/(1+z)
-                alpha_x, alpha_y = lensObject.deflection(x_k_phys, y_k_phys)
+        if fermat:
+            fermat_potential = np.zeros_like(x_k)
+        n_rays = np.size(x_array)
+        chi_last = 0
+        for i, (chi, lens_list) in enumerate(planes):
+            T_k_last = chi - chi_last
+            x_k += alpha_x_tot*T_k_last
+            y_k += alpha_y_tot*T_k_last
+            if fermat:
+                with instrumentation.section('fermat', n_rays=n_rays, plane=i):
+                    theta_x, theta_y = x_k/chi, y_k/chi
+                    if i > 0:
+                        fermat_potential += _geometric_delay(theta_x, theta_y, chi, theta_x_last, theta_y_last,
+                                                             chi_last)
+                    for lensObject in lens_list:
+                        z = lensObject.redshift
+                        fermat_potential -= (1+z)*lensObject.potential(x_k/(1+z), y_k/(1+z))
+                    theta_x_last, theta_y_last = theta_x, theta_y
+            if cull_tolerance is not None:
+                with instrumentation.section('culling', n_rays=n_rays, plane=i):
+                    plane = None
+                    if n_slabs is None and not tiered:
+                        plane = lensAssembly._culling_columns(lensAssembly._culling_plane(lens_list[0].redshift))
+                    lens_list, alpha_x, alpha_y = self._cull(lens_list, x_k, y_k, cull_tolerance*const.arcsec,
+                                                             plane=plane)
                 alpha_x_tot -= alpha_x
                 alpha_y_tot -= alpha_y
-                z_last = z
-            else:
-                pass
-        T_k_last = self.cosmo.T_xy(z_last, z_source)
-        D_s = self.cosmo.D_xy(0, z_source)
+            if multi_resolution is not None and coarse_grid is not None:
+                with instrumentation.section('multi_resolution', n_rays=n_rays, plane=i):
+                    lens_list, alpha_x, alpha_y = self._coarse(lens_list, x_k, y_k, coarse_grid,
+                                                               multi_resolution*const.arcsec)
+                alpha_x_tot -= alpha_x
+                alpha_y_tot -= alpha_y
+            for lensObject in lens_list:
+                z = lensObject.redshift
+                with instrumentation.section('deflection', n_rays=n_rays, plane=i, profile=lensObject.type):
+                    alpha_x, alpha_y = lensObject.deflection(x_k/(1+z), y_k/(1+z))
+                alpha_x_tot -= alpha_x
+                alpha_y_tot -= alpha_y
+            chi_last = chi
+        with instrumentation.section('distances'):
+            T_k_last = self.cosmo.comoving_transverse_distance(z_source) - chi_last
+            D_s = self.cosmo.D_xy(0, z_source)
         x_k += alpha_x_tot*T_k_last
         y_k += alpha_y_tot*T_k_last
         x_s_phys, y_s_phys = x_k/(1+z_source), y_k/(1+z_source)
         beta_sx = x_s_phys / D_s
         beta_sy = y_s_phys / D_s
+        if tiered:
+            beta_sx, beta_sy = self._weak_tiers(lensAssembly, z_source, x_array, y_array, beta_sx, beta_sy)
+        if fermat:
+            if len(planes) > 0:
+                fermat_potential += _geometric_delay(beta_sx, beta_sy, chi_last + T_k_last, theta_x_last, theta_y_last,
+                                                     chi_last)
+            arrival_time = fermat_potential * const.Mpc / const.c / const.day_s
+            return (self._batch_shape(beta_sx, shape), self._batch_shape(beta_sy, shape),
+                    self._batch_shape(arrival_time, shape))
+        return self._batch_shape(beta_sx, shape), self._batch_shape(beta_sy, shape)
+
+    def time_delays(self, lensAssembly, z_source, x_image, y_image, observer_frame=True):
+        """
+        time delays between the images of point sources from the arrival times of a single full ray-tracing through
+        all the images (see full_ray_tracing() with fermat=True)
+        :param z_source: redshift of the source
+        :param x_image: x-coords of the images in arc seconds (1d array of the images of a source or 2d array of shape
+         (number of sources, number of images))
+        :param y_image: y-coords of the images in arc seconds
+        :return: time delays in days relative to the first image of each source (shape of x_image, with a leading axis
+         along the cosmologies for a batch)
+        """
+        x_image = np.asarray(x_image, dtype=float) * const.arcsec
+        y_image = np.asarray(y_image, dtype=float) * const.arcsec
+        if x_image.ndim not in (1, 2) or x_image.shape != y_image.shape:
+            raise ValueError("image positions of shape %s and %s not valid." % (x_image.shape, y_image.shape))
+        beta_x, beta_y, arrival_time = self.full_ray_tracing(lensAssembly, z_source, x_image, y_image,
+                                                             observer_frame=observer_frame, fermat=True)
+        return arrival_time - arrival_time[..., :1]
+
+    def full_ray_tracing_gradient(self, lensAssembly, z_source, x_array, y_array=None, params=None):
+        """
+        full ray-tracing (in the observer frame) with the derivatives of the source positions with respect to the
+        parameters of the lens objects (see GradientLens)
+        :param z_source: redshift of the source
+        :param x_array: x-coords of the rays (or RaySet instance)
+        :param y_array: y-coords of the rays (None if x_array is a RaySet)
+        :param params: list of (lens id, parameter name) (default: all parameters, see GradientLens.parameters())
+        :return: beta_x, beta_y, d beta_x/d params, d beta_y/d params
+        """
+        if self._batch:
+            raise ValueError("gradients not valid for a batch of cosmologies.")
+        return self.gradientLens.ray_shooting(lensAssembly, z_source, x_array, y_array, params=params)
+
+    def full_ray_tracing_adjoint(self, lensAssembly, z_source, x_array, y_array, v_x, v_y, params=None):
+        """
+        full ray-tracing (in the observer frame) with the derivatives of sum(v_x*beta_x + v_y*beta_y) with respect to
+        the parameters of the lens objects, at a cost independent of the number of parameters (see GradientLens)
+        :param z_source: redshift of the source
+        :param x_array: x-coords of the rays
+        :param y_array: y-coords of the rays
+        :param v_x: weights of beta_x (e.g. d chi^2/d beta_x)
+        :param v_y: weights of beta_y
+        :param params: list of (lens id, parameter name) (default: all parameters, see GradientLens.parameters())
+        :return: beta_x, beta_y, derivatives along params
+        """
+        if self._batch:
+            raise ValueError("gradients not valid for a batch of cosmologies.")
+        return self.gradientLens.adjoint(lensAssembly, z_source, x_array, y_array, v_x, v_y, params=params)
+
+    def _cull(self, lens_list, x_k, y_k, tolerance, plane=None):
+        """
+        culls the truncated lens objects of a lens plane against the bounding box of the ray bundle. Lenses whose
+        truncation radius does not reach the bounding box deflect the rays as point masses (see
+        LensObject.monopole()). Their deflections are summed in a linear expansion around the center of the bundle if
+        the error of the expansion is below the tolerance.
+        With plane (see LensAssembly._culling_plane()), the lenses reaching the bundle are looked up in the GridIndex of
+        the plane and the positions and monopoles are taken from its cached columns, such that only the lenses near
+        the bundle (or exceeding the tolerance) are handled one by one. Otherwise, they are collected from lens_list.
+
+        :param lens_list: lens objects of the plane
+        :param x_k: comoving x-coords of the rays at the plane
+        :param y_k: comoving y-coords of the rays at the plane
+        :param tolerance: tolerated error per culled lens (in radian)
+        :param plane: dictionary of LensAssembly._culling_plane() of the plane of lens_list (None to collect the lenses
+         from lens_list)
+        :return: lens objects to be evaluated exactly, summed deflections (x and y) of the culled lenses
+        """
+        x_min, x_max, y_min, y_max = np.min(x_k), np.max(x_k), np.min(y_k), np.max(y_k)
+        if plane is None:
+            truncated = [lensObject for lensObject in lens_list if lensObject.r_trunc is not None]
+            exact = [lensObject for lensObject in lens_list if lensObject.r_trunc is None]
+            if not truncated:
+                return exact, 0, 0
+            scale = np.array([1. + lensObject.redshift for lensObject in truncated])
+            pos_x = np.array([lensObject.kwargs_param.get('pos_x', 0) for lensObject in truncated])
+            pos_y = np.array([lensObject.kwargs_param.get('pos_y', 0) for lensObject in truncated])
+            r_trunc = np.array([lensObject.r_trunc for lensObject in truncated])
+            candidates = np.arange(len(truncated))
+        else:
+            truncated, exact = plane['truncated'], list(plane['exact'])
+            if not truncated:
+                return exact, 0, 0
+            scale = 1. + truncated[0].redshift
+            pos_x, pos_y, r_trunc = plane['pos_x'], plane['pos_y'], plane['r_trunc']
+            # bounding box in arc seconds, widened by the truncation radii and the shifts from the indexed positions
+            to_arcsec, margin = 1. / (scale * plane['factor']), plane['margin']
+            candidates = plane['index'].query_box(x_min*to_arcsec - margin, x_max*to_arcsec + margin,
+                                                  y_min*to_arcsec - margin, y_max*to_arcsec + margin)
+        # positions, truncation radii and monopoles in comoving units
+        pos_x, pos_y, r_trunc = pos_x * scale, pos_y * scale, r_trunc * scale
+        # distance of the lenses to the bounding box of the rays
+        d_x = np.maximum(0, np.maximum(x_min - pos_x, pos_x - x_max))
+        d_y = np.maximum(0, np.maximum(y_min - pos_y, pos_y - y_max))
+        d_box = np.sqrt(d_x**2 + d_y**2)
+        near = np.zeros(len(truncated), dtype=bool)
+        near[candidates] = d_box[candidates] <= r_trunc[candidates]
+        if plane is None:
+            monopole = np.array([0. if near[k] else lensObject.monopole() for k, lensObject in enumerate(truncated)])
+        else:
+            monopole = np.where(near, 0., plane['monopole'])
+        monopole = monopole * scale
+        c_x, c_y = (x_min + x_max) / 2., (y_min + y_max) / 2.
+        r_bundle = np.sqrt((x_max - x_min)**2 + (y_max - y_min)**2) / 2.
+        # second order remainder of the linear expansion of the point mass deflection over the bundle
+        error = monopole * r_bundle**2 / np.maximum(d_box, r_trunc)**3
+        linear = ~near & (error < tolerance)
+        exact += [truncated[k] for k in np.where(~linear)[0]]
+        if not np.any(linear):
+            return exact, 0, 0
+        linear_index = np.where(linear)[0]
+        A, p_x, p_y = monopole[linear], pos_x[linear], pos_y[linear]
+        d_x, d_y = c_x - p_x, c_y - p_y
+        d2 = d_x**2 + d_y**2
+        # deflection at the center of the bundle relative to the one at the origin (see LensObject.deflection())
+        a_x, a_y = A*d_x/d2, A*d_y/d2
+        r2 = p_x**2 + p_y**2
+        origin_outside = r2 > r_trunc[linear]**2
+        a_x -= np.where(origin_outside, -A*p_x/np.where(origin_outside, r2, 1.), 0)
+        a_y -= np.where(origin_outside, -A*p_y/np.where(origin_outside, r2, 1.), 0)
+        for k in np.where(~origin_outside)[0]:
+            f_x0, f_y0 = truncated[linear_index[k]]._derivative(0, 0)
+            a_x[k] -= f_x0
+            a_y[k] -= f_y0
+        h = A / d2**2
+        h_xx, h_xy = np.sum(h*(d_y**2 - d_x**2)), np.sum(-2*h*d_x*d_y)
+        alpha_x = np.sum(a_x) + h_xx*(x_k - c_x) + h_xy*(y_k - c_y)
+        alpha_y = np.sum(a_y) + h_xy*(x_k - c_x) - h_xx*(y_k - c_y)
+        return exact, alpha_x, alpha_y
+
+    def _coarse(self, lens_list, x_k, y_k, coarse_grid, tolerance):
+        """
+        evaluates the smooth lens objects of a lens plane (deflection and hessian) on a sub-grid of the rays and expands
+        their deflections to first order around the nearest node of each ray. The error of the expansion of a lens is
+        estimated from the change of its hessian between neighbouring nodes (third derivatives of the potential) and
+        the largest distance of a ray from its node. Lenses exceeding the tolerance and the main deflector are left for
+        the evaluation at full resolution, as are all the lenses of planes with less than _COARSE_MIN smooth lenses
+        (where the expansion costs more than it saves).
+
+        :param lens_list: lens objects of the plane
+        :param x_k: comoving x-coords of the rays at the plane
+        :param y_k: comoving y-coords of the rays at the plane
+        :param coarse_grid: sub-grid of the rays (see _coarse_grid())
+        :param tolerance: tolerated error per lens (in radian)
+        :return: lens objects to be evaluated at full resolution, summed deflections (x and y) of the other lenses
+        """
+        nodes, node_shape, nearest = coarse_grid
+        candidates = [lensObject for lensObject in lens_list if not lensObject.main]
+        if len(candidates) < _COARSE_MIN:
+            return lens_list, 0, 0
+        x_flat, y_flat = np.ravel(x_k), np.ravel(y_k)
+        x_c = np.take(x_flat, nodes).reshape(node_shape)
+        y_c = np.take(y_flat, nodes).reshape(node_shape)
+        d_x = x_flat - np.take(x_c, nearest)
+        d_y = y_flat - np.take(y_c, nearest)
+        d2_max = np.max(d_x**2 + d_y**2)
+        exact = [lensObject for lensObject in lens_list if lensObject.main]
+        smooth = []
+        for lensObject in candidates:
+            z = lensObject.redshift
+            x_phys, y_phys = x_c/(1+z), y_c/(1+z)
+            f_xx, f_yy, f_xy = lensObject.distortion(x_phys, y_phys)
+            third = _third_derivative(x_phys, y_phys, f_xx, f_yy, f_xy)
+            if third * d2_max/(1+z)**2 / 2. <= tolerance:
+                smooth.append((lensObject, x_phys, y_phys, f_xx, f_yy, f_xy))
+            else:
+                exact.append(lensObject)
+        if len(smooth) < _COARSE_MIN:
+            return lens_list, 0, 0
+        terms = np.zeros((5,) + node_shape)
+        for lensObject, x_phys, y_phys, f_xx, f_yy, f_xy in smooth:
+            alpha_x, alpha_y = lensObject.deflection(x_phys, y_phys)
+            # hessian with respect to the comoving coordinates
+            z = lensObject.redshift
+            terms += (alpha_x, alpha_y, f_xx/(1+z), f_yy/(1+z), f_xy/(1+z))
+        alpha_x, alpha_y, f_xx, f_yy, f_xy = [np.take(term, nearest) for term in terms]
+        alpha_x += f_xx*d_x + f_xy*d_y
+        alpha_y += f_xy*d_x + f_yy*d_y
+        return exact, alpha_x.reshape(np.shape(x_k)), alpha_y.reshape(np.shape(y_k))
+
+    def _weak_tiers(self, lensAssembly, z_source, x_array, y_array, beta_sx, beta_sy):
+        """
+        adds the deflections of the 'born' and 'tidal' lens objects to the source positions
+        """
+        born_list = [lensObject for lensObject in lensAssembly.object_array if lensObject.tier == 'born']
+        tidal_list = [lensObject for lensObject in lensAssembly.object_array if lensObject.tier == 'tidal']
+        if born_list:
+            x, y = np.ravel(x_array), np.ravel(y_array)
+            alpha_x, alpha_y, _, _, _ = self.bornLens.lens_sum(born_list, z_source, x, y, hessian=False)
+            beta_sx = beta_sx - alpha_x.reshape(np.shape(beta_sx))
+            beta_sy = beta_sy - alpha_y.reshape(np.shape(beta_sy))
+        if tidal_list:
+            _, _, f_xx, f_yy, f_xy = self.bornLens.lens_sum(tidal_list, z_source, np.zeros(1), np.zeros(1),
+                                                           deflection=False)
+            beta_sx = beta_sx - (f_xx[0]*x_array + f_xy[0]*y_array)
+            beta_sy = beta_sy - (f_xy[0]*x_array + f_yy[0]*y_array)
         return beta_sx, beta_sy
 
-    def _full_ray_tracing_observer(self, lensAssembly):
+    def slab_tracing_error(self, lensAssembly, z_source, x_array, y_array=None, n_slabs=10, observer_frame=True):
+        """
+        compares the full ray-tracing in redshift slabs with the exact full ray-tracing
+
+        :param z_source: redshift of the source
+        :param x_array: x-coords of the rays (or RaySet instance)
+        :param y_array: y-coords of the rays (None if x_array is a RaySet)
+        :param n_slabs: number of redshift slabs
+        :return: dictionary with the number of lens planes of the exact tracing 'n_planes', the number of non-empty slabs
+         'n_slabs' and the maximum and root mean square deviation of the source positions 'max', 'rms' (in radian)
+        """
+        x_array, y_array = ray_set.coordinates(x_array, y_array)
+        beta_x, beta_y = self.full_ray_tracing(lensAssembly, z_source, x_array, y_array, observer_frame=observer_frame)
+        beta_x_slab, beta_y_slab = self.full_ray_tracing(lensAssembly, z_source, x_array, y_array,
+                                                         observer_frame=observer_frame, n_slabs=n_slabs)
+        delta = np.sqrt((beta_x_slab - beta_x)**2 + (beta_y_slab - beta_y)**2)
+        return {'n_planes': len(self._lens_planes(lensAssembly, z_source)),
+                'n_slabs': len(self._slab_planes(lensAssembly, z_source, n_slabs)),
+                'max': float(np.max(delta)), 'rms': float(np.sqrt(np.mean(delta**2)))}
+
+    def _lens_planes(self, lensAssembly, z_source, tiers=None):
+        """
+        lens planes in front of the source
+
+        :param tiers: approximation tiers of the lens objects to be included (None for all)
+        :return: list of (comoving distance, list of lens objects)
+        """
+        planes = []
+        for i, (z, lens_list) in enumerate(lensAssembly.planes()):
+            if tiers is not None:
+                lens_list = [lensObject for lensObject in lens_list if lensObject.tier in tiers]
+            if z < z_source and lens_list:
+                with self.instrumentation.section('distances', plane=i):
+                    planes.append((self.cosmo.comoving_transverse_distance(z), lens_list))
+        return planes
+
+    def _slab_planes(self, lensAssembly, z_source, n_slabs, tiers=None):
+        """
+        bins the lens objects in front of the source into slabs of equal comoving depth between the observer and the
+        source. Each non-empty slab is placed at the mean comoving distance of its lens planes.
+
+        :return: list of (comoving distance, list of lens objects)
+        """
+        if int(n_slabs) < 1:
+            raise ValueError("number of slabs %s not valid." % n_slabs)
+        planes = self._lens_planes(lensAssembly, z_source, tiers=tiers)
+        if not planes:
+            return []
+        chi = np.array([plane[0] for plane in planes])
+        chi_s = self.cosmo.comoving_transverse_distance(z_source)
+        index = np.minimum((chi / chi_s * n_slabs).astype(int), int(n_slabs) - 1)
+        slabs = []
+        for k in np.unique(index):
+            members = np.where(index == k)[0]
+            lens_list = [lensObject for j in members for lensObject in planes[j][1]]
+            slabs.append((np.mean(chi[members]), lens_list))
+        return slabs
+
+    def _full_ray_tracing_observer(self, lensAssembly, tiered=False):
         """
         computes the real positions of the lens objects given the position in the observer frame
         :param lensAssembly:
+        :param tiered: bool, if True, only the 'full' lens objects deflect the light rays
         :return:
         """
-        object_list = lensAssembly.object_array
-        alpha_x_tot, alpha_y_tot = lensAssembly.get_visible_positions()
+        instrumentation = self.instrumentation
+        pos_x, pos_y = lensAssembly.get_visible_positions()
+        alpha_x_tot, alpha_y_tot = self._batch_rays(pos_x.copy(), pos_y.copy())
         x_k = np.zeros_like(alpha_x_tot)
         y_k = np.zeros_like(alpha_y_tot)
         z_last = 0
         i = 0
-        for lensObject in object_list:
-            z = lensObject.redshift
-            T_k_last = self.cosmo.T_xy(z_last, z)
+        for k, (z, lens_list) in enumerate(lensAssembly.planes()):
+            with instrumentation.section('distances', plane=k):
+                T_k_last = self.cosmo.T_xy(z_last, z)
             x_k += alpha_x_tot*T_k_last
             y_k += alpha_y_tot*T_k_last
             x_k_phys, y_k_phys = x_k/(1+z), y_k/(1+z)
-            lensObject.update_position(x_k_phys[i], y_k_phys[i])  # update position of the i'th lens according to the deflection
-            alpha_x, alpha_y = lensObject.deflection(x_k_phys, y_k_phys)
-            alpha_x_tot -= alpha_x
-            alpha_y_tot -= alpha_y
+            for lensObject in lens_list:
+                lensObject.update_position(_column(x_k_phys, i), _column(y_k_phys, i))  # update position of the i'th lens according to the deflection
+                i += 1
+            for lensObject in lens_list:
+                if tiered and lensObject.tier != 'full':
+                    continue
+                with instrumentation.section('deflection', n_rays=np.size(x_k), plane=k, profile=lensObject.type):
+                    alpha_x, alpha_y = lensObject.deflection(x_k_phys, y_k_phys)
+                alpha_x_tot -= alpha_x
+                alpha_y_tot -= alpha_y
             z_last = z
-            i += 1
         return 0
 
-    def combined_ray_tracing(self, lensAssembly, z_source, x_array, y_array, observer_frame=True):
+    def combined_ray_tracing(self, lensAssembly, z_source, x_array, y_array=None, observer_frame=True):
         """
         ray-tracing routine with Born approximation for the objects specified (eqn 17 in Birrer in prep)
         :param object_list: list of sources with specified physical deflection angles (sorted by redshift)
         :param z_source: redshift of the source
-        :param x_array: x-coords of the rays
-        :param y_array: y-coords of the rays
+        :param x_array: x-coords of the rays (or RaySet instance)
+        :param y_array: y-coords of the rays (None if x_array is a RaySet)
         :return: deflections delta x_coords, delta y_coords such that x_source = x - delta x_source
         """
+        x_array, y_array = ray_set.coordinates(x_array, y_array)
+        shape = np.shape(x_array)
+        x_array, y_array = self._batch_rays(x_array, y_array)
+        instrumentation = self.instrumentation
+        n_rays = np.size(x_array)
         if observer_frame:
-            self._combined_ray_tracing_observer(lensAssembly, z_source)
+            with instrumentation.section('observer_frame'):
+                self._combined_ray_tracing_observer(lensAssembly, z_source)
         else:
-            lensAssembly.reset_observer_frame()
+            lensAssembly.reset_observer_frame(self.cosmo)
         object_list = lensAssembly.object_array
         mainLens = lensAssembly.main_deflector()
         z_d = mainLens.redshift
@@ -121,7 +506,8 @@ class MultiLens(object):
                 D_k = self.cosmo.D_xy(0, z)
                 D_ks = self.cosmo.D_xy(z, z_source)
                 D_kd = self.cosmo.D_xy(z, z_d)
-                alpha_x, alpha_y = lensObject.deflection(D_k*x_array, D_k*y_array)
+                with instrumentation.section('deflection', n_rays=n_rays, plane=i, profile=lensObject.type):
+                    alpha_x, alpha_y = lensObject.deflection(D_k*x_array, D_k*y_array)
                 alpha_x_foreground += alpha_x
                 alpha_y_foreground += alpha_y
                 beta_sx -= D_ks/Ds*alpha_x
@@ -130,7 +516,8 @@ class MultiLens(object):
                 beta_dy -= D_kd/Dd*alpha_y
             elif lensObject.main is True:
                 D_ds = self.cosmo.D_xy(z_d, z_source)
-                alpha_dx, alpha_dy = lensObject.deflection(Dd*beta_dx, Dd*beta_dy)
+                with instrumentation.section('deflection', n_rays=n_rays, plane=i, profile=lensObject.type):
+                    alpha_dx, alpha_dy = lensObject.deflection(Dd*beta_dx, Dd*beta_dy)
                 beta_sx -= D_ds/Ds*alpha_dx
                 beta_sy -= D_ds/Ds*alpha_dy
             elif z >= z_d:
@@ -139,11 +526,12 @@ class MultiLens(object):
                 D_kd = self.cosmo.D_xy(z_d, z)
                 beta_x = beta_dx - D_kd/D_k*(alpha_dx + alpha_x_foreground)  # equation 16 in Birrer in prep
                 beta_y = beta_dy - D_kd/D_k*(alpha_dy + alpha_y_foreground)  # equation 16 in Birrer in prep
-                alpha_x, alpha_y = lensObject.deflection(D_k*beta_x, D_k*beta_y)
+                with instrumentation.section('deflection', n_rays=n_rays, plane=i, profile=lensObject.type):
+                    alpha_x, alpha_y = lensObject.deflection(D_k*beta_x, D_k*beta_y)
                 beta_sx -= D_ks/Ds*alpha_x
                 beta_sy -= D_ks/Ds*alpha_y
             i += 1
-        return beta_sx, beta_sy
+        return self._batch_shape(beta_sx, shape), self._batch_shape(beta_sy, shape)
 
     def _combined_ray_tracing_observer(self, lensAssembly, z_source):
         """
@@ -154,7 +542,7 @@ class MultiLens(object):
         object_list = lensAssembly.object_array
         mainLens = lensAssembly.main_deflector()
         z_d = mainLens.redshift
-        x_array, y_array = lensAssembly.get_visible_positions()
+        x_array, y_array = self._batch_rays(*lensAssembly.get_visible_positions())
         beta_dx = x_array.copy()
         beta_dy = y_array.copy()
         beta_sx = x_array.copy()
@@ -171,7 +559,7 @@ class MultiLens(object):
                 D_k = self.cosmo.D_xy(0, z)
                 D_ks = self.cosmo.D_xy(z, z_source)
                 D_kd = self.cosmo.D_xy(z, z_d)
-                lensObject.update_position(D_k*x_array[i], D_k*y_array[i])
+                lensObject.update_position(D_k*_column(x_array, i), D_k*_column(y_array, i))
                 alpha_x, alpha_y = lensObject.deflection(D_k*x_array, D_k*y_array)
                 alpha_x_foreground += alpha_x
                 alpha_y_foreground += alpha_y
@@ -181,7 +569,7 @@ class MultiLens(object):
                 beta_dy -= D_kd/Dd*alpha_y
             elif lensObject.main is True:
                 D_ds = self.cosmo.D_xy(z_d, z_source)
-                lensObject.update_position(Dd*x_array[i], Dd*y_array[i])
+                lensObject.update_position(Dd*_column(x_array, i), Dd*_column(y_array, i))
                 alpha_dx, alpha_dy = lensObject.deflection(Dd*beta_dx, Dd*beta_dy)
                 alpha_dx *= D_ds/Ds
                 alpha_dy *= D_ds/Ds
@@ -192,47 +580,56 @@ class MultiLens(object):
                 D_kd = self.cosmo.D_xy(z_d, z)
                 beta_x = beta_dx - D_kd/D_k*(alpha_dx + alpha_x_foreground)  # equation 16 in Birrer in prep
                 beta_y = beta_dy - D_kd/D_k*(alpha_dy + alpha_y_foreground)  # equation 16 in Birrer in prep
-                lensObject.update_position(D_k*beta_x[i], D_k*beta_y[i])
+                lensObject.update_position(D_k*_column(beta_x, i), D_k*_column(beta_y, i))
             i += 1
         return 0
 
-    def born_ray_tracing(self, lensAssembly, z_source, x_array, y_array):
+    def born_ray_tracing(self, lensAssembly, z_source, x_array, y_array=None):
         """
         routine with Born approximation for all objects (eqn 14 in Birrer in prep)
         :param object_list: list of sources with specified physical deflection angles (sorted by redshift)
         :param z_source: redshift of the source
-        :param x_array: x-coords of the rays
-        :param y_array: y-coords of the rays
+        :param x_array: x-coords of the rays (or RaySet instance)
+        :param y_array: y-coords of the rays (None if x_array is a RaySet)
         :return: deflections delta x_coords, delta y_coords such that x_source = x - delta x_source
         """
-        lensAssembly.reset_observer_frame()
+        x_array, y_array = ray_set.coordinates(x_array, y_array)
+        shape = np.shape(x_array)
+        x_array, y_array = self._batch_rays(x_array, y_array)
+        instrumentation = self.instrumentation
+        lensAssembly.reset_observer_frame(self.cosmo)
         object_list = lensAssembly.object_array
-        beta_sx = copy.deepcopy(y_array)
-        beta_sy = copy.deepcopy(x_array)
+        beta_sx = copy.deepcopy(x_array)
+        beta_sy = copy.deepcopy(y_array)
         Ds = self.cosmo.D_xy(0, z_source)
-        for lensObject in object_list:
+        for i, lensObject in enumerate(object_list):
             z = lensObject.redshift
             if z < z_source:
                 D_k = self.cosmo.D_xy(0, z)
                 D_ks = self.cosmo.D_xy(z, z_source)
-                delta_x, delta_y = lensObject.deflection(D_k*x_array, D_k*y_array)
+                with instrumentation.section('deflection', n_rays=np.size(x_array), plane=i, profile=lensObject.type):
+                    delta_x, delta_y = lensObject.deflection(D_k*x_array, D_k*y_array)
                 beta_sx -= delta_x*D_ks/Ds
                 beta_sy -= delta_y*D_ks/Ds
-        return beta_sx, beta_sy
+        return self._batch_shape(beta_sx, shape), self._batch_shape(beta_sy, shape)
 
-    def analytic_mapping(self, lensAssembly, z_source, x_array, y_array, LOS_corrected=True, observer_frame=True):
+    def analytic_mapping(self, lensAssembly, z_source, x_array, y_array=None, LOS_corrected=True, observer_frame=True):
         """
         computes equation 29 in Birrer in prep with analytic terms for the LOS structure
         :param object_list:
         :param z_source:
-        :param x_array:
-        :param y_array:
+        :param x_array: x-coords of the rays (or RaySet instance)
+        :param y_array: y-coords of the rays (None if x_array is a RaySet)
         :return:
         """
+        x_array, y_array = ray_set.coordinates(x_array, y_array)
+        shape = np.shape(x_array)
+        x_array, y_array = self._batch_rays(x_array, y_array)
         if observer_frame:
-            self._full_ray_tracing_observer(lensAssembly)
+            with self.instrumentation.section('observer_frame'):
+                self._full_ray_tracing_observer(lensAssembly)
         else:
-            lensAssembly.reset_observer_frame()
+            lensAssembly.reset_observer_frame(self.cosmo)
         object_list = lensAssembly.object_array
         mainLens = lensAssembly.main_deflector()
         z_d = mainLens.redshift
@@ -254,7 +651,7 @@ class MultiLens(object):
         alpha_x, alpha_y = mainLens.deflection(Dd*x_lens, Dd*y_lens)
         beta_sx = x_array - D_ds/Ds * alpha_x + shear_x
         beta_sy = y_array - D_ds/Ds * alpha_y + shear_y
-        return beta_sx, beta_sy
+        return self._batch_shape(beta_sx, shape), self._batch_shape(beta_sy, shape)
 
     def analytic_matrices(self, lensAssembly, z_source, LOS_corrected=True, observer_frame=True):
         """
@@ -266,9 +663,10 @@ class MultiLens(object):
         :return:
         """
         if observer_frame:
-            self._full_ray_tracing_observer(lensAssembly)
+            with self.instrumentation.section('observer_frame'):
+                self._full_ray_tracing_observer(lensAssembly)
         else:
-            lensAssembly.reset_observer_frame()
+            lensAssembly.reset_observer_frame(self.cosmo)
         object_list = lensAssembly.object_array
         mainLens = lensAssembly.main_deflector()
         z_d = mainLens.redshift
@@ -280,4 +678,92 @@ class MultiLens(object):
             gamma_C = self.analyticLens.shear_background_zero(object_list, z_d, z_source)
         gamma_BC = gamma_B + gamma_C
 
-        return gamma_A, gamma_BC
\ No newline at end of file
+        return gamma_A, gamma_BC
+
+    @property
+    def _batch(self):
+        """
+        bool, True if the rays are traced for a batch of cosmologies
+        """
+        return isinstance(self.cosmo, CosmoBatch)
+
+    def _batch_rays(self, x_array, y_array):
+        """
+        copies of the ray coordinates, flattened and with a leading axis along the cosmologies for a batch
+        """
+        if not self._batch:
+            return x_array, y_array
+        return (np.ravel(x_array) + np.zeros(self.cosmo.batch_shape),
+                np.ravel(y_array) + np.zeros(self.cosmo.batch_shape))
+
+    def _batch_shape(self, beta, shape):
+        """
+        source positions of a batch of cosmologies in the shape (number of cosmologies,) + shape of the rays
+        """
+        if not self._batch:
+            return beta
+        return beta.reshape((len(self.cosmo),) + shape)
+
+
+def _column(values, i):
+    """
+    i'th entry of a 1d array, or i'th column (of shape (number of cosmologies, 1)) of an array with a leading axis along
+    the cosmologies
+    """
+    if np.ndim(values) == 1:
+        return values[i]
+    return values[:, i:i+1]
+
+
+def _geometric_delay(theta_x, theta_y, chi, theta_x_last, theta_y_last, chi_last):
+    """
+    geometric part of the Fermat potential between two consecutive planes (flat cosmology, in Mpc)
+
+    :param theta_x: angular x-coords of the rays on the plane at comoving distance chi
+    :param theta_x_last: angular x-coords of the rays on the previous plane at comoving distance chi_last
+    :return: chi_last*chi/(chi - chi_last) * |theta - theta_last|^2/2
+    """
+    return chi_last*chi/(2*(chi - chi_last)) * ((theta_x - theta_x_last)**2 + (theta_y - theta_y_last)**2)
+
+
+def _coarse_grid(shape, factor):
+    """
+    sub-grid of every factor'th ray of a grid of rays (including the last row and column)
+
+    :param shape: (ny, nx) of the grid of rays
+    :param factor: spacing of the sub-grid in rays
+    :return: flat indices of the nodes, (ny, nx) of the sub-grid, index of the nearest node of each ray (or None if
+     the sub-grid would contain all the rays)
+    """
+    axes = []
+    for n in shape:
+        nodes = np.unique(np.append(np.arange(0, n, max(1, int(factor))), n - 1))
+        # nearest node of each ray along the axis
+        nearest = np.searchsorted((nodes[1:] + nodes[:-1]) / 2., np.arange(n))
+        axes.append((nodes, nearest))
+    (rows, nearest_y), (cols, nearest_x) = axes
+    if len(rows)*len(cols) == shape[0]*shape[1]:
+        return None
+    nodes = (rows[:, np.newaxis]*shape[1] + cols).ravel()
+    nearest = (nearest_y[:, np.newaxis]*len(cols) + nearest_x).ravel()
+    return nodes, (len(rows), len(cols)), nearest
+
+
+def _third_derivative(x, y, f_xx, f_yy, f_xy):
+    """
+    estimate of the largest third derivative of the lensing potential from the change of the hessian between
+    neighbouring nodes of a sub-grid
+
+    :param x: physical x-coords of the nodes (2d)
+    :param y: physical y-coords of the nodes (2d)
+    :param f_xx: hessian of the lens at the nodes
+    :return: norm of the third derivatives (per physical distance)
+    """
+    third = 0
+    for axis in [0, 1]:
+        if x.shape[axis] < 2:
+            continue
+        d = np.sqrt(np.diff(x, axis=axis)**2 + np.diff(y, axis=axis)**2)
+        d_hessian = np.sqrt(np.diff(f_xx, axis=axis)**2 + np.diff(f_yy, axis=axis)**2 + 2*np.diff(f_xy, axis=axis)**2)
+        third = max(third, np.max(d_hessian / np.maximum(d, 1e-300)))
+    return third
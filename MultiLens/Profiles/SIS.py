@@ -7,11 +7,17 @@ class SIS(object):
     """
     this class contains the function and the derivatives of the Singular Isothermal Sphere in Physical coordinates
     """
+    # the deflection and hessian are proportional to amplitude**amplitude_power
+    amplitude = 'sigma_v'
+    amplitude_power = 2
+
     def function(self, x, y, sigma_v, pos_x=0, pos_y=0):
+        """
+        returns the lensing potential (in rad*Mpc), whose gradient is the deflection angle
+        """
         x_shift = x - pos_x
         y_shift = y - pos_y
-        f_ = 2*(sigma_v/const.c)**2 * np.sqrt(x_shift*x_shift + y_shift*y_shift)
-        #TODO not right dimensions!!!
+        f_ = 4*np.pi*(sigma_v/const.c)**2 * np.sqrt(x_shift*x_shift + y_shift*y_shift)
         return f_
 
     def derivative(self, x, y, sigma_v, pos_x=0, pos_y=0):
@@ -25,14 +31,29 @@ class SIS(object):
         if isinstance(R, int) or isinstance(R, float):
             a = phi/max(0.000001, R)
         else:
-            a=np.empty_like(R)
-            r = R[R > 0]  #in the SIS regime
-            a[R == 0] = 0
-            a[R > 0] = phi/r
+            a = np.zeros(np.broadcast(R, phi).shape)
+            np.divide(phi, R, out=a, where=R > 0)  #in the SIS regime
         f_x = a * x_shift
         f_y = a * y_shift
         return f_x, f_y
 
+    def param_derivative(self, x, y, sigma_v, pos_x=0, pos_y=0):
+        """
+        returns the derivatives of df/dx and df/dy with respect to the profile parameters
+        (the derivatives with respect to pos_x and pos_y are the negative hessian)
+        :return: dictionary of (d f_x/d param, d f_y/d param)
+        """
+        x_shift = x - pos_x
+        y_shift = y - pos_y
+        R = np.sqrt(x_shift*x_shift + y_shift*y_shift)
+        dphi = 8*np.pi*sigma_v/const.c**2
+        if isinstance(R, int) or isinstance(R, float):
+            a = dphi/max(0.000001, R)
+        else:
+            a = np.zeros(np.broadcast(R, dphi).shape)
+            np.divide(dphi, R, out=a, where=R > 0)  #in the SIS regime
+        return {'sigma_v': (a * x_shift, a * y_shift)}
+
     def hessian(self, x, y, sigma_v, pos_x=0, pos_y=0):
         """
         returns Hessian matrix of function d^2f/dx^2, d^f/dy^2, d^2/dxdy
@@ -42,12 +63,10 @@ class SIS(object):
         R = (x_shift*x_shift + y_shift*y_shift)**(3./2)
         phi = 4*np.pi*(sigma_v/const.c)**2
         if isinstance(R, int) or isinstance(R, float):
-            prefac = phi/max(0.000001, R)
+            prefac = phi/max(0.000001**3, R)
         else:
-            prefac = np.empty_like(R)
-            r = R[R>0]  #in the SIS regime
-            prefac[R==0] = 0.
-            prefac[R>0] = phi/r
+            prefac = np.zeros(np.broadcast(R, phi).shape)
+            np.divide(phi, R, out=prefac, where=R > 0)  #in the SIS regime
 
         f_xx = y_shift*y_shift * prefac
         f_yy = x_shift*x_shift * prefac
@@ -65,23 +84,19 @@ class SIS(object):
         if isinstance(R, int) or isinstance(R, float):
             a = phi/max(0.000001,R)
         else:
-            a=np.empty_like(R)
-            r = R[R>0]  #in the SIS regime
-            a[R==0] = 0.
-            a[R>0] = phi/r
+            a = np.zeros(np.broadcast(R, phi).shape)
+            np.divide(phi, R, out=a, where=R > 0)  #in the SIS regime
 
-        f_ = 2*(sigma_v/const.c)**2 * R
+        f_ = phi * R
         f_x = a * x_shift
         f_y = a * y_shift
         R = (x_shift*x_shift + y_shift*y_shift)**(3./2)
 
         if isinstance(R, int) or isinstance(R, float):
-            prefac = phi/max(0.000001, R)
+            prefac = phi/max(0.000001**3, R)
         else:
-            prefac = np.empty_like(R)
-            r = R[R>0]  #in the SIS regime
-            prefac[R==0] = 0.
-            prefac[R>0] = phi/r
+            prefac = np.zeros(np.broadcast(R, phi).shape)
+            np.divide(phi, R, out=prefac, where=R > 0)  #in the SIS regime
 
         f_xx = y_shift*y_shift * prefac
         f_yy = x_shift*x_shift * prefac
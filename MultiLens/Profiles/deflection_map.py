@@ -0,0 +1,299 @@
+__author__ = 'sibirrer'
+
+import numpy as np
+
+_LEVEL_KEYS = ('f_x', 'f_y', 'f_xx', 'f_yy', 'f_xy')
+_GROUPS = {'deflection': ('f_x', 'f_y'), 'hessian': ('f_xx', 'f_yy', 'f_xy')}
+
+
+class DeflectionMap(object):
+    """
+    this class contains a deflection field sampled on nested uniform grids (physical Mpc) and interpolated bilinearly
+    (order=1) or bicubically (order=3, cubic convolution). A point is evaluated on the finest grid containing it.
+    Outside of the coarsest grid, the deflection is the one of a point mass at the center of the map with the monopole
+    measured on the boundary of the coarsest grid.
+    """
+    def __init__(self, levels, order=3, center_x=0, center_y=0, error=None):
+        """
+
+        :param levels: list of grids from the finest to the coarsest, each a dictionary with the lower left corner
+         'x_min', 'y_min', the spacing 'delta' and the 2d maps (ny, nx) 'f_x', 'f_y', 'f_xx', 'f_yy', 'f_xy'
+        :param order: 1 (bilinear) or 3 (bicubic)
+        :param center_x: x-coord of the center of the monopole outside the maps
+        :param center_y: y-coord of the center of the monopole outside the maps
+        :param error: dictionary with the maximum and root mean square interpolation error of the deflection 'max',
+         'rms' (in radian), see from_lenses()
+        """
+        if order not in (1, 3):
+            raise ValueError("interpolation order %s not valid." % order)
+        self.order = order
+        self.center_x = center_x
+        self.center_y = center_y
+        self.error = error
+        self.levels = []
+        for level in levels:
+            level = dict(level)
+            for key in _LEVEL_KEYS:
+                level[key] = np.array(level[key], dtype=float)
+            level['shape'] = level['f_x'].shape
+            if min(level['shape']) < 2:
+                raise ValueError("maps need at least 2x2 grid points.")
+            # the maps are interpolated together from flat tables of shape (number of grid points, number of maps)
+            for group, keys in _GROUPS.items():
+                table = np.stack([level[key] for key in keys], axis=-1)
+                if order == 3:
+                    # linear extrapolation by one grid point, such that the 4x4 stencil exists in every cell
+                    table = np.pad(table, ((1, 1), (1, 1), (0, 0)), mode='reflect', reflect_type='odd')
+                level[group] = table.reshape(-1, len(keys))
+            self.levels.append(level)
+        # monopole from the boundary of the coarsest map
+        level = self.levels[-1]
+        ny, nx = level['shape']
+        x, y = self._coordinates(level)
+        boundary = np.zeros((ny, nx), dtype=bool)
+        boundary[[0, -1], :] = True
+        boundary[:, [0, -1]] = True
+        self._monopole = np.mean((x - center_x)[boundary]*level['f_x'][boundary] +
+                                 (y - center_y)[boundary]*level['f_y'][boundary])
+
+    @classmethod
+    def from_lenses(cls, lens_list, x_min, x_max, y_min, y_max, num_pix=100, order=3, hessian=True, tolerance=None,
+                    max_levels=4):
+        """
+        samples the summed deflection (and hessian) of lens objects at the same redshift
+
+        :param lens_list: list of lens objects (with deflection() and distortion() in physical coordinates)
+        :param x_min: lower x-limit of the map (physical Mpc)
+        :param x_max: upper x-limit of the map
+        :param y_min: lower y-limit of the map
+        :param y_max: upper y-limit of the map
+        :param num_pix: number of grid points along the longer axis of the coarsest map
+        :param order: 1 (bilinear) or 3 (bicubic)
+        :param hessian: bool, if True, samples the hessian of the lenses, otherwise it is the numerical derivative of
+         the sampled deflection
+        :param tolerance: tolerated interpolation error of the deflection (in radian), if given, the regions exceeding
+         it are sampled on nested grids of half the spacing (up to max_levels grids)
+        :param max_levels: maximum number of nested grids
+        :return: DeflectionMap instance, with the interpolation error at the cell centers in 'error'
+        """
+        delta = max(x_max - x_min, y_max - y_min) / (num_pix - 1)
+        levels = [_sample(lens_list, x_min, x_max, y_min, y_max, delta, hessian)]
+        midpoints = [_midpoints(lens_list, levels[0])]
+        while tolerance is not None and len(levels) < max_levels:
+            level = levels[0]
+            deflectionMap = cls(levels, order=order)
+            x, y, f_x, f_y = midpoints[0]
+            d_x, d_y = deflectionMap.derivative(x, y)
+            bad = np.sqrt((d_x - f_x)**2 + (d_y - f_y)**2) > tolerance
+            if not np.any(bad):
+                break
+            rows, cols = np.nonzero(bad)
+            x_0, y_0, delta = level['x_min'], level['y_min'], level['delta']
+            ny, nx = level['f_x'].shape
+            bounds = (x_0 + max(0, np.min(cols) - 1)*delta, x_0 + min(nx - 1, np.max(cols) + 2)*delta,
+                      y_0 + max(0, np.min(rows) - 1)*delta, y_0 + min(ny - 1, np.max(rows) + 2)*delta)
+            levels.insert(0, _sample(lens_list, bounds[0], bounds[1], bounds[2], bounds[3], delta/2., hessian))
+            midpoints.insert(0, _midpoints(lens_list, levels[0]))
+        deflectionMap = cls(levels, order=order, center_x=(x_min + x_max)/2., center_y=(y_min + y_max)/2.)
+        x, y, f_x, f_y = [np.concatenate([np.ravel(points[k]) for points in midpoints]) for k in range(4)]
+        d_x, d_y = deflectionMap.derivative(x, y)
+        delta = np.sqrt((d_x - f_x)**2 + (d_y - f_y)**2)
+        deflectionMap.error = {'max': float(np.max(delta)), 'rms': float(np.sqrt(np.mean(delta**2)))}
+        return deflectionMap
+
+    def function(self, x, y):
+        """
+        the lensing potential is not sampled
+        """
+        raise ValueError("the lensing potential of a deflection map is not available.")
+
+    def derivative(self, x, y):
+        """
+        returns the interpolated df/dx and df/dy
+        """
+        f_x, f_y = self._evaluate(x, y, 'deflection')
+        return f_x, f_y
+
+    def hessian(self, x, y):
+        """
+        returns the interpolated Hessian matrix d^2f/dx^2, d^f/dy^2, d^2/dxdy
+        """
+        f_xx, f_yy, f_xy = self._evaluate(x, y, 'hessian')
+        return f_xx, f_yy, f_xy
+
+    def param_derivative(self, x, y):
+        """
+        a deflection map has no parameters
+        """
+        return {}
+
+    def to_arrays(self):
+        """
+        :return: dictionary of numpy arrays describing the map (see from_arrays())
+        """
+        arrays = {'order': np.array(self.order), 'center': np.array([self.center_x, self.center_y], dtype=float),
+                  'n_levels': np.array(len(self.levels))}
+        if self.error is not None:
+            arrays['error'] = np.array([self.error['max'], self.error['rms']])
+        for k, level in enumerate(self.levels):
+            arrays['level%s_grid' % k] = np.array([level['x_min'], level['y_min'], level['delta']], dtype=float)
+            for key in _LEVEL_KEYS:
+                arrays['level%s_%s' % (k, key)] = level[key]
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        inverse of to_arrays()
+
+        :param arrays: dictionary of numpy arrays
+        :return: DeflectionMap instance
+        """
+        levels = []
+        for k in range(int(arrays['n_levels'])):
+            x_min, y_min, delta = arrays['level%s_grid' % k]
+            level = {'x_min': float(x_min), 'y_min': float(y_min), 'delta': float(delta)}
+            for key in _LEVEL_KEYS:
+                level[key] = arrays['level%s_%s' % (k, key)]
+            levels.append(level)
+        error = None
+        if 'error' in arrays:
+            error = {'max': float(arrays['error'][0]), 'rms': float(arrays['error'][1])}
+        center_x, center_y = arrays['center']
+        return cls(levels, order=int(arrays['order']), center_x=float(center_x), center_y=float(center_y),
+                   error=error)
+
+    def save(self, filename):
+        """
+        saves the map to a .npz file
+        """
+        np.savez_compressed(filename, **self.to_arrays())
+
+    @classmethod
+    def load(cls, filename):
+        """
+        loads a map saved with save()
+        """
+        with np.load(filename) as f:
+            return cls.from_arrays(dict((key, f[key]) for key in f.files))
+
+    def _coordinates(self, level):
+        ny, nx = level['shape']
+        x_axis = level['x_min'] + np.arange(nx)*level['delta']
+        y_axis = level['y_min'] + np.arange(ny)*level['delta']
+        return np.meshgrid(x_axis, y_axis)
+
+    def _evaluate(self, x, y, group):
+        """
+        interpolates the maps of a group ('deflection' or 'hessian') at (x, y), on the finest grid containing each point
+        """
+        scalar = np.ndim(x) == 0 and np.ndim(y) == 0
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        shape = x.shape
+        x, y = x.ravel(), y.ravel()
+        values = np.zeros((len(x), len(_GROUPS[group])))
+        remaining = None
+        for level in self.levels:
+            ny, nx = level['shape']
+            u = (x - level['x_min']) / level['delta']
+            v = (y - level['y_min']) / level['delta']
+            inside = (u >= 0) & (u <= nx - 1) & (v >= 0) & (v <= ny - 1)
+            if remaining is not None:
+                inside &= remaining
+            if np.all(inside):
+                values = self._interpolate(level, group, u, v)
+                remaining = ~inside
+                break
+            if np.any(inside):
+                values[inside] = self._interpolate(level, group, u[inside], v[inside])
+            remaining = ~inside if remaining is None else remaining & ~inside
+        if np.any(remaining):
+            d_x, d_y = x[remaining] - self.center_x, y[remaining] - self.center_y
+            r2 = d_x**2 + d_y**2
+            if group == 'deflection':
+                values[remaining] = np.column_stack((d_x, d_y)) * (self._monopole/r2)[:, np.newaxis]
+            else:
+                values[remaining] = np.column_stack((d_y**2 - d_x**2, d_x**2 - d_y**2, -2*d_x*d_y)) * \
+                                    (self._monopole/r2**2)[:, np.newaxis]
+        if scalar:
+            return [float(value) for value in values[0]]
+        return [values[:, k].reshape(shape) for k in range(values.shape[1])]
+
+    def _interpolate(self, level, group, u, v):
+        """
+        interpolation of the maps of a group at the grid coordinates (u, v)
+
+        :return: array of shape (len(u), number of maps)
+        """
+        ny, nx = level['shape']
+        table = level[group]
+        i = np.clip(np.floor(u).astype(int), 0, nx - 2)
+        j = np.clip(np.floor(v).astype(int), 0, ny - 2)
+        t, s = (u - i)[:, np.newaxis], (v - j)[:, np.newaxis]
+        if self.order == 1:
+            index = j*nx + i
+            return (1 - s)*((1 - t)*np.take(table, index, axis=0) + t*np.take(table, index + 1, axis=0)) + \
+                s*((1 - t)*np.take(table, index + nx, axis=0) + t*np.take(table, index + nx + 1, axis=0))
+        # padded table: the stencil of the cell (i, j) starts at (i - 1, j - 1), i.e. at (i, j) of the padded grid
+        nx += 2
+        index = j*nx + i
+        w_t, w_s = _cubic_weights(t), _cubic_weights(s)
+        value = 0
+        for b in range(4):
+            row = w_t[0]*np.take(table, index, axis=0)
+            for a in range(1, 4):
+                row += w_t[a]*np.take(table, index + a, axis=0)
+            value = value + w_s[b]*row
+            index = index + nx
+        return value
+
+
+def _cubic_weights(t):
+    """
+    weights of the cubic convolution (Catmull-Rom) kernel of the grid points -1, 0, 1, 2 at 0 <= t <= 1
+    """
+    return (((-0.5*t + 1)*t - 0.5)*t, (1.5*t - 2.5)*t**2 + 1, ((-1.5*t + 2)*t + 0.5)*t, (0.5*t - 0.5)*t**2)
+
+
+def _sample(lens_list, x_min, x_max, y_min, y_max, delta, hessian):
+    """
+    samples the summed deflection (and hessian) of lens objects on a uniform grid
+    """
+    nx = int(np.ceil((x_max - x_min) / delta - 1e-9)) + 1
+    ny = int(np.ceil((y_max - y_min) / delta - 1e-9)) + 1
+    x, y = np.meshgrid(x_min + np.arange(nx)*delta, y_min + np.arange(ny)*delta)
+    level = {'x_min': x_min, 'y_min': y_min, 'delta': delta}
+    level['f_x'], level['f_y'] = _deflection(lens_list, x, y)
+    if hessian:
+        level['f_xx'], level['f_yy'], level['f_xy'] = np.zeros_like(x), np.zeros_like(x), np.zeros_like(x)
+        for lensObject in lens_list:
+            f_xx, f_yy, f_xy = lensObject.distortion(x, y)
+            level['f_xx'] += f_xx
+            level['f_yy'] += f_yy
+            level['f_xy'] += f_xy
+    else:
+        d_xx, d_xy = np.gradient(level['f_x'], delta)[::-1]
+        d_yx, d_yy = np.gradient(level['f_y'], delta)[::-1]
+        level['f_xx'], level['f_yy'], level['f_xy'] = d_xx, d_yy, (d_xy + d_yx)/2.
+    return level
+
+
+def _midpoints(lens_list, level):
+    """
+    deflection of the lens objects at the centers of the cells of a grid
+    """
+    ny, nx = level['f_x'].shape
+    delta = level['delta']
+    x, y = np.meshgrid(level['x_min'] + (np.arange(nx - 1) + 0.5)*delta,
+                       level['y_min'] + (np.arange(ny - 1) + 0.5)*delta)
+    f_x, f_y = _deflection(lens_list, x, y)
+    return x, y, f_x, f_y
+
+
+def _deflection(lens_list, x, y):
+    f_x, f_y = np.zeros_like(x), np.zeros_like(y)
+    for lensObject in lens_list:
+        d_x, d_y = lensObject.deflection(x, y)
+        f_x += d_x
+        f_y += d_y
+    return f_x, f_y
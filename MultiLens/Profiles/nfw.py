@@ -12,19 +12,24 @@ class NFW(object):
 
     relation are: R_200 = c * Rs
     """
+    # the deflection and hessian are proportional to amplitude**amplitude_power
+    amplitude = 'rho_s'
+    amplitude_power = 1
+
     def __init__(self):
         self.halo_param = HaloParam()
 
     def function(self, x, y, rho_s, Rs, pos_x, pos_y):
         """
-        returns double integral of NFW profile
+        returns double integral of NFW profile, i.e. the lensing potential (in rad*Mpc)
         """
         # rho_s [h^-2 M_sun/Mpc physical]
         # Rs [Mpc physical]
         x_ = x - pos_x
         y_ = y - pos_y
         R = np.sqrt(x_**2 + y_**2)
-        f_ = self.nfwPot(R, Rs, rho_s)
+        C = 4*np.pi*const.G/const.c**2/const.Mpc*const.M_sun
+        f_ = C*self.nfwPot(R, Rs, rho_s)
         return f_
 
     def derivative(self, x, y, rho_s, Rs, pos_x, pos_y):
@@ -37,13 +42,34 @@ class NFW(object):
         f_x, f_y = self.alpha(R, Rs, rho_s, x_, y_)
         return f_x, f_y
 
+    def param_derivative(self, x, y, rho_s, Rs, pos_x, pos_y):
+        """
+        returns the derivatives of df/dx and df/dy with respect to the profile parameters
+        (the derivatives with respect to pos_x and pos_y are the negative hessian)
+        :return: dictionary of (d f_x/d param, d f_y/d param)
+        """
+        x_ = x - pos_x
+        y_ = y - pos_y
+        R = np.sqrt(x_**2 + y_**2)
+        if isinstance(R, int) or isinstance(R, float):
+            R = max(R, 0.000001)
+        else:
+            R[R == 0] = 0.000001
+        X = R/Rs
+        gx = self.g_new(X)
+        dgx = self.dg_new(X)
+        C = 4*np.pi*const.G/const.c**2/const.Mpc*const.M_sun
+        a_rho = C*4*Rs**3/R * gx
+        a_Rs = C*4*rho_s*Rs**2/R * (3*gx - X*dgx)
+        return {'rho_s': (a_rho*x_/R, a_rho*y_/R), 'Rs': (a_Rs*x_/R, a_Rs*y_/R)}
+
     def hessian(self, x, y, rho_s, Rs, pos_x, pos_y):
         """
         returns Hessian matrix of function d^2f/dx^2, d^f/dy^2, d^2/dxdy
         """
         x_ = x - pos_x
         y_ = y - pos_y
-        R = np.sqrt(x_**2 + y_**2)
+        R = np.maximum(np.sqrt(x_**2 + y_**2), 0.000001)
         f_x, f_y = self.alpha(R, Rs, rho_s, x_, y_)
         alpha = np.sqrt(f_x**2+f_y**2)
         dalpha_dr = self.dalpha_dr(R, Rs, rho_s, x_, y_)
@@ -59,7 +85,7 @@ class NFW(object):
         x_ = x - pos_x
         y_ = y - pos_y
         R = np.sqrt(x_**2 + y_**2)
-        f_ = self.nfwPot(R, Rs, rho0)
+        f_ = 4*np.pi*const.G/const.c**2/const.Mpc*const.M_sun * self.nfwPot(R, Rs, rho0)
         f_x, f_y = self.alpha(R, Rs, rho0, x_, y_)
         kappa = self.nfw2D(R, Rs, rho0)
         gamma1, gamma2 = self.nfwGamma(R, Rs, rho0, x_, y_)
@@ -156,10 +182,8 @@ class NFW(object):
         :type axis: same as R
         :return: Epsilon(R) projected density at radius R
         """
-        if isinstance(R, int) or isinstance(R, float):
-            R = max(R, 0.000001)
-        else:
-            R[R == 0] = 0.000001
+        # the series of g_new() cancels numerically close to the center
+        R = np.maximum(R, 0.000001)
         x = R/Rs
         gx = self.g_new(x)
         a = 4*rho_s*Rs**3/R * gx
@@ -250,10 +274,10 @@ class NFW(object):
         else:
             a=np.empty_like(X)
             x = X[X < 1]
-            a[X < 1] = 1-2/np.sqrt(1-x**2)*np.arctanh(np.sqrt((1-x)/(1+x)))
-            a[X == 1] = 0
+            a[X < 1] = -2*x*np.arctanh(np.sqrt((1-x)/(x+1)))/(1-x**2)**(3./2) + 1/(x*(x+1)*np.sqrt(1-x**2)*np.sqrt((1-x)/(x+1)))
+            a[X == 1] = 2./3
             x = X[X > 1]
-            a[X > 1] = 1-2/np.sqrt(x**2-1)*np.arctan(np.sqrt((x-1)/(1+x)))
+            a[X > 1] = -1/(x*(x+1)*np.sqrt(x**2-1)*np.sqrt((x-1)/(x+1))) + 2*x*np.arctan(np.sqrt((x-1)/(x+1)))/(x**2-1)**(3./2)
         return a
 
     def g_new(self, x):
@@ -8,6 +8,10 @@ class PointMass(object):
     """
     class to compute the physical deflection angle of a point mass
     """
+    # the deflection and hessian are proportional to amplitude**amplitude_power
+    amplitude = 'mass'
+    amplitude_power = 1
+
     def __init__(self):
         self.r_min = 10**(-8)
 
@@ -17,7 +21,7 @@ class PointMass(object):
         :param x: x-coord (in physical Mpc)
         :param y: y-coord (in physical Mpc)
         :param mass: mass of the point mass (in M_sun)
-        :return: potential
+        :return: potential (in rad*Mpc)
         """
         x_ = x - pos_x
         y_ = y - pos_y
@@ -28,7 +32,7 @@ class PointMass(object):
             r = np.empty_like(a)
             r[a > self.r_min] = a[a > self.r_min]  #in the SIS regime
             r[a <= self.r_min] = self.r_min
-        phi = 4*const.G/const.c**2 * (mass*const.M_sun)*np.log(r*const.Mpc)
+        phi = 4*const.G/const.c**2 * (mass*const.M_sun)/const.Mpc*np.log(r)
         return phi
 
     def derivative(self, x, y, mass, pos_x=0, pos_y=0):
@@ -51,6 +55,25 @@ class PointMass(object):
         alpha = 4*const.G * (mass*const.M_sun)/const.c**2/(r*const.Mpc)
         return alpha*x_/r, alpha*y_/r
 
+    def param_derivative(self, x, y, mass, pos_x=0, pos_y=0):
+        """
+
+        :param x: x-coord (in physical Mpc)
+        :param y: y-coord (in physical Mpc)
+        :param mass: mass of the point mass (in M_sun)
+        :return: dictionary of the derivatives of the deflection angle with respect to the profile parameters
+        (the derivatives with respect to pos_x and pos_y are the negative hessian)
+        """
+        x_ = x - pos_x
+        y_ = y - pos_y
+        a = np.sqrt(x_**2 + y_**2)
+        if isinstance(a, int) or isinstance(a, float):
+            r = max(self.r_min, a)
+        else:
+            r = np.maximum(self.r_min, a)
+        dalpha = 4*const.G * const.M_sun/const.c**2/(r*const.Mpc)
+        return {'mass': (dalpha*x_/r, dalpha*y_/r)}
+
     def hessian(self, x, y, mass, pos_x=0, pos_y=0):
         """
 
@@ -93,7 +116,7 @@ class PointMass(object):
             r[a > self.r_min] = a[a > self.r_min]  #in the SIS regime
             r[a <= self.r_min] = self.r_min
         r2 = r**2
-        f_ = C * np.log(r*const.Mpc)
+        f_ = C/const.Mpc * np.log(r)
         alpha = C/(r*const.Mpc)
         f_x = alpha*x_/r
         f_y = alpha*y_/r
@@ -0,0 +1,173 @@
+__author__ = 'sibirrer'
+
+import collections
+
+import numpy as np
+
+import MultiLens.Utils.constants as const
+
+# deflection angle (in radian) of 1 M_sun at a distance of 1 Mpc
+_ALPHA_UNIT = 4*const.G/const.c**2*const.M_sun/const.Mpc
+# number of profiles kept by from_density()
+_CACHE_SIZE = 1024
+_CACHE = collections.OrderedDict()
+
+
+class RadialProfile(object):
+    """
+    this class contains the function and the derivatives of a circular lens given by a tabulated surface density
+    (in M_sun per physical Mpc^2) on a logarithmic radius grid (physical Mpc). The enclosed projected mass and the
+    potential are integrated once and interpolated in log radius (the enclosed mass linearly in log-log, the potential
+    with cubic Hermite polynomials). Within the first radius of the grid, the surface density is taken to be constant,
+    beyond the last radius, the projected mass is taken to be enclosed (point mass).
+    """
+    def __init__(self, r, sigma):
+        """
+
+        :param r: increasing radii (physical Mpc), logarithmically spaced
+        :param sigma: surface density at the radii (M_sun/Mpc^2)
+        """
+        r = np.array(r, dtype=float)
+        sigma = np.array(sigma, dtype=float)
+        if r.ndim != 1 or r.shape != sigma.shape or len(r) < 2 or r[0] <= 0 or np.any(np.diff(r) <= 0):
+            raise ValueError("radius grid of shape %s not valid." % (r.shape,))
+        if np.any(sigma < 0) or sigma[0] <= 0:
+            raise ValueError("surface density not valid.")
+        self.r = r
+        self.sigma = sigma
+        self._ln_r = np.log(r)
+        # enclosed projected mass (constant surface density within r[0]) and potential (zero at the center)
+        integrand = 2*np.pi*r**2*sigma
+        mass = np.pi*r[0]**2*sigma[0] + np.concatenate(([0], np.cumsum((integrand[1:] + integrand[:-1]) / 2 *
+                                                                      np.diff(self._ln_r))))
+        self.mass = mass
+        self._ln_mass = np.log(mass)
+        alpha_r = _ALPHA_UNIT*mass
+        self.potential = alpha_r[0]/2. + np.concatenate(([0], np.cumsum((alpha_r[1:] + alpha_r[:-1]) / 2 *
+                                                                        np.diff(self._ln_r))))
+
+    @classmethod
+    def from_density(cls, density, projected=False, r_min=0.00001, r_max=10., num_r=256, z_max=None, **kwargs):
+        """
+        tabulates a density profile. The tables are computed once per density function, grid and parameters and
+        shared by the lenses using them (up to _CACHE_SIZE profiles are kept).
+
+        :param density: function of the radius (physical Mpc) and the keyword arguments kwargs, returning the 3d
+         density (M_sun/Mpc^3) or, with projected=True, the surface density (M_sun/Mpc^2)
+        :param projected: bool, if True, density is the surface density, otherwise the 3d density which is projected
+        :param r_min: first radius of the grid (physical Mpc)
+        :param r_max: last radius of the grid
+        :param num_r: number of radii
+        :param z_max: extent of the projection along the line of sight (default r_max)
+        :param kwargs: parameters of density
+        :return: RadialProfile instance
+        """
+        try:
+            key = (density, projected, r_min, r_max, num_r, z_max, tuple(sorted(kwargs.items())))
+            hash(key)
+        except TypeError:
+            key = None
+        if key is not None and key in _CACHE:
+            return _CACHE[key]
+        r = np.logspace(np.log10(r_min), np.log10(r_max), num_r)
+        if projected:
+            sigma = density(r, **kwargs)
+        else:
+            sigma = project(density, r, z_max=r_max if z_max is None else z_max, **kwargs)
+        profile = cls(r, sigma)
+        if key is not None:
+            _CACHE[key] = profile
+            if len(_CACHE) > _CACHE_SIZE:
+                _CACHE.popitem(last=False)
+        return profile
+
+    def function(self, x, y, pos_x=0, pos_y=0):
+        """
+        returns the lensing potential (in rad*Mpc)
+        """
+        R = np.sqrt((x - pos_x)**2 + (y - pos_y)**2)
+        r_0, r_1 = self.r[0], self.r[-1]
+        inner = self.potential[0] * (R/r_0)**2
+        outer = self.potential[-1] + _ALPHA_UNIT*self.mass[-1]*np.log(np.maximum(R, r_1)/r_1)
+        # cubic Hermite interpolation in log radius with the slopes d f/d ln R = alpha*R
+        ln_r = np.clip(np.log(np.maximum(R, r_0)), self._ln_r[0], self._ln_r[-1])
+        i = np.clip(np.searchsorted(self._ln_r, ln_r) - 1, 0, len(self.r) - 2)
+        h = self._ln_r[i + 1] - self._ln_r[i]
+        t = (ln_r - self._ln_r[i]) / h
+        slope = _ALPHA_UNIT*self.mass
+        f_ = ((2*t**3 - 3*t**2 + 1)*self.potential[i] + (t**3 - 2*t**2 + t)*h*slope[i] +
+              (-2*t**3 + 3*t**2)*self.potential[i + 1] + (t**3 - t**2)*h*slope[i + 1])
+        return np.where(R < r_0, inner, np.where(R > r_1, outer, f_))
+
+    def derivative(self, x, y, pos_x=0, pos_y=0):
+        """
+        returns df/dx and df/dy of the function
+        """
+        x_ = x - pos_x
+        y_ = y - pos_y
+        a = self._alpha_over_r(x_**2 + y_**2)
+        return a*x_, a*y_
+
+    def param_derivative(self, x, y, pos_x=0, pos_y=0):
+        """
+        the tabulated profile has no parameters besides the position (whose derivatives are the negative hessian)
+        """
+        return {}
+
+    def hessian(self, x, y, pos_x=0, pos_y=0):
+        """
+        returns Hessian matrix of function d^2f/dx^2, d^f/dy^2, d^2/dxdy
+        """
+        x_ = x - pos_x
+        y_ = y - pos_y
+        r2 = np.maximum(x_**2 + y_**2, self.r[0]**2 / 10**6)
+        a = self._alpha_over_r(r2)
+        R = np.sqrt(r2)
+        sigma = np.interp(np.log(R), self._ln_r, self.sigma, left=self.sigma[0], right=0)
+        # d alpha/dR - alpha/R
+        b = (_ALPHA_UNIT*2*np.pi*sigma - 2*a) / r2
+        f_xx = a + b*x_**2
+        f_yy = a + b*y_**2
+        f_xy = b*x_*y_
+        return f_xx, f_yy, f_xy
+
+    def _alpha_over_r(self, r2):
+        """
+        deflection angle divided by the radius
+        """
+        r_0 = self.r[0]
+        r2 = np.maximum(r2, r_0**2)
+        ln_r = np.log(r2)/2.
+        mass = np.exp(np.interp(ln_r, self._ln_r, self._ln_mass))
+        return _ALPHA_UNIT*mass/r2
+
+    def to_arrays(self):
+        """
+        tables as a dictionary of numpy arrays (see from_arrays())
+        """
+        return {'r': self.r, 'sigma': self.sigma}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        inverse of to_arrays()
+        """
+        return cls(arrays['r'], arrays['sigma'])
+
+
+def project(density, R, z_max, num_z=512, **kwargs):
+    """
+    projects a 3d density along the line of sight, sigma(R) = 2 int_0^z_max density(sqrt(R^2 + z^2)) dz, with the
+    substitution z = R sinh(t) (trapezoidal rule)
+
+    :param density: function of the 3d radius and kwargs
+    :param R: 1d array of projected radii
+    :param z_max: extent of the projection
+    :param num_z: number of integration points
+    :return: surface density at R
+    """
+    R = np.asarray(R, dtype=float)[:, np.newaxis]
+    t = np.linspace(0, 1, num_z) * np.arcsinh(z_max / R)
+    cosh = np.cosh(t)
+    integrand = density(R*cosh, **kwargs) * R*cosh
+    return 2*np.sum((integrand[:, 1:] + integrand[:, :-1]) / 2 * np.diff(t, axis=1), axis=1)
@@ -2,6 +2,8 @@ __author__ = 'sibirrer'
 
 import numpy as np
 
+import MultiLens.Utils.constants as const
+
 class HaloParam(object):
     """
     class which contains a halo model parameters dependent on cosmology for NFW profile
@@ -78,4 +80,37 @@ class HaloParam(object):
         r200 = self.r200_M(M, z)
         rho_s = self.rho_s(c, z)
         Rs = r200/c
-        return r200, rho_s, Rs, c
\ No newline at end of file
+        return r200, rho_s, Rs, c
+
+    def sigma_v_M_z(self, M, z):
+        """
+        velocity dispersion of a singular isothermal sphere with mass M within R_200
+        :param M: halo mass in M_sun/h
+        :type M: float or numpy array
+        :param z: redshift
+        :return: velocity dispersion in m/s
+        """
+        r200 = self.r200_M(M, z)
+        return np.sqrt(const.G*M*const.M_sun/(2*r200*const.Mpc))
+
+    def kwargs_profile(self, M, z, type='NFW', h=None):
+        """
+        profile parameters of halos (vectorized over M and z) in the physical units of the profiles (Mpc and M_sun)
+        :param M: halo mass in M_sun/h
+        :param z: redshift
+        :param type: 'NFW' (see profileMain(), Rs/h in Mpc and rho_s*h^2 in M_sun/Mpc^3), 'SIS' (see sigma_v_M_z(),
+         independent of h) or 'point_mass' (mass M/h in M_sun)
+        :param h: dimensionless Hubble constant (default: the one of get_cosmo())
+        :return: dictionary of parameter arrays
+        """
+        if type not in ('NFW', 'SIS', 'point_mass'):
+            raise ValueError("lens type %s not valid." % type)
+        if type == 'SIS':
+            return {'sigma_v': self.sigma_v_M_z(M, z)}
+        if h is None:
+            from MultiLens.Cosmo.cosmo import get_cosmo
+            h = get_cosmo().H0/100.
+        if type == 'NFW':
+            r200, rho_s, Rs, c = self.profileMain(M, z)
+            return {'rho_s': rho_s*h**2, 'Rs': Rs/h}
+        return {'mass': np.asarray(M, dtype=float)/h}
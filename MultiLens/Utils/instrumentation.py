@@ -0,0 +1,189 @@
+"""
+opt-in instrumentation of the tracing routines: wall time, call counts, rays processed and peak temporary memory
+per section, lens plane and lens profile
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+__author__ = 'sibirrer'
+
+import time
+
+
+def _import_tracemalloc():
+    try:
+        import tracemalloc
+    except ImportError:
+        raise ImportError("tracemalloc (Python 3.4 or later) is needed to track the memory of the sections.")
+    return tracemalloc
+
+
+class Instrumentation(object):
+    """
+    class to record timed sections of the tracing routines.
+
+    Each section is recorded as an event with its name, wall time, number of rays and optionally the lens plane index,
+    the profile type and the peak temporary memory (traced with tracemalloc if track_memory=True). The events are
+    aggregated in report() and passed to the registered callbacks as they happen.
+    """
+
+    def __init__(self, track_memory=False, keep_events=False):
+        """
+
+        :param track_memory: bool, if True, records the peak memory allocated within each section (with tracemalloc,
+         Python 3.4 or later; before Python 3.9, the peak is the one since the start of the tracing, an upper bound)
+        :param keep_events: bool, if True, keeps the list of all the individual events
+        :return:
+        """
+        self.enabled = True
+        self._tracemalloc = _import_tracemalloc() if track_memory else None
+        self._track_memory = track_memory
+        self._keep_events = keep_events
+        self._callbacks = []
+        self._stack = []
+        self.reset()
+
+    def reset(self):
+        """
+        clears all the recorded information
+        :return:
+        """
+        self._sections = {}
+        self._planes = {}
+        self._profiles = {}
+        self._peak_memory = 0
+        self.events = []
+
+    def add_callback(self, callback):
+        """
+        registers a function that is called with the event dictionary at the end of every section
+        :param callback: function(event)
+        :return:
+        """
+        self._callbacks.append(callback)
+
+    def section(self, name, n_rays=0, plane=None, profile=None):
+        """
+        context manager recording a section
+
+        :param name: name of the section (e.g. 'deflection', 'distances', 'observer_frame')
+        :param n_rays: number of rays processed within the section
+        :param plane: index of the lens plane (optional)
+        :param profile: type of the lens profile (optional)
+        :return: context manager
+        """
+        return _Section(self, name, n_rays, plane, profile)
+
+    def record(self, event):
+        """
+        records a finished section
+        :param event: dictionary with keys 'name', 'time', 'rays', 'plane', 'profile', 'memory'
+        :return:
+        """
+        _accumulate(self._sections, event['name'], event)
+        if event['plane'] is not None:
+            _accumulate(self._planes, event['plane'], event)
+        if event['profile'] is not None:
+            _accumulate(self._profiles, event['profile'], event)
+        self._peak_memory = max(self._peak_memory, event['memory'])
+        if self._keep_events:
+            self.events.append(event)
+        for callback in self._callbacks:
+            callback(event)
+
+    def report(self):
+        """
+        structured report of the recorded sections
+
+        :return: dictionary with the aggregated time (s), calls, rays and peak memory (bytes) per section name
+         ('sections'), per lens plane ('planes') and per profile type ('profiles') and the overall 'peak_memory'
+        """
+        return {'sections': _copy(self._sections), 'planes': _copy(self._planes),
+                'profiles': _copy(self._profiles), 'peak_memory': self._peak_memory}
+
+    def print_report(self):
+        """
+        prints the time spent per section, plane and profile
+        :return:
+        """
+        report = self.report()
+        for key in ['sections', 'planes', 'profiles']:
+            print('==========', key)
+            for name, value in sorted(report[key].items(), key=lambda item: -item[1]['time']):
+                print(name, ": time = %.4g s, calls = %s, rays = %s, peak memory = %s bytes"
+                      % (value['time'], value['calls'], value['rays'], value['memory']))
+        print("peak memory = %s bytes" % report['peak_memory'])
+
+
+class _Section(object):
+    """
+    context manager of a recorded section
+    """
+    def __init__(self, instrumentation, name, n_rays, plane, profile):
+        self._instrumentation = instrumentation
+        self._event = {'name': name, 'rays': n_rays, 'plane': plane, 'profile': profile, 'memory': 0}
+
+    def __enter__(self):
+        if self._instrumentation._track_memory:
+            tracemalloc = self._instrumentation._tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            stack = self._instrumentation._stack
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                # keep the peak of the enclosing section before resetting it for this one
+                stack[-1]._child_peak = max(stack[-1]._child_peak, peak)
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self._memory_start = current
+            self._child_peak = 0
+            stack.append(self)
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._event['time'] = time.time() - self._start
+        if self._instrumentation._track_memory:
+            stack = self._instrumentation._stack
+            stack.pop()
+            peak = max(self._instrumentation._tracemalloc.get_traced_memory()[1], self._child_peak)
+            self._event['memory'] = max(0, peak - self._memory_start)
+            if stack:
+                stack[-1]._child_peak = max(stack[-1]._child_peak, peak)
+        self._instrumentation.record(self._event)
+        return False
+
+
+class NullInstrumentation(object):
+    """
+    disabled instrumentation with negligible overhead (default of the tracing routines)
+    """
+    enabled = False
+
+    def section(self, name, n_rays=0, plane=None, profile=None):
+        return _NULL_SECTION
+
+    def report(self):
+        return {'sections': {}, 'planes': {}, 'profiles': {}, 'peak_memory': 0}
+
+
+class _NullSection(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_SECTION = _NullSection()
+NULL_INSTRUMENTATION = NullInstrumentation()
+
+
+def _accumulate(table, key, event):
+    entry = table.setdefault(key, {'time': 0., 'calls': 0, 'rays': 0, 'memory': 0})
+    entry['time'] += event['time']
+    entry['calls'] += 1
+    entry['rays'] += event['rays']
+    entry['memory'] = max(entry['memory'], event['memory'])
+
+
+def _copy(table):
+    return dict((key, dict(value)) for key, value in table.items())
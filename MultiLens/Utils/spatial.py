@@ -0,0 +1,64 @@
+"""
+spatial indexing of lens positions
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+__author__ = 'sibirrer'
+
+import numpy as np
+
+
+class GridIndex(object):
+    """
+    class to index points in the plane with square grid buckets
+
+    The points are sorted by the index of their cell, such that the points within a rectangular region are found by
+    scanning only the rows of cells overlapping the region.
+    """
+
+    def __init__(self, x, y, cell_size=None):
+        """
+
+        :param x: 1d array of x-coordinates of the points
+        :param y: 1d array of y-coordinates of the points
+        :param cell_size: size of the cells (default: such that there are about two points per cell)
+        :return:
+        """
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        n = len(self.x)
+        if n == 0:
+            self._x_min, self._y_min, self.cell_size, self._nx, self._ny = 0., 0., 1., 1, 1
+            self._order, self._starts = np.zeros(0, dtype=int), np.zeros(2, dtype=int)
+            return
+        self._x_min, self._y_min = np.min(self.x), np.min(self.y)
+        extent = max(np.max(self.x) - self._x_min, np.max(self.y) - self._y_min)
+        if cell_size is None:
+            cell_size = extent / max(1., np.sqrt(n / 2.))
+        if not cell_size > 0:
+            cell_size = 1.
+        self.cell_size = cell_size
+        self._nx = int(np.floor((np.max(self.x) - self._x_min) / cell_size)) + 1
+        self._ny = int(np.floor((np.max(self.y) - self._y_min) / cell_size)) + 1
+        cells = self._cell(self.x, self._x_min, self._nx) + self._nx * self._cell(self.y, self._y_min, self._ny)
+        self._order = np.argsort(cells, kind='mergesort')
+        self._starts = np.searchsorted(cells[self._order], np.arange(self._nx * self._ny + 1))
+
+    def _cell(self, coord, coord_min, n):
+        return np.clip(np.floor((coord - coord_min) / self.cell_size).astype(int), 0, n - 1)
+
+    def query_box(self, x_min, x_max, y_min, y_max):
+        """
+        indices of the points within a rectangular region (boundaries included)
+
+        :return: sorted 1d array of indices
+        """
+        if len(self._order) == 0 or x_max < max(x_min, self._x_min) or y_max < max(y_min, self._y_min):
+            return np.zeros(0, dtype=int)
+        i_min, i_max = self._cell(x_min, self._x_min, self._nx), self._cell(x_max, self._x_min, self._nx)
+        j_min, j_max = self._cell(y_min, self._y_min, self._ny), self._cell(y_max, self._y_min, self._ny)
+        candidates = [self._order[self._starts[j*self._nx + i_min]:self._starts[j*self._nx + i_max + 1]]
+                      for j in range(j_min, j_max + 1)]
+        candidates = np.concatenate(candidates)
+        x, y = self.x[candidates], self.y[candidates]
+        inside = (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+        return np.sort(candidates[inside])
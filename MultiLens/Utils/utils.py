@@ -16,19 +16,26 @@ def make_grid(numPix, deltapix):
     return x_grid*const.arcsec, y_grid*const.arcsec
 
 
-def array2image(array):
+def array2image(array, nx=0, ny=0):
     """
     returns the information contained in a 1d array into an n*n 2d array (only works when lenght of array is n**2)
+    or into a ny*nx 2d array if nx and ny are specified
 
     :param array: image values
-    :type array: array of size n**2
+    :type array: array of size n**2 or nx*ny
+    :param nx: number of pixels along x (optional)
+    :param ny: number of pixels along y (optional)
     :returns:  2d array
     :raises: AttributeError, KeyError
     """
-    n=int(np.sqrt(len(array)))
-    if n**2 != len(array):
-        raise ValueError("lenght of input array given as %s is not square of integer number!" %(len(array)))
-    image = array.reshape(n, n)
+    if nx == 0 or ny == 0:
+        n = int(np.sqrt(len(array)))
+        if n**2 != len(array):
+            raise ValueError("lenght of input array given as %s is not square of integer number!" %(len(array)))
+        nx, ny = n, n
+    elif nx*ny != len(array):
+        raise ValueError("lenght of input array given as %s does not match nx*ny = %s!" % (len(array), nx*ny))
+    image = array.reshape(ny, nx)
     return image
 
 
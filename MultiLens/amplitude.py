@@ -0,0 +1,95 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+__author__ = 'sibirrer'
+
+import numpy as np
+
+
+class AmplitudeCache(object):
+    """
+    class to cache the deflection (and hessian) fields of lens objects at fixed ray positions for unit amplitude
+    parameter (see LensObject.amplitude())
+
+    The deflections of PointMass (mass), SIS (sigma_v**2) and NFW (rho_s at fixed Rs) are linear in their amplitude.
+    As long as the rays and the other parameters of the lenses stay fixed (Born approximation or the first lens plane
+    with varied parameters), updates of the amplitudes are a matrix product of the current amplitudes with the cached
+    fields instead of an evaluation of the profiles. Amplitudes given as columns (number of walkers, 1) give fields
+    with a leading walker axis. Lenses without amplitude parameter enter with a constant factor 1.
+    """
+
+    def __init__(self, hessian=False):
+        """
+
+        :param hessian: bool, if True, also caches the distortion
+        :return:
+        """
+        self._hessian = hessian
+        self.lens_list = []
+        self._fields = []
+        self._shape = ()
+        self._stacked = None
+        self._ids = set()
+
+    def add(self, lensObject, x, y, weight=1.):
+        """
+        evaluates the fields of a lens object at unit amplitude
+
+        :param lensObject: LensObject instance (with fixed parameters besides the amplitude)
+        :param x: x-coords of the rays at the lens (physical Mpc)
+        :param y: y-coords of the rays at the lens
+        :param weight: factor of the fields (e.g. lensing efficiency of the lens in the Born approximation)
+        :return:
+        """
+        fields = lensObject.unit_fields(x, y, hessian=self._hessian)
+        self._fields.append([weight * np.ravel(field) for field in fields])
+        self._shape = np.shape(fields[0])
+        self.lens_list.append(lensObject)
+        self._ids.add(id(lensObject))
+        self._stacked = None
+
+    def __contains__(self, lensObject):
+        return id(lensObject) in self._ids
+
+    def __len__(self):
+        return len(self.lens_list)
+
+    def amplitudes(self):
+        """
+        current amplitude factors of the cached lenses
+
+        :return: 1d array along the lenses or 2d array (number of walkers, number of lenses)
+        """
+        factors = [lensObject.amplitude() for lensObject in self.lens_list]
+        if any(np.ndim(factor) > 0 for factor in factors):
+            n_walkers = max(np.size(factor) for factor in factors)
+            return np.column_stack([np.broadcast_to(np.ravel(factor), (n_walkers,)) for factor in factors])
+        return np.array(factors, dtype=float)
+
+    def deflection(self):
+        """
+        summed (weighted) deflection of the cached lenses at their current amplitudes
+
+        :return: delta_x, delta_y (shape of the rays, with a leading walker axis for amplitude columns)
+        """
+        return self._sum(0, 2)
+
+    def distortion(self):
+        """
+        summed (weighted) distortion of the cached lenses at their current amplitudes
+
+        :return: f_xx, f_yy, f_xy
+        """
+        if not self._hessian:
+            raise ValueError("the distortion is not cached.")
+        return self._sum(2, 5)
+
+    def _sum(self, start, stop):
+        """
+        product of the amplitudes with the stacked fields start:stop
+        """
+        if not self.lens_list:
+            return tuple(0. for _ in range(start, stop))
+        if self._stacked is None:
+            self._stacked = [np.array([fields[k] for fields in self._fields]) for k in range(len(self._fields[0]))]
+        amplitudes = self.amplitudes()
+        shape = amplitudes.shape[:-1] + self._shape
+        return tuple(np.dot(amplitudes, self._stacked[k]).reshape(shape) for k in range(start, stop))
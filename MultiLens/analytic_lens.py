@@ -3,15 +3,27 @@ __author__ = 'sibirrer'
 
 import numpy as np
 
-from MultiLens.Cosmo.cosmo import CosmoProp
+from MultiLens.Cosmo.cosmo import get_cosmo
+from MultiLens.Utils.instrumentation import NULL_INSTRUMENTATION
 
 class AnalyticLens(object):
     """
     class to compute the analytic terms in Birrer in prep given the lensing objects
+
+    With a CosmoBatch instance, the entries of the matrices are columns of shape (number of cosmologies, 1).
     """
 
-    def __init__(self):
-        self.cosmo = CosmoProp()
+    def __init__(self, instrumentation=None, cosmo=None):
+        """
+
+        :param instrumentation: Instrumentation instance (None for no instrumentation)
+        :param cosmo: CosmoProp or CosmoBatch instance (default: get_cosmo())
+        :return:
+        """
+        self.cosmo = get_cosmo() if cosmo is None else cosmo
+        if instrumentation is None:
+            instrumentation = NULL_INSTRUMENTATION
+        self.instrumentation = instrumentation
 
     def shear_lens(self, object_list, z_lens):
         """
@@ -30,7 +42,8 @@ class AnalyticLens(object):
             if z < z_lens:
                 D_k = self.cosmo.D_xy(0, z)
                 D_kd = self.cosmo.D_xy(z, z_lens)
-                f_xx_k, f_yy_k, f_xy_k = lensObject.distortion(0, 0)
+                with self.instrumentation.section('distortion', n_rays=1, profile=lensObject.type):
+                    f_xx_k, f_yy_k, f_xy_k = lensObject.distortion(0, 0)
                 f_xx -= D_k*D_kd/Dd * f_xx_k
                 f_yy -= D_k*D_kd/Dd * f_yy_k
                 f_xy -= D_k*D_kd/Dd * f_xy_k
@@ -54,7 +67,8 @@ class AnalyticLens(object):
             if z < z_lens:
                 D_k = self.cosmo.D_xy(0, z)
                 D_ks = self.cosmo.D_xy(z, z_source)
-                f_xx_k, f_yy_k, f_xy_k = lensObject.distortion(0, 0)
+                with self.instrumentation.section('distortion', n_rays=1, profile=lensObject.type):
+                    f_xx_k, f_yy_k, f_xy_k = lensObject.distortion(0, 0)
                 f_xx -= D_k*D_ks/Ds * f_xx_k
                 f_yy -= D_k*D_ks/Ds * f_yy_k
                 f_xy -= D_k*D_ks/Ds * f_xy_k
@@ -79,7 +93,8 @@ class AnalyticLens(object):
             if z >= z_lens and not lensObject.main:
                 D_k = self.cosmo.D_xy(0, z)
                 D_ks = self.cosmo.D_xy(z, z_source)
-                f_xx_k, f_yy_k, f_xy_k = lensObject.distortion(0, 0)
+                with self.instrumentation.section('distortion', n_rays=1, profile=lensObject.type):
+                    f_xx_k, f_yy_k, f_xy_k = lensObject.distortion(0, 0)
                 f_xx -= D_k*D_ks/Ds * f_xx_k
                 f_yy -= D_k*D_ks/Ds * f_yy_k
                 f_xy -= D_k*D_ks/Ds * f_xy_k
@@ -106,7 +121,8 @@ class AnalyticLens(object):
                 D_k = self.cosmo.D_xy(0, z)
                 D_ks = self.cosmo.D_xy(z, z_source)
                 D_dk = self.cosmo.D_xy(z_lens, z)
-                f_xx_k, f_yy_k, f_xy_k = lensObject.distortion(0, 0)
+                with self.instrumentation.section('distortion', n_rays=1, profile=lensObject.type):
+                    f_xx_k, f_yy_k, f_xy_k = lensObject.distortion(0, 0)
                 A = D_k*D_ks/Ds * (1 - D_dk*Ds/(D_k*D_ds))
                 f_xx -= A * f_xx_k
                 f_yy -= A * f_yy_k
@@ -0,0 +1,262 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+__author__ = 'sibirrer'
+
+import numpy as np
+
+from MultiLens.Cosmo.cosmo import get_cosmo
+import MultiLens.ray_set as ray_set
+from MultiLens.Utils.instrumentation import NULL_INSTRUMENTATION
+
+
+class BornLens(object):
+    """
+    class to compute the lensing quantities of all the lens objects in the Born approximation (eqn 14 in Birrer in prep)
+
+    The lens objects of the same profile type are evaluated together in batched (broadcast) calls of their profile with
+    the lensing efficiency weights computed once per call. Convergence, shear and magnification follow analytically
+    from the weighted sum of the hessians of the lenses.
+    """
+
+    def __init__(self, max_elements=2**16, instrumentation=None, cosmo=None):
+        """
+
+        :param max_elements: maximum number of (lens, ray) pairs evaluated in one batch (bounds the temporary memory)
+        :param instrumentation: Instrumentation instance (None for no instrumentation)
+        :param cosmo: CosmoProp instance (default: get_cosmo())
+        :return:
+        """
+        self.cosmo = get_cosmo() if cosmo is None else cosmo
+        self._max_elements = max_elements
+        if instrumentation is None:
+            instrumentation = NULL_INSTRUMENTATION
+        self.instrumentation = instrumentation
+
+    def ray_shooting(self, lensAssembly, z_source, x_array, y_array=None):
+        """
+        source positions in the Born approximation
+
+        :param lensAssembly: LensAssembly instance
+        :param z_source: redshift of the source
+        :param x_array: x-coords of the rays (or RaySet instance)
+        :param y_array: y-coords of the rays (None if x_array is a RaySet)
+        :return: beta_x, beta_y
+        """
+        beta_x, beta_y, _ = self._evaluate(lensAssembly, z_source, x_array, y_array, hessian=False)
+        return beta_x, beta_y
+
+    def hessian(self, lensAssembly, z_source, x_array, y_array=None):
+        """
+        sum of the hessians of the deflection potentials, weighted with the lensing efficiency D_k*D_ks/D_s
+
+        :param lensAssembly: LensAssembly instance
+        :param z_source: redshift of the source
+        :param x_array: x-coords of the rays (or RaySet instance)
+        :param y_array: y-coords of the rays (None if x_array is a RaySet)
+        :return: f_xx, f_yy, f_xy
+        """
+        _, _, hessian = self._evaluate(lensAssembly, z_source, x_array, y_array, deflection=False)
+        return hessian
+
+    def all(self, lensAssembly, z_source, x_array, y_array=None):
+        """
+        source positions, convergence, shear and magnification in the Born approximation
+        (same conventions as Numerics.all())
+
+        :param lensAssembly: LensAssembly instance
+        :param z_source: redshift of the source
+        :param x_array: x-coords of the rays (or RaySet instance)
+        :param y_array: y-coords of the rays (None if x_array is a RaySet)
+        :return: beta_x, beta_y, kappa, gamma1, gamma2, magnification
+        """
+        beta_x, beta_y, (f_xx, f_yy, f_xy) = self._evaluate(lensAssembly, z_source, x_array, y_array)
+        kappa = 1./2 * (f_xx + f_yy)
+        gamma1 = 1./2 * (f_xx - f_yy)
+        gamma2 = -f_xy
+        mag = 1./((1 - f_xx) * (1 - f_yy) - f_xy**2)
+        return beta_x, beta_y, kappa, gamma1, gamma2, mag
+
+    def amplitude_cache(self, lensAssembly, z_source, x_array, y_array=None):
+        """
+        caches the weighted deflections of the lens objects in front of the source at unit amplitude (see
+        AmplitudeCache), such that the source positions for other amplitudes of the lenses (with their other parameters
+        fixed) follow without evaluating the profiles: beta = x - cache.deflection()
+
+        :param lensAssembly: LensAssembly instance
+        :param z_source: redshift of the source
+        :param x_array: x-coords of the rays (or RaySet instance)
+        :param y_array: y-coords of the rays (None if x_array is a RaySet)
+        :return: AmplitudeCache instance
+        """
+        from MultiLens.amplitude import AmplitudeCache
+        x_array, y_array = ray_set.coordinates(x_array, y_array)
+        x, y = np.asarray(x_array, dtype=float), np.asarray(y_array, dtype=float)
+        lensAssembly.reset_observer_frame()
+        lens_list = [lensObject for lensObject in lensAssembly.object_array if lensObject.redshift < z_source]
+        D_k, w_k, _ = self.lensing_weights([lensObject.redshift for lensObject in lens_list], z_source)
+        cache = AmplitudeCache()
+        with self.instrumentation.section('amplitude_cache', n_rays=np.size(x)*len(lens_list)):
+            for lensObject, D, w in zip(lens_list, D_k, w_k):
+                cache.add(lensObject, D * x, D * y, weight=w)
+        return cache
+
+    def lensing_weights(self, redshifts, z_source):
+        """
+        angular diameter distances and lensing efficiency weights of the lens planes (flat cosmology)
+
+        :param redshifts: array of lens redshifts (in front of the source)
+        :param z_source: redshift of the source
+        :return: D_k, D_ks/D_s, D_k*D_ks/D_s
+        """
+        redshifts = np.asarray(redshifts, dtype=float)
+        if len(redshifts) == 0:
+            return np.zeros(0), np.zeros(0), np.zeros(0)
+        chi_k = np.atleast_1d(self.cosmo.comoving_transverse_distance(redshifts))
+        chi_s = self.cosmo.comoving_transverse_distance(z_source)
+        D_k = chi_k / (1 + redshifts)
+        w_k = (chi_s - chi_k) / chi_s
+        return D_k, w_k, D_k * w_k
+
+    def lens_sum(self, lens_list, z_source, x, y, deflection=True, hessian=True):
+        """
+        weighted sums of the deflections and hessians of a list of lens objects (the lens positions are used as they
+        are, i.e. no reset of the observer frame)
+
+        :param lens_list: list of lens objects
+        :param z_source: redshift of the source
+        :param x: 1d array of x-coords of the rays
+        :param y: 1d array of y-coords of the rays
+        :return: sum_k D_ks/D_s*alpha_k (x and y), sum_k D_k*D_ks/D_s*hessian_k (f_xx, f_yy, f_xy)
+        """
+        n_rays = len(x)
+        alpha_x, alpha_y = np.zeros(n_rays), np.zeros(n_rays)
+        f_xx, f_yy, f_xy = np.zeros(n_rays), np.zeros(n_rays), np.zeros(n_rays)
+        for batch, a_x, a_y, h_xx, h_yy, h_xy in self.lens_terms(lens_list, z_source, x, y, deflection, hessian):
+            if deflection:
+                alpha_x += np.sum(a_x, axis=0)
+                alpha_y += np.sum(a_y, axis=0)
+            if hessian:
+                f_xx += np.sum(h_xx, axis=0)
+                f_yy += np.sum(h_yy, axis=0)
+                f_xy += np.sum(h_xy, axis=0)
+        return alpha_x, alpha_y, f_xx, f_yy, f_xy
+
+    def lens_terms(self, lens_list, z_source, x, y, deflection=True, hessian=True):
+        """
+        iterates over batches of lens objects (of the same type) in front of the source and yields their individual
+        weighted deflections and hessians
+
+        :param lens_list: list of lens objects
+        :param z_source: redshift of the source
+        :param x: 1d array of x-coords of the rays
+        :param y: 1d array of y-coords of the rays
+        :return: generator of (lens objects of the batch, D_ks/D_s*alpha_x, D_ks/D_s*alpha_y, D_k*D_ks/D_s*f_xx,
+         D_k*D_ks/D_s*f_yy, D_k*D_ks/D_s*f_xy), arrays of shape (number of lenses of the batch, number of rays) or None
+        """
+        n_rays = len(x)
+        chunk = max(1, self._max_elements // max(1, n_rays))
+        for lens_type, lens_group in group_by_type(lens_list, z_source):
+            with self.instrumentation.section('distances', profile=lens_type):
+                D_k, w_k, w_kk = self.lensing_weights([lensObject.redshift for lensObject in lens_group], z_source)
+            func = lens_group[0].func
+            for i in range(0, len(lens_group), chunk):
+                batch = lens_group[i:i + chunk]
+                kwargs = stack_kwargs(batch)
+                D = D_k[i:i + chunk, np.newaxis]
+                x_phys, y_phys = D * x, D * y
+                a_x, a_y, h_xx, h_yy, h_xy = None, None, None, None, None
+                truncation = _truncation(batch, kwargs, x_phys, y_phys)
+                with self.instrumentation.section('deflection', n_rays=n_rays*len(batch), profile=lens_type):
+                    if deflection:
+                        f_x, f_y = func.derivative(x_phys, y_phys, **kwargs)
+                        if truncation is None:
+                            f_x0, f_y0 = func.derivative(0, 0, **kwargs)
+                        else:
+                            outside, x_, y_, r2, monopole = truncation
+                            f_x = np.where(outside, monopole*x_/r2, f_x)
+                            f_y = np.where(outside, monopole*y_/r2, f_y)
+                            reference = np.array([lensObject.reference_deflection() for lensObject in batch])
+                            f_x0, f_y0 = reference[:, 0, np.newaxis], reference[:, 1, np.newaxis]
+                        w = w_k[i:i + chunk, np.newaxis]
+                        a_x, a_y = w * (f_x - f_x0), w * (f_y - f_y0)
+                    if hessian:
+                        f_xx, f_yy, f_xy = func.hessian(x_phys, y_phys, **kwargs)
+                        if truncation is not None:
+                            outside, x_, y_, r2, monopole = truncation
+                            a = monopole / r2**2
+                            f_xx = np.where(outside, a*(y_**2 - x_**2), f_xx)
+                            f_yy = np.where(outside, a*(x_**2 - y_**2), f_yy)
+                            f_xy = np.where(outside, -2*a*x_*y_, f_xy)
+                        w = w_kk[i:i + chunk, np.newaxis]
+                        h_xx, h_yy, h_xy = w * f_xx, w * f_yy, w * f_xy
+                yield batch, a_x, a_y, h_xx, h_yy, h_xy
+
+    def _evaluate(self, lensAssembly, z_source, x_array, y_array, deflection=True, hessian=True):
+        """
+        evaluates the weighted deflections and hessians of all the lenses in front of the source
+        """
+        x_array, y_array = ray_set.coordinates(x_array, y_array)
+        shape = np.shape(x_array)
+        x = np.asarray(x_array, dtype=float).ravel()
+        y = np.asarray(y_array, dtype=float).ravel()
+        lensAssembly.reset_observer_frame()
+        alpha_x, alpha_y, f_xx, f_yy, f_xy = self.lens_sum(lensAssembly.object_array, z_source, x, y, deflection,
+                                                           hessian)
+        beta_x, beta_y = x - alpha_x, y - alpha_y
+        return beta_x.reshape(shape), beta_y.reshape(shape), (f_xx.reshape(shape), f_yy.reshape(shape),
+                                                                f_xy.reshape(shape))
+
+
+def _truncation(batch, kwargs, x_phys, y_phys):
+    """
+    rays outside the truncation radii of a batch of truncated lens objects, where the lenses deflect as point masses
+    with their monopole (see LensObject.set_truncation())
+
+    :return: None for untruncated lenses, otherwise mask of the rays outside, x and y relative to the lenses, squared
+     radius (1 inside) and monopoles, arrays of shape (number of lenses, number of rays)
+    """
+    if batch[0].r_trunc is None:
+        return None
+    r_trunc = np.array([lensObject.r_trunc for lensObject in batch])[:, np.newaxis]
+    monopole = np.array([lensObject.monopole() for lensObject in batch])[:, np.newaxis]
+    x_ = x_phys - kwargs.get('pos_x', 0)
+    y_ = y_phys - kwargs.get('pos_y', 0)
+    r2 = x_**2 + y_**2
+    outside = r2 > r_trunc**2
+    return outside, x_, y_, np.where(outside, r2, 1.), monopole
+
+
+def group_by_type(lens_list, z_source):
+    """
+    groups the lens objects in front of the source by profile type (deflection maps do not share their profile and
+    form groups of their own, tabulated lenses are grouped by their tables, truncated lenses are grouped apart from
+    untruncated ones)
+
+    :param lens_list: list of lens objects
+    :param z_source: redshift of the source
+    :return: list of (type, list of lens objects)
+    """
+    groups = {}
+    tables = {}
+    for k, lensObject in enumerate(lens_list):
+        if lensObject.redshift < z_source:
+            key = lensObject.type
+            if key == 'deflection_map':
+                key = 'deflection_map:%04d' % k
+            elif key == 'tabulated':
+                key = 'tabulated:%04d' % tables.setdefault(id(lensObject.func), k)
+            if lensObject.r_trunc is not None:
+                key += ':truncated'
+            groups.setdefault(key, []).append(lensObject)
+    return sorted(groups.items())
+
+
+def stack_kwargs(lens_list):
+    """
+    stacks the profile parameters of lens objects of the same type into column vectors of shape (n_lens, 1)
+
+    :param lens_list: list of lens objects of the same type
+    :return: keyword arguments of the profile
+    """
+    names = lens_list[0].kwargs_param.keys()
+    return dict((name, np.array([lensObject.kwargs_param[name] for lensObject in lens_list],
+                                dtype=float)[:, np.newaxis]) for name in names)
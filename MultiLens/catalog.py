@@ -0,0 +1,253 @@
+"""
+chunked reading of halo catalogs (mass, redshift and angular position) into lens objects
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+__author__ = 'sibirrer'
+
+import itertools
+import os
+import zipfile
+
+import numpy as np
+
+from MultiLens.lens_assembly import LensAssembly
+from MultiLens.lens_object import LensObject
+from MultiLens.Utils.halo_param import HaloParam
+
+_FORMATS = ('npy', 'npz', 'hdf5', 'csv')
+_EXTENSIONS = {'.npy': 'npy', '.npz': 'npz', '.h5': 'hdf5', '.hdf5': 'hdf5', '.csv': 'csv', '.txt': 'csv'}
+# quantities read from a catalog (the names of the columns in the file can be given with CatalogReader(columns=...))
+_COLUMNS = ('mass', 'redshift', 'pos_x', 'pos_y')
+
+
+class CatalogReader(object):
+    """
+    class to stream a halo catalog in chunks of rows
+
+    The catalog is a table with the halo mass (M_sun/h), the redshift and the angular position (arc seconds in the
+    observer frame), stored as a structured .npy file (memory mapped), a .npz file of columns, an HDF5 file (a group of
+    columns or a compound dataset) or a CSV file with a header line. At most chunk_size rows are held in memory at a
+    time: the rows outside the redshift range and the footprint are dropped from each chunk as it is read, and the
+    remaining halos are converted into profile parameters with vectorized HaloParam.kwargs_profile().
+    """
+
+    def __init__(self, filename, chunk_size=100000, z_range=None, footprint=None, columns=None, key=None,
+                 format=None):
+        """
+
+        :param filename: name of the catalog file
+        :param chunk_size: number of rows read at a time
+        :param z_range: (z_min, z_max), redshift range of the selected halos (boundaries included)
+        :param footprint: (x_min, x_max, y_min, y_max) in arc seconds, region of the selected halos (boundaries
+         included)
+        :param columns: dictionary of the names of the columns in the file for the quantities 'mass', 'redshift',
+         'pos_x' and 'pos_y' (default the same names)
+        :param key: name of the group or dataset within an HDF5 file (default the root group)
+        :param format: 'npy', 'npz', 'hdf5' or 'csv' (default from the file extension)
+        :return:
+        """
+        if format is None:
+            format = _EXTENSIONS.get(os.path.splitext(str(filename))[1].lower())
+        if format not in _FORMATS:
+            raise ValueError("catalog format of %s not valid. Chose among %s." % (filename, list(_FORMATS)))
+        if not chunk_size >= 1:
+            raise ValueError("chunk size %s not valid." % chunk_size)
+        self.filename = filename
+        self.format = format
+        self.chunk_size = int(chunk_size)
+        self.z_range = z_range
+        self.footprint = footprint
+        names = dict((name, name) for name in _COLUMNS)
+        names.update(columns or {})
+        self._names = names
+        self._key = key
+        self._haloParam = HaloParam()
+
+    def __iter__(self):
+        """
+        iterates over the selected halos
+
+        :return: dictionaries of 1d arrays 'mass', 'redshift', 'pos_x', 'pos_y' of at most chunk_size halos
+        """
+        for chunk in self._read():
+            selected = np.ones(len(chunk['mass']), dtype=bool)
+            if self.z_range is not None:
+                z_min, z_max = self.z_range
+                selected &= (chunk['redshift'] >= z_min) & (chunk['redshift'] <= z_max)
+            if self.footprint is not None:
+                x_min, x_max, y_min, y_max = self.footprint
+                selected &= (chunk['pos_x'] >= x_min) & (chunk['pos_x'] <= x_max)
+                selected &= (chunk['pos_y'] >= y_min) & (chunk['pos_y'] <= y_max)
+            if np.any(selected):
+                yield dict((name, np.asarray(chunk[name], dtype=float)[selected]) for name in _COLUMNS)
+
+    def profiles(self, type='NFW'):
+        """
+        iterates over the profile parameters of the selected halos
+
+        :param type: 'NFW', 'SIS' or 'point_mass' (see HaloParam.kwargs_profile())
+        :return: dictionaries of 1d arrays of the profile parameters (including 'pos_x' and 'pos_y') and 'redshift'
+        """
+        for chunk in self:
+            kwargs = self._haloParam.kwargs_profile(chunk['mass'], chunk['redshift'], type=type)
+            kwargs.update(redshift=chunk['redshift'], pos_x=chunk['pos_x'], pos_y=chunk['pos_y'])
+            yield kwargs
+
+    def lens_objects(self, type='NFW', approximation='weak', r_trunc=None):
+        """
+        iterates over lists of lens objects of the selected halos (one list per chunk)
+
+        :param type: 'NFW', 'SIS' or 'point_mass'
+        :param approximation: approximation tier of the lens objects
+        :param r_trunc: truncation radius of the lens objects in physical Mpc
+        :return: lists of LensObject instances
+        """
+        for kwargs in self.profiles(type=type):
+            redshifts = kwargs.pop('redshift')
+            names = list(kwargs)
+            rows = zip(redshifts.tolist(), *[kwargs[name].tolist() for name in names])
+            lens_list = []
+            for row in rows:
+                lensObject = LensObject(redshift=row[0], type=type, approximation=approximation, r_trunc=r_trunc)
+                lensObject.add_info('kwargs_profile', dict(zip(names, row[1:])))
+                lens_list.append(lensObject)
+            yield lens_list
+
+    def load(self, type='NFW', approximation='weak', r_trunc=None, lensAssembly=None):
+        """
+        adds the lens objects of the selected halos to a lens assembly, chunk by chunk
+
+        :param type: 'NFW', 'SIS' or 'point_mass'
+        :param approximation: approximation tier of the lens objects
+        :param r_trunc: truncation radius of the lens objects in physical Mpc
+        :param lensAssembly: LensAssembly instance to add the lenses to (default a new one)
+        :return: LensAssembly instance
+        """
+        if lensAssembly is None:
+            lensAssembly = LensAssembly()
+        for lens_list in self.lens_objects(type=type, approximation=approximation, r_trunc=r_trunc):
+            lensAssembly.add_lenses(lens_list)
+        return lensAssembly
+
+    def _read(self):
+        """
+        iterates over the chunks of the file (before the selection)
+        """
+        names = [self._names[name] for name in _COLUMNS]
+        if self.format == 'npy':
+            chunks = _read_npy(self.filename, names, self.chunk_size)
+        elif self.format == 'npz':
+            chunks = _read_npz(self.filename, names, self.chunk_size)
+        elif self.format == 'hdf5':
+            chunks = _read_hdf5(self.filename, names, self.chunk_size, self._key)
+        else:
+            chunks = _read_csv(self.filename, names, self.chunk_size)
+        for chunk in chunks:
+            yield dict((name, chunk[self._names[name]]) for name in _COLUMNS)
+
+
+def _missing(names, available, filename):
+    missing = [name for name in names if name not in available]
+    if missing:
+        raise ValueError("columns %s not in the catalog %s." % (missing, filename))
+
+
+def _read_npy(filename, names, chunk_size):
+    """
+    chunks of a structured array saved with np.save (memory mapped)
+    """
+    table = np.load(filename, mmap_mode='r')
+    if table.dtype.names is None:
+        raise ValueError("catalog %s needs to be a structured array." % filename)
+    _missing(names, table.dtype.names, filename)
+    for start in range(0, len(table), chunk_size):
+        rows = table[start:start + chunk_size]
+        yield dict((name, np.array(rows[name])) for name in names)
+
+
+def _read_npz(filename, names, chunk_size):
+    """
+    chunks of the columns saved with np.savez or np.savez_compressed, decompressed as they are read
+    """
+    with zipfile.ZipFile(filename) as archive:
+        _missing(names, [member[:-len('.npy')] for member in archive.namelist()], filename)
+        files = [archive.open(name + '.npy') for name in names]
+        try:
+            dtypes = []
+            lengths = []
+            for f in files:
+                version = np.lib.format.read_magic(f)
+                if version == (1, 0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+                else:
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+                if len(shape) != 1 or dtype.hasobject:
+                    raise ValueError("columns of the catalog %s need to be 1d numeric arrays." % filename)
+                dtypes.append(dtype)
+                lengths.append(shape[0])
+            if len(set(lengths)) > 1:
+                raise ValueError("columns of the catalog %s have different lengths %s." % (filename, lengths))
+            n = lengths[0]
+            for start in range(0, n, chunk_size):
+                count = min(chunk_size, n - start)
+                yield dict((name, np.frombuffer(_read_bytes(f, count*dtype.itemsize), dtype=dtype))
+                           for name, f, dtype in zip(names, files, dtypes))
+        finally:
+            for f in files:
+                f.close()
+
+
+def _read_bytes(f, size):
+    """
+    reads exactly size bytes from a file object
+    """
+    data = f.read(size)
+    while len(data) < size:
+        more = f.read(size - len(data))
+        if not more:
+            raise ValueError("unexpected end of a catalog column.")
+        data += more
+    return data
+
+
+def _read_hdf5(filename, names, chunk_size, key=None):
+    """
+    chunks of a group of 1d datasets or of a compound dataset of an HDF5 file
+    """
+    from MultiLens.persistence import _import_h5py
+    h5py = _import_h5py()
+    with h5py.File(filename, 'r') as f:
+        table = f if key is None else f[key]
+        if isinstance(table, h5py.Dataset):
+            if table.dtype.names is None:
+                raise ValueError("catalog %s needs to be a compound dataset." % filename)
+            _missing(names, table.dtype.names, filename)
+            n = len(table)
+        else:
+            _missing(names, list(table.keys()), filename)
+            n = len(table[names[0]])
+        for start in range(0, n, chunk_size):
+            if isinstance(table, h5py.Dataset):
+                rows = table[start:start + chunk_size]
+                yield dict((name, rows[name]) for name in names)
+            else:
+                yield dict((name, table[name][start:start + chunk_size]) for name in names)
+
+
+def _read_csv(filename, names, chunk_size):
+    """
+    chunks of a comma separated file whose first line contains the names of the columns
+    """
+    with open(filename) as f:
+        header = [name.strip() for name in f.readline().split(',')]
+        _missing(names, header, filename)
+        usecols = [header.index(name) for name in names]
+        while True:
+            lines = list(itertools.islice(f, chunk_size))
+            if not lines:
+                break
+            lines = [line for line in lines if line.strip()]
+            if not lines:
+                continue
+            table = np.loadtxt(lines, delimiter=',', usecols=usecols, ndmin=2)
+            yield dict((name, table[:, i]) for i, name in enumerate(names))
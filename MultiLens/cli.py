@@ -0,0 +1,277 @@
+"""
+command line batch runner of ray-tracing jobs (console command 'multilens')
+
+A job is specified in a JSON file, e.g.::
+
+    {
+        "cosmology": {"H0": 70, "Om0": 0.3, "Ob0": 0.05},
+        "assembly": ["los_0.npz", "los_1.npz"],
+        "grid": {"num_pix": 1000, "delta_pix": 0.01},
+        "method": "full",
+        "method_kwargs": {"n_slabs": 20},
+        "z_source": [1.0, 2.0],
+        "output": "run_01",
+        "tile_size": 100,
+        "processes": 4
+    }
+
+"assembly" is one file (or a list of files, one per realization) saved with persistence.save_assembly(). The field
+is traced in tiles of tile_size rows for each realization and source redshift. The source positions are written to
+output/r<realization>_z<z_source>/ (see persistence.MapWriter) as the tiles complete and the completed tiles are
+recorded in output/checkpoint.json, such that an interrupted run continues where it stopped when started again.
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+__author__ = 'sibirrer'
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+_METHODS = ('full', 'born', 'combined', 'analytic')
+_DEFAULTS = {'cosmology': {}, 'method': 'full', 'method_kwargs': {}, 'tile_size': None, 'processes': 1}
+_CHECKPOINT = 'checkpoint.json'
+
+# state of the worker processes (loaded once per process by _init_worker())
+_WORKER = {}
+
+
+def load_job(filename):
+    """
+    reads a job specification from a JSON file and fills in the defaults
+
+    :param filename: name of the JSON file
+    :return: job dictionary
+    """
+    with open(filename) as f:
+        job = json.load(f)
+    return check_job(job)
+
+
+def check_job(job):
+    """
+    checks a job specification and fills in the defaults
+
+    :param job: job dictionary
+    :return: job dictionary
+    """
+    job = dict(job)
+    for key, value in _DEFAULTS.items():
+        job.setdefault(key, value)
+    for key in ['assembly', 'grid', 'z_source', 'output']:
+        if key not in job:
+            raise ValueError("job specification needs the entry '%s'." % key)
+    if not isinstance(job['assembly'], list):
+        job['assembly'] = [job['assembly']]
+    if not isinstance(job['z_source'], list):
+        job['z_source'] = [job['z_source']]
+    if job['method'] not in _METHODS:
+        raise ValueError("method %s not valid. Chose among %s." % (job['method'], list(_METHODS)))
+    if 'num_pix' not in job['grid'] or 'delta_pix' not in job['grid']:
+        raise ValueError("grid needs the entries 'num_pix' and 'delta_pix'.")
+    return job
+
+
+def grid_shape(job):
+    """
+    (ny, nx) of the traced grid
+    """
+    grid = job['grid']
+    num_pix_y = grid.get('num_pix_y')
+    return (grid['num_pix'] if num_pix_y is None else num_pix_y), grid['num_pix']
+
+
+def tasks(job):
+    """
+    list of the tasks of a job (realization index, source redshift index, first row, last row + 1)
+    """
+    ny, nx = grid_shape(job)
+    tile_size = ny if job['tile_size'] is None else max(1, int(job['tile_size']))
+    return [(r, s, r0, min(r0 + tile_size, ny)) for r in range(len(job['assembly']))
+            for s in range(len(job['z_source'])) for r0 in range(0, ny, tile_size)]
+
+
+def map_path(job, realization, source):
+    """
+    directory of the maps of a realization and source redshift
+    """
+    return os.path.join(job['output'], 'r%s_z%s' % (realization, job['z_source'][source]))
+
+
+def _job_hash(job):
+    """
+    hash of the entries of the job that determine the results (to refuse resuming a different job)
+    """
+    keys = ['cosmology', 'assembly', 'grid', 'method', 'method_kwargs', 'z_source', 'tile_size']
+    return hashlib.md5(json.dumps(dict((key, job[key]) for key in keys), sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _init_worker(job):
+    """
+    loads the lens assemblies and the grid of a worker process (the cosmology of the job is passed to the tracers and
+    the lens objects)
+    """
+    from MultiLens.Cosmo.cosmo import get_cosmo
+    from MultiLens.MultiLens import MultiLens
+    from MultiLens.born import BornLens
+    from MultiLens.persistence import load_assembly
+    from MultiLens.ray_set import RaySet
+    grid = job['grid']
+    rays = RaySet.grid(grid['num_pix'], grid['delta_pix'], grid.get('num_pix_y'), grid.get('center_x', 0),
+                       grid.get('center_y', 0))
+    ny, nx = grid_shape(job)
+    cosmo = get_cosmo(**job['cosmology'])
+    _WORKER.clear()
+    _WORKER.update({'job': job, 'x': rays.x.reshape(ny, nx), 'y': rays.y.reshape(ny, nx), 'cosmo': cosmo,
+                    'multiLens': MultiLens(cosmo=cosmo), 'bornLens': BornLens(cosmo=cosmo), 'assemblies': {},
+                    'load_assembly': load_assembly})
+
+
+def _run_task(task):
+    """
+    traces one tile of a realization for one source redshift
+
+    :return: task, beta_x, beta_y, number of rays, number of lens planes (distinct redshifts), time
+    """
+    start = time.time()
+    job = _WORKER['job']
+    realization, source, r0, r1 = task
+    assemblies = _WORKER['assemblies']
+    if realization not in assemblies:
+        assemblies[realization] = _WORKER['load_assembly'](job['assembly'][realization], cosmo=_WORKER['cosmo'])
+    lensAssembly = assemblies[realization]
+    z_source = job['z_source'][source]
+    x, y = _WORKER['x'][r0:r1].ravel(), _WORKER['y'][r0:r1].ravel()
+    kwargs = job['method_kwargs']
+    if job['method'] == 'full':
+        beta_x, beta_y = _WORKER['multiLens'].full_ray_tracing(lensAssembly, z_source, x, y, **kwargs)
+    elif job['method'] == 'born':
+        beta_x, beta_y = _WORKER['bornLens'].ray_shooting(lensAssembly, z_source, x, y)
+    elif job['method'] == 'combined':
+        beta_x, beta_y = _WORKER['multiLens'].combined_ray_tracing(lensAssembly, z_source, x, y, **kwargs)
+    else:
+        beta_x, beta_y = _WORKER['multiLens'].analytic_mapping(lensAssembly, z_source, x, y, **kwargs)
+    n_planes = len(set(z for z in lensAssembly.redshift_array if z < z_source))
+    return task, beta_x, beta_y, len(x), n_planes, time.time() - start
+
+
+def run(job, processes=None, resume=True, verbose=True):
+    """
+    runs a job, writing the maps tile by tile and recording the completed tiles in a checkpoint file
+
+    :param job: job dictionary (see check_job())
+    :param processes: number of worker processes (default from the job)
+    :param resume: bool, if True, continues an interrupted run of the same job (skipping the completed tiles)
+    :param verbose: bool, if True, prints the progress and the throughput statistics
+    :return: dictionary of throughput statistics
+    """
+    from MultiLens.persistence import MapWriter
+    job = check_job(job)
+    processes = job['processes'] if processes is None else processes
+    start = time.time()
+    if not os.path.isdir(job['output']):
+        os.makedirs(job['output'])
+    checkpoint_file = os.path.join(job['output'], _CHECKPOINT)
+    job_hash = _job_hash(job)
+    done = []
+    if resume and os.path.exists(checkpoint_file):
+        with open(checkpoint_file) as f:
+            checkpoint = json.load(f)
+        if checkpoint['job'] != job_hash:
+            raise ValueError("output %s contains the results of a different job." % job['output'])
+        done = [tuple(task) for task in checkpoint['done']]
+    done_set = set(done)
+    todo = [task for task in tasks(job) if task not in done_set]
+    shape = grid_shape(job)
+    writers = {}
+    for realization in range(len(job['assembly'])):
+        for source in range(len(job['z_source'])):
+            path = map_path(job, realization, source)
+            started = any(task[:2] == (realization, source) for task in done)
+            writers[(realization, source)] = MapWriter(path, shape, mode='r+' if started else 'w')
+    n_tasks = len(todo) + len(done)
+    stats = {'tiles': len(todo), 'tiles_skipped': len(done), 'rays': 0, 'ray_planes': 0, 'compute_time': 0.}
+    if processes > 1 and len(todo) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(job,))
+        results = pool.imap_unordered(_run_task, todo)
+    else:
+        pool = None
+        _init_worker(job)
+        results = (_run_task(task) for task in todo)
+    try:
+        for task, beta_x, beta_y, n_rays, n_planes, compute_time in results:
+            realization, source, r0, r1 = task
+            writer = writers[(realization, source)]
+            writer.write('beta_x', np.reshape(beta_x, (r1 - r0, shape[1])), slice(r0, r1))
+            writer.write('beta_y', np.reshape(beta_y, (r1 - r0, shape[1])), slice(r0, r1))
+            writer.flush()
+            done.append(task)
+            _write_checkpoint(checkpoint_file, job_hash, done)
+            stats['rays'] += n_rays
+            stats['ray_planes'] += n_rays * n_planes
+            stats['compute_time'] += compute_time
+            if verbose:
+                print("tile %s/%s done (realization %s, z_source = %s, rows %s-%s)"
+                      % (len(done), n_tasks, realization, job['z_source'][source], r0, r1))
+    finally:
+        if pool is not None:
+            pool.terminate()
+        for writer in writers.values():
+            writer.close()
+    stats['wall_time'] = time.time() - start
+    stats['rays_per_second'] = stats['rays'] / max(stats['wall_time'], 1e-12)
+    stats['ray_planes_per_second'] = stats['ray_planes'] / max(stats['wall_time'], 1e-12)
+    if verbose:
+        print_stats(stats)
+    return stats
+
+
+def _write_checkpoint(filename, job_hash, done):
+    """
+    writes the list of completed tasks (atomically, via a temporary file)
+    """
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'job': job_hash, 'done': [list(task) for task in done]}, f)
+    os.rename(tmp, filename)
+
+
+def print_stats(stats):
+    """
+    prints the throughput statistics of a run
+    """
+    print("==========")
+    print("tiles traced = %s, tiles skipped (resumed) = %s" % (stats['tiles'], stats['tiles_skipped']))
+    print("rays = %s, ray-planes = %s" % (stats['rays'], stats['ray_planes']))
+    print("wall time = %.3f s, compute time = %.3f s" % (stats['wall_time'], stats['compute_time']))
+    print("throughput = %.4g rays/s, %.4g ray-planes/s" % (stats['rays_per_second'], stats['ray_planes_per_second']))
+
+
+def main(argv=None):
+    """
+    entry point of the 'multilens' console command
+    """
+    parser = argparse.ArgumentParser(prog='multilens', description='runs a multi-plane ray-tracing job')
+    parser.add_argument('job', help='job specification (JSON file)')
+    parser.add_argument('-p', '--processes', type=int, default=None, help='number of worker processes')
+    parser.add_argument('-t', '--tile-size', type=int, default=None, help='number of grid rows per tile')
+    parser.add_argument('-o', '--output', default=None, help='output directory')
+    parser.add_argument('--restart', action='store_true', help='ignore the checkpoint and start from scratch')
+    parser.add_argument('-q', '--quiet', action='store_true', help='do not print the progress')
+    args = parser.parse_args(argv)
+    job = load_job(args.job)
+    if args.tile_size is not None:
+        job['tile_size'] = args.tile_size
+    if args.output is not None:
+        job['output'] = args.output
+    run(job, processes=args.processes, resume=not args.restart, verbose=not args.quiet)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
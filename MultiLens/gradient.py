@@ -0,0 +1,358 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+__author__ = 'sibirrer'
+
+import numpy as np
+
+from MultiLens.Cosmo.cosmo import get_cosmo
+import MultiLens.ray_set as ray_set
+import MultiLens.Utils.constants as const
+from MultiLens.Utils.instrumentation import NULL_INSTRUMENTATION
+
+_POSITIONS = ('pos_x', 'pos_y')
+
+
+class GradientLens(object):
+    """
+    class to compute the source positions of the full ray-tracing together with their derivatives with respect to the
+    parameters of the lens objects (forward mode)
+
+    The derivatives of the ray positions and angles with respect to each parameter are propagated through the recursion
+    of MultiLens.full_ray_tracing() together with the rays: the deflection of a lens plane changes with the ray
+    positions and the lens positions through the hessians of the lenses and with the profile parameters through
+    LensObject.param_derivative(). The positions of the lenses in the observer frame are traced in the same way, such
+    that the derivatives include the displacement of the lenses by the lenses in front of them.
+    ray_shooting() propagates the derivatives forward and returns the full jacobian at the cost of a trace with the
+    deflections and hessians plus a few array operations per ray, plane and parameter. adjoint() propagates them
+    backward from a weighting of the source positions (e.g. the derivative of a chi^2) and returns the derivatives of
+    the weighted sum at the cost of about three traces, independent of the number of parameters.
+    """
+
+    def __init__(self, instrumentation=None, cosmo=None):
+        """
+
+        :param instrumentation: Instrumentation instance (None for no instrumentation)
+        :param cosmo: CosmoProp instance (default: get_cosmo())
+        :return:
+        """
+        self.cosmo = get_cosmo() if cosmo is None else cosmo
+        if instrumentation is None:
+            instrumentation = NULL_INSTRUMENTATION
+        self.instrumentation = instrumentation
+
+    def parameters(self, lensAssembly):
+        """
+        all the parameters of the lens objects of an assembly
+        (the positions are in the units of 'kwargs_profile', i.e. arc seconds in the observer frame)
+
+        :param lensAssembly: LensAssembly instance
+        :return: list of (lens id, parameter name)
+        """
+        params = []
+        for lens_id, lensObject in zip(lensAssembly.lens_ids, lensAssembly.object_array):
+            params += [(lens_id, name) for name in sorted(lensObject.kwargs_param)]
+        return params
+
+    def ray_shooting(self, lensAssembly, z_source, x_array, y_array=None, params=None):
+        """
+        source positions of the full ray-tracing (in the observer frame) and their derivatives
+
+        :param lensAssembly: LensAssembly instance
+        :param z_source: redshift of the source
+        :param x_array: x-coords of the rays (or RaySet instance)
+        :param y_array: y-coords of the rays (None if x_array is a RaySet)
+        :param params: list of (lens id, parameter name) (default: all parameters, see parameters())
+        :return: beta_x, beta_y, d beta_x/d params, d beta_y/d params (the derivatives with an additional first axis
+         along params)
+        """
+        x_array, y_array = ray_set.coordinates(x_array, y_array)
+        shape = np.shape(x_array)
+        if params is None:
+            params = self.parameters(lensAssembly)
+        rows = self._rows(lensAssembly, params)
+        slots = dict((id(lensObject), i) for i, lensObject in enumerate(lensAssembly.object_array))
+        n_params = len(params)
+        with self.instrumentation.section('observer_frame'):
+            d_pos_x, d_pos_y = self._observer_frame(lensAssembly, rows, slots, n_params)
+        x = np.array(x_array, dtype=float).ravel()
+        y = np.array(y_array, dtype=float).ravel()
+        n_rays = len(x)
+        alpha_x, alpha_y = x.copy(), y.copy()
+        d_alpha_x, d_alpha_y = np.zeros((n_params, n_rays)), np.zeros((n_params, n_rays))
+        x_k, y_k = np.zeros(n_rays), np.zeros(n_rays)
+        d_x_k, d_y_k = np.zeros((n_params, n_rays)), np.zeros((n_params, n_rays))
+        chi_last = 0
+        for i, (z, lens_list) in enumerate(lensAssembly.planes()):
+            if z >= z_source:
+                break
+            chi = self.cosmo.comoving_transverse_distance(z)
+            T_k_last = chi - chi_last
+            x_k += alpha_x*T_k_last
+            y_k += alpha_y*T_k_last
+            d_x_k += T_k_last*d_alpha_x
+            d_y_k += T_k_last*d_alpha_y
+            with self.instrumentation.section('deflection', n_rays=n_rays, plane=i):
+                a_x, a_y, d_a_x, d_a_y = self._deflect(lens_list, x_k/(1+z), y_k/(1+z), d_x_k, d_y_k, 1./(1+z),
+                                                       d_pos_x, d_pos_y, rows, slots)
+            alpha_x -= a_x
+            alpha_y -= a_y
+            d_alpha_x -= d_a_x
+            d_alpha_y -= d_a_y
+            chi_last = chi
+        T_k_last = self.cosmo.comoving_transverse_distance(z_source) - chi_last
+        factor = 1. / (1 + z_source) / self.cosmo.D_xy(0, z_source)
+        beta_x = (x_k + alpha_x*T_k_last) * factor
+        beta_y = (y_k + alpha_y*T_k_last) * factor
+        d_beta_x = (d_x_k + d_alpha_x*T_k_last) * factor
+        d_beta_y = (d_y_k + d_alpha_y*T_k_last) * factor
+        return beta_x.reshape(shape), beta_y.reshape(shape), d_beta_x.reshape((n_params,) + shape), \
+            d_beta_y.reshape((n_params,) + shape)
+
+    def adjoint(self, lensAssembly, z_source, x_array, y_array=None, v_x=None, v_y=None, params=None):
+        """
+        source positions of the full ray-tracing (in the observer frame) and the derivatives of
+        sum(v_x*beta_x + v_y*beta_y) with respect to the parameters (reverse mode). The ray positions at each lens plane
+        are kept in memory.
+
+        :param lensAssembly: LensAssembly instance
+        :param z_source: redshift of the source
+        :param x_array: x-coords of the rays (or RaySet instance)
+        :param y_array: y-coords of the rays (None if x_array is a RaySet)
+        :param v_x: weights of beta_x (same shape as x_array)
+        :param v_y: weights of beta_y (same shape as x_array)
+        :param params: list of (lens id, parameter name) (default: all parameters, see parameters())
+        :return: beta_x, beta_y, 1d array of the derivatives along params
+        """
+        x_array, y_array = ray_set.coordinates(x_array, y_array)
+        shape = np.shape(x_array)
+        if params is None:
+            params = self.parameters(lensAssembly)
+        rows = self._rows(lensAssembly, params)
+        slots = dict((id(lensObject), i) for i, lensObject in enumerate(lensAssembly.object_array))
+        n_lens = len(slots)
+        pos_x, pos_y = lensAssembly.get_visible_positions()
+        with self.instrumentation.section('observer_frame'):
+            observer_tape = self._forward(lensAssembly.planes(), pos_x.copy(), pos_y.copy(), observer=True)[-1]
+        x = np.array(x_array, dtype=float).ravel()
+        y = np.array(y_array, dtype=float).ravel()
+        planes = [(z, lens_list) for z, lens_list in lensAssembly.planes() if z < z_source]
+        with self.instrumentation.section('deflection', n_rays=len(x)):
+            x_k, y_k, alpha_x, alpha_y, chi_last, tape = self._forward(planes, x, y)
+        T_k_last = self.cosmo.comoving_transverse_distance(z_source) - chi_last
+        factor = 1. / (1 + z_source) / self.cosmo.D_xy(0, z_source)
+        beta_x = (x_k + alpha_x*T_k_last) * factor
+        beta_y = (y_k + alpha_y*T_k_last) * factor
+        lam_x_x = factor * np.array(v_x, dtype=float).ravel()
+        lam_x_y = factor * np.array(v_y, dtype=float).ravel()
+        grad = np.zeros(len(params))
+        g_pos_x, g_pos_y = np.zeros(n_lens), np.zeros(n_lens)
+        with self.instrumentation.section('adjoint', n_rays=len(x)):
+            self._backward(tape, lam_x_x, lam_x_y, T_k_last*lam_x_x, T_k_last*lam_x_y, grad, g_pos_x, g_pos_y, rows,
+                           slots)
+        with self.instrumentation.section('observer_frame'):
+            lam_a_x, lam_a_y = self._backward(observer_tape, np.zeros(n_lens), np.zeros(n_lens), np.zeros(n_lens),
+                                              np.zeros(n_lens), grad, g_pos_x, g_pos_y, rows, slots, observer=True)
+        for j, lensObject in enumerate(lensAssembly.object_array):
+            for row, name in rows.get(id(lensObject), []):
+                if name not in _POSITIONS:
+                    continue
+                # positions in the observer frame are the initial angles of the rays of the observer frame pass
+                if lensObject.observer_frame:
+                    grad[row] += const.arcsec * (lam_a_x[j] if name == 'pos_x' else lam_a_y[j])
+                else:
+                    grad[row] += g_pos_x[j] if name == 'pos_x' else g_pos_y[j]
+        return beta_x.reshape(shape), beta_y.reshape(shape), grad
+
+    def _forward(self, planes, x, y, observer=False):
+        """
+        recursion of the full ray-tracing, keeping the ray positions at each lens plane
+
+        :param planes: list of (redshift, list of lens objects)
+        :param x: initial x-angles of the rays (modified in place)
+        :param y: initial y-angles of the rays (modified in place)
+        :param observer: bool, if True, the rays are the ones of the lens objects and the lenses are placed at the
+         positions of their rays (observer frame)
+        :return: x_k, y_k, alpha_x, alpha_y, comoving distance of the last plane,
+         list of (T_k_last, 1/(1+z), list of lens objects, physical x, physical y) per plane
+        """
+        alpha_x, alpha_y = x, y
+        x_k, y_k = np.zeros_like(x), np.zeros_like(y)
+        tape = []
+        chi_last = 0
+        i = 0
+        for z, lens_list in planes:
+            chi = self.cosmo.comoving_transverse_distance(z)
+            T_k_last = chi - chi_last
+            x_k += alpha_x*T_k_last
+            y_k += alpha_y*T_k_last
+            x_k_phys, y_k_phys = x_k/(1+z), y_k/(1+z)
+            if observer:
+                for lensObject in lens_list:
+                    lensObject.update_position(x_k_phys[i], y_k_phys[i])
+                    i += 1
+            for lensObject in lens_list:
+                a_x, a_y = lensObject.deflection(x_k_phys, y_k_phys)
+                alpha_x -= a_x
+                alpha_y -= a_y
+            tape.append((T_k_last, 1./(1+z), lens_list, x_k_phys, y_k_phys))
+            chi_last = chi
+        return x_k, y_k, alpha_x, alpha_y, chi_last, tape
+
+    def _backward(self, tape, lam_x_x, lam_x_y, lam_a_x, lam_a_y, grad, g_pos_x, g_pos_y, rows, slots, observer=False):
+        """
+        reverse recursion: propagates the derivatives of the output with respect to the comoving ray positions (lam_x)
+        and angles (lam_a) from the last to the first plane, adding the derivatives with respect to the profile
+        parameters to grad and the ones with respect to the physical lens positions to g_pos (all modified in place)
+
+        :param observer: bool, if True, the tape is the one of the observer frame pass and the derivatives with respect
+         to the lens positions are propagated to the rays of the lenses
+        :return: derivatives with respect to the initial angles of the rays lam_a_x, lam_a_y
+        """
+        i = sum(len(plane[2]) for plane in tape)
+        for T_k_last, scale, lens_list, x, y in reversed(tape):
+            f_xx, f_yy, f_xy = np.zeros_like(x), np.zeros_like(x), np.zeros_like(x)
+            for lensObject in lens_list:
+                h_xx, h_yy, h_xy = lensObject.distortion(x, y)
+                f_xx += h_xx
+                f_yy += h_yy
+                f_xy += h_xy
+                # a displacement of the lens changes the deflection and the subtracted deflection at the origin
+                h_xx0, h_yy0, h_xy0 = lensObject.distortion(0, 0)
+                j = slots[id(lensObject)]
+                g_pos_x[j] += np.sum((h_xx - h_xx0)*lam_a_x + (h_xy - h_xy0)*lam_a_y)
+                g_pos_y[j] += np.sum((h_xy - h_xy0)*lam_a_x + (h_yy - h_yy0)*lam_a_y)
+                own = [(row, name) for row, name in rows.get(id(lensObject), []) if name not in _POSITIONS]
+                if own:
+                    derivatives = lensObject.param_derivative(x, y)
+                    derivatives0 = lensObject.param_derivative(0, 0)
+                    for row, name in own:
+                        grad[row] -= np.sum(lam_a_x*(derivatives[name][0] - derivatives0[name][0]) +
+                                            lam_a_y*(derivatives[name][1] - derivatives0[name][1]))
+            lam_x_x -= scale*(f_xx*lam_a_x + f_xy*lam_a_y)
+            lam_x_y -= scale*(f_xy*lam_a_x + f_yy*lam_a_y)
+            if observer:
+                # the lenses of the plane are placed at the positions of their rays
+                for lensObject in reversed(lens_list):
+                    i -= 1
+                    if lensObject.observer_frame:
+                        lam_x_x[i] += scale*g_pos_x[i]
+                        lam_x_y[i] += scale*g_pos_y[i]
+            lam_a_x += T_k_last*lam_x_x
+            lam_a_y += T_k_last*lam_x_y
+        return lam_a_x, lam_a_y
+
+    def _rows(self, lensAssembly, params):
+        """
+        parameters per lens object
+
+        :return: dictionary id(lens object): list of (index in params, parameter name)
+        """
+        rows = {}
+        for row, (lens_id, name) in enumerate(params):
+            lensObject = lensAssembly.get_lens(lens_id)
+            if name not in lensObject.kwargs_param:
+                raise ValueError("parameter %s of lens %s not valid." % (name, lens_id))
+            rows.setdefault(id(lensObject), []).append((row, name))
+        return rows
+
+    def _observer_frame(self, lensAssembly, rows, slots, n_params):
+        """
+        places the lens objects at their real positions given the positions in the observer frame (as
+        MultiLens._full_ray_tracing_observer()) and computes the derivatives of these physical positions
+
+        :return: d pos_x/d params, d pos_y/d params, arrays of shape (number of parameters, number of lens objects)
+        """
+        pos_x, pos_y = lensAssembly.get_visible_positions()
+        n_lens = len(pos_x)
+        alpha_x, alpha_y = pos_x.copy(), pos_y.copy()
+        d_alpha_x, d_alpha_y = np.zeros((n_params, n_lens)), np.zeros((n_params, n_lens))
+        d_pos_x, d_pos_y = np.zeros((n_params, n_lens)), np.zeros((n_params, n_lens))
+        for j, lensObject in enumerate(lensAssembly.object_array):
+            for row, name in rows.get(id(lensObject), []):
+                if name not in _POSITIONS:
+                    continue
+                # positions in the observer frame are given in arc seconds, otherwise in physical Mpc
+                d_alpha, d_pos = (d_alpha_x, d_pos_x) if name == 'pos_x' else (d_alpha_y, d_pos_y)
+                if lensObject.observer_frame:
+                    d_alpha[row, j] = const.arcsec
+                else:
+                    d_pos[row, j] = 1.
+        x_k, y_k = np.zeros(n_lens), np.zeros(n_lens)
+        d_x_k, d_y_k = np.zeros((n_params, n_lens)), np.zeros((n_params, n_lens))
+        z_last = 0
+        i = 0
+        for z, lens_list in lensAssembly.planes():
+            T_k_last = self.cosmo.T_xy(z_last, z)
+            x_k += alpha_x*T_k_last
+            y_k += alpha_y*T_k_last
+            d_x_k += d_alpha_x*T_k_last
+            d_y_k += d_alpha_y*T_k_last
+            x_k_phys, y_k_phys = x_k/(1+z), y_k/(1+z)
+            for lensObject in lens_list:
+                lensObject.update_position(x_k_phys[i], y_k_phys[i])
+                if lensObject.observer_frame:
+                    d_pos_x[:, i] = d_x_k[:, i]/(1+z)
+                    d_pos_y[:, i] = d_y_k[:, i]/(1+z)
+                i += 1
+            a_x, a_y, d_a_x, d_a_y = self._deflect(lens_list, x_k_phys, y_k_phys, d_x_k, d_y_k, 1./(1+z), d_pos_x,
+                                                   d_pos_y, rows, slots)
+            alpha_x -= a_x
+            alpha_y -= a_y
+            d_alpha_x -= d_a_x
+            d_alpha_y -= d_a_y
+            z_last = z
+        return d_pos_x, d_pos_y
+
+    def _deflect(self, lens_list, x, y, d_x, d_y, scale, d_pos_x, d_pos_y, rows, slots):
+        """
+        deflection of the lens objects of a plane and its derivatives
+
+        :param x: x-coords of the rays (physical)
+        :param y: y-coords of the rays (physical)
+        :param d_x: derivatives of x/scale, array of shape (number of parameters, number of rays)
+        :param d_y: derivatives of y/scale
+        :param scale: factor of d_x and d_y (i.e. 1/(1+z) for comoving derivatives)
+        :param d_pos_x: derivatives of the lens positions, array of shape (number of parameters, number of lenses)
+        :param d_pos_y: derivatives of the lens positions
+        :return: alpha_x, alpha_y, d alpha_x/d params, d alpha_y/d params
+        """
+        alpha_x, alpha_y = np.zeros_like(x), np.zeros_like(y)
+        f_xx, f_yy, f_xy = np.zeros_like(x), np.zeros_like(x), np.zeros_like(x)
+        # hessians relative to the one at the origin and position derivatives of the displaced lenses of the plane
+        moved_h_xx, moved_h_yy, moved_h_xy, moved_slots = [], [], [], []
+        own = []
+        for lensObject in lens_list:
+            a_x, a_y = lensObject.deflection(x, y)
+            alpha_x += a_x
+            alpha_y += a_y
+            h_xx, h_yy, h_xy = lensObject.distortion(x, y)
+            f_xx += h_xx
+            f_yy += h_yy
+            f_xy += h_xy
+            # a displacement of the lens changes the deflection and the subtracted deflection at the origin
+            j = slots[id(lensObject)]
+            if np.any(d_pos_x[:, j] != 0) or np.any(d_pos_y[:, j] != 0):
+                h_xx0, h_yy0, h_xy0 = lensObject.distortion(0, 0)
+                moved_h_xx.append(h_xx - h_xx0)
+                moved_h_yy.append(h_yy - h_yy0)
+                moved_h_xy.append(h_xy - h_xy0)
+                moved_slots.append(j)
+            own += [(lensObject, row, name) for row, name in rows.get(id(lensObject), []) if name not in _POSITIONS]
+        f_xx *= scale
+        f_yy *= scale
+        f_xy *= scale
+        d_alpha_x = f_xx*d_x
+        d_alpha_x += f_xy*d_y
+        d_alpha_y = f_xy*d_x
+        d_alpha_y += f_yy*d_y
+        if moved_slots:
+            dp_x, dp_y = d_pos_x[:, moved_slots], d_pos_y[:, moved_slots]
+            d_alpha_x -= np.dot(dp_x, moved_h_xx) + np.dot(dp_y, moved_h_xy)
+            d_alpha_y -= np.dot(dp_x, moved_h_xy) + np.dot(dp_y, moved_h_yy)
+        derivatives = {}
+        for lensObject, row, name in own:
+            if id(lensObject) not in derivatives:
+                derivatives[id(lensObject)] = lensObject.param_derivative(x, y), lensObject.param_derivative(0, 0)
+            d, d0 = derivatives[id(lensObject)]
+            d_alpha_x[row] += d[name][0] - d0[name][0]
+            d_alpha_y[row] += d[name][1] - d0[name][1]
+        return alpha_x, alpha_y, d_alpha_x, d_alpha_y
@@ -0,0 +1,156 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+__author__ = 'sibirrer'
+
+import numpy as np
+
+
+class ImageFormation(object):
+    """
+    class to turn supersampled ray-traced surface brightness into detector images.
+    The surface brightness is integrated over the detector pixels and convolved with a PSF in Fourier space.
+    The real FFT of the kernel and the padded FFT shapes are cached per image shape such that repeated simulations
+    with the same PSF only perform the forward and backward transform of the image itself.
+    """
+
+    def __init__(self, kernel=None, supersampling_factor=1, normalize_kernel=True):
+        """
+
+        :param kernel: 2d PSF kernel at detector resolution (None for no convolution)
+        :param supersampling_factor: number of supersampled pixels per detector pixel along each axis
+        :param normalize_kernel: bool, if True, normalizes the kernel to unit sum
+        :return:
+        """
+        self._supersampling_factor = int(supersampling_factor)
+        if self._supersampling_factor < 1:
+            raise ValueError("supersampling factor needs to be a positive integer, %s given." % supersampling_factor)
+        self._fft_cache = {}
+        self.set_kernel(kernel, normalize=normalize_kernel)
+
+    @property
+    def supersampling_factor(self):
+        return self._supersampling_factor
+
+    @property
+    def kernel(self):
+        return self._kernel
+
+    def set_kernel(self, kernel, normalize=True):
+        """
+        sets a new PSF kernel and clears the cached kernel transforms
+        :param kernel: 2d PSF kernel at detector resolution (None for no convolution)
+        :param normalize: bool, if True, normalizes the kernel to unit sum
+        :return:
+        """
+        if kernel is not None:
+            kernel = np.array(kernel, dtype=float)
+            if kernel.ndim != 2:
+                raise ValueError("kernel needs to be a 2d array, %s dimensions given." % kernel.ndim)
+            if normalize:
+                kernel /= np.sum(kernel)
+        self._kernel = kernel
+        self._fft_cache = {}
+
+    def image(self, flux, numPix_x=None, numPix_y=None):
+        """
+        integrates the supersampled surface brightness over the detector pixels and convolves it with the PSF
+
+        :param flux: supersampled surface brightness, either as 1d array of the traced rays (as returned by the
+         ray-tracing routines on a utils.make_grid() grid), as 2d image or as a stack of those with leading batch axis
+        :param numPix_x: number of supersampled pixels along x (only needed for non-square grids or stacked 1d arrays)
+        :param numPix_y: number of supersampled pixels along y (only needed for non-square grids or stacked 1d arrays)
+        :return: detector image(s) of shape (..., ny, nx)
+        """
+        image = self._to_image(flux, numPix_x, numPix_y)
+        image = self.downsample(image)
+        return self.convolve(image)
+
+    def downsample(self, image):
+        """
+        averages the supersampled pixels within each detector pixel
+
+        :param image: supersampled image(s) of shape (..., ny*s, nx*s)
+        :return: image(s) of shape (..., ny, nx)
+        """
+        s = self._supersampling_factor
+        if s == 1:
+            return image
+        ny, nx = image.shape[-2:]
+        if ny % s != 0 or nx % s != 0:
+            raise ValueError("image shape %s is not a multiple of the supersampling factor %s." % ((ny, nx), s))
+        shape = image.shape[:-2] + (ny//s, s, nx//s, s)
+        return image.reshape(shape).mean(axis=(-3, -1))
+
+    def convolve(self, image):
+        """
+        convolves image(s) with the PSF kernel using real FFTs of cached size, the output has the same shape as the input
+
+        :param image: image(s) of shape (..., ny, nx)
+        :return: convolved image(s) of shape (..., ny, nx)
+        """
+        if self._kernel is None:
+            return image
+        fft_shape, kernel_ft, slice_y, slice_x = self._fft_setup(image.shape[-2:])
+        image_ft = np.fft.rfft2(image, s=fft_shape)
+        image_ft *= kernel_ft
+        conv = np.fft.irfft2(image_ft, s=fft_shape)
+        return conv[..., slice_y, slice_x]
+
+    def _fft_setup(self, shape):
+        """
+        returns (and caches) the padded FFT shape, the kernel transform and the slices of the 'same' output region
+        :param shape: (ny, nx) of the images to be convolved
+        :return: fft_shape, kernel_ft, slice_y, slice_x
+        """
+        shape = tuple(shape)
+        if shape not in self._fft_cache:
+            k_y, k_x = self._kernel.shape
+            fft_shape = (_next_fast_len(shape[0] + k_y - 1), _next_fast_len(shape[1] + k_x - 1))
+            kernel_ft = np.fft.rfft2(self._kernel, s=fft_shape)
+            slice_y = slice((k_y - 1)//2, (k_y - 1)//2 + shape[0])
+            slice_x = slice((k_x - 1)//2, (k_x - 1)//2 + shape[1])
+            self._fft_cache[shape] = (fft_shape, kernel_ft, slice_y, slice_x)
+        return self._fft_cache[shape]
+
+    def _to_image(self, flux, numPix_x=None, numPix_y=None):
+        """
+        reshapes 1d ray arrays (or stacks thereof) into 2d images without copying.
+        1d inputs without numPix are assumed to be square, 2d and 3d inputs without numPix are taken as images.
+
+        :param flux: 1d, 2d or 3d array
+        :param numPix_x: number of pixels along x of the (supersampled) grid
+        :param numPix_y: number of pixels along y of the (supersampled) grid
+        :return: array of shape (..., ny, nx)
+        """
+        flux = np.asarray(flux, dtype=float)
+        if numPix_x is None and numPix_y is None:
+            if flux.ndim > 1:
+                return flux
+            numPix_x = int(np.sqrt(len(flux)))
+        if numPix_x is None:
+            numPix_x = numPix_y
+        if numPix_y is None:
+            numPix_y = numPix_x
+        if flux.shape[-1] != numPix_x*numPix_y:
+            raise ValueError("lenght of input array given as %s does not match %s x %s pixels!"
+                             % (flux.shape[-1], numPix_y, numPix_x))
+        return flux.reshape(flux.shape[:-1] + (numPix_y, numPix_x))
+
+
+def _next_fast_len(n):
+    """
+    smallest integer >= n that factorizes into 2, 3 and 5 (fast sizes for the FFT)
+    :param n: integer
+    :return: integer
+    """
+    best = 2 * n
+    p5 = 1
+    while p5 < best:
+        p35 = p5
+        while p35 < best:
+            p235 = p35
+            while p235 < n:
+                p235 *= 2
+            best = min(best, p235)
+            p35 *= 3
+        p5 *= 5
+    return best
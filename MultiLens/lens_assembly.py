@@ -1,25 +1,68 @@
 from __future__ import print_function, division, absolute_import, unicode_literals
 __author__ = 'sibirrer'
 
+import bisect
+
 import numpy as np
 
+import MultiLens.Utils.constants as const
+
+
 class LensAssembly(object):
     """
     class to arrange all the strong and weak lenses along a line of sight
+
+    The lens objects are kept sorted by redshift (lenses at equal redshift in the order they were added). Each added
+    lens gets an integer identifier. Redshifts and observer frame positions are also available as numpy columns.
     """
     def __init__(self):
         self.redshift_array = []
         self.object_array = []
+        self._id_array = []
+        self._redshift_of_id = {}
+        self._next_id = 0
+        self._columns = None
+        self._culling = None
+        self._params_version = 0
 
     def add_lens(self, lensObject):
         """
 
         :param lensObject: object class of lens_object.py
-        :return:
+        :return: identifier of the lens within the assembly
+        """
+        i = bisect.bisect_right(self.redshift_array, lensObject.redshift)
+        lens_id = self._next_id
+        self._next_id += 1
+        self.redshift_array.insert(i, lensObject.redshift)
+        self.object_array.insert(i, lensObject)
+        self._id_array.insert(i, lens_id)
+        self._redshift_of_id[lens_id] = lensObject.redshift
+        self._register(lensObject)
+        self._columns = None
+        return lens_id
+
+    def add_lenses(self, lens_list):
         """
-        self.redshift_array.append(lensObject.redshift)
-        self.object_array.append(lensObject)
-        self._arrange_lenses()
+        adds many lens objects at once (with a single sort)
+
+        :param lens_list: list of lens objects
+        :return: list of the identifiers of the lenses
+        """
+        lens_ids = list(range(self._next_id, self._next_id + len(lens_list)))
+        self._next_id += len(lens_list)
+        redshift_array = self.redshift_array + [lensObject.redshift for lensObject in lens_list]
+        object_array = self.object_array + list(lens_list)
+        id_array = self._id_array + lens_ids
+        order = sorted(range(len(redshift_array)), key=redshift_array.__getitem__)
+        self.redshift_array = [redshift_array[i] for i in order]
+        self.object_array = [object_array[i] for i in order]
+        self._id_array = [id_array[i] for i in order]
+        for lens_id, lensObject in zip(lens_ids, lens_list):
+            self._redshift_of_id[lens_id] = lensObject.redshift
+            self._register(lensObject)
+        self._columns = None
+        return lens_ids
 
     def remove_lens(self, redshift):
         """
@@ -27,31 +70,86 @@ class LensAssembly(object):
         :param redshift: redshift of removing object
         :return:
         """
-        for i in xrange(len(self.redshift_array), 0, -1):
-            z = self.redshift_array[i]
-            if z == redshift:
-                del self.redshift_array[i]
-                del self.object_array[i]
+        i_min = bisect.bisect_left(self.redshift_array, redshift)
+        i_max = bisect.bisect_right(self.redshift_array, redshift)
+        for lensObject in self.object_array[i_min:i_max]:
+            self._unregister(lensObject)
+        for lens_id in self._id_array[i_min:i_max]:
+            del self._redshift_of_id[lens_id]
+        del self.redshift_array[i_min:i_max]
+        del self.object_array[i_min:i_max]
+        del self._id_array[i_min:i_max]
+        self._columns = None
+
+    def remove_lens_id(self, lens_id):
+        """
+        removes the lens with the given identifier (as returned by add_lens)
+        :param lens_id: identifier of the lens
+        :return:
+        """
+        i = self._index(lens_id)
+        self._unregister(self.object_array[i])
+        del self.redshift_array[i]
+        del self.object_array[i]
+        del self._id_array[i]
+        del self._redshift_of_id[lens_id]
+        self._columns = None
+
+    def get_lens(self, lens_id):
+        """
+        returns the lens object with the given identifier
+        :param lens_id: identifier of the lens
+        :return: lens object
+        """
+        return self.object_array[self._index(lens_id)]
+
+    def _index(self, lens_id):
+        """
+        position of the lens with given identifier in the sorted arrays
+        """
+        if lens_id not in self._redshift_of_id:
+            raise ValueError("lens with identifier %s not in the assembly." % lens_id)
+        redshift = self._redshift_of_id[lens_id]
+        i_min = bisect.bisect_left(self.redshift_array, redshift)
+        i_max = bisect.bisect_right(self.redshift_array, redshift)
+        return self._id_array.index(lens_id, i_min, i_max)
+
+    def freeze_plane(self, redshift, half_width, **kwargs):
+        """
+        replaces all the lenses at a redshift by a single lens object of type 'deflection_map' sampling their
+        deflection (see lens_object.freeze() for the keyword arguments). Lenses in the observer frame are sampled at
+        their current physical positions.
+
+        :param redshift: redshift of the lens plane
+        :param half_width: half width of the map in arc seconds
+        :return: identifier of the new lens
+        """
+        from MultiLens.lens_object import freeze
+        i_min = bisect.bisect_left(self.redshift_array, redshift)
+        i_max = bisect.bisect_right(self.redshift_array, redshift)
+        if i_min == i_max:
+            raise ValueError("no lens at redshift %s." % redshift)
+        lensObject = freeze(self.object_array[i_min:i_max], half_width, **kwargs)
+        self.remove_lens(redshift)
+        return self.add_lens(lensObject)
 
     def print_info(self):
         print("Number of lenses = ", len(self.redshift_array))
         for lens_object in self.object_array:
             lens_object.print_info()
 
-    def _arrange_lenses(self):
-        """
-        re-arrange the lens orders to increasing redshifts
-        :return:
-        """
-        self.redshift_array, self.object_array = (list(x) for x in zip(*sorted(zip(self.redshift_array, self.object_array))))
-
     def clear(self):
         """
         remove all the data of the object class
         :return:
         """
+        for lensObject in self.object_array:
+            self._unregister(lensObject)
         self.redshift_array = []
         self.object_array = []
+        self._id_array = []
+        self._redshift_of_id = {}
+        self._columns = None
         print("LensAssembly class cleared. No lens object specified.")
 
     def main_deflector(self):
@@ -64,22 +162,139 @@ class LensAssembly(object):
                 return lensObject
         raise ValueError("main deflector not found. Please specify one lens object as such to execute this routine!")
 
+    def planes(self):
+        """
+        groups the lens objects at identical redshift into lens planes
+        :return: list of (redshift, list of lens objects), sorted by redshift
+        """
+        planes = []
+        for z, lensObject in zip(self.redshift_array, self.object_array):
+            if planes and planes[-1][0] == z:
+                planes[-1][1].append(lensObject)
+            else:
+                planes.append((z, [lensObject]))
+        return planes
+
+    @property
+    def lens_ids(self):
+        """
+        identifiers of the lenses in redshift order
+        """
+        return list(self._id_array)
+
+    @property
+    def redshifts(self):
+        """
+        numpy array of the redshifts of the lenses (read-only)
+        """
+        return self._get_columns()[0]
+
     def get_visible_positions(self):
         """
         return list of pos_x, pos_y of the positions of the lenses in the observer frame
-        :return: pos_x, pos_y list
+        :return: pos_x, pos_y list (read-only numpy arrays)
+        """
+        columns = self._get_columns()
+        return columns[1], columns[2]
+
+    def _get_columns(self):
+        """
+        builds (once after each change) the redshift and observer frame position columns
+        """
+        if self._columns is None:
+            n = len(self.object_array)
+            redshifts = np.array(self.redshift_array, dtype=float)
+            pos_x = np.zeros(n)
+            pos_y = np.zeros(n)
+            for i, lensObject in enumerate(self.object_array):
+                pos_x[i], pos_y[i] = lensObject.position()
+            for column in (redshifts, pos_x, pos_y):
+                column.flags.writeable = False
+            self._columns = (redshifts, pos_x, pos_y)
+        return self._columns
+
+    def _culling_plane(self, redshift):
         """
-        pos_x_list = np.zeros(len(self.object_array))
-        pos_y_list = np.zeros_like(pos_x_list)
-        for i in range(len(self.object_array)):
-            lensObject = self.object_array[i]
-            pos_x_list[i], pos_y_list[i] = lensObject.position()
-        return pos_x_list, pos_y_list
+        lens plane prepared for the culling of MultiLens.full_ray_tracing(): the lens objects without truncation, the
+        truncated ones and a GridIndex of their positions in arc seconds (observer frame positions, or the fixed
+        positions of lenses in the physical frame), built once after each change of the assembly, and the columns of
+        their current physical positions and monopoles, built once after each change of their parameters (e.g. by the
+        observer frame pass).
+
+        :param redshift: redshift of the lens plane
+        :return: dictionary with the entries 'exact', 'truncated', 'index', 'factor', 'r_trunc' and, via
+         _culling_columns(), 'pos_x', 'pos_y', 'monopole' and 'margin'
+        """
+        columns = self._get_columns()
+        if self._culling is None or self._culling[0] is not columns:
+            self._culling = (columns, {})
+        planes = self._culling[1]
+        if redshift not in planes:
+            from MultiLens.Utils.spatial import GridIndex
+            i_min = bisect.bisect_left(self.redshift_array, redshift)
+            i_max = bisect.bisect_right(self.redshift_array, redshift)
+            lens_list = self.object_array[i_min:i_max]
+            truncated = [lensObject for lensObject in lens_list if lensObject.r_trunc is not None]
+            # physical Mpc per arc second
+            factor = truncated[0]._distance_factor() if truncated else 1.
+            theta_x, theta_y = np.zeros(len(truncated)), np.zeros(len(truncated))
+            for k, lensObject in enumerate(truncated):
+                if lensObject.observer_frame:
+                    theta_x[k], theta_y[k] = np.array(lensObject.position()) / const.arcsec
+                else:
+                    theta_x[k] = lensObject.kwargs_param.get('pos_x', 0) / factor
+                    theta_y[k] = lensObject.kwargs_param.get('pos_y', 0) / factor
+            planes[redshift] = {'exact': [lensObject for lensObject in lens_list if lensObject.r_trunc is None],
+                                'truncated': truncated, 'index': GridIndex(theta_x, theta_y), 'factor': factor,
+                                'r_trunc': np.array([lensObject.r_trunc for lensObject in truncated], dtype=float),
+                                'version': None}
+        return planes[redshift]
+
+    def _culling_columns(self, plane):
+        """
+        fills in the physical positions and monopoles of the truncated lenses of a plane returned by _culling_plane()
+        and the largest distance (in arc seconds) of a lens from its indexed position plus its truncation radius
+
+        :param plane: dictionary returned by _culling_plane()
+        :return: plane
+        """
+        if plane['version'] != self._params_version:
+            truncated = plane['truncated']
+            pos_x = np.array([lensObject.kwargs_param.get('pos_x', 0) for lensObject in truncated], dtype=float)
+            pos_y = np.array([lensObject.kwargs_param.get('pos_y', 0) for lensObject in truncated], dtype=float)
+            index = plane['index']
+            shift = np.sqrt((pos_x / plane['factor'] - index.x)**2 + (pos_y / plane['factor'] - index.y)**2)
+            plane.update(pos_x=pos_x, pos_y=pos_y,
+                         monopole=np.array([lensObject.monopole() for lensObject in truncated], dtype=float),
+                         margin=np.max(shift + plane['r_trunc'] / plane['factor']) if truncated else 0.,
+                         version=self._params_version)
+        return plane
+
+    def _lens_changed(self, lensObject):
+        """
+        called by the lens objects of the assembly when their parameters or positions are replaced
+        """
+        self._columns = None
+
+    def _params_changed(self, lensObject):
+        """
+        called by the lens objects of the assembly when their parameters change (see LensObject.params_changed())
+        """
+        self._params_version += 1
+
+    def _register(self, lensObject):
+        if hasattr(lensObject, '_assemblies'):
+            lensObject._assemblies.append(self)
+
+    def _unregister(self, lensObject):
+        if hasattr(lensObject, '_assemblies') and self in lensObject._assemblies:
+            lensObject._assemblies.remove(self)
 
-    def reset_observer_frame(self):
+    def reset_observer_frame(self, cosmo=None):
         """
         undo the positional information of the observer
+        :param cosmo: CosmoProp or CosmoBatch instance (default: the one of each lens)
         :return:
         """
         for lens_object in self.object_array:
-            lens_object.reset_position()
\ No newline at end of file
+            lens_object.reset_position(cosmo)
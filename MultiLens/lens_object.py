@@ -8,18 +8,45 @@ from __future__ import print_function, division, absolute_import, unicode_litera
 __author__ = 'sibirrer'
 
 
-from MultiLens.Cosmo.cosmo import CosmoProp
+import numpy as np
+
+from MultiLens.Cosmo.cosmo import get_cosmo
 import MultiLens.Utils.constants as const
 
+# approximation tiers honoured by the tiered tracers: exact multi-plane, Born, tidal (hessian at the origin) or skip
+TIERS = ('full', 'born', 'tidal', 'skip')
+_TIER_ALIASES = {'strong': 'full', 'weak': 'born'}
+
 
 class LensObject(object):
     """
     class to specify the deflection caused by this object
+
+    The parameters are stored as floats (or arrays for batches) and passed to the profile as a cached tuple of
+    positional arguments. The derived quantities (deflection at the origin, monopole of the truncation) are cached
+    until the parameters change: parameters written into kwargs_param in place need to be followed by
+    params_changed() (or set with update_params()).
     """
+    __slots__ = ('redshift', 'type', 'approximation', 'kwargs_param', 'main', 'observer_frame', 'func', 'cosmo',
+                 'r_trunc', 'pos_x_observer', 'pos_y_observer', '_assemblies', '_monopole', '_reference', '_args',
+                 '_arcsec2phys')
 
-    def __init__(self, redshift, type='point_mass', approximation='weak', main=False, observer_frame=True):
+    def __init__(self, redshift, type='point_mass', approximation='weak', main=False, observer_frame=True,
+                 r_trunc=None):
+        """
+
+        :param redshift: redshift of the lens
+        :param type: profile type ('point_mass', 'NFW', 'SIS', 'deflection_map', 'tabulated')
+        :param approximation: approximation tier (see TIERS)
+        :param main: bool, True for the main deflector
+        :param observer_frame: bool, if True, the positions are given in the observer frame (arc seconds)
+        :param r_trunc: truncation radius in physical Mpc (None for no truncation), see set_truncation()
+        :return:
+        """
         self.redshift = redshift
         self.type = type
+        if approximation not in TIERS and approximation not in _TIER_ALIASES:
+            raise ValueError("approximation %s not valid." % approximation)
         self.approximation = approximation
         self.kwargs_param = dict([])
         self.main = main
@@ -33,9 +60,117 @@ class LensObject(object):
         elif type == 'SIS':
             from MultiLens.Profiles.SIS import SIS
             self.func = SIS()
+        elif type == 'deflection_map':
+            # the sampled map is added with add_info('deflection_map', DeflectionMap instance)
+            self.func = None
+        elif type == 'tabulated':
+            # the tables are added with add_info('radial_profile', RadialProfile instance)
+            self.func = None
         else:
             raise ValueError("lens type %s not valid." % type)
-        self.cosmo = CosmoProp()
+        self.cosmo = get_cosmo()
+        self._assemblies = []
+        self._arcsec2phys = None
+        self._args = None
+        self.set_truncation(r_trunc)
+
+    @property
+    def tier(self):
+        """
+        approximation tier of the lens object, one of TIERS ('weak' stands for 'born' and 'strong' for 'full')
+        """
+        return _TIER_ALIASES.get(self.approximation, self.approximation)
+
+    def set_truncation(self, r_trunc):
+        """
+        truncates the projected mass of the profile at a radius r_trunc: outside of it, the deflection is the one of a
+        point mass with the projected mass enclosed within r_trunc
+        :param r_trunc: truncation radius in physical Mpc (None for no truncation)
+        :return:
+        """
+        self.r_trunc = r_trunc
+        self.params_changed()
+        for lensAssembly in self._assemblies:
+            lensAssembly._lens_changed(self)
+
+    def params_changed(self):
+        """
+        drops the cached quantities derived from the parameters, to be called after changing kwargs_param in place
+        :return:
+        """
+        self._monopole = None
+        self._reference = None
+        self._args = None
+        for lensAssembly in self._assemblies:
+            lensAssembly._params_changed(self)
+
+    def update_params(self, **kwargs):
+        """
+        sets profile parameters (physical units, i.e. without the conversion of the observer frame positions)
+        :param kwargs: parameter values
+        :return:
+        """
+        self.kwargs_param.update(kwargs)
+        self.params_changed()
+
+    def monopole(self):
+        """
+        deflection angle times radius at the truncation radius, i.e. 4G/c^2 times the projected mass within r_trunc
+        (in rad*Mpc), which describes the deflection outside the truncation radius
+        :return: monopole
+        """
+        if self._monopole is None:
+            self._monopole = self._monopole_of(self._profile_args())
+        return self._monopole
+
+    def _monopole_of(self, args):
+        """
+        monopole of the truncation for the positional arguments args of the profile
+        """
+        pos_x, pos_y = self.kwargs_param.get('pos_x', 0), self.kwargs_param.get('pos_y', 0)
+        f_x, f_y = self.func.derivative(pos_x + self.r_trunc, pos_y, *args)
+        return float(np.sqrt(f_x**2 + f_y**2)) * self.r_trunc
+
+    @property
+    def amplitude_name(self):
+        """
+        name of the parameter the deflection and hessian scale with (see amplitude()), None if there is none
+        """
+        return getattr(self.func, 'amplitude', None)
+
+    def amplitude(self):
+        """
+        factor of the deflection and hessian relative to the ones at unit amplitude parameter (1 without amplitude)
+        :return: amplitude parameter to the power of the profile (float or array for batches)
+        """
+        name = self.amplitude_name
+        if name is None:
+            return 1.
+        return self.kwargs_param[name]**self.func.amplitude_power
+
+    def unit_fields(self, x, y, hessian=False):
+        """
+        deflection (and distortion) at unit amplitude parameter, i.e. deflection() = amplitude() * unit deflection
+        :param x: x-coordinate of the light ray
+        :param y: y-coordinate of the light ray
+        :param hessian: bool, if True, also returns the distortion
+        :return: delta_x, delta_y (and f_xx, f_yy, f_xy)
+        """
+        args = self._profile_args()
+        name = self.amplitude_name
+        if name is None:
+            monopole = None
+        else:
+            # the profile is evaluated with the amplitude replaced in a copy of the arguments (the parameters and the
+            # cached quantities of the lens object are not touched)
+            args = tuple(1. if arg_name == name else arg for arg_name, arg in zip(_profile_arg_names(self.func), args))
+            monopole = None if self.r_trunc is None else self._monopole_of(args)
+        f_x0, f_y0 = self._derivative(0, 0, args, monopole)
+        f_x, f_y = self._derivative(x, y, args, monopole)
+        fields = (f_x - f_x0, f_y - f_y0)
+        if hessian:
+            fields += self._distortion(x, y, args, monopole)
+        return fields
 
     def add_info(self, name, data):
         """
@@ -43,24 +178,51 @@ class LensObject(object):
         :return:
         """
         if name == 'kwargs_profile':
+            for key, value in data.items():
+                if np.ndim(value) == 0:
+                    data[key] = float(value)
             self.kwargs_param = data
+            self.params_changed()
             if self.observer_frame and 'pos_x' in data and 'pos_y' in data:
                 self.pos_x_observer = data['pos_x']*const.arcsec
                 self.pos_y_observer = data['pos_y']*const.arcsec
-                self.kwargs_param['pos_x'] = self.cosmo.arcsec2phys(data['pos_x'], z=self.redshift)
-                self.kwargs_param['pos_y'] = self.cosmo.arcsec2phys(data['pos_y'], z=self.redshift)
+                self.kwargs_param['pos_x'] = data['pos_x']*self._distance_factor()
+                self.kwargs_param['pos_y'] = data['pos_y']*self._distance_factor()
+            for lensAssembly in self._assemblies:
+                lensAssembly._lens_changed(self)
+        elif (name, self.type) in (('deflection_map', 'deflection_map'), ('radial_profile', 'tabulated')):
+            self.func = data
+            self.params_changed()
+            for lensAssembly in self._assemblies:
+                lensAssembly._lens_changed(self)
         else:
             print("name %s is not a valid info attribute." % name)
 
     def potential(self, x, y):
         """
-        returns the lensing potential of the object
+        returns the lensing potential of the object (in rad*Mpc), consistent with deflection(): the gradient at the
+        origin is subtracted and, outside the truncation radius, it is the potential of the enclosed mass
         :param x: x-coordinate of the light ray
         :param y: y-coordinate of the light ray
         :return: potential
         """
-        f_ = self.func.function(x, y, **self.kwargs_param)
-        return f_
+        f_x0, f_y0 = self.reference_deflection()
+        f_ = self._potential(x, y)
+        return f_ - f_x0*x - f_y0*y
+
+    def _potential(self, x, y):
+        """
+        potential of the (possibly truncated) profile
+        """
+        args = self._profile_args()
+        f_ = self.func.function(x, y, *args)
+        if self.r_trunc is None:
+            return f_
+        pos_x, pos_y = self.kwargs_param.get('pos_x', 0), self.kwargs_param.get('pos_y', 0)
+        r2 = (x - pos_x)**2 + (y - pos_y)**2
+        outside = r2 > self.r_trunc**2
+        f_trunc = self.func.function(pos_x + self.r_trunc, pos_y, *args)
+        return np.where(outside, f_trunc + self.monopole()/2.*np.log(np.where(outside, r2, 1.)/self.r_trunc**2), f_)
 
     def deflection(self, x, y):
         """
@@ -69,10 +231,92 @@ class LensObject(object):
         :param y: y-coordinate of the light ray
         :return: delta_x, delta_y
         """
-        f_x0, f_y0 = self.func.derivative(0, 0, **self.kwargs_param)
-        f_x, f_y = self.func.derivative(x, y, **self.kwargs_param)
+        f_x0, f_y0 = self.reference_deflection()
+        f_x, f_y = self._derivative(x, y)
         return f_x-f_x0, f_y-f_y0
 
+    def reference_deflection(self):
+        """
+        deflection of the profile at the origin, which is subtracted by deflection() (cached)
+        :return: f_x, f_y
+        """
+        if self._reference is None:
+            self._reference = self._derivative(0, 0)
+        return self._reference
+
+    def _profile_args(self):
+        """
+        parameters as a tuple of positional arguments of the profile functions (cached)
+        """
+        if self._args is None:
+            self._args = _profile_args(self.func, self.kwargs_param)
+        return self._args
+
+    def _distance_factor(self):
+        """
+        physical Mpc per arc second at the redshift of the lens (cached)
+        """
+        if self._arcsec2phys is None:
+            self._arcsec2phys = self.cosmo.arcsec2phys(1., z=self.redshift)
+        return self._arcsec2phys
+
+    def _derivative(self, x, y, args=None, monopole=None):
+        """
+        derivative of the (possibly truncated) profile
+
+        :param args: positional arguments of the profile (default: the ones of the parameters)
+        :param monopole: monopole of the truncation for args (default: monopole())
+        """
+        if args is None:
+            args = self._profile_args()
+        if self.r_trunc is None:
+            return self.func.derivative(x, y, *args)
+        if monopole is None:
+            monopole = self.monopole()
+        x_ = x - self.kwargs_param.get('pos_x', 0)
+        y_ = y - self.kwargs_param.get('pos_y', 0)
+        r2 = x_**2 + y_**2
+        outside = r2 > self.r_trunc**2
+        if np.ndim(r2) == 0:
+            if outside:
+                return monopole*x_/r2, monopole*y_/r2
+            return self.func.derivative(x, y, *args)
+        x, y = np.broadcast_arrays(x, y)
+        a = np.zeros_like(r2)
+        np.divide(monopole, r2, out=a, where=outside)
+        f_x, f_y = a*x_, a*y_
+        inside = ~outside
+        if np.any(inside):
+            f_x[inside], f_y[inside] = self.func.derivative(x[inside], y[inside], *args)
+        return f_x, f_y
+
+    def param_derivative(self, x, y):
+        """
+        returns the derivatives of the deflection with respect to the profile parameters (except the position, whose
+        derivatives are the negative distortion)
+        :param x: x-coordinate of the light ray
+        :param y: y-coordinate of the light ray
+        :return: dictionary of (d delta_x/d param, d delta_y/d param) without the subtraction of the deflection at the
+         origin (see deflection())
+        """
+        args = self._profile_args()
+        derivatives = self.func.param_derivative(x, y, *args)
+        if self.r_trunc is None:
+            return derivatives
+        pos_x, pos_y = self.kwargs_param.get('pos_x', 0), self.kwargs_param.get('pos_y', 0)
+        x_, y_ = x - pos_x, y - pos_y
+        r2 = x_**2 + y_**2
+        outside = r2 > self.r_trunc**2
+        r2 = np.where(outside, r2, 1.)
+        # derivative of the monopole, i.e. of the deflection at the truncation radius
+        f_x, f_y = self.func.derivative(pos_x + self.r_trunc, pos_y, *args)
+        derivatives_trunc = self.func.param_derivative(pos_x + self.r_trunc, pos_y, *args)
+        for name, (d_x, d_y) in derivatives.items():
+            d_x0, d_y0 = derivatives_trunc[name]
+            d_monopole = float((f_x*d_x0 + f_y*d_y0) / np.sqrt(f_x**2 + f_y**2)) * self.r_trunc
+            derivatives[name] = np.where(outside, d_monopole*x_/r2, d_x), np.where(outside, d_monopole*y_/r2, d_y)
+        return derivatives
+
     def distortion(self, x, y):
         """
         returns the distortion matrix
@@ -80,7 +324,26 @@ class LensObject(object):
         :param y: y-coordinate of the light ray
         :return:
         """
-        f_xx, f_yy, f_xy = self.func.hessian(x, y, **self.kwargs_param)
+        return self._distortion(x, y)
+
+    def _distortion(self, x, y, args=None, monopole=None):
+        """
+        hessian of the (possibly truncated) profile (see _derivative() for args and monopole)
+        """
+        if args is None:
+            args = self._profile_args()
+        f_xx, f_yy, f_xy = self.func.hessian(x, y, *args)
+        if self.r_trunc is not None:
+            if monopole is None:
+                monopole = self.monopole()
+            x_ = x - self.kwargs_param.get('pos_x', 0)
+            y_ = y - self.kwargs_param.get('pos_y', 0)
+            r2 = x_**2 + y_**2
+            outside = r2 > self.r_trunc**2
+            a = monopole / np.where(outside, r2, 1.)**2
+            f_xx = np.where(outside, a*(y_**2 - x_**2), f_xx)
+            f_yy = np.where(outside, a*(x_**2 - y_**2), f_yy)
+            f_xy = np.where(outside, -2*a*x_*y_, f_xy)
         return f_xx, f_yy, f_xy
 
     def position(self):
@@ -103,14 +366,57 @@ class LensObject(object):
         if self.observer_frame:
             self.kwargs_param['pos_x'] = pos_x
             self.kwargs_param['pos_y'] = pos_y
+            self._position_changed()
+
+    def _position_changed(self):
+        """
+        drops the cached quantities depending on the position (the monopole of the truncation is kept)
+        """
+        self._reference = None
+        self._args = None
+        for lensAssembly in self._assemblies:
+            lensAssembly._params_changed(self)
 
-    def reset_position(self):
+    def reset_position(self, cosmo=None):
         """
         reset position to the one of the observer
+        :param cosmo: CosmoProp or CosmoBatch instance (default: the one of the lens)
         :return:
         """
-        self.kwargs_param['pos_x'] = self.cosmo.arcsec2phys(self.pos_x_observer/const.arcsec, z=self.redshift)
-        self.kwargs_param['pos_y'] = self.cosmo.arcsec2phys(self.pos_y_observer/const.arcsec, z=self.redshift)
+        if not self.observer_frame or not hasattr(self, 'pos_x_observer'):
+            return
+        if cosmo is None or cosmo is self.cosmo:
+            factor = self._distance_factor()
+        else:
+            factor = cosmo.arcsec2phys(1., z=self.redshift)
+        self.kwargs_param['pos_x'] = self.pos_x_observer/const.arcsec*factor
+        self.kwargs_param['pos_y'] = self.pos_y_observer/const.arcsec*factor
+        self._position_changed()
+
+    def recentered(self, center_x, center_y):
+        """
+        copy of the lens object in the observer frame of a sightline centered at (center_x, center_y). The profile,
+        the parameters and the cached quantities that do not depend on the position (distance factor, monopole of the
+        truncation) are shared with the original, the copy does not belong to any lens assembly.
+        :param center_x: x-coord of the center of the sightline in arc seconds in the observer frame of the lens
+        :param center_y: y-coord of the center of the sightline
+        :return: LensObject instance
+        """
+        if not self.observer_frame or not hasattr(self, 'pos_x_observer'):
+            raise ValueError("only lens objects with positions in the observer frame can be recentered.")
+        lensObject = LensObject.__new__(LensObject)
+        for name in self.__slots__:
+            if hasattr(self, name):
+                setattr(lensObject, name, getattr(self, name))
+        lensObject._assemblies = []
+        lensObject._reference = None
+        lensObject._args = None
+        lensObject.pos_x_observer = self.pos_x_observer - center_x*const.arcsec
+        lensObject.pos_y_observer = self.pos_y_observer - center_y*const.arcsec
+        factor = self._distance_factor()
+        lensObject.kwargs_param = dict(self.kwargs_param, pos_x=lensObject.pos_x_observer/const.arcsec*factor,
+                                       pos_y=lensObject.pos_y_observer/const.arcsec*factor)
+        return lensObject
 
     def print_info(self):
         """
@@ -124,3 +430,71 @@ class LensObject(object):
         print("type = ", self.type)
         print("approximation: ", self.approximation)
         print("parameters: ", self.kwargs_param)
+
+
+def _profile_arg_names(func):
+    """
+    names of the positional arguments (after x, y) of the profile functions of func
+    """
+    code = func.derivative.__code__
+    return code.co_varnames[3:code.co_argcount]
+
+
+def _profile_args(func, kwargs):
+    """
+    positional arguments (after x, y) of the profile functions of func, filled from kwargs and the defaults
+    """
+    names = _profile_arg_names(func)
+    defaults = func.derivative.__defaults__ or ()
+    defaults = dict(zip(names[len(names) - len(defaults):], defaults))
+    unknown = set(kwargs) - set(names)
+    if unknown:
+        raise ValueError("parameters %s not valid for the profile %s." % (sorted(unknown), type(func).__name__))
+    missing = set(names) - set(kwargs) - set(defaults)
+    if missing:
+        raise ValueError("parameters %s of the profile %s missing." % (sorted(missing), type(func).__name__))
+    return tuple(kwargs[name] if name in kwargs else defaults[name] for name in names)
+
+
+def freeze(lens_list, half_width, center_x=0, center_y=0, num_pix=100, order=3, hessian=True, tolerance=None,
+           max_levels=4):
+    """
+    samples the deflection of lens objects at the same redshift once onto a grid and returns a lens object of type
+    'deflection_map' that interpolates it. The lenses are sampled at their current physical positions, i.e. lenses in
+    the observer frame need to be placed (by a ray-tracing) before. The extent of the map is converted to physical
+    units with the cosmology of the lenses.
+
+    :param lens_list: list of lens objects at the same redshift
+    :param half_width: half width of the (square) map in arc seconds at the redshift of the lenses
+    :param center_x: x-coord of the center of the map in arc seconds
+    :param center_y: y-coord of the center of the map in arc seconds
+    :param num_pix: number of grid points along each axis of the coarsest map
+    :param order: 1 (bilinear) or 3 (bicubic) interpolation
+    :param hessian: bool, if True, samples the hessian of the lenses, otherwise it is derived from the sampled
+     deflection
+    :param tolerance: tolerated interpolation error of the deflection in arc seconds, if given, regions exceeding it
+     are refined with nested grids (see DeflectionMap.from_lenses())
+    :param max_levels: maximum number of nested grids
+    :return: LensObject instance (the interpolation error is available as lensObject.func.error)
+    """
+    from MultiLens.Profiles.deflection_map import DeflectionMap
+    if len(lens_list) == 0:
+        raise ValueError("no lens objects to freeze.")
+    redshift = lens_list[0].redshift
+    if any(lensObject.redshift != redshift for lensObject in lens_list):
+        raise ValueError("lens objects at different redshifts can not be frozen into one map.")
+    cosmo = lens_list[0].cosmo
+    width = cosmo.arcsec2phys(half_width, z=redshift)
+    x_0 = cosmo.arcsec2phys(center_x, z=redshift)
+    y_0 = cosmo.arcsec2phys(center_y, z=redshift)
+    if tolerance is not None:
+        tolerance *= const.arcsec
+    deflectionMap = DeflectionMap.from_lenses(lens_list, x_0 - width, x_0 + width, y_0 - width, y_0 + width,
+                                              num_pix=num_pix, order=order, hessian=hessian, tolerance=tolerance,
+                                              max_levels=max_levels)
+    approximation = TIERS[min(TIERS.index(lensObject.tier) for lensObject in lens_list)]
+    lensObject = LensObject(redshift, type='deflection_map', approximation=approximation,
+                            main=any(lensObject.main for lensObject in lens_list), observer_frame=False)
+    lensObject.cosmo = cosmo
+    lensObject.add_info('deflection_map', deflectionMap)
+    return lensObject
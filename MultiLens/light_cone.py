@@ -0,0 +1,162 @@
+"""
+tracing of many sightlines through one shared light-cone catalog
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+__author__ = 'sibirrer'
+
+import numpy as np
+
+from MultiLens.lens_assembly import LensAssembly
+import MultiLens.Utils.constants as const
+from MultiLens.Utils.spatial import GridIndex
+
+_METHODS = ('full', 'born', 'combined', 'analytic')
+
+# state of the worker processes (set once per process by _init_worker())
+_WORKER = {}
+
+
+class LightCone(object):
+    """
+    class to trace the lens systems of many sightlines through the same light cone
+
+    The halo catalog is a LensAssembly whose lens objects have their positions in the observer frame of the light cone
+    (arc seconds). The observed positions are indexed once with a GridIndex, such that the halos of a sightline are
+    found by a box query. The lens objects of a sightline are copies of the catalog lenses recentered on the sightline
+    (see LensObject.recentered()), which share the profiles, the parameters and the position-independent derived
+    quantities (distance factors, monopoles of truncated lenses) computed once for the catalog.
+    """
+
+    def __init__(self, catalog, margin=0., cosmo=None):
+        """
+
+        :param catalog: LensAssembly instance with the lens objects of the light cone in the observer frame
+        :param margin: extent in arc seconds beyond the field of a sightline within which the halos are selected
+        :param cosmo: CosmoProp instance of the tracing (default: the one of the lens objects, get_cosmo() for an
+         empty catalog)
+        :return:
+        """
+        if cosmo is None:
+            from MultiLens.Cosmo.cosmo import get_cosmo
+            cosmo = catalog.object_array[0].cosmo if catalog.object_array else get_cosmo()
+        self.catalog = catalog
+        self.margin = margin
+        self.cosmo = cosmo
+        for lensObject in catalog.object_array:
+            if not lensObject.observer_frame or not hasattr(lensObject, 'pos_x_observer'):
+                raise ValueError("lens objects of a light cone need positions in the observer frame.")
+            lensObject._distance_factor()
+            if lensObject.r_trunc is not None:
+                lensObject.monopole()
+        pos_x, pos_y = catalog.get_visible_positions()
+        self._index = GridIndex(pos_x / const.arcsec, pos_y / const.arcsec)
+
+    @classmethod
+    def from_file(cls, filename, margin=0., cosmo=None):
+        """
+        light cone of a catalog saved with persistence.save_assembly()
+
+        :param filename: name of the .npz or HDF5 file
+        :param margin: see __init__()
+        :param cosmo: CosmoProp instance of the lens objects and the tracing (default: get_cosmo())
+        :return: LightCone instance
+        """
+        from MultiLens.persistence import load_assembly
+        return cls(load_assembly(filename, cosmo=cosmo), margin=margin, cosmo=cosmo)
+
+    def __len__(self):
+        return len(self.catalog.object_array)
+
+    def select(self, center_x, center_y, half_width):
+        """
+        indices (in the catalog) of the halos within the field of a sightline (plus the margin)
+
+        :param center_x: x-coord of the center of the sightline in arc seconds
+        :param center_y: y-coord of the center of the sightline in arc seconds
+        :param half_width: half width of the (square) field of the sightline in arc seconds
+        :return: sorted 1d array of indices
+        """
+        width = half_width + self.margin
+        return self._index.query_box(center_x - width, center_x + width, center_y - width, center_y + width)
+
+    def assembly(self, center_x, center_y, half_width):
+        """
+        lens assembly of a sightline with the selected halos in the observer frame centered on the sightline
+
+        :param center_x: x-coord of the center of the sightline in arc seconds
+        :param center_y: y-coord of the center of the sightline in arc seconds
+        :param half_width: half width of the field of the sightline in arc seconds
+        :return: LensAssembly instance
+        """
+        object_array = self.catalog.object_array
+        lensAssembly = LensAssembly()
+        lensAssembly.add_lenses([object_array[i].recentered(center_x, center_y)
+                                 for i in self.select(center_x, center_y, half_width)])
+        return lensAssembly
+
+    def trace(self, sightlines, z_source, x_array, y_array, method='full', processes=1, **kwargs):
+        """
+        traces the rays of all the sightlines
+
+        :param sightlines: list of (center_x, center_y, half_width) in arc seconds
+        :param z_source: redshift of the source
+        :param x_array: x-coords of the rays relative to the center of the sightlines (radian), the same for all
+         sightlines or a list of arrays, one per sightline
+        :param y_array: y-coords of the rays (same structure as x_array)
+        :param method: 'full', 'born', 'combined' or 'analytic'
+        :param processes: number of worker processes (the sightlines are distributed among them)
+        :param kwargs: keyword arguments of the tracing method
+        :return: beta_x, beta_y (and the further outputs of the method, e.g. the arrival times with fermat=True) with a
+         leading axis along the sightlines (lists for rays given per sightline)
+        """
+        if method not in _METHODS:
+            raise ValueError("method %s not valid. Chose among %s." % (method, list(_METHODS)))
+        sightlines = [tuple(sightline) for sightline in sightlines]
+        per_sightline = isinstance(x_array, (list, tuple))
+        if per_sightline and (len(x_array) != len(sightlines) or len(y_array) != len(sightlines)):
+            raise ValueError("number of ray arrays not valid for %s sightlines." % len(sightlines))
+        tasks = [(sightline, z_source, x_array[i] if per_sightline else x_array,
+                  y_array[i] if per_sightline else y_array) for i, sightline in enumerate(sightlines)]
+        if processes > 1 and len(tasks) > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(self, method, kwargs))
+            try:
+                results = pool.map(_run_task, tasks)
+            finally:
+                pool.terminate()
+        else:
+            _init_worker(self, method, kwargs)
+            results = [_run_task(task) for task in tasks]
+        outputs = [list(output) for output in zip(*results)]
+        if per_sightline:
+            return tuple(outputs)
+        return tuple(np.array(output) for output in outputs)
+
+
+def _init_worker(lightCone, method, kwargs):
+    """
+    sets the light cone and the tracer (in the cosmology of the light cone) of a worker process
+    """
+    from MultiLens.MultiLens import MultiLens
+    _WORKER.clear()
+    _WORKER.update({'lightCone': lightCone, 'method': method, 'kwargs': kwargs,
+                    'multiLens': MultiLens(cosmo=lightCone.cosmo)})
+
+
+def _run_task(task):
+    """
+    traces the rays of one sightline
+
+    :return: beta_x, beta_y
+    """
+    (center_x, center_y, half_width), z_source, x, y = task
+    lensAssembly = _WORKER['lightCone'].assembly(center_x, center_y, half_width)
+    multiLens = _WORKER['multiLens']
+    method, kwargs = _WORKER['method'], _WORKER['kwargs']
+    if method == 'full':
+        return multiLens.full_ray_tracing(lensAssembly, z_source, x, y, **kwargs)
+    elif method == 'born':
+        return multiLens.born_ray_tracing(lensAssembly, z_source, x, y, **kwargs)
+    elif method == 'combined':
+        return multiLens.combined_ray_tracing(lensAssembly, z_source, x, y, **kwargs)
+    return multiLens.analytic_mapping(lensAssembly, z_source, x, y, **kwargs)
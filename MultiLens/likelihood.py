@@ -0,0 +1,329 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+__author__ = 'sibirrer'
+
+import numpy as np
+
+from MultiLens.amplitude import AmplitudeCache
+from MultiLens.Cosmo.cosmo import get_cosmo
+from MultiLens.image_formation import ImageFormation
+import MultiLens.ray_set as ray_set
+import MultiLens.Utils.constants as const
+
+_POSITIONS = ('pos_x', 'pos_y')
+
+
+class LensLikelihood(object):
+    """
+    class to evaluate the likelihood of a vector of lens parameters for (ensemble) samplers, given either the image
+    positions of a point source or an image of an extended source
+
+    The rays and the data are bound once. A parameter vector is written directly into the parameters of the lens
+    objects (no add_info() calls) and the full ray-tracing is repeated only from the first lens plane with a varied
+    parameter: the rays and lens positions in front of it are kept from the construction. In the observer frame, only
+    the lenses behind that plane are placed again. log_likelihood() evaluates a single parameter vector or, with a 2d
+    array, all the walkers of an ensemble at once (with the parameters broadcast along a leading walker axis).
+    The lenses of the first varied plane whose only varied parameter is their amplitude (or which are not varied) see
+    fixed rays: their unit-amplitude deflections are cached (see AmplitudeCache). With born=True, the rays are traced
+    in the Born approximation (see MultiLens.born_ray_tracing()) and this holds for the lenses of all the planes.
+    """
+
+    def __init__(self, lensAssembly, z_source, params, x_image=None, y_image=None, sigma_source=None, data=None,
+                 x_grid=None, y_grid=None, source=None, sigma_pixel=None, numPix_x=None, numPix_y=None,
+                 imageFormation=None, max_elements=2**20, born=False, cosmo=None):
+        """
+
+        :param lensAssembly: LensAssembly instance (its lens objects are updated in place)
+        :param z_source: redshift of the source
+        :param params: list of (lens id, parameter name) (positions in the units of 'kwargs_profile', i.e. arc seconds
+         in the observer frame), defines the order of the parameter vector
+        :param x_image: x-coords of the images of a point source (arc seconds)
+        :param y_image: y-coords of the images of a point source (arc seconds)
+        :param sigma_source: uncertainty of the source position (arc seconds), the likelihood of the image positions is
+         evaluated in the source plane
+        :param data: observed image (detector pixels)
+        :param x_grid: x-coords of the rays of the image (or RaySet instance)
+        :param y_grid: y-coords of the rays of the image (None if x_grid is a RaySet)
+        :param source: function of the source positions (beta_x, beta_y) returning the surface brightness
+        :param sigma_pixel: noise of the pixels (scalar or map)
+        :param numPix_x: number of (supersampled) pixels along x (see ImageFormation.image())
+        :param numPix_y: number of (supersampled) pixels along y
+        :param imageFormation: ImageFormation instance (default: no supersampling and no PSF)
+        :param max_elements: maximum number of (walker, ray) pairs traced at once
+        :param born: bool, if True, the rays are traced in the Born approximation
+        :param cosmo: CosmoProp instance (default: the one of the lens objects, get_cosmo() for an empty assembly)
+        :return:
+        """
+        if (x_image is None) == (data is None):
+            raise ValueError("either image positions or an image need to be given.")
+        self.lensAssembly = lensAssembly
+        self.z_source = z_source
+        self.params = list(params)
+        if cosmo is None:
+            cosmo = lensAssembly.object_array[0].cosmo if lensAssembly.object_array else get_cosmo()
+        self.cosmo = cosmo
+        self._max_elements = max_elements
+        self._born = born
+        if x_image is not None:
+            if sigma_source is None:
+                raise ValueError("image positions need the uncertainty sigma_source.")
+            self._x = np.array(x_image, dtype=float).ravel() * const.arcsec
+            self._y = np.array(y_image, dtype=float).ravel() * const.arcsec
+            self._sigma_source = sigma_source * const.arcsec
+            self._data = None
+        else:
+            if source is None or sigma_pixel is None:
+                raise ValueError("an image needs a source function and the noise sigma_pixel.")
+            x_grid, y_grid = ray_set.coordinates(x_grid, y_grid)
+            self._x = np.array(x_grid, dtype=float).ravel()
+            self._y = np.array(y_grid, dtype=float).ravel()
+            self._data = np.array(data, dtype=float)
+            self._source = source
+            self._sigma_pixel = sigma_pixel
+            if numPix_x is None and numPix_y is None:
+                numPix_x = int(np.sqrt(len(self._x)))
+            self._numPix = (numPix_x, numPix_y)
+            if imageFormation is None:
+                imageFormation = ImageFormation()
+            self.imageFormation = imageFormation
+        self._setup()
+
+    def _setup(self):
+        """
+        binds the parameters to the lens objects and traces the rays and lens positions through the fixed lens planes
+        """
+        lensAssembly = self.lensAssembly
+        self._planes = []
+        for z, lens_list in lensAssembly.planes():
+            if z < self.z_source:
+                self._planes.append((z, self.cosmo.comoving_transverse_distance(z), lens_list))
+        plane_index = dict((id(lensObject), k) for k, plane in enumerate(self._planes) for lensObject in plane[2])
+        self._setters = []
+        first = len(self._planes)
+        for lens_id, name in self.params:
+            lensObject = lensAssembly.get_lens(lens_id)
+            if name not in lensObject.kwargs_param:
+                raise ValueError("parameter %s of lens %s not valid." % (name, lens_id))
+            if id(lensObject) in plane_index:
+                first = min(first, plane_index[id(lensObject)])
+            self._setters.append((lensObject, name, name in _POSITIONS and lensObject.observer_frame))
+        self._first = first
+        # lenses whose position in the observer frame depends on the parameters
+        if self._born:
+            self._observer = [lensObject for lensObject, _, observer in self._setters if observer]
+        else:
+            self._observer = [lensObject for plane in self._planes[first:] for lensObject in plane[2]
+                              if lensObject.observer_frame]
+        self._truncated = any(lensObject.r_trunc is not None for plane in self._planes[first:]
+                              for lensObject in plane[2])
+        # place all the lenses once and trace the rays through the fixed planes
+        self._place_all()
+        self._cache = AmplitudeCache()
+        if self._born:
+            self._setup_born()
+        else:
+            self._prefix = self._recursion(self._planes[:first], np.zeros_like(self._x), np.zeros_like(self._y),
+                                           self._x.copy(), self._y.copy(), 0)
+            if first < len(self._planes):
+                z, chi, lens_list = self._planes[first]
+                x_k, y_k, alpha_x, alpha_y, chi_last = self._prefix
+                x_k_phys = (x_k + alpha_x*(chi - chi_last)) / (1+z)
+                y_k_phys = (y_k + alpha_y*(chi - chi_last)) / (1+z)
+                for lensObject in lens_list:
+                    if self._amplitude_only(lensObject):
+                        self._cache.add(lensObject, x_k_phys, y_k_phys)
+        self._theta = self.get_params()
+
+    def _setup_born(self):
+        """
+        caches the (weighted) fields of the lenses in the Born approximation whose only varied parameter is their
+        amplitude
+        """
+        self._born_lenses = []
+        Ds = self.cosmo.D_xy(0, self.z_source)
+        for z, chi, lens_list in self._planes:
+            D_k = self.cosmo.D_xy(0, z)
+            weight = self.cosmo.D_xy(z, self.z_source) / Ds
+            for lensObject in lens_list:
+                if self._amplitude_only(lensObject):
+                    self._cache.add(lensObject, D_k*self._x, D_k*self._y, weight=weight)
+                else:
+                    self._born_lenses.append((D_k, weight, lensObject))
+
+    def _amplitude_only(self, lensObject):
+        """
+        bool, True if no parameter of the lens besides its amplitude is varied
+        """
+        return all(name == lensObject.amplitude_name for lens, name, _ in self._setters if lens is lensObject)
+
+    def get_params(self):
+        """
+        current values of the parameters
+
+        :return: 1d array along params
+        """
+        theta = np.zeros(len(self._setters))
+        for k, (lensObject, name, observer) in enumerate(self._setters):
+            if observer:
+                theta[k] = getattr(lensObject, name + '_observer') / const.arcsec
+            else:
+                theta[k] = lensObject.kwargs_param[name]
+        return theta
+
+    def set_params(self, theta):
+        """
+        writes a parameter vector into the lens objects and places the lenses in the observer frame
+
+        :param theta: 1d array along params
+        :return:
+        """
+        theta = np.asarray(theta, dtype=float)
+        if theta.shape != (len(self._setters),):
+            raise ValueError("parameter vector of shape %s does not match %s parameters." % (theta.shape,
+                                                                                              len(self._setters)))
+        self._set(theta)
+        self._place()
+        self._theta = theta.copy()
+
+    def log_likelihood(self, theta):
+        """
+        log likelihood of a parameter vector or of an ensemble of parameter vectors
+
+        :param theta: 1d array along params or 2d array (number of walkers, number of parameters)
+        :return: log likelihood (float or 1d array along the walkers)
+        """
+        theta = np.asarray(theta, dtype=float)
+        if theta.ndim == 1:
+            self.set_params(theta)
+            beta_x, beta_y = self._trace()
+            return float(self._log_likelihood(beta_x, beta_y))
+        if theta.ndim != 2 or theta.shape[1] != len(self._setters):
+            raise ValueError("parameter array of shape %s not valid." % (theta.shape,))
+        if self._truncated:
+            # truncated profiles are evaluated walker by walker
+            theta_set = self._theta.copy()
+            try:
+                logL = np.array([self.log_likelihood(theta_k) for theta_k in theta])
+            finally:
+                self.set_params(theta_set)
+            return logL
+        n_walkers = len(theta)
+        chunk = max(1, self._max_elements // max(1, len(self._x)))
+        logL = np.zeros(n_walkers)
+        try:
+            for i in range(0, n_walkers, chunk):
+                self._set(theta[i:i + chunk].T[:, :, np.newaxis])
+                self._place()
+                beta_x, beta_y = self._trace()
+                logL[i:i + chunk] = self._log_likelihood(beta_x, beta_y)
+        finally:
+            self._set(self._theta)
+            self._place()
+        return logL
+
+    def _set(self, theta):
+        """
+        writes the parameter values (scalars or columns along the walkers) into the lens objects
+        """
+        for (lensObject, name, observer), value in zip(self._setters, theta):
+            if observer:
+                setattr(lensObject, name + '_observer', value * const.arcsec)
+            else:
+                lensObject.update_params(**{name: value})
+        if any(observer for _, _, observer in self._setters):
+            self.lensAssembly._lens_changed(None)
+
+    def _place_all(self):
+        """
+        places all the lenses in front of the source in the observer frame
+        """
+        self._place([lensObject for plane in self._planes for lensObject in plane[2] if lensObject.observer_frame])
+
+    def _place(self, lens_list=None):
+        """
+        places lenses in the observer frame, i.e. at the positions of the rays towards their observed positions
+        """
+        if lens_list is None:
+            lens_list = self._observer
+        if not lens_list:
+            return
+        if self._born:
+            # undeflected rays: the lenses are at their observed positions
+            for lensObject in lens_list:
+                lensObject.reset_position()
+            return
+        slots = dict((id(lensObject), i) for i, lensObject in enumerate(lens_list))
+        positions = [lensObject.position() for lensObject in lens_list]
+        if any(np.ndim(pos_x) > 0 or np.ndim(pos_y) > 0 for pos_x, pos_y in positions):
+            # parameters along the walkers: rays of shape (number of walkers, number of lenses)
+            n_walkers = max(np.size(value) for position in positions for value in position)
+            pos_x = np.column_stack([np.broadcast_to(np.ravel(pos_x), (n_walkers,)) for pos_x, _ in positions])
+            pos_y = np.column_stack([np.broadcast_to(np.ravel(pos_y), (n_walkers,)) for _, pos_y in positions])
+        else:
+            pos_x = np.array([pos_x for pos_x, _ in positions], dtype=float)
+            pos_y = np.array([pos_y for _, pos_y in positions], dtype=float)
+        self._recursion(self._planes, np.zeros_like(pos_x), np.zeros_like(pos_y), pos_x, pos_y, 0, slots=slots)
+
+    def _trace(self):
+        """
+        traces the rays from the first plane with varied parameters to the source
+        :return: beta_x, beta_y (with a leading walker axis if the parameters are columns)
+        """
+        if self._born:
+            alpha_x, alpha_y = self._cache.deflection()
+            for D_k, weight, lensObject in self._born_lenses:
+                delta_x, delta_y = lensObject.deflection(D_k*self._x, D_k*self._y)
+                alpha_x = alpha_x + weight*delta_x
+                alpha_y = alpha_y + weight*delta_y
+            return self._x - alpha_x, self._y - alpha_y
+        x_k, y_k, alpha_x, alpha_y, chi_last = self._prefix
+        x_k, y_k, alpha_x, alpha_y, chi_last = self._recursion(self._planes[self._first:], x_k.copy(), y_k.copy(),
+                                                               alpha_x.copy(), alpha_y.copy(), chi_last,
+                                                               cache=self._cache)
+        T_k_last = self.cosmo.comoving_transverse_distance(self.z_source) - chi_last
+        factor = 1. / (1 + self.z_source) / self.cosmo.D_xy(0, self.z_source)
+        return (x_k + alpha_x*T_k_last) * factor, (y_k + alpha_y*T_k_last) * factor
+
+    def _recursion(self, planes, x_k, y_k, alpha_x, alpha_y, chi_last, slots=None, cache=None):
+        """
+        recursion of MultiLens.full_ray_tracing() through a sequence of lens planes
+
+        :param slots: dictionary id(lens object): index of its ray, if given, the lenses are placed at the position of
+         their ray when it reaches their plane (observer frame)
+        :param cache: AmplitudeCache instance with the fields of lenses of the first plane (at the rays reaching it)
+        :return: x_k, y_k, alpha_x, alpha_y, comoving distance of the last plane
+        """
+        for k, (z, chi, lens_list) in enumerate(planes):
+            T_k_last = chi - chi_last
+            x_k = x_k + alpha_x*T_k_last
+            y_k = y_k + alpha_y*T_k_last
+            x_k_phys, y_k_phys = x_k/(1+z), y_k/(1+z)
+            if slots is not None:
+                for lensObject in lens_list:
+                    if id(lensObject) in slots:
+                        i = slots[id(lensObject)]
+                        lensObject.update_position(x_k_phys[..., i:i+1] if x_k.ndim > 1 else x_k_phys[i],
+                                                   y_k_phys[..., i:i+1] if y_k.ndim > 1 else y_k_phys[i])
+            if cache is not None and k == 0 and len(cache) > 0:
+                delta_x, delta_y = cache.deflection()
+                alpha_x = alpha_x - delta_x
+                alpha_y = alpha_y - delta_y
+                lens_list = [lensObject for lensObject in lens_list if lensObject not in cache]
+            for lensObject in lens_list:
+                delta_x, delta_y = lensObject.deflection(x_k_phys, y_k_phys)
+                alpha_x = alpha_x - delta_x
+                alpha_y = alpha_y - delta_y
+            chi_last = chi
+        return x_k, y_k, alpha_x, alpha_y, chi_last
+
+    def _log_likelihood(self, beta_x, beta_y):
+        """
+        log likelihood of the source positions (along the last axis)
+        """
+        if self._data is None:
+            delta_x = beta_x - np.mean(beta_x, axis=-1, keepdims=True)
+            delta_y = beta_y - np.mean(beta_y, axis=-1, keepdims=True)
+            return -np.sum(delta_x**2 + delta_y**2, axis=-1) / (2 * self._sigma_source**2)
+        flux = self._source(beta_x, beta_y)
+        model = self.imageFormation.image(flux, *self._numPix)
+        residuals = (model - self._data) / self._sigma_pixel
+        return -np.sum(residuals**2, axis=(-2, -1)) / 2.
@@ -1,56 +1,116 @@
 from __future__ import print_function, division, absolute_import, unicode_literals
 __author__ = 'sibirrer'
 
+import numpy as np
+
+import MultiLens.Utils.utils as util
+from MultiLens.Utils.instrumentation import NULL_INSTRUMENTATION
+
+# antisymmetric central difference coefficients c_k of f'(i) = sum_k c_k*(f(i+k) - f(i-k)), k = 1, 2, ...
+_CENTRAL_DIFFERENCE = {
+    2: (1./2,),
+    4: (2./3, -1./12),
+    6: (3./4, -3./20, 1./60),
+    8: (4./5, -1./5, 4./105, -1./280),
+}
 
-import astrofunc.util as util
 
 class Numerics(object):
     """
     class to compute numerical differentials of the deflection angle
+
+    The differentials are evaluated with central difference stencils of selectable accuracy order on rectangular
+    (and possibly rotated) regular grids. The outputs are defined on the interior of the grid, i.e. order/2 pixels
+    are lost at each border. Large maps can be processed in tiles of rows to bound the temporary memory.
     """
-    def __init__(self):
-        pass
+    def __init__(self, order=2, tile_size=None, instrumentation=None):
+        """
 
-    def kappa(self, beta_x, beta_y, theta_x, theta_y):
+        :param order: accuracy order of the central difference stencil (2, 4, 6 or 8)
+        :param tile_size: number of output rows computed at once (None for the full map at once)
+        :param instrumentation: Instrumentation instance (None for no instrumentation)
+        :return:
+        """
+        if order not in _CENTRAL_DIFFERENCE:
+            raise ValueError("order %s not supported. Chose among %s." % (order, sorted(_CENTRAL_DIFFERENCE.keys())))
+        self._order = order
+        self._coeffs = _CENTRAL_DIFFERENCE[order]
+        self._tile_size = tile_size
+        if instrumentation is None:
+            instrumentation = NULL_INSTRUMENTATION
+        self.instrumentation = instrumentation
+
+    def kappa(self, beta_x, beta_y, theta_x, theta_y, shape=None):
         """
         computes the convergence
         :param beta_x: source position in x-coord
         :param beta_y: source position in y-coord
         :param theta_x: image position in x-coord
         :param theta_y: image position in y-coord
+        :param shape: (ny, nx) of the grid (None for square grids or 2d inputs)
         :return: kappa
         """
-        f_xx, f_xy, f_yx, f_yy = self.differentials(beta_x, beta_y, theta_x, theta_y)
+        f_xx, f_xy, f_yx, f_yy = self.differentials(beta_x, beta_y, theta_x, theta_y, shape=shape)
         kappa = -1./2 * (f_xx + f_yy)
         return kappa
 
-    def gamma(self, beta_x, beta_y, theta_x, theta_y):
+    def gamma(self, beta_x, beta_y, theta_x, theta_y, shape=None):
         """
         computes the shear
         :param beta_x: source position in x-coord
         :param beta_y: source position in y-coord
         :param theta_x: image position in x-coord
         :param theta_y: image position in y-coord
+        :param shape: (ny, nx) of the grid (None for square grids or 2d inputs)
         :return: gamma1, gamma2
         """
-        f_xx, f_xy, f_yx, f_yy = self.differentials(beta_x, beta_y, theta_x, theta_y)
+        f_xx, f_xy, f_yx, f_yy = self.differentials(beta_x, beta_y, theta_x, theta_y, shape=shape)
         gamma1 = 1./2 * (f_yy - f_xx)
         gamma2 = f_xy
         return gamma1, gamma2
 
-    def magnification(self, beta_x, beta_y, theta_x, theta_y):
+    def magnification(self, beta_x, beta_y, theta_x, theta_y, shape=None):
         """
         computes the magnification
         :param beta_x: source position in x-coord
         :param beta_y: source position in y-coord
         :param theta_x: image position in x-coord
         :param theta_y: image position in y-coord
+        :param shape: (ny, nx) of the grid (None for square grids or 2d inputs)
         :return: potential
         """
-        f_xx, f_xy, f_yx, f_yy = self.differentials(beta_x, beta_y, theta_x, theta_y)
+        f_xx, f_xy, f_yx, f_yy = self.differentials(beta_x, beta_y, theta_x, theta_y, shape=shape)
         det_A = (1 + f_xx) * (1 + f_yy) - f_xy*f_yx
         return 1/det_A
 
+    def all(self, beta_x, beta_y, theta_x, theta_y, shape=None, out=None):
+        """
+        computes convergence, shear and magnification from one single evaluation of the differentials
+
+        :param beta_x: source position in x-coord
+        :param beta_y: source position in y-coord
+        :param theta_x: image position in x-coord
+        :param theta_y: image position in y-coord
+        :param shape: (ny, nx) of the grid (None for square grids or 2d inputs)
+        :param out: optional tuple of four pre-allocated arrays of the interior shape to write the results into
+        :return: kappa, gamma1, gamma2, magnification
+        """
+        ny, nx = self._grid_shape(theta_x, shape)
+        kappa, gamma1, gamma2, mag = self._output(ny, nx, out)
+        for rows, f_xx, f_xy, f_yx, f_yy in self._iter_differentials(beta_x, beta_y, theta_x, theta_y, ny, nx):
+            np.add(f_xx, f_yy, out=kappa[rows])
+            kappa[rows] *= -1./2
+            np.subtract(f_yy, f_xx, out=gamma1[rows])
+            gamma1[rows] *= 1./2
+            gamma2[rows] = f_xy
+            f_xx += 1
+            f_yy += 1
+            f_xx *= f_yy
+            f_xy *= f_yx
+            f_xx -= f_xy
+            np.divide(1., f_xx, out=mag[rows])
+        return kappa, gamma1, gamma2, mag
+
     def potential(self, beta_x, beta_y, theta_x, theta_y):
         """
         computes the potential (modulo constant)
@@ -62,38 +122,107 @@ class Numerics(object):
         """
         pass
 
-    def differentials(self, beta_ra, beta_dec, theta_ra, theta_dec):
+    def differentials(self, beta_ra, beta_dec, theta_ra, theta_dec, shape=None, out=None):
         """
         computes the differentials f_xx, f_yy, f_xy from f_x and f_y
         :param beta_x: source position in x-coord
         :param beta_y: source position in y-coord
         :param theta_x: image position in x-coord
         :param theta_y: image position in y-coord
-        :return: kappa
+        :param shape: (ny, nx) of the grid (None for square grids or 2d inputs)
+        :param out: optional tuple of four pre-allocated arrays of the interior shape to write the results into
+        :return: f_xx, f_xy, f_yx, f_yy
+        """
+        ny, nx = self._grid_shape(theta_ra, shape)
+        f_xx, f_xy, f_yx, f_yy = self._output(ny, nx, out)
+        for rows, f_xx_, f_xy_, f_yx_, f_yy_ in self._iter_differentials(beta_ra, beta_dec, theta_ra, theta_dec, ny, nx):
+            f_xx[rows], f_xy[rows], f_yx[rows], f_yy[rows] = f_xx_, f_xy_, f_yx_, f_yy_
+        return f_xx, f_xy, f_yx, f_yy
+
+    def _iter_differentials(self, beta_ra, beta_dec, theta_ra, theta_dec, ny, nx):
+        """
+        iterates over tiles of output rows and yields the differentials of the deflection within each tile
+
+        :return: generator of (rows, f_xx, f_xy, f_yx, f_yy) with rows the slice of the output rows
+        """
+        p = len(self._coeffs)
+        if ny <= 2*p or nx <= 2*p:
+            raise ValueError("grid of shape %s too small for a stencil of order %s." % ((ny, nx), self._order))
+        beta_ra, beta_dec = self._image(beta_ra, ny, nx), self._image(beta_dec, ny, nx)
+        ra, dec = self._image(theta_ra, ny, nx), self._image(theta_dec, ny, nx)
+        # grid spacing per pixel step along the columns (axis 1) and rows (axis 0) from the full extent of the grid
+        ra_1 = (ra[0, -1] - ra[0, 0]) / (nx - 1)
+        ra_0 = (ra[-1, 0] - ra[0, 0]) / (ny - 1)
+        dec_1 = (dec[0, -1] - dec[0, 0]) / (nx - 1)
+        dec_0 = (dec[-1, 0] - dec[0, 0]) / (ny - 1)
+        det = ra_1 * dec_0 - ra_0 * dec_1
+        if det == 0:
+            raise ValueError("degenerate grid, the coordinates do not span two dimensions.")
+        n_out = ny - 2*p
+        tile_size = n_out if self._tile_size is None else max(1, int(self._tile_size))
+        for r0 in range(0, n_out, tile_size):
+            r1 = min(r0 + tile_size, n_out)
+            with self.instrumentation.section('differentials', n_rays=(r1 - r0)*(nx - 2*p)):
+                alpha_ra = beta_ra[r0:r1 + 2*p] - ra[r0:r1 + 2*p]
+                alpha_dec = beta_dec[r0:r1 + 2*p] - dec[r0:r1 + 2*p]
+                d1_ra, d0_ra = self._stencil(alpha_ra, p)
+                d1_dec, d0_dec = self._stencil(alpha_dec, p)
+                # invert the grid Jacobian: d/d_index1 = ra_1*d/dra + dec_1*d/ddec, d/d_index0 = ra_0*d/dra + dec_0*d/ddec
+                f_xx = (dec_0 * d1_ra - dec_1 * d0_ra) / det
+                f_xy = (ra_1 * d0_ra - ra_0 * d1_ra) / det
+                f_yx = (dec_0 * d1_dec - dec_1 * d0_dec) / det
+                f_yy = (ra_1 * d0_dec - ra_0 * d1_dec) / det
+            yield slice(r0, r1), f_xx, f_xy, f_yx, f_yy
+
+    def _stencil(self, field, p):
+        """
+        central differences per pixel step of a 2d field along both axes, evaluated on the interior of the field
+
+        :param field: 2d array of shape (m + 2p, nx)
+        :param p: half width of the stencil
+        :return: derivative along axis 1, derivative along axis 0, both of shape (m, nx - 2p)
+        """
+        m, nx = field.shape[0] - 2*p, field.shape[1]
+        d1 = np.zeros((m, nx - 2*p))
+        d0 = np.zeros((m, nx - 2*p))
+        tmp = np.empty_like(d1)
+        for k, c in enumerate(self._coeffs, 1):
+            np.subtract(field[p:p + m, p + k:nx - p + k], field[p:p + m, p - k:nx - p - k], out=tmp)
+            tmp *= c
+            d1 += tmp
+            np.subtract(field[p + k:p + k + m, p:nx - p], field[p - k:p - k + m, p:nx - p], out=tmp)
+            tmp *= c
+            d0 += tmp
+        return d1, d0
+
+    def _grid_shape(self, theta, shape):
+        """
+        returns (ny, nx) of the grid
+        """
+        if shape is not None:
+            return tuple(shape)
+        if np.ndim(theta) == 2:
+            return np.shape(theta)
+        n = util.array2image(theta).shape[0]
+        return n, n
+
+    def _image(self, array, ny, nx):
+        """
+        2d view of the array
+        """
+        if np.ndim(array) == 2:
+            return array
+        return util.array2image(array, nx, ny)
+
+    def _output(self, ny, nx, out):
+        """
+        returns the four output arrays of the interior shape (pre-allocated or new)
         """
-        alpha_ra = util.array2image(beta_ra - theta_ra)
-        alpha_dec = util.array2image(beta_dec - theta_dec)
-        ra = util.array2image(theta_ra)
-        dec = util.array2image(theta_dec)
-        num_x = len(ra)
-        num_y = len(dec)
-        dra_x = ra[1, 2] - ra[1, 0]
-        dra_y = ra[2, 1] - ra[0, 1]
-        ddec_x = dec[1, 2] - dec[1, 0]
-        ddec_y = dec[2, 1] - dec[0, 1]
-
-        dalpha_rara = dra_x * (alpha_ra[1:num_y - 1, 2:num_x] - alpha_ra[1:num_y - 1, :num_x - 2]) + dra_y * (
-        alpha_ra[2:num_y, 1:num_x - 1] - alpha_ra[:num_y - 2, 1:num_x - 1])
-        dalpha_decra = dra_x * (alpha_dec[1:num_y - 1, 2:num_x] - alpha_dec[1:num_y - 1, :num_x - 2]) + dra_y * (
-        alpha_dec[2:num_y, 1:num_x - 1] - alpha_dec[:num_y - 2, 1:num_x - 1])
-
-        dalpha_radec = ddec_x * (alpha_ra[1:num_y - 1, 2:num_x] - alpha_ra[1:num_y - 1, :num_x - 2]) + ddec_y * (
-        alpha_ra[2:num_y, 1:num_x - 1] - alpha_ra[:num_y - 2, 1:num_x - 1])
-        dalpha_decdec = ddec_x * (alpha_dec[1:num_y - 1, 2:num_x] - alpha_dec[1:num_y - 1, :num_x - 2]) + ddec_y * (
-        alpha_dec[2:num_y, 1:num_x - 1] - alpha_dec[:num_y - 2, 1:num_x - 1])
-
-        f_xx = dalpha_rara / (dra_x ** 2 + dra_y ** 2)
-        f_yy = dalpha_decdec / (ddec_x ** 2 + ddec_y ** 2)
-        f_xy = dalpha_radec / (ddec_x ** 2 + ddec_y ** 2)
-        f_yx = dalpha_decra / (dra_x ** 2 + dra_y ** 2)
-        return f_xx, f_xy, f_yx, f_yy
\ No newline at end of file
+        p = len(self._coeffs)
+        shape = (ny - 2*p, nx - 2*p)
+        if out is None:
+            return tuple(np.empty(shape) for _ in range(4))
+        for array in out:
+            if array.shape != shape:
+                raise ValueError("output array of shape %s does not match the interior shape %s." % (array.shape, shape))
+        return out
@@ -0,0 +1,279 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+__author__ = 'sibirrer'
+
+import json
+import os
+
+import numpy as np
+
+from MultiLens.lens_assembly import LensAssembly
+from MultiLens.lens_object import LensObject
+from MultiLens.Profiles.deflection_map import DeflectionMap
+from MultiLens.Profiles.radial_profile import RadialProfile
+import MultiLens.Utils.constants as const
+
+_HDF5_EXTENSIONS = ('.h5', '.hdf5')
+_PARAM_PREFIX = 'param_'
+_MAP_PREFIX = 'map%s_'
+_TABLE_PREFIX = 'table%s_'
+
+
+def _is_hdf5(filename):
+    return os.path.splitext(str(filename))[1].lower() in _HDF5_EXTENSIONS
+
+
+def _import_h5py():
+    try:
+        import h5py
+    except ImportError:
+        raise ImportError("h5py needs to be installed to read and write HDF5 files.")
+    return h5py
+
+
+def assembly2columns(lensAssembly):
+    """
+    converts a LensAssembly into a plane table and parameter columns (one entry per lens object, sorted by redshift).
+    Positions of lenses in the observer frame are stored in arc seconds in the observer frame, all other parameters as
+    stored in the lens objects. Parameters not used by a lens type and the truncation radii (column 'r_trunc') of
+    untruncated lenses are NaN. The arrays of deflection maps are stored under the keys 'map<index>_<name>' (see
+    DeflectionMap.to_arrays()), the tables of tabulated lenses under 'table<index>_<name>' (see
+    RadialProfile.to_arrays()).
+
+    :param lensAssembly: LensAssembly instance
+    :return: dictionary of 1d numpy arrays
+    """
+    object_list = lensAssembly.object_array
+    n = len(object_list)
+    param_names = sorted(set(name for lensObject in object_list for name in lensObject.kwargs_param))
+    columns = {'redshift': np.array([lensObject.redshift for lensObject in object_list], dtype=float),
+               'type': np.array([lensObject.type for lensObject in object_list], dtype=str),
+               'approximation': np.array([lensObject.approximation for lensObject in object_list], dtype=str),
+               'main': np.array([lensObject.main for lensObject in object_list], dtype=bool),
+               'observer_frame': np.array([lensObject.observer_frame for lensObject in object_list], dtype=bool),
+               'r_trunc': np.array([np.nan if lensObject.r_trunc is None else lensObject.r_trunc
+                                    for lensObject in object_list], dtype=float)}
+    for name in param_names:
+        columns[_PARAM_PREFIX + name] = np.full(n, np.nan)
+    for i, lensObject in enumerate(object_list):
+        for name, value in lensObject.kwargs_param.items():
+            columns[_PARAM_PREFIX + name][i] = value
+        if lensObject.observer_frame and hasattr(lensObject, 'pos_x_observer'):
+            columns[_PARAM_PREFIX + 'pos_x'][i] = lensObject.pos_x_observer/const.arcsec
+            columns[_PARAM_PREFIX + 'pos_y'][i] = lensObject.pos_y_observer/const.arcsec
+        if lensObject.type == 'deflection_map':
+            for key, value in lensObject.func.to_arrays().items():
+                columns[_MAP_PREFIX % i + key] = value
+        elif lensObject.type == 'tabulated':
+            for key, value in lensObject.func.to_arrays().items():
+                columns[_TABLE_PREFIX % i + key] = value
+    return columns
+
+
+def columns2assembly(columns, cosmo=None):
+    """
+    inverse of assembly2columns()
+
+    :param columns: dictionary of 1d numpy arrays
+    :param cosmo: CosmoProp instance of the lens objects (default: get_cosmo())
+    :return: LensAssembly instance
+    """
+    param_names = [key[len(_PARAM_PREFIX):] for key in columns if key.startswith(_PARAM_PREFIX)]
+    lensAssembly = LensAssembly()
+    # files written before the truncation radii were stored have no 'r_trunc' column
+    r_trunc = columns.get('r_trunc', np.full(len(columns['redshift']), np.nan))
+    for i in range(len(columns['redshift'])):
+        lensObject = LensObject(redshift=float(columns['redshift'][i]), type=str(columns['type'][i]),
+                                approximation=str(columns['approximation'][i]), main=bool(columns['main'][i]),
+                                observer_frame=bool(columns['observer_frame'][i]),
+                                r_trunc=None if np.isnan(r_trunc[i]) else float(r_trunc[i]))
+        if cosmo is not None:
+            lensObject.cosmo = cosmo
+        kwargs_profile = {}
+        for name in param_names:
+            value = columns[_PARAM_PREFIX + name][i]
+            if not np.isnan(value):
+                kwargs_profile[name] = float(value)
+        lensObject.add_info('kwargs_profile', kwargs_profile)
+        if lensObject.type == 'deflection_map':
+            prefix = _MAP_PREFIX % i
+            arrays = dict((key[len(prefix):], value) for key, value in columns.items() if key.startswith(prefix))
+            lensObject.add_info('deflection_map', DeflectionMap.from_arrays(arrays))
+        elif lensObject.type == 'tabulated':
+            prefix = _TABLE_PREFIX % i
+            arrays = dict((key[len(prefix):], value) for key, value in columns.items() if key.startswith(prefix))
+            lensObject.add_info('radial_profile', RadialProfile.from_arrays(arrays))
+        lensAssembly.add_lens(lensObject)
+    return lensAssembly
+
+
+def save_assembly(lensAssembly, filename, compressed=True):
+    """
+    saves a LensAssembly in columnar form to a .npz or HDF5 (.h5, .hdf5) file
+
+    :param lensAssembly: LensAssembly instance
+    :param filename: file name
+    :param compressed: bool, compression of the .npz file
+    :return:
+    """
+    columns = assembly2columns(lensAssembly)
+    if _is_hdf5(filename):
+        h5py = _import_h5py()
+        with h5py.File(filename, 'w') as f:
+            group = f.create_group('assembly')
+            for key, value in columns.items():
+                if value.dtype.kind == 'U':
+                    value = value.astype('S')
+                group.create_dataset(key, data=value)
+    elif compressed:
+        np.savez_compressed(filename, **columns)
+    else:
+        np.savez(filename, **columns)
+
+
+def load_assembly(filename, cosmo=None):
+    """
+    loads a LensAssembly saved with save_assembly()
+
+    :param filename: file name
+    :param cosmo: CosmoProp instance of the lens objects (default: get_cosmo())
+    :return: LensAssembly instance
+    """
+    if _is_hdf5(filename):
+        h5py = _import_h5py()
+        with h5py.File(filename, 'r') as f:
+            group = f['assembly']
+            columns = {}
+            for key in group:
+                value = group[key][()]
+                if value.dtype.kind == 'S':
+                    value = value.astype(str)
+                columns[key] = value
+    else:
+        with np.load(filename) as f:
+            columns = dict((key, f[key]) for key in f.files)
+    return columns2assembly(columns, cosmo=cosmo)
+
+
+class MapWriter(object):
+    """
+    class to write traced maps (e.g. beta_x, beta_y, kappa, magnification) incrementally to disk.
+    The maps are pre-allocated on disk, either as .npy files in a directory (memory mapped) or as datasets of an
+    HDF5 file (.h5, .hdf5), and can be filled slice by slice (e.g. tile by tile) without holding them in memory.
+    """
+
+    def __init__(self, path, shape, names=('beta_x', 'beta_y'), dtype=float, mode='w'):
+        """
+
+        :param path: directory name (or HDF5 file name)
+        :param shape: shape of each map
+        :param names: names of the maps
+        :param dtype: numpy data type of the maps
+        :param mode: 'w' to create the maps, 'r+' to continue writing into existing maps (e.g. to resume a run)
+        :return:
+        """
+        if mode not in ('w', 'r+'):
+            raise ValueError("mode %s not valid." % mode)
+        self.path = path
+        self.shape = tuple(shape)
+        self.names = tuple(names)
+        self._hdf5 = _is_hdf5(path)
+        self._maps = {}
+        if self._hdf5:
+            h5py = _import_h5py()
+            self._file = h5py.File(path, mode)
+            for name in self.names:
+                if mode == 'w':
+                    self._maps[name] = self._file.create_dataset(name, shape=self.shape, dtype=dtype)
+                else:
+                    self._maps[name] = self._file[name]
+        else:
+            self._file = None
+            if mode == 'w':
+                if not os.path.isdir(path):
+                    os.makedirs(path)
+                with open(os.path.join(path, 'maps.json'), 'w') as f:
+                    json.dump({'shape': self.shape, 'names': self.names}, f)
+            memmap_mode = 'w+' if mode == 'w' else 'r+'
+            for name in self.names:
+                self._maps[name] = np.lib.format.open_memmap(os.path.join(path, name + '.npy'), mode=memmap_mode,
+                                                             dtype=dtype, shape=self.shape)
+        for name in self.names:
+            if tuple(self._maps[name].shape) != self.shape:
+                raise ValueError("map %s of shape %s does not match the shape %s." % (name, self._maps[name].shape,
+                                                                                       self.shape))
+
+    def __getitem__(self, name):
+        return self._maps[name]
+
+    def write(self, name, values, index=Ellipsis):
+        """
+        writes values into a part of a map
+
+        :param name: name of the map
+        :param values: values to be written
+        :param index: index or slice of the map to be written (default the full map)
+        :return:
+        """
+        self._maps[name][index] = values
+
+    def flush(self):
+        """
+        flushes the written data to disk
+        :return:
+        """
+        if self._hdf5:
+            self._file.flush()
+        else:
+            for name in self.names:
+                self._maps[name].flush()
+
+    def close(self):
+        """
+        flushes and closes all maps
+        :return:
+        """
+        self.flush()
+        if self._hdf5:
+            self._file.close()
+        self._maps = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_maps(path, mode='r'):
+    """
+    opens maps written by MapWriter (or save_maps) without loading them into memory
+
+    :param path: directory name, HDF5 file name or .npz file name
+    :param mode: 'r' for read-only, 'r+' to modify the maps in place (not for .npz)
+    :return: dictionary of memory mapped arrays (h5py datasets for HDF5, loaded arrays for .npz)
+    """
+    if _is_hdf5(path):
+        h5py = _import_h5py()
+        f = h5py.File(path, mode)
+        return dict((name, f[name]) for name in f)
+    if os.path.isdir(path):
+        with open(os.path.join(path, 'maps.json')) as f:
+            names = json.load(f)['names']
+        return dict((name, np.load(os.path.join(path, name + '.npy'), mmap_mode=mode)) for name in names)
+    with np.load(path) as f:
+        return dict((name, f[name]) for name in f.files)
+
+
+def save_maps(filename, compressed=False, **maps):
+    """
+    saves small traced maps at once to a .npz file (use MapWriter for large maps)
+
+    :param filename: file name
+    :param compressed: bool, compression of the .npz file
+    :param maps: arrays to save, keyed by their names
+    :return:
+    """
+    if compressed:
+        np.savez_compressed(filename, **maps)
+    else:
+        np.savez(filename, **maps)
@@ -0,0 +1,283 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+__author__ = 'sibirrer'
+
+import numpy as np
+
+import MultiLens.Utils.constants as const
+
+
+class RaySet(object):
+    """
+    class to describe the set of light rays to be traced.
+
+    A ray set is a regular 2d arrangement of rays (rectangular pixel grid or polar/log-polar grid around a center),
+    optionally restricted to the pixels selected by a boolean mask. The coordinates (in radian) are only generated
+    when first needed and only for the selected rays. Traced quantities of the rays can be put back into the 2d
+    arrangement with image(), which is a zero-copy reshape for unmasked ray sets.
+    """
+
+    def __init__(self, axis_1, axis_2, kind='cartesian', center_x=0, center_y=0, mask=None, explicit=None):
+        """
+        use the class methods grid(), polar() and from_arrays() to create ray sets
+
+        :param axis_1: 1d coordinates along the fast axis (x for cartesian, angle phi for polar) in radian
+        :param axis_2: 1d coordinates along the slow axis (y for cartesian, radius for polar) in radian
+        :param kind: 'cartesian', 'polar' or 'explicit'
+        :param center_x: x-coordinate of the center of the polar grid in radian
+        :param center_y: y-coordinate of the center of the polar grid in radian
+        :param mask: boolean array of shape (len(axis_2), len(axis_1)) selecting the rays (None for all)
+        :param explicit: tuple of explicit flat x, y coordinates of all the pixels (instead of generating them)
+        :return:
+        """
+        if kind not in ['cartesian', 'polar', 'explicit']:
+            raise ValueError("ray set kind %s not valid." % kind)
+        self._axis_1 = np.asarray(axis_1, dtype=float)
+        self._axis_2 = np.asarray(axis_2, dtype=float)
+        self._kind = kind
+        self._center_x, self._center_y = center_x, center_y
+        self.shape = (len(self._axis_2), len(self._axis_1))
+        if mask is not None:
+            mask = np.asarray(mask, dtype=bool)
+            if mask.shape != self.shape:
+                raise ValueError("mask of shape %s does not match the ray set shape %s." % (mask.shape, self.shape))
+            if mask.all():
+                mask = None
+        self.mask = mask
+        self._explicit = explicit
+        self._index = None
+        self._x, self._y = None, None
+
+    @classmethod
+    def grid(cls, numPix, deltapix, numPix_y=None, center_x=0, center_y=0):
+        """
+        rectangular pixel grid with the same convention as utils.make_grid()
+
+        :param numPix: number of pixels along x
+        :param deltapix: pixel size in arc seconds
+        :param numPix_y: number of pixels along y (default numPix)
+        :param center_x: x-offset of the grid in arc seconds
+        :param center_y: y-offset of the grid in arc seconds
+        :return: RaySet instance
+        """
+        if numPix_y is None:
+            numPix_y = numPix
+        axis_x = ((np.arange(numPix) - numPix/2.)*deltapix + center_x)*const.arcsec
+        axis_y = ((np.arange(numPix_y) - numPix_y/2.)*deltapix + center_y)*const.arcsec
+        return cls(axis_x, axis_y, kind='cartesian')
+
+    @classmethod
+    def polar(cls, r_min, r_max, num_r, num_phi, center_x=0, center_y=0, log=False):
+        """
+        polar or log-polar sampling around a center (e.g. the lens center)
+
+        :param r_min: minimal radius in arc seconds
+        :param r_max: maximal radius in arc seconds
+        :param num_r: number of radial samples
+        :param num_phi: number of angular samples
+        :param center_x: x-coordinate of the center in arc seconds
+        :param center_y: y-coordinate of the center in arc seconds
+        :param log: bool, if True, the radii are logarithmically spaced
+        :return: RaySet instance with image shape (num_r, num_phi)
+        """
+        if log:
+            if r_min <= 0:
+                raise ValueError("log-polar sampling requires r_min > 0, %s given." % r_min)
+            r = np.logspace(np.log10(r_min), np.log10(r_max), num_r)
+        else:
+            r = np.linspace(r_min, r_max, num_r)
+        phi = np.linspace(0, 2*np.pi, num_phi, endpoint=False)
+        return cls(phi, r*const.arcsec, kind='polar', center_x=center_x*const.arcsec, center_y=center_y*const.arcsec)
+
+    @classmethod
+    def from_arrays(cls, x_array, y_array, shape=None):
+        """
+        ray set from given coordinate arrays in radian (e.g. as returned by utils.make_grid())
+        :param x_array: x-coordinates
+        :param y_array: y-coordinates
+        :param shape: (ny, nx) image shape of the rays (default one row)
+        :return: RaySet instance
+        """
+        x_array, y_array = np.asarray(x_array, dtype=float), np.asarray(y_array, dtype=float)
+        if shape is None:
+            shape = (1, x_array.size)
+        if shape[0]*shape[1] != x_array.size:
+            raise ValueError("shape %s does not match the number of rays %s." % (shape, x_array.size))
+        return cls(np.zeros(shape[1]), np.zeros(shape[0]), kind='explicit', explicit=(x_array.ravel(), y_array.ravel()))
+
+    def masked(self, mask):
+        """
+        ray set restricted to the rays where the mask is True (combined with the existing mask)
+
+        :param mask: boolean array of the image shape
+        :return: new RaySet instance
+        """
+        mask = np.asarray(mask, dtype=bool)
+        if self.mask is not None:
+            mask = mask & self.mask
+        return RaySet(self._axis_1, self._axis_2, kind=self._kind, center_x=self._center_x,
+                      center_y=self._center_y, mask=mask, explicit=self._explicit)
+
+    def region(self, x_min, x_max, y_min, y_max):
+        """
+        restricts the ray set to a rectangular region of interest
+        :param x_min: in arc seconds
+        :param x_max: in arc seconds
+        :param y_min: in arc seconds
+        :param y_max: in arc seconds
+        :return: new RaySet instance
+        """
+        x, y = self._full_coordinates()
+        mask = (x >= x_min*const.arcsec) & (x <= x_max*const.arcsec) & (y >= y_min*const.arcsec) & (y <= y_max*const.arcsec)
+        return self.masked(mask)
+
+    def annulus(self, r_min, r_max, center_x=0, center_y=0):
+        """
+        restricts the ray set to an annulus (e.g. around the Einstein ring)
+        :param r_min: inner radius in arc seconds
+        :param r_max: outer radius in arc seconds
+        :param center_x: x-coordinate of the center in arc seconds
+        :param center_y: y-coordinate of the center in arc seconds
+        :return: new RaySet instance
+        """
+        x, y = self._full_coordinates()
+        r2 = (x - center_x*const.arcsec)**2 + (y - center_y*const.arcsec)**2
+        mask = (r2 >= (r_min*const.arcsec)**2) & (r2 <= (r_max*const.arcsec)**2)
+        return self.masked(mask)
+
+    @property
+    def index(self):
+        """
+        flat image indices of the selected rays (None if all rays are selected)
+        """
+        if self.mask is not None and self._index is None:
+            self._index = np.flatnonzero(self.mask)
+        return self._index
+
+    @property
+    def num_rays(self):
+        if self.mask is None:
+            return self.shape[0]*self.shape[1]
+        return len(self.index)
+
+    def __len__(self):
+        return self.num_rays
+
+    @property
+    def x(self):
+        """
+        x-coordinates of the selected rays in radian
+        """
+        if self._x is None:
+            self._x, self._y = self._coordinates()
+        return self._x
+
+    @property
+    def y(self):
+        """
+        y-coordinates of the selected rays in radian
+        """
+        if self._y is None:
+            self._x, self._y = self._coordinates()
+        return self._y
+
+    def coordinates(self):
+        """
+        :return: x, y coordinates of the selected rays in radian
+        """
+        return self.x, self.y
+
+    def image(self, values, fill_value=0):
+        """
+        puts the values of the selected rays back into the 2d image shape of the ray set
+
+        :param values: 1d array of length num_rays (or stack of those with leading axes)
+        :param fill_value: value of the pixels outside the mask
+        :return: array of shape (..., ny, nx), a view of values if the ray set is not masked
+        """
+        values = np.asarray(values)
+        if self.mask is None:
+            return values.reshape(values.shape[:-1] + self.shape)
+        image = np.full(values.shape[:-1] + (self.shape[0]*self.shape[1],), fill_value, dtype=values.dtype)
+        image[..., self.index] = values
+        return image.reshape(values.shape[:-1] + self.shape)
+
+    def array(self, image):
+        """
+        inverse of image(): selects the values of the rays from a 2d image
+        :param image: array of shape (..., ny, nx)
+        :return: array of shape (..., num_rays)
+        """
+        image = np.asarray(image)
+        flat = image.reshape(image.shape[:-2] + (self.shape[0]*self.shape[1],))
+        if self.mask is None:
+            return flat
+        return flat[..., self.index]
+
+    def _coordinates(self, index=None):
+        """
+        generates the coordinates of the rays with the given flat indices (default: the selected rays)
+        """
+        if index is None:
+            index = self.index
+        if self._kind == 'explicit':
+            x, y = self._explicit
+            if index is None:
+                return x, y
+            return x[index], y[index]
+        n_1 = self.shape[1]
+        if index is None:
+            c_1 = np.tile(self._axis_1, self.shape[0])
+            c_2 = np.repeat(self._axis_2, n_1)
+        else:
+            c_1 = self._axis_1[index % n_1]
+            c_2 = self._axis_2[index // n_1]
+        if self._kind == 'cartesian':
+            return c_1, c_2
+        return self._center_x + c_2*np.cos(c_1), self._center_y + c_2*np.sin(c_1)
+
+    def _full_coordinates(self):
+        """
+        coordinates of all the rays of the image in the image shape (used to build masks)
+        """
+        if self._kind == 'cartesian':
+            x, y = np.meshgrid(self._axis_1, self._axis_2, sparse=True)
+            return x, y
+        x, y = self._coordinates(index=np.arange(self.shape[0]*self.shape[1]))
+        return x.reshape(self.shape), y.reshape(self.shape)
+
+
+def coordinates(x_array, y_array=None):
+    """
+    returns the coordinate arrays of the rays, accepting either a RaySet or the x- and y-coordinate arrays
+
+    :param x_array: RaySet instance or x-coordinates
+    :param y_array: y-coordinates (None if x_array is a RaySet)
+    :return: x, y coordinates
+    """
+    if isinstance(x_array, RaySet):
+        return x_array.x, x_array.y
+    if y_array is None:
+        raise ValueError("y-coordinates of the rays need to be specified if no RaySet is given.")
+    return x_array, y_array
+
+
+def grid_shape(x_array, y_array=None):
+    """
+    returns the image shape of rays arranged on a regular 2d grid, accepting an unmasked RaySet, 2d coordinate arrays
+    or the flattened square grids of utils.make_grid()
+
+    :param x_array: RaySet instance or x-coordinates
+    :param y_array: y-coordinates (None if x_array is a RaySet)
+    :return: (ny, nx)
+    """
+    if isinstance(x_array, RaySet):
+        if x_array.mask is not None:
+            raise ValueError("masked ray sets are not arranged on a regular grid.")
+        return x_array.shape
+    if np.ndim(x_array) == 2:
+        return np.shape(x_array)
+    n = np.size(x_array)
+    num_pix = int(round(np.sqrt(n)))
+    if np.ndim(x_array) != 1 or num_pix**2 != n:
+        raise ValueError("rays of shape %s are not arranged on a regular grid." % (np.shape(x_array),))
+    return num_pix, num_pix
@@ -0,0 +1,476 @@
+"""
+long-lived local tracing service (console command 'multilens-service') and its client
+
+The service loads the cosmology and the lens assemblies once and keeps them (with the tracers and their caches) warm
+in its workers, such that short tracing requests do not pay the start-up costs. It is configured with a JSON file,
+e.g.::
+
+    {
+        "cosmology": {"H0": 70, "Om0": 0.3, "Ob0": 0.05},
+        "assembly": {"los_0": "los_0.npz", "los_1": "los_1.npz"},
+        "processes": 4
+    }
+
+and listens on a Unix socket or a local TCP port. The messages are a JSON header (operation, parameters, dtype and
+shape of the arrays) followed by the raw bytes of the numpy arrays, i.e. no objects are pickled. TracingClient
+offers the tracing methods of MultiLens with the name of an assembly of the service in place of the LensAssembly.
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+__author__ = 'sibirrer'
+
+import argparse
+import json
+import socket
+import struct
+import sys
+import threading
+
+import numpy as np
+
+_DEFAULTS = {'cosmology': {}, 'processes': 1}
+_METHODS = ('full_ray_tracing', 'born_ray_tracing', 'combined_ray_tracing', 'analytic_mapping')
+_OPERATIONS = ('ping', 'trace', 'analytic_matrices')
+# length of the JSON header of a message
+_LENGTH = struct.Struct('>I')
+
+# state of a worker process of the pool (loaded once per process by _init_worker())
+_WORKER = {}
+
+
+def load_config(filename):
+    """
+    reads a service configuration from a JSON file and fills in the defaults
+
+    :param filename: name of the JSON file
+    :return: configuration dictionary
+    """
+    with open(filename) as f:
+        config = json.load(f)
+    return check_config(config)
+
+
+def check_config(config):
+    """
+    checks a service configuration and fills in the defaults
+
+    :param config: configuration dictionary
+    :return: configuration dictionary
+    """
+    config = dict(config)
+    for key, value in _DEFAULTS.items():
+        config.setdefault(key, value)
+    if 'assembly' not in config:
+        raise ValueError("service configuration needs the entry 'assembly'.")
+    if not isinstance(config['assembly'], dict):
+        raise ValueError("assembly needs to be a dictionary of names and files.")
+    return config
+
+
+def _load_worker(config):
+    """
+    loads the lens assemblies and the tracer of a worker. The cosmology of the configuration is passed to the tracer
+    and the lens objects.
+
+    :param config: configuration dictionary
+    :return: dictionary of the worker state
+    """
+    from MultiLens.Cosmo.cosmo import get_cosmo
+    from MultiLens.MultiLens import MultiLens
+    from MultiLens.persistence import load_assembly
+    cosmo = get_cosmo(**config['cosmology'])
+    assemblies = dict((name, load_assembly(filename, cosmo=cosmo)) for name, filename in config['assembly'].items())
+    return {'multiLens': MultiLens(cosmo=cosmo), 'assemblies': assemblies}
+
+
+def _init_worker(config):
+    """
+    loads the state of a worker process of the pool
+    """
+    _WORKER.clear()
+    _WORKER.update(_load_worker(config))
+
+
+def _run_process_request(header, arrays):
+    """
+    executes a tracing request in a worker process of the pool
+    """
+    return _run_request(_WORKER, header, arrays)
+
+
+def _run_request(worker, header, arrays):
+    """
+    executes a tracing request in a worker
+
+    :param worker: dictionary of the worker state (see _load_worker())
+    :param header: request header
+    :param arrays: list of numpy arrays of the request
+    :return: list of numpy arrays of the reply
+    """
+    assemblies = worker['assemblies']
+    name = header.get('assembly')
+    if name not in assemblies:
+        raise ValueError("assembly %s not valid. Chose among %s." % (name, sorted(assemblies)))
+    lensAssembly = assemblies[name]
+    kwargs = header.get('kwargs', {})
+    multiLens = worker['multiLens']
+    if header['op'] == 'analytic_matrices':
+        return list(multiLens.analytic_matrices(lensAssembly, header['z_source'], **kwargs))
+    method = header.get('method')
+    if method not in _METHODS:
+        raise ValueError("method %s not valid. Chose among %s." % (method, list(_METHODS)))
+    x_array, y_array = arrays
+    outputs = getattr(multiLens, method)(lensAssembly, header['z_source'], x_array, y_array, **kwargs)
+    return [np.asarray(output) for output in outputs]
+
+
+def _encode(header, arrays=()):
+    """
+    message of a header and numpy arrays as a list of byte strings
+    """
+    arrays = [np.ascontiguousarray(array) for array in arrays]
+    for array in arrays:
+        if array.dtype.hasobject:
+            raise ValueError("arrays of dtype %s can not be sent." % array.dtype)
+    header = dict(header, arrays=[[array.dtype.str, list(array.shape)] for array in arrays])
+    data = json.dumps(header).encode('utf-8')
+    return [_LENGTH.pack(len(data)), data] + [array.tobytes() for array in arrays]
+
+
+def _decode_header(data):
+    """
+    header of a message and the dtypes, shapes and sizes in bytes of its arrays
+    """
+    header = json.loads(data.decode('utf-8'))
+    specs = []
+    for dtype, shape in header.pop('arrays', []):
+        dtype = np.dtype(str(dtype))
+        if dtype.hasobject:
+            raise ValueError("arrays of dtype %s can not be received." % dtype)
+        specs.append((dtype, tuple(shape), dtype.itemsize*int(np.prod(shape))))
+    return header, specs
+
+
+def _decode_array(data, dtype, shape):
+    """
+    numpy array of the received bytes (writeable, without copy for a bytearray)
+    """
+    if isinstance(data, bytes):
+        data = bytearray(data)
+    return np.frombuffer(data, dtype=dtype).reshape(shape)
+
+
+class TracingService(object):
+    """
+    class of the asyncio server dispatching the tracing requests to a pool of warm workers
+
+    With processes=1, the requests are executed one after the other in a worker thread of the service process,
+    otherwise in a pool of processes that each hold their own copy of the assemblies. The requests of a connection are
+    answered in order, the requests of several connections concurrently up to the number of workers.
+    """
+
+    def __init__(self, config):
+        """
+
+        :param config: configuration dictionary (see check_config())
+        :return:
+        """
+        self.config = check_config(config)
+        self.address = None
+        self._server = None
+        self._executor = None
+        self._run_request = None
+        self._loop = None
+        self._thread = None
+
+    def _start_executor(self):
+        import concurrent.futures
+        import functools
+        processes = self.config['processes']
+        if processes > 1:
+            self._executor = concurrent.futures.ProcessPoolExecutor(processes, initializer=_init_worker,
+                                                                    initargs=(self.config,))
+            self._run_request = _run_process_request
+        else:
+            # the state of the worker thread is kept by the service (several services can run in one process)
+            self._executor = concurrent.futures.ThreadPoolExecutor(1)
+            self._run_request = functools.partial(_run_request, _load_worker(self.config))
+        # loads the workers before the first request arrives
+        futures = [self._executor.submit(_ping) for _ in range(max(1, processes))]
+        for future in futures:
+            future.result()
+
+    async def start(self, path=None, host='127.0.0.1', port=0):
+        """
+        starts the workers and listens on a Unix socket (if path is given) or a local TCP port
+
+        :param path: file name of the Unix socket
+        :param host: host of the TCP server
+        :param port: port of the TCP server (0 for any free port)
+        :return: address of the service (path or (host, port))
+        """
+        import asyncio
+        self._loop = asyncio.get_running_loop()
+        await self._loop.run_in_executor(None, self._start_executor)
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path=path)
+            self.address = path
+        else:
+            self._server = await asyncio.start_server(self._handle, host=host, port=port)
+            self.address = self._server.sockets[0].getsockname()[:2]
+        return self.address
+
+    async def serve_forever(self):
+        """
+        serves the requests until the service is closed
+        """
+        try:
+            await self._server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        stops listening and shuts the workers down
+        """
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def start_background(self, path=None, host='127.0.0.1', port=0):
+        """
+        runs the service in a daemon thread with its own event loop (e.g. within an interactive session)
+
+        :return: address of the service
+        """
+        import asyncio
+        started = threading.Event()
+        errors = []
+
+        def run():
+            async def main():
+                try:
+                    await self.start(path=path, host=host, port=port)
+                except Exception as e:
+                    errors.append(e)
+                    return
+                finally:
+                    started.set()
+                await self.serve_forever()
+            try:
+                asyncio.run(main())
+            except asyncio.CancelledError:
+                pass
+        self._thread = threading.Thread(target=run, name='multilens-service')
+        self._thread.daemon = True
+        self._thread.start()
+        started.wait()
+        if errors:
+            raise errors[0]
+        return self.address
+
+    def stop(self):
+        """
+        stops a service started with start_background()
+        """
+        if self._loop is not None and self._server is not None:
+            self._loop.call_soon_threadsafe(self.close)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    async def _handle(self, reader, writer):
+        """
+        serves the requests of a connection
+        """
+        import asyncio
+        try:
+            while True:
+                try:
+                    data = await reader.readexactly(_LENGTH.size)
+                except asyncio.IncompleteReadError:
+                    break
+                header, specs = _decode_header(await reader.readexactly(_LENGTH.unpack(data)[0]))
+                arrays = []
+                for dtype, shape, size in specs:
+                    arrays.append(_decode_array(await reader.readexactly(size), dtype, shape))
+                try:
+                    reply = await self._dispatch(header, arrays)
+                except Exception as e:
+                    reply = _encode({'status': 'error', 'message': '%s: %s' % (type(e).__name__, e)})
+                writer.writelines(reply)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # closed connection or service shut down with the connection open
+            pass
+        finally:
+            writer.close()
+
+    async def _dispatch(self, header, arrays):
+        """
+        reply to a request
+        """
+        op = header.get('op')
+        if op not in _OPERATIONS:
+            raise ValueError("operation %s not valid. Chose among %s." % (op, list(_OPERATIONS)))
+        if op == 'ping':
+            return _encode({'status': 'ok', 'assemblies': sorted(self.config['assembly'])})
+        if op == 'trace' and len(arrays) != 2:
+            raise ValueError("tracing requests need the arrays x and y.")
+        outputs = await self._loop.run_in_executor(self._executor, self._run_request, header, arrays)
+        return _encode({'status': 'ok'}, outputs)
+
+
+def _ping():
+    return True
+
+
+class TracingClient(object):
+    """
+    client of a TracingService, offering the tracing methods of MultiLens for the assemblies of the service (given by
+    their names in the configuration of the service)
+    """
+
+    def __init__(self, address, timeout=None):
+        """
+
+        :param address: file name of the Unix socket or (host, port) of the service
+        :param timeout: timeout of the requests in seconds (None for no timeout)
+        :return:
+        """
+        if isinstance(address, (tuple, list)):
+            self._socket = socket.create_connection(tuple(address), timeout=timeout)
+        else:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.settimeout(timeout)
+            self._socket.connect(address)
+
+    def ping(self):
+        """
+        :return: names of the assemblies of the service
+        """
+        header, arrays = self._request({'op': 'ping'})
+        return header['assemblies']
+
+    def full_ray_tracing(self, lensAssembly, z_source, x_array, y_array=None, **kwargs):
+        """
+        see MultiLens.full_ray_tracing(), with the name of an assembly of the service as lensAssembly
+        """
+        return self._trace('full_ray_tracing', lensAssembly, z_source, x_array, y_array, kwargs)
+
+    def born_ray_tracing(self, lensAssembly, z_source, x_array, y_array=None):
+        """
+        see MultiLens.born_ray_tracing()
+        """
+        return self._trace('born_ray_tracing', lensAssembly, z_source, x_array, y_array, {})
+
+    def combined_ray_tracing(self, lensAssembly, z_source, x_array, y_array=None, **kwargs):
+        """
+        see MultiLens.combined_ray_tracing()
+        """
+        return self._trace('combined_ray_tracing', lensAssembly, z_source, x_array, y_array, kwargs)
+
+    def analytic_mapping(self, lensAssembly, z_source, x_array, y_array=None, **kwargs):
+        """
+        see MultiLens.analytic_mapping()
+        """
+        return self._trace('analytic_mapping', lensAssembly, z_source, x_array, y_array, kwargs)
+
+    def analytic_matrices(self, lensAssembly, z_source, **kwargs):
+        """
+        see MultiLens.analytic_matrices()
+        """
+        header, arrays = self._request({'op': 'analytic_matrices', 'assembly': lensAssembly,
+                                        'z_source': float(z_source), 'kwargs': kwargs})
+        return tuple(arrays)
+
+    def _trace(self, method, lensAssembly, z_source, x_array, y_array, kwargs):
+        import MultiLens.ray_set as ray_set
+        x_array, y_array = ray_set.coordinates(x_array, y_array)
+        header, arrays = self._request({'op': 'trace', 'method': method, 'assembly': lensAssembly,
+                                        'z_source': float(z_source), 'kwargs': kwargs},
+                                       [np.asarray(x_array, dtype=float), np.asarray(y_array, dtype=float)])
+        return tuple(arrays)
+
+    def _request(self, header, arrays=()):
+        """
+        sends a request and waits for the reply
+        """
+        self._socket.sendall(b''.join(_encode(header, arrays)))
+        header, specs = _decode_header(self._receive(_LENGTH.unpack(self._receive(_LENGTH.size))[0]))
+        arrays = [_decode_array(self._receive(size), dtype, shape) for dtype, shape, size in specs]
+        if header.get('status') != 'ok':
+            raise ValueError("tracing service: %s" % header.get('message'))
+        return header, arrays
+
+    def _receive(self, size):
+        """
+        receives exactly size bytes
+        """
+        data = bytearray()
+        while len(data) < size:
+            chunk = self._socket.recv(min(size - len(data), 2**20))
+            if not chunk:
+                raise ValueError("connection to the tracing service closed.")
+            data += chunk
+        return data
+
+    def close(self):
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def serve(config, path=None, host='127.0.0.1', port=0, verbose=True):
+    """
+    runs the service until it is interrupted
+
+    :param config: configuration dictionary (see check_config())
+    :param path: file name of the Unix socket (None for TCP)
+    :param host: host of the TCP server
+    :param port: port of the TCP server
+    :param verbose: bool, if True, prints the address once the service is ready
+    :return:
+    """
+    import asyncio
+    service = TracingService(config)
+
+    async def main():
+        address = await service.start(path=path, host=host, port=port)
+        if verbose:
+            print("MultiLens service ready on %s" % (address,))
+            sys.stdout.flush()
+        await service.serve_forever()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+
+
+def main(argv=None):
+    """
+    entry point of the 'multilens-service' console command
+    """
+    parser = argparse.ArgumentParser(prog='multilens-service', description='runs a warm MultiLens tracing service')
+    parser.add_argument('config', help='service configuration (JSON file)')
+    parser.add_argument('-s', '--socket', default=None, help='file name of the Unix socket')
+    parser.add_argument('--host', default='127.0.0.1', help='host of the TCP server')
+    parser.add_argument('--port', type=int, default=0, help='port of the TCP server')
+    parser.add_argument('-p', '--processes', type=int, default=None, help='number of worker processes')
+    parser.add_argument('-q', '--quiet', action='store_true', help='do not print the address')
+    args = parser.parse_args(argv)
+    config = load_config(args.config)
+    if args.processes is not None:
+        config['processes'] = args.processes
+    serve(config, path=args.socket, host=args.host, port=args.port, verbose=not args.quiet)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
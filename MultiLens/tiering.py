@@ -0,0 +1,126 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+__author__ = 'sibirrer'
+
+import numpy as np
+
+from MultiLens.born import BornLens
+import MultiLens.ray_set as ray_set
+import MultiLens.Utils.constants as const
+
+
+class Tiering(object):
+    """
+    class to assign the approximation tier of each lens object from its estimated effect over the field of view
+
+    The deflections and hessians of the lenses are evaluated in the Born approximation on a coarse grid of sample
+    points covering the field. A lens is traced exactly ('full') if its weighted hessian (i.e. its convergence and
+    shear contribution) exceeds strong_threshold anywhere in the field, skipped ('skip') if its deflection stays below
+    the tolerance, treated with its hessian at the origin ('tidal') if the linear deflection field reproduces its
+    deflection within the tolerance and in the Born approximation ('born') otherwise. Lenses also need to be traced
+    exactly if their coupling to the exactly traced lenses (see _coupling()) exceeds the tolerance. The main
+    deflector is always traced exactly and lenses centered within the field are never skipped or treated as tidal.
+    """
+
+    def __init__(self, strong_threshold=0.01, tolerance=0.001, num_samples=10, instrumentation=None):
+        """
+
+        :param strong_threshold: maximal weighted hessian of a lens not traced exactly
+        :param tolerance: tolerated deflection error per lens in arc seconds
+        :param num_samples: number of sample points along each axis of the field
+        :param instrumentation: Instrumentation instance (None for no instrumentation)
+        :return:
+        """
+        self.strong_threshold = strong_threshold
+        self.tolerance = tolerance
+        self.num_samples = num_samples
+        self.bornLens = BornLens(instrumentation=instrumentation)
+
+    def assign(self, lensAssembly, z_source, x_array, y_array=None):
+        """
+        sets the approximation of all the lens objects of the assembly
+
+        :param lensAssembly: LensAssembly instance
+        :param z_source: redshift of the source
+        :param x_array: x-coords of the rays of the field (or RaySet instance)
+        :param y_array: y-coords of the rays of the field (None if x_array is a RaySet)
+        :return: dictionary with the number of lens objects per tier
+        """
+        x_sample, y_sample = self._samples(x_array, y_array)
+        tolerance = self.tolerance * const.arcsec
+        lensAssembly.reset_observer_frame()
+        lens_list, strength, deflection, residual = [], [], [], []
+        for lensObject in lensAssembly.object_array:
+            if lensObject.redshift >= z_source:
+                lensObject.approximation = 'skip'
+        terms = self.bornLens.lens_terms(lensAssembly.object_array, z_source, x_sample, y_sample)
+        for batch, a_x, a_y, h_xx, h_yy, h_xy in terms:
+            lens_list += batch
+            strength.append(np.max(np.maximum(np.maximum(np.abs(h_xx), np.abs(h_yy)), np.abs(h_xy)), axis=1))
+            deflection.append(np.max(np.sqrt(a_x**2 + a_y**2), axis=1))
+            # the first sample point is the origin, where the tidal approximation is evaluated
+            tidal_x = h_xx[:, :1]*x_sample + h_xy[:, :1]*y_sample
+            tidal_y = h_xy[:, :1]*x_sample + h_yy[:, :1]*y_sample
+            residual.append(np.max(np.sqrt((a_x - tidal_x)**2 + (a_y - tidal_y)**2), axis=1))
+        if lens_list:
+            strength, deflection, residual = np.concatenate(strength), np.concatenate(deflection), np.concatenate(residual)
+            main = np.array([lensObject.main is True for lensObject in lens_list])
+            full = main | (strength > self.strong_threshold)
+            coupling = self._coupling(lens_list, z_source, strength, deflection, full)
+            full |= coupling > tolerance
+            inside = self._inside(lens_list, x_sample, y_sample)
+            for k, lensObject in enumerate(lens_list):
+                if full[k]:
+                    lensObject.approximation = 'full'
+                elif inside[k]:
+                    lensObject.approximation = 'born'
+                elif deflection[k] < tolerance:
+                    lensObject.approximation = 'skip'
+                elif residual[k] < tolerance:
+                    lensObject.approximation = 'tidal'
+                else:
+                    lensObject.approximation = 'born'
+        counts = dict((tier, 0) for tier in ('full', 'born', 'tidal', 'skip'))
+        for lensObject in lensAssembly.object_array:
+            counts[lensObject.tier] += 1
+        return counts
+
+    def _coupling(self, lens_list, z_source, strength, deflection, full):
+        """
+        estimated error of the source positions when a lens is not traced together with the exactly traced lenses:
+        its weighted hessian times the displacement of the rays at its plane by the lenses in front of it plus the
+        displacement of the rays by the lens at the planes behind it times their weighted hessian
+
+        :return: array of the estimated errors (in radian)
+        """
+        redshifts = np.array([lensObject.redshift for lensObject in lens_list], dtype=float)
+        chi = np.atleast_1d(self.bornLens.cosmo.comoving_transverse_distance(redshifts))
+        D_k, w_k, w_kk = self.bornLens.lensing_weights(redshifts, z_source)
+        # maximal physical deflection angle of the exactly traced lenses and of all the lenses
+        amplitude = deflection / w_k
+        chi_j = chi[full][np.newaxis, :]
+        chi_k = chi[:, np.newaxis]
+        front = np.where(chi_j < chi_k, 1 - chi_j / chi_k, 0)
+        back = np.where(chi_j > chi_k, 1 - chi_k / chi_j, 0)
+        displacement = np.sum(front * amplitude[full][np.newaxis, :], axis=1)
+        response = np.sum(back * strength[full][np.newaxis, :], axis=1)
+        return strength * displacement + amplitude * response
+
+    def _inside(self, lens_list, x_sample, y_sample):
+        """
+        whether the lenses are centered within the field (the sample points may miss their central deflection field,
+        hence they are never skipped or treated as tidal)
+        """
+        pos = np.array([lensObject.position() for lensObject in lens_list], dtype=float)
+        x_min, x_max = np.min(x_sample), np.max(x_sample)
+        y_min, y_max = np.min(y_sample), np.max(y_sample)
+        return (pos[:, 0] >= x_min) & (pos[:, 0] <= x_max) & (pos[:, 1] >= y_min) & (pos[:, 1] <= y_max)
+
+    def _samples(self, x_array, y_array):
+        """
+        origin followed by a regular grid of sample points covering the bounding box of the rays
+        """
+        x_array, y_array = ray_set.coordinates(x_array, y_array)
+        x_axis = np.linspace(np.min(x_array), np.max(x_array), self.num_samples)
+        y_axis = np.linspace(np.min(y_array), np.max(y_array), self.num_samples)
+        x_grid, y_grid = np.meshgrid(x_axis, y_axis)
+        return np.append(0., x_grid.ravel()), np.append(0., y_grid.ravel())
@@ -0,0 +1,89 @@
+"""
+asv benchmarks of the lens profiles, the numerical differentials and the cosmological distances
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+__author__ = 'sibirrer'
+
+import numpy as np
+
+from MultiLens.Profiles.point_mass import PointMass
+from MultiLens.Profiles.SIS import SIS
+from MultiLens.Profiles.nfw import NFW
+from MultiLens.numerics import Numerics
+from MultiLens.Cosmo.cosmo import CosmoProp
+import MultiLens.Utils.utils as utils
+
+from .common import throughput
+
+PROFILES = {'point_mass': (PointMass, {'mass': 10**10, 'pos_x': 0.001, 'pos_y': 0.}),
+            'SIS': (SIS, {'sigma_v': 200*1000., 'pos_x': 0.001, 'pos_y': 0.}),
+            'NFW': (NFW, {'rho_s': 10**15, 'Rs': 0.1, 'pos_x': 0.001, 'pos_y': 0.})}
+
+
+class Profiles(object):
+    """
+    timing, peak memory and throughput (rays/s) of the profile kernels
+    """
+    params = (sorted(PROFILES.keys()), [10**4, 10**6])
+    param_names = ['profile', 'n_rays']
+
+    def setup(self, profile, n_rays):
+        profile_class, self.kwargs = PROFILES[profile]
+        self.profile = profile_class()
+        random = np.random.RandomState(42)
+        self.x, self.y = random.uniform(-0.01, 0.01, (2, n_rays))
+
+    def time_derivative(self, profile, n_rays):
+        self.profile.derivative(self.x, self.y, **self.kwargs)
+
+    def time_hessian(self, profile, n_rays):
+        self.profile.hessian(self.x, self.y, **self.kwargs)
+
+    def peakmem_hessian(self, profile, n_rays):
+        self.profile.hessian(self.x, self.y, **self.kwargs)
+
+    def track_derivative_throughput(self, profile, n_rays):
+        return throughput(self.profile.derivative, len(self.x), 1, self.x, self.y, **self.kwargs)
+    track_derivative_throughput.unit = 'rays/s'
+
+    def track_hessian_throughput(self, profile, n_rays):
+        return throughput(self.profile.hessian, len(self.x), 1, self.x, self.y, **self.kwargs)
+    track_hessian_throughput.unit = 'rays/s'
+
+
+class NumericsDifferentials(object):
+    """
+    timing and peak memory of the numerical differentials
+    """
+    params = ([100, 300, 1000], [2, 4])
+    param_names = ['num_pix', 'order']
+
+    def setup(self, num_pix, order):
+        self.x, self.y = utils.make_grid(num_pix, 0.05)
+        r = np.sqrt(self.x**2 + self.y**2) + 10**(-10)
+        self.beta_x = self.x - 10**(-5)*self.x/r
+        self.beta_y = self.y - 10**(-5)*self.y/r
+        self.numerics = Numerics(order=order)
+
+    def time_differentials(self, num_pix, order):
+        self.numerics.differentials(self.beta_x, self.beta_y, self.x, self.y)
+
+    def time_all(self, num_pix, order):
+        self.numerics.all(self.beta_x, self.beta_y, self.x, self.y)
+
+    def peakmem_all(self, num_pix, order):
+        self.numerics.all(self.beta_x, self.beta_y, self.x, self.y)
+
+
+class CosmoDistances(object):
+    """
+    timing of the angular diameter distances
+    """
+
+    def setup(self):
+        self.cosmo = CosmoProp()
+        self.z = np.linspace(0.05, 2, 100)
+
+    def time_D_xy(self):
+        for z in self.z:
+            self.cosmo.D_xy(0.01, z)
@@ -0,0 +1,43 @@
+"""
+asv benchmarks of the package startup: import time and construction of many lens objects
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+__author__ = 'sibirrer'
+
+from MultiLens.lens_object import LensObject
+
+from .common import make_assembly
+
+
+class Startup(object):
+    """
+    import time (in a fresh interpreter) and construction time of lens objects and assemblies
+    """
+
+    def timeraw_import_multilens(self):
+        return "from MultiLens.MultiLens import MultiLens"
+
+    def timeraw_first_tracing_setup(self):
+        return """
+        from MultiLens.MultiLens import MultiLens
+        from MultiLens.lens_object import LensObject
+        lensObject = LensObject(redshift=0.5, type='SIS', main=True)
+        lensObject.add_info('kwargs_profile', {'sigma_v': 200*1000., 'pos_x': 0., 'pos_y': 0.})
+        MultiLens()
+        """
+
+    def time_lens_objects(self):
+        for i in range(10**4):
+            lensObject = LensObject(redshift=0.5, type='NFW')
+            lensObject.add_info('kwargs_profile', {'rho_s': 10**15, 'Rs': 0.1, 'pos_x': 1., 'pos_y': 1.})
+
+
+class BuildAssembly(object):
+    """
+    construction time of a LensAssembly with many lens objects
+    """
+    params = [100, 1000]
+    param_names = ['n_lenses']
+
+    def time_make_assembly(self, n_lenses):
+        make_assembly(n_lenses, 'mixed')
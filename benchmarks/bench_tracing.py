@@ -0,0 +1,76 @@
+"""
+asv benchmarks of the ray-tracing and analytic routines of MultiLens
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+__author__ = 'sibirrer'
+
+from MultiLens.MultiLens import MultiLens
+import MultiLens.Utils.utils as utils
+
+from .common import make_assembly, throughput, PROFILE_MIXES
+
+Z_SOURCE = 1.5
+
+
+class Tracing(object):
+    """
+    timing, peak memory and throughput (rays*planes/s) of the ray-tracing routines
+    """
+    params = ([1, 10, 100], [50, 150], PROFILE_MIXES)
+    param_names = ['n_lenses', 'num_pix', 'profile_mix']
+    timeout = 300
+
+    def setup(self, n_lenses, num_pix, profile_mix):
+        self.lensAssembly = make_assembly(n_lenses, profile_mix)
+        self.multiLens = MultiLens()
+        self.x, self.y = utils.make_grid(num_pix, 0.05)
+        self.n_rays = num_pix**2
+        self.n_planes = n_lenses
+
+    def time_full_ray_tracing(self, n_lenses, num_pix, profile_mix):
+        self.multiLens.full_ray_tracing(self.lensAssembly, Z_SOURCE, self.x, self.y)
+
+    def time_born_ray_tracing(self, n_lenses, num_pix, profile_mix):
+        self.multiLens.born_ray_tracing(self.lensAssembly, Z_SOURCE, self.x, self.y)
+
+    def time_combined_ray_tracing(self, n_lenses, num_pix, profile_mix):
+        self.multiLens.combined_ray_tracing(self.lensAssembly, Z_SOURCE, self.x, self.y)
+
+    def time_analytic_mapping(self, n_lenses, num_pix, profile_mix):
+        self.multiLens.analytic_mapping(self.lensAssembly, Z_SOURCE, self.x, self.y)
+
+    def peakmem_full_ray_tracing(self, n_lenses, num_pix, profile_mix):
+        self.multiLens.full_ray_tracing(self.lensAssembly, Z_SOURCE, self.x, self.y)
+
+    def peakmem_born_ray_tracing(self, n_lenses, num_pix, profile_mix):
+        self.multiLens.born_ray_tracing(self.lensAssembly, Z_SOURCE, self.x, self.y)
+
+    def track_full_ray_tracing_throughput(self, n_lenses, num_pix, profile_mix):
+        return throughput(self.multiLens.full_ray_tracing, self.n_rays, self.n_planes, self.lensAssembly, Z_SOURCE,
+                          self.x, self.y)
+    track_full_ray_tracing_throughput.unit = 'rays*planes/s'
+
+    def track_born_ray_tracing_throughput(self, n_lenses, num_pix, profile_mix):
+        return throughput(self.multiLens.born_ray_tracing, self.n_rays, self.n_planes, self.lensAssembly, Z_SOURCE,
+                          self.x, self.y)
+    track_born_ray_tracing_throughput.unit = 'rays*planes/s'
+
+    def track_combined_ray_tracing_throughput(self, n_lenses, num_pix, profile_mix):
+        return throughput(self.multiLens.combined_ray_tracing, self.n_rays, self.n_planes, self.lensAssembly,
+                          Z_SOURCE, self.x, self.y)
+    track_combined_ray_tracing_throughput.unit = 'rays*planes/s'
+
+
+class AnalyticMatrices(object):
+    """
+    timing of the analytic LOS matrices
+    """
+    params = ([1, 10, 100], PROFILE_MIXES)
+    param_names = ['n_lenses', 'profile_mix']
+
+    def setup(self, n_lenses, profile_mix):
+        self.lensAssembly = make_assembly(n_lenses, profile_mix)
+        self.multiLens = MultiLens()
+
+    def time_analytic_matrices(self, n_lenses, profile_mix):
+        self.multiLens.analytic_matrices(self.lensAssembly, Z_SOURCE)
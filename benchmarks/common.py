@@ -0,0 +1,66 @@
+"""
+helper functions to set up reproducible lens configurations for the benchmarks
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+__author__ = 'sibirrer'
+
+import time
+
+import numpy as np
+
+from MultiLens.Cosmo.cosmo import get_cosmo
+from MultiLens.lens_assembly import LensAssembly
+from MultiLens.lens_object import LensObject
+from MultiLens.Utils.halo_param import HaloParam
+
+PROFILE_MIXES = ['point_mass', 'SIS', 'NFW', 'mixed']
+
+
+def kwargs_profile(lens_type, mass, pos_x, pos_y, z):
+    """
+    profile parameters of a halo of given mass (in M_sun) at position pos_x, pos_y (arc seconds)
+    """
+    if lens_type == 'point_mass':
+        return {'mass': mass, 'pos_x': pos_x, 'pos_y': pos_y}
+    if lens_type == 'SIS':
+        return {'sigma_v': 50*1000.*(mass/10**10)**(1./3), 'pos_x': pos_x, 'pos_y': pos_y}
+    # HaloParam takes the mass in M_sun/h and returns the NFW parameters in physical units
+    h = get_cosmo().H0/100.
+    kwargs = HaloParam().kwargs_profile(mass*h, z, type='NFW', h=h)
+    return {'rho_s': float(kwargs['rho_s']), 'Rs': float(kwargs['Rs']), 'pos_x': pos_x, 'pos_y': pos_y}
+
+
+def make_assembly(n_lenses, profile_mix='mixed', seed=42):
+    """
+    builds a LensAssembly with a main deflector (SIS at z=0.5) and n_lenses-1 line-of-sight halos with random
+    redshifts, masses and positions (reproducible with the seed)
+
+    :param n_lenses: total number of lens objects
+    :param profile_mix: 'point_mass', 'SIS', 'NFW' or 'mixed'
+    :param seed: random seed
+    :return: LensAssembly instance
+    """
+    random = np.random.RandomState(seed)
+    lensAssembly = LensAssembly()
+    lensObject = LensObject(redshift=0.5, type='SIS', main=True)
+    lensObject.add_info('kwargs_profile', {'sigma_v': 200*1000., 'pos_x': 0., 'pos_y': 0.})
+    lensAssembly.add_lens(lensObject)
+    types = ['point_mass', 'SIS', 'NFW']
+    for i in range(n_lenses - 1):
+        lens_type = types[i % 3] if profile_mix == 'mixed' else profile_mix
+        z = random.uniform(0.05, 1.4)
+        mass = 10**random.uniform(8, 12)
+        pos_x, pos_y = random.uniform(-5, 5, 2)
+        lensObject = LensObject(redshift=z, type=lens_type)
+        lensObject.add_info('kwargs_profile', kwargs_profile(lens_type, mass, pos_x, pos_y, z))
+        lensAssembly.add_lens(lensObject)
+    return lensAssembly
+
+
+def throughput(func, n_rays, n_planes, *args, **kwargs):
+    """
+    runs func once and returns the throughput in rays*planes per second
+    """
+    start = time.time()
+    func(*args, **kwargs)
+    return n_rays * n_planes / max(time.time() - start, 1e-12)
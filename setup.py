@@ -54,6 +54,8 @@ setup(
     package_dir={'MultiLens': 'MultiLens'},
     include_package_data=True,
     install_requires=requires,
+    entry_points={'console_scripts': ['multilens = MultiLens.cli:main',
+                                    'multilens-service = MultiLens.service:main']},
     license='Proprietary',
     zip_safe=False,
     keywords='MultiLens',
@@ -0,0 +1,67 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for `amplitude` module.
+"""
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from MultiLens.amplitude import AmplitudeCache
+from MultiLens.lens_object import LensObject
+
+
+class TestAmplitudeCache(object):
+
+    def setup_method(self):
+        self.lens_list = []
+        for type, kwargs in [('point_mass', {'mass': 10**11, 'pos_x': 0.3, 'pos_y': -0.2}),
+                             ('SIS', {'sigma_v': 150*1000., 'pos_x': -0.4, 'pos_y': 0.1}),
+                             ('NFW', {'rho_s': 10**15, 'Rs': 0.05, 'pos_x': 0.1, 'pos_y': 0.5})]:
+            lensObject = LensObject(redshift=0.5, type=type)
+            lensObject.add_info('kwargs_profile', kwargs)
+            self.lens_list.append(lensObject)
+        self.lens_list[2].set_truncation(0.01)
+        self.x = np.linspace(-0.005, 0.005, 7)
+        self.y = np.linspace(0.004, -0.003, 7)
+        self.cache = AmplitudeCache(hessian=True)
+        for lensObject in self.lens_list:
+            self.cache.add(lensObject, self.x, self.y, weight=0.5)
+
+    def _sum(self):
+        fields = np.zeros((5, len(self.x)))
+        for lensObject in self.lens_list:
+            fields += 0.5 * np.array(lensObject.deflection(self.x, self.y) + lensObject.distortion(self.x, self.y))
+        return fields
+
+    def test_amplitudes(self):
+        npt.assert_allclose(self.cache.deflection() + self.cache.distortion(), self._sum(), rtol=1e-12)
+        self.lens_list[0].update_params(mass=3*10**11)
+        self.lens_list[1].update_params(sigma_v=100*1000.)
+        self.lens_list[2].update_params(rho_s=2*10**15)
+        npt.assert_allclose(self.cache.deflection() + self.cache.distortion(), self._sum(), rtol=1e-12)
+
+    def test_unit_fields(self):
+        lensObject = self.lens_list[2]
+        reference, monopole = lensObject.reference_deflection(), lensObject.monopole()
+        fields = lensObject.unit_fields(self.x, self.y, hessian=True)
+        # the parameters and the cached quantities of the lens object are not touched
+        assert lensObject.kwargs_param['rho_s'] == 10**15
+        assert lensObject.reference_deflection() is reference
+        assert lensObject._monopole == monopole
+        expected = np.array(lensObject.deflection(self.x, self.y) + lensObject.distortion(self.x, self.y)) / 10**15
+        npt.assert_allclose(fields, expected, rtol=1e-12)
+
+    def test_walkers(self):
+        masses = np.array([[10**11], [2*10**11]])
+        self.lens_list[0].update_params(mass=masses)
+        delta_x, delta_y = self.cache.deflection()
+        assert delta_x.shape == (2, len(self.x))
+        for k in range(2):
+            self.lens_list[0].update_params(mass=float(masses[k, 0]))
+            npt.assert_allclose(delta_x[k], self._sum()[0], rtol=1e-12)
+
+    def test_raise(self):
+        with pytest.raises(ValueError):
+            AmplitudeCache().distortion()
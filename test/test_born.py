@@ -0,0 +1,108 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for `born` module.
+"""
+
+import numpy as np
+import numpy.testing as npt
+
+from MultiLens.born import BornLens
+from MultiLens.MultiLens import MultiLens
+from MultiLens.lens_assembly import LensAssembly
+from MultiLens.lens_object import LensObject
+from MultiLens.numerics import Numerics
+import MultiLens.Utils.utils as utils
+
+
+class TestBornLens(object):
+
+    def setup_method(self):
+        self.lensAssembly = LensAssembly()
+        kwargs_list = [(0.3, 'NFW', {'rho_s': 10**15, 'Rs': 0.1, 'pos_x': 3., 'pos_y': -2.}),
+                       (0.5, 'SIS', {'sigma_v': 150*1000., 'pos_x': -4., 'pos_y': 1.}),
+                       (0.7, 'NFW', {'rho_s': 5*10**14, 'Rs': 0.2, 'pos_x': -1., 'pos_y': 4.}),
+                       (1.1, 'point_mass', {'mass': 10**11, 'pos_x': 3., 'pos_y': 3.}),
+                       (2.5, 'SIS', {'sigma_v': 300*1000., 'pos_x': 0., 'pos_y': 0.})]
+        for z, lens_type, kwargs in kwargs_list:
+            lensObject = LensObject(redshift=z, type=lens_type)
+            lensObject.add_info('kwargs_profile', kwargs)
+            self.lensAssembly.add_lens(lensObject)
+        self.x, self.y = utils.make_grid(40, 0.1)
+        self.z_source = 1.5
+
+    def test_ray_shooting(self):
+        beta_x, beta_y = MultiLens().born_ray_tracing(self.lensAssembly, self.z_source, self.x, self.y)
+        for max_elements in [1, 2**16]:
+            bornLens = BornLens(max_elements=max_elements)
+            beta_x_, beta_y_ = bornLens.ray_shooting(self.lensAssembly, self.z_source, self.x, self.y)
+            npt.assert_allclose(beta_x_, beta_x, rtol=1e-12, atol=1e-20)
+            npt.assert_allclose(beta_y_, beta_y, rtol=1e-12, atol=1e-20)
+
+    def test_amplitude_cache(self):
+        bornLens = BornLens()
+        cache = bornLens.amplitude_cache(self.lensAssembly, self.z_source, self.x, self.y)
+        assert len(cache) == 4
+        self.lensAssembly.object_array[0].update_params(rho_s=2*10**15)
+        self.lensAssembly.object_array[1].update_params(sigma_v=100*1000.)
+        beta_x, beta_y = bornLens.ray_shooting(self.lensAssembly, self.z_source, self.x, self.y)
+        alpha_x, alpha_y = cache.deflection()
+        npt.assert_allclose(self.x - alpha_x, beta_x, rtol=1e-12, atol=1e-20)
+        npt.assert_allclose(self.y - alpha_y, beta_y, rtol=1e-12, atol=1e-20)
+
+    def test_all_numerics(self):
+        beta_x, beta_y, kappa, gamma1, gamma2, mag = BornLens().all(self.lensAssembly, self.z_source, self.x, self.y)
+        kappa_num, gamma1_num, gamma2_num, mag_num = Numerics(order=4).all(beta_x, beta_y, self.x, self.y)
+
+        def interior(array):
+            return utils.array2image(array)[2:-2, 2:-2]
+        npt.assert_allclose(kappa_num, interior(kappa), rtol=1e-3, atol=1e-4*np.max(np.abs(kappa)))
+        npt.assert_allclose(gamma1_num, interior(gamma1), rtol=1e-3, atol=1e-4*np.max(np.abs(gamma1)))
+        npt.assert_allclose(gamma2_num, interior(gamma2), rtol=1e-3, atol=1e-4*np.max(np.abs(gamma2)))
+        npt.assert_allclose(mag_num, interior(mag), rtol=1e-4)
+
+    def test_lensing_weights(self):
+        bornLens = BornLens()
+        D_k, w_k, w_kk = bornLens.lensing_weights([0.3, 0.7], self.z_source)
+        cosmo = bornLens.cosmo
+        npt.assert_almost_equal(D_k[1], cosmo.D_xy(0, 0.7), decimal=8)
+        npt.assert_almost_equal(w_k[1], cosmo.D_xy(0.7, self.z_source) / cosmo.D_xy(0, self.z_source), decimal=10)
+        npt.assert_almost_equal(w_kk, D_k * w_k, decimal=10)
+
+    def test_shape(self):
+        x, y = utils.make_grid(10, 0.1)
+        x, y = utils.array2image(x), utils.array2image(y)
+        beta_x, beta_y, kappa, gamma1, gamma2, mag = BornLens().all(self.lensAssembly, self.z_source, x, y)
+        assert beta_x.shape == (10, 10)
+        assert kappa.shape == (10, 10)
+
+    def test_truncation(self):
+        lensAssembly = LensAssembly()
+        kwargs_list = [(0.3, 'NFW', {'rho_s': 10**15, 'Rs': 0.1, 'pos_x': 0.5, 'pos_y': -0.2}),
+                       (0.5, 'SIS', {'sigma_v': 250*1000., 'pos_x': -0.3, 'pos_y': 0.4}),
+                       (0.7, 'NFW', {'rho_s': 5*10**14, 'Rs': 0.2, 'pos_x': 3., 'pos_y': 1.}),
+                       (0.9, 'SIS', {'sigma_v': 150*1000., 'pos_x': 1., 'pos_y': 1.})]
+        for z, lens_type, kwargs in kwargs_list:
+            lensObject = LensObject(redshift=z, type=lens_type, r_trunc=0.01)
+            lensObject.add_info('kwargs_profile', kwargs)
+            lensAssembly.add_lens(lensObject)
+        bornLens = BornLens()
+        x, y = np.ravel(self.x), np.ravel(self.y)
+        # Born approximation evaluated lens by lens
+        D_k, w_k, w_kk = bornLens.lensing_weights(lensAssembly.redshift_array, self.z_source)
+        alpha_x, alpha_y, kappa = np.zeros_like(x), np.zeros_like(x), np.zeros_like(x)
+        for lensObject, D, w, ww in zip(lensAssembly.object_array, D_k, w_k, w_kk):
+            a_x, a_y = lensObject.deflection(D*x, D*y)
+            f_xx, f_yy, f_xy = lensObject.distortion(D*x, D*y)
+            alpha_x += w*a_x
+            alpha_y += w*a_y
+            kappa += ww*(f_xx + f_yy)/2.
+        beta_x, beta_y, kappa_, _, _, _ = bornLens.all(lensAssembly, self.z_source, x, y)
+        npt.assert_allclose(beta_x, x - alpha_x, rtol=1e-10, atol=1e-16)
+        npt.assert_allclose(beta_y, y - alpha_y, rtol=1e-10, atol=1e-16)
+        npt.assert_allclose(kappa_, kappa, rtol=1e-10, atol=1e-16)
+        # the 'born' tier of the tiered full ray-tracing
+        beta_x_, beta_y_ = MultiLens().full_ray_tracing(lensAssembly, self.z_source, x, y, observer_frame=False,
+                                                        tiered=True)
+        npt.assert_allclose(beta_x_, x - alpha_x, rtol=1e-10, atol=1e-16)
+        npt.assert_allclose(beta_y_, y - alpha_y, rtol=1e-10, atol=1e-16)
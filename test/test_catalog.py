@@ -0,0 +1,109 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for `catalog` module.
+"""
+
+import os
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from MultiLens.catalog import CatalogReader
+from MultiLens.lens_object import LensObject
+from MultiLens.Profiles.nfw import NFW
+from MultiLens.Profiles.point_mass import PointMass
+from MultiLens.Utils.halo_param import HaloParam
+import MultiLens.Utils.constants as const
+
+
+class TestCatalogReader(object):
+
+    def setup_method(self):
+        np.random.seed(7)
+        n = 1000
+        self.columns = {'mass': 10**np.random.uniform(10, 14, n), 'redshift': np.random.uniform(0.05, 2., n),
+                        'pos_x': np.random.uniform(-100, 100, n), 'pos_y': np.random.uniform(-100, 100, n)}
+        self.z_range = (0.2, 1.2)
+        self.footprint = (-50, 20, -30, 60)
+        columns = self.columns
+        self.selected = ((columns['redshift'] >= 0.2) & (columns['redshift'] <= 1.2) & (columns['pos_x'] >= -50) &
+                         (columns['pos_x'] <= 20) & (columns['pos_y'] >= -30) & (columns['pos_y'] <= 60))
+
+    def _write(self, tmpdir, format):
+        filename = os.path.join(str(tmpdir), 'catalog.' + format)
+        names = ['mass', 'redshift', 'pos_x', 'pos_y']
+        if format == 'npy':
+            table = np.zeros(len(self.columns['mass']), dtype=[(name, float) for name in names])
+            for name in names:
+                table[name] = self.columns[name]
+            np.save(filename, table)
+        elif format == 'npz':
+            np.savez_compressed(filename, **self.columns)
+        elif format == 'hdf5':
+            h5py = pytest.importorskip('h5py')
+            with h5py.File(filename, 'w') as f:
+                group = f.create_group('halos')
+                for name in names:
+                    group.create_dataset(name, data=self.columns[name])
+        else:
+            table = np.column_stack([self.columns[name] for name in names])
+            np.savetxt(filename, table, delimiter=',', header=','.join(names), comments='', fmt='%.17g')
+        return filename
+
+    @pytest.mark.parametrize('format', ['npy', 'npz', 'hdf5', 'csv'])
+    def test_formats(self, tmpdir, format):
+        filename = self._write(tmpdir, format)
+        key = 'halos' if format == 'hdf5' else None
+        reader = CatalogReader(filename, chunk_size=64, z_range=self.z_range, footprint=self.footprint, key=key)
+        chunks = list(reader)
+        assert max(len(chunk['mass']) for chunk in chunks) <= 64
+        for name in self.columns:
+            npt.assert_allclose(np.concatenate([chunk[name] for chunk in chunks]),
+                                self.columns[name][self.selected], rtol=1e-15)
+
+    def test_load(self, tmpdir):
+        filename = self._write(tmpdir, 'npz')
+        lensAssembly = CatalogReader(filename, chunk_size=100, z_range=self.z_range,
+                                     footprint=self.footprint).load(type='NFW')
+        assert len(lensAssembly.object_array) == np.sum(self.selected)
+        i = np.argmin(self.columns['redshift'][self.selected])
+        mass, z, pos_x, pos_y = [self.columns[name][self.selected][i] for name in
+                                 ['mass', 'redshift', 'pos_x', 'pos_y']]
+        r200, rho_s, Rs, c = HaloParam().profileMain(mass, z)
+        lensObject = LensObject(redshift=z, type='NFW')
+        lensObject.add_info('kwargs_profile', {'rho_s': rho_s*0.7**2, 'Rs': Rs/0.7, 'pos_x': pos_x, 'pos_y': pos_y})
+        lensObject_ = lensAssembly.object_array[0]
+        assert lensObject_.redshift == z
+        x, y = np.array([0.01, -0.02]), np.array([0.003, 0.01])
+        npt.assert_allclose(lensObject_.deflection(x, y), lensObject.deflection(x, y), rtol=1e-12)
+        npt.assert_almost_equal(lensObject_.position(), (pos_x*const.arcsec, pos_y*const.arcsec), decimal=16)
+
+    def test_kwargs_profile(self):
+        haloParam = HaloParam()
+        mass, z = np.array([10**12, 10**13]), np.array([0.3, 0.8])
+        kwargs = haloParam.kwargs_profile(mass, z, type='SIS')
+        # the SIS has the mass M within r200, M(<r) = 2 sigma_v^2 r / G
+        r200 = haloParam.r200_M(mass, z)
+        npt.assert_allclose(2*kwargs['sigma_v']**2*r200*const.Mpc/const.G/const.M_sun, mass, rtol=1e-12)
+        # the point masses are converted from M_sun/h to M_sun
+        npt.assert_allclose(haloParam.kwargs_profile(mass, z, type='point_mass')['mass'], mass/0.7, rtol=1e-15)
+        npt.assert_allclose(haloParam.kwargs_profile(mass, z, type='point_mass', h=0.65)['mass'], mass/0.65,
+                            rtol=1e-15)
+        # the projected mass of the NFW profile within r200 (physical Mpc) relative to the point mass of the same halo
+        r200, c = r200/0.7, haloParam.c_M_z(mass, z)
+        kwargs = haloParam.kwargs_profile(mass, z, type='NFW')
+        alpha = NFW().derivative(r200, 0*r200, kwargs['rho_s'], kwargs['Rs'], 0, 0)[0]
+        alpha_ = PointMass().derivative(r200, 0*r200, mass/0.7, 0, 0)[0]
+        ratio = (np.log(c/2) + np.arccos(1/c)/np.sqrt(c**2 - 1))/(np.log(1 + c) - c/(1 + c))
+        npt.assert_allclose(alpha/alpha_, ratio, rtol=1e-8)
+        with pytest.raises(ValueError):
+            haloParam.kwargs_profile(mass, z, type='gaussian')
+
+    def test_raise(self, tmpdir):
+        with pytest.raises(ValueError):
+            CatalogReader(os.path.join(str(tmpdir), 'catalog.fits'))
+        filename = self._write(tmpdir, 'npz')
+        with pytest.raises(ValueError):
+            list(CatalogReader(filename, columns={'mass': 'm200'}))
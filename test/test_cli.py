@@ -0,0 +1,107 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for `cli` module.
+"""
+
+import json
+import os
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from MultiLens.Cosmo.cosmo import get_cosmo
+from MultiLens.MultiLens import MultiLens
+from MultiLens.lens_assembly import LensAssembly
+from MultiLens.lens_object import LensObject
+from MultiLens.ray_set import RaySet
+import MultiLens.cli as cli
+import MultiLens.persistence as persistence
+
+
+class TestCli(object):
+
+    def setup_method(self):
+        self.lensAssembly = LensAssembly()
+        lensObject = LensObject(redshift=0.5, type='SIS', main=True)
+        lensObject.add_info('kwargs_profile', {'sigma_v': 200*1000., 'pos_x': 0.05, 'pos_y': 0.03})
+        self.lensAssembly.add_lens(lensObject)
+        lensObject = LensObject(redshift=0.3, type='point_mass')
+        lensObject.add_info('kwargs_profile', {'mass': 10**10, 'pos_x': 1., 'pos_y': -0.5})
+        self.lensAssembly.add_lens(lensObject)
+
+    def _job(self, tmpdir):
+        filename = os.path.join(str(tmpdir), 'assembly.npz')
+        persistence.save_assembly(self.lensAssembly, filename)
+        return {'assembly': filename, 'grid': {'num_pix': 10, 'delta_pix': 0.1}, 'z_source': [1.0, 1.5],
+                'output': os.path.join(str(tmpdir), 'out'), 'tile_size': 4}
+
+    def test_run(self, tmpdir):
+        job = self._job(tmpdir)
+        stats = cli.run(job, verbose=False)
+        assert stats['tiles'] == 6
+        assert stats['rays'] == 200
+        rays = RaySet.grid(10, 0.1)
+        multiLens = MultiLens()
+        for source, z_source in enumerate(job['z_source']):
+            beta_x, beta_y = multiLens.full_ray_tracing(self.lensAssembly, z_source, rays)
+            maps = persistence.open_maps(cli.map_path(job, 0, source))
+            npt.assert_almost_equal(maps['beta_x'], beta_x.reshape(10, 10), decimal=12)
+            npt.assert_almost_equal(maps['beta_y'], beta_y.reshape(10, 10), decimal=12)
+
+    def test_cosmology(self, tmpdir):
+        lensObject = LensObject(redshift=0.5, type='point_mass')
+        lensObject.add_info('kwargs_profile', {'mass': 10**10, 'pos_x': -0.3, 'pos_y': 0.2})
+        self.lensAssembly.add_lens(lensObject)
+        job = self._job(tmpdir)
+        job['cosmology'] = {'H0': 65, 'Om0': 0.25}
+        stats = cli.run(job, verbose=False)
+        # two lens planes (z = 0.3 and 0.5) in front of the sources
+        assert stats['ray_planes'] == 2*stats['rays']
+        cosmo = get_cosmo(H0=65, Om0=0.25)
+        lensAssembly = persistence.load_assembly(job['assembly'], cosmo=cosmo)
+        beta_x, beta_y = MultiLens(cosmo=cosmo).full_ray_tracing(lensAssembly, 1.5, RaySet.grid(10, 0.1))
+        beta_x_, beta_y_ = MultiLens().full_ray_tracing(self.lensAssembly, 1.5, RaySet.grid(10, 0.1))
+        assert not np.allclose(beta_x, beta_x_, rtol=1e-6, atol=0)
+        maps = persistence.open_maps(cli.map_path(job, 0, 1))
+        npt.assert_almost_equal(maps['beta_x'], beta_x.reshape(10, 10), decimal=12)
+        npt.assert_almost_equal(maps['beta_y'], beta_y.reshape(10, 10), decimal=12)
+
+    def test_resume(self, tmpdir):
+        job = self._job(tmpdir)
+        cli.run(job, verbose=False)
+        maps = persistence.open_maps(cli.map_path(job, 0, 1))
+        beta_x = maps['beta_x'].copy()
+        # an interrupted run: only the first tiles are recorded as completed
+        checkpoint_file = os.path.join(job['output'], 'checkpoint.json')
+        with open(checkpoint_file) as f:
+            checkpoint = json.load(f)
+        checkpoint['done'] = checkpoint['done'][:2]
+        with open(checkpoint_file, 'w') as f:
+            json.dump(checkpoint, f)
+        stats = cli.run(job, verbose=False)
+        assert stats['tiles'] == 4
+        assert stats['tiles_skipped'] == 2
+        maps = persistence.open_maps(cli.map_path(job, 0, 1))
+        npt.assert_almost_equal(maps['beta_x'], beta_x, decimal=16)
+        stats = cli.run(job, verbose=False)
+        assert stats['tiles'] == 0
+        job['grid']['num_pix'] = 12
+        with pytest.raises(ValueError):
+            cli.run(job, verbose=False)
+
+    def test_main(self, tmpdir):
+        job = self._job(tmpdir)
+        filename = os.path.join(str(tmpdir), 'job.json')
+        with open(filename, 'w') as f:
+            json.dump(job, f)
+        assert cli.main([filename, '--quiet', '--processes', '2']) == 0
+        assert os.path.exists(os.path.join(job['output'], 'checkpoint.json'))
+
+    def test_raise(self):
+        with pytest.raises(ValueError):
+            cli.check_job({'assembly': 'a.npz', 'grid': {'num_pix': 10, 'delta_pix': 0.1}, 'z_source': 1,
+                           'output': 'out', 'method': 'exact'})
+        with pytest.raises(ValueError):
+            cli.check_job({'assembly': 'a.npz', 'grid': {'num_pix': 10}, 'z_source': 1, 'output': 'out'})
@@ -0,0 +1,93 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for `cosmo` module.
+"""
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from MultiLens.MultiLens import MultiLens
+from MultiLens.Cosmo.cosmo import CosmoBatch, cosmology_from_config, get_cosmo
+import MultiLens.Cosmo.pycosmo_config_planck2013 as planck2013
+from MultiLens.lens_assembly import LensAssembly
+from MultiLens.lens_object import LensObject
+import MultiLens.Utils.utils as utils
+
+
+class TestCosmoBatch(object):
+
+    def setup_method(self):
+        self.cosmoBatch = CosmoBatch(H0=[65, 70, 75], Om0=[0.25, 0.3, 0.35], Ob0=0.05)
+
+    def test_distances(self):
+        z = np.array([0.1, 0.5, 1.2, 3.])
+        chi = self.cosmoBatch.comoving_transverse_distance(z)
+        assert chi.shape == (3, 4)
+        for i in range(3):
+            cosmo = self.cosmoBatch[i]
+            npt.assert_allclose(chi[i], cosmo.cosmo.comoving_transverse_distance(z).value, rtol=1e-10)
+            npt.assert_allclose(self.cosmoBatch.D_xy(0.5, 1.2)[i, 0], cosmo.D_xy(0.5, 1.2), rtol=1e-10)
+            npt.assert_allclose(self.cosmoBatch.arcsec2phys(1., 0.5)[i, 0], cosmo.arcsec2phys(1., 0.5), rtol=1e-10)
+        assert self.cosmoBatch.D_xy(0, 0.5).shape == (3, 1)
+
+    def test_config(self):
+        kwargs = cosmology_from_config(planck2013)
+        assert kwargs['H0'] == planck2013.h * 100
+        cosmo = get_cosmo(**kwargs)
+        assert cosmo.Om0 == planck2013.omega_m
+
+    def test_raise(self):
+        with pytest.raises(ValueError):
+            CosmoBatch(H0=np.ones((2, 2)) * 70)
+        with pytest.raises(ValueError):
+            self.cosmoBatch.cosmo
+
+
+class TestBatchTracing(object):
+
+    def setup_method(self):
+        self.lensAssembly = LensAssembly()
+        lensObject = LensObject(redshift=0.5, type='SIS', main=True)
+        lensObject.add_info('kwargs_profile', {'sigma_v': 200*1000., 'pos_x': 0.05, 'pos_y': 0.03})
+        self.lensAssembly.add_lens(lensObject)
+        for z, pos_x, pos_y in [(0.3, 0.4, -0.3), (0.8, -0.9, 0.6)]:
+            lensObject = LensObject(redshift=z, type='NFW')
+            lensObject.add_info('kwargs_profile', {'rho_s': 10**15, 'Rs': 0.05, 'pos_x': pos_x, 'pos_y': pos_y})
+            self.lensAssembly.add_lens(lensObject)
+        self.cosmoBatch = CosmoBatch(H0=[65, 70, 75], Om0=[0.25, 0.3, 0.35], Ob0=0.05)
+        self.x, self.y = utils.make_grid(10, 0.2)
+
+    def _compare(self, method, **kwargs):
+        beta_x, beta_y = getattr(MultiLens(cosmo=self.cosmoBatch), method)(self.lensAssembly, 1.5, self.x, self.y,
+                                                                          **kwargs)
+        assert beta_x.shape == (3, len(self.x))
+        for i in range(3):
+            multiLens = MultiLens(cosmo=self.cosmoBatch[i])
+            beta_x_, beta_y_ = getattr(multiLens, method)(self.lensAssembly, 1.5, self.x, self.y, **kwargs)
+            npt.assert_allclose(beta_x[i], beta_x_, rtol=1e-8, atol=1e-16)
+            npt.assert_allclose(beta_y[i], beta_y_, rtol=1e-8, atol=1e-16)
+
+    def test_tracers(self):
+        self._compare('full_ray_tracing')
+        self._compare('full_ray_tracing', observer_frame=False)
+        self._compare('combined_ray_tracing')
+        self._compare('born_ray_tracing')
+        self._compare('analytic_mapping')
+
+    def test_shape(self):
+        multiLens = MultiLens(cosmo=self.cosmoBatch)
+        x, y = utils.array2image(self.x), utils.array2image(self.y)
+        beta_x, beta_y = multiLens.full_ray_tracing(self.lensAssembly, 1.5, x, y)
+        assert beta_x.shape == (3, 10, 10)
+        gamma_A, gamma_BC = multiLens.analytic_matrices(self.lensAssembly, 1.5)
+        gamma_A_, gamma_BC_ = MultiLens(cosmo=self.cosmoBatch[1]).analytic_matrices(self.lensAssembly, 1.5)
+        npt.assert_allclose(gamma_BC[:, :, 1, 0], gamma_BC_, rtol=1e-8)
+
+    def test_raise(self):
+        multiLens = MultiLens(cosmo=self.cosmoBatch)
+        with pytest.raises(ValueError):
+            multiLens.full_ray_tracing(self.lensAssembly, 1.5, self.x, self.y, n_slabs=5)
+        with pytest.raises(ValueError):
+            multiLens.full_ray_tracing_gradient(self.lensAssembly, 1.5, self.x, self.y)
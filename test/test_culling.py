@@ -0,0 +1,101 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for truncated lens objects and the culling of the full ray-tracing.
+"""
+
+import numpy as np
+import numpy.testing as npt
+
+from MultiLens.MultiLens import MultiLens
+from MultiLens.lens_assembly import LensAssembly
+from MultiLens.lens_object import LensObject
+import MultiLens.Utils.constants as const
+import MultiLens.Utils.utils as utils
+
+
+class TestTruncation(object):
+
+    def test_deflection(self):
+        for lens_type, kwargs in [('NFW', {'rho_s': 10**15, 'Rs': 0.1}), ('SIS', {'sigma_v': 200*1000.}),
+                                  ('point_mass', {'mass': 10**11})]:
+            kwargs.update({'pos_x': 0.01, 'pos_y': 0.})
+            lensObject = LensObject(redshift=0.5, type=lens_type, observer_frame=False, r_trunc=0.05)
+            lensObject.add_info('kwargs_profile', dict(kwargs))
+            lensObject_full = LensObject(redshift=0.5, type=lens_type, observer_frame=False)
+            lensObject_full.add_info('kwargs_profile', dict(kwargs))
+            x, y = np.array([0.02, 0.0599, 0.0601, 0.3]), np.zeros(4)
+            f_x, f_y = lensObject._derivative(x, y)
+            f_x_full, f_y_full = lensObject_full._derivative(x, y)
+            npt.assert_almost_equal(f_x[:2], f_x_full[:2], decimal=16)
+            # continuous at the truncation radius and point mass like outside
+            npt.assert_allclose(f_x[2], f_x[1], rtol=1e-2)
+            npt.assert_allclose(f_x[3], f_x[2] * 0.0501 / 0.29, rtol=1e-12)
+            npt.assert_allclose(lensObject._derivative(0.3, 0.)[0], f_x[3], rtol=1e-12)
+
+
+class TestCulling(object):
+
+    def setup_method(self):
+        random = np.random.RandomState(1)
+        self.lensAssembly = LensAssembly()
+        lensObject = LensObject(redshift=0.5, type='SIS', main=True)
+        lensObject.add_info('kwargs_profile', {'sigma_v': 250*1000., 'pos_x': 0.05, 'pos_y': 0.03})
+        lens_list = [lensObject]
+        for i in range(200):
+            z = [0.3, 0.7, 1.0][i % 3]
+            lensObject = LensObject(redshift=z, type='NFW', r_trunc=0.02)
+            pos_x, pos_y = random.uniform(-40, 40, 2)
+            lensObject.add_info('kwargs_profile', {'rho_s': 10**15, 'Rs': 0.005, 'pos_x': pos_x, 'pos_y': pos_y})
+            lens_list.append(lensObject)
+        self.lensAssembly.add_lenses(lens_list)
+        self.x, self.y = utils.make_grid(20, 0.1)
+        self.multiLens = MultiLens()
+
+    def test_culling(self):
+        beta_x, beta_y = self.multiLens.full_ray_tracing(self.lensAssembly, 1.5, self.x, self.y)
+        beta_x_, beta_y_ = self.multiLens.full_ray_tracing(self.lensAssembly, 1.5, self.x, self.y,
+                                                           cull_tolerance=10**-5)
+        error = np.sqrt((beta_x_ - beta_x)**2 + (beta_y_ - beta_y)**2) / const.arcsec
+        assert np.max(error) < 10**-3
+        assert np.max(np.sqrt((beta_x - self.x)**2 + (beta_y - self.y)**2)) / const.arcsec > 0.1
+
+    def test_culled_lenses(self):
+        lens_list = self.lensAssembly.planes()[0][1]
+        x_k, y_k = self.x * 1000., self.y * 1000.
+        exact, alpha_x, alpha_y = self.multiLens._cull(lens_list, x_k, y_k, 10**-5 * const.arcsec)
+        assert len(exact) < len(lens_list) / 2
+        alpha_x_exact, alpha_y_exact = 0, 0
+        for lensObject in lens_list:
+            if lensObject not in exact:
+                z = lensObject.redshift
+                a_x, a_y = lensObject.deflection(x_k / (1 + z), y_k / (1 + z))
+                alpha_x_exact += a_x
+                alpha_y_exact += a_y
+        npt.assert_allclose(alpha_x, alpha_x_exact, atol=10**-5 * const.arcsec * len(lens_list))
+        npt.assert_allclose(alpha_y, alpha_y_exact, atol=10**-5 * const.arcsec * len(lens_list))
+
+    def test_culling_plane(self):
+        self.multiLens.full_ray_tracing(self.lensAssembly, 1.5, self.x, self.y)
+        z, lens_list = self.lensAssembly.planes()[0]
+        plane = self.lensAssembly._culling_columns(self.lensAssembly._culling_plane(z))
+        assert len(plane['truncated']) == len(lens_list)
+        # the index and the columns are cached until the assembly or the parameters change
+        assert self.lensAssembly._culling_plane(z) is plane
+        assert self.lensAssembly._culling_columns(plane)['pos_x'] is plane['pos_x']
+        chi = self.multiLens.cosmo.comoving_transverse_distance(z)
+        x_k, y_k = self.x * chi, self.y * chi
+        tolerance = 10**-5 * const.arcsec
+        exact, alpha_x, alpha_y = self.multiLens._cull(lens_list, x_k, y_k, tolerance)
+        exact_, alpha_x_, alpha_y_ = self.multiLens._cull(lens_list, x_k, y_k, tolerance, plane=plane)
+        assert exact_ == exact
+        npt.assert_allclose(alpha_x_, alpha_x, rtol=1e-12)
+        npt.assert_allclose(alpha_y_, alpha_y, rtol=1e-12)
+        # only the lenses near the bundle are returned by the index
+        x_min, x_max = np.min(self.x) / const.arcsec, np.max(self.x) / const.arcsec
+        assert len(plane['index'].query_box(x_min - 1, x_max + 1, x_min - 1, x_max + 1)) < len(lens_list) / 10
+        lensObject = lens_list[0]
+        lensObject.update_params(rho_s=2*10**15)
+        assert self.lensAssembly._culling_columns(plane)['monopole'][0] == lensObject.monopole()
+        lensObject.set_truncation(0.03)
+        assert self.lensAssembly._culling_plane(z) is not plane
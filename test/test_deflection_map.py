@@ -0,0 +1,166 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for `deflection_map` module.
+"""
+
+import os
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from MultiLens.Cosmo.cosmo import get_cosmo
+from MultiLens.MultiLens import MultiLens
+from MultiLens.born import BornLens
+from MultiLens.lens_assembly import LensAssembly
+from MultiLens.lens_object import LensObject, freeze
+from MultiLens.Profiles.deflection_map import DeflectionMap
+import MultiLens.persistence as persistence
+import MultiLens.Utils.constants as const
+import MultiLens.Utils.utils as utils
+
+
+class TestDeflectionMap(object):
+
+    def setup_method(self):
+        self.lens_list = []
+        for rho_s, Rs, pos_x, pos_y in [(10**15, 0.05, 0.3, -0.2), (10**15, 0.02, -1.1, 0.7), (10**14, 0.1, 0.8, 1.3)]:
+            lensObject = LensObject(redshift=0.5, type='NFW')
+            lensObject.add_info('kwargs_profile', {'rho_s': rho_s, 'Rs': Rs, 'pos_x': pos_x, 'pos_y': pos_y})
+            self.lens_list.append(lensObject)
+        x, y = utils.make_grid(30, 0.1)
+        self.x = x * self.lens_list[0].cosmo.D_xy(0, 0.5)
+        self.y = y * self.lens_list[0].cosmo.D_xy(0, 0.5)
+
+    def _exact(self, x, y):
+        f_x, f_y = np.zeros_like(x), np.zeros_like(y)
+        for lensObject in self.lens_list:
+            d_x, d_y = lensObject.deflection(x, y)
+            f_x += d_x
+            f_y += d_y
+        return f_x, f_y
+
+    def test_interpolation(self):
+        f_x, f_y = self._exact(self.x, self.y)
+        for order in [1, 3]:
+            lensObject = freeze(self.lens_list, 2., num_pix=101, order=order)
+            d_x, d_y = lensObject.deflection(self.x, self.y)
+            error = np.max(np.sqrt((d_x - f_x)**2 + (d_y - f_y)**2))
+            assert error < 2 * lensObject.func.error['max']
+            assert error < 0.01 * const.arcsec
+        lensObject_1 = freeze(self.lens_list, 2., num_pix=51, order=1)
+        lensObject_3 = freeze(self.lens_list, 2., num_pix=51, order=3)
+        assert lensObject_3.func.error['rms'] < lensObject_1.func.error['rms']
+
+    def test_hessian(self):
+        f_xx, f_yy, f_xy = np.zeros_like(self.x), np.zeros_like(self.x), np.zeros_like(self.x)
+        for lensObject in self.lens_list:
+            h_xx, h_yy, h_xy = lensObject.distortion(self.x, self.y)
+            f_xx += h_xx
+            f_yy += h_yy
+            f_xy += h_xy
+        lensObject = freeze(self.lens_list, 2., num_pix=101, order=3)
+        d_xx, d_yy, d_xy = lensObject.distortion(self.x, self.y)
+        npt.assert_allclose(d_xx + d_yy, f_xx + f_yy, rtol=0.05, atol=0.01)
+        npt.assert_allclose(d_xy, f_xy, rtol=0.05, atol=0.01)
+        lensObject = freeze(self.lens_list, 2., num_pix=101, order=3, hessian=False)
+        d_xx, d_yy, d_xy = lensObject.distortion(self.x, self.y)
+        npt.assert_allclose(d_xx + d_yy, f_xx + f_yy, rtol=0.1, atol=0.01)
+
+    def test_refinement(self):
+        tolerance = 0.0005
+        lensObject = freeze(self.lens_list, 2., num_pix=31, order=3)
+        assert len(lensObject.func.levels) == 1
+        assert lensObject.func.error['max'] > tolerance * const.arcsec
+        lensObject_refined = freeze(self.lens_list, 2., num_pix=31, order=3, tolerance=tolerance, max_levels=4)
+        assert len(lensObject_refined.func.levels) > 1
+        assert lensObject_refined.func.error['max'] < lensObject.func.error['max']
+
+    def test_outside(self):
+        lensObject = freeze(self.lens_list, 2., num_pix=51, order=3)
+        d_x, d_y = lensObject.deflection(np.array([0.5]), np.array([0.]))
+        assert np.all(np.isfinite(d_x))
+        assert d_x[0] > 0
+        d_x, d_y = lensObject.deflection(0.5, 0.)
+        assert isinstance(d_x, float)
+
+    def test_arrays(self, tmpdir):
+        deflectionMap = freeze(self.lens_list, 2., num_pix=51, order=3, tolerance=0.001).func
+        filename = os.path.join(str(tmpdir), 'map.npz')
+        deflectionMap.save(filename)
+        deflectionMap_ = DeflectionMap.load(filename)
+        assert deflectionMap_.error == deflectionMap.error
+        d_x, d_y = deflectionMap.derivative(self.x, self.y)
+        d_x_, d_y_ = deflectionMap_.derivative(self.x, self.y)
+        npt.assert_almost_equal(d_x_, d_x, decimal=16)
+        npt.assert_almost_equal(d_y_, d_y, decimal=16)
+
+    def test_cosmology(self):
+        cosmo = get_cosmo(H0=60, Om0=0.25)
+        for lensObject in self.lens_list:
+            lensObject.cosmo = cosmo
+        lensObject = freeze(self.lens_list, 2., center_x=0.5, num_pix=11)
+        assert lensObject.cosmo is cosmo
+        level = lensObject.func.levels[0]
+        npt.assert_allclose(level['x_min'], cosmo.arcsec2phys(-1.5, z=0.5), rtol=1e-12)
+        npt.assert_allclose(level['y_min'], cosmo.arcsec2phys(-2., z=0.5), rtol=1e-12)
+
+    def test_raise(self):
+        with pytest.raises(ValueError):
+            DeflectionMap(freeze(self.lens_list, 2., num_pix=11).func.levels, order=2)
+        lensObject = LensObject(redshift=0.7, type='SIS')
+        with pytest.raises(ValueError):
+            freeze(self.lens_list + [lensObject], 2.)
+
+
+class TestFreezePlane(object):
+
+    def setup_method(self):
+        self.lensAssembly = LensAssembly()
+        lensObject = LensObject(redshift=0.3, type='SIS', main=True)
+        lensObject.add_info('kwargs_profile', {'sigma_v': 200*1000., 'pos_x': 0.05, 'pos_y': 0.03})
+        self.lensAssembly.add_lens(lensObject)
+        for pos_x, pos_y in [(0.4, -0.3), (-0.9, 0.6), (1.5, 1.2)]:
+            lensObject = LensObject(redshift=0.6, type='NFW', observer_frame=False)
+            lensObject.add_info('kwargs_profile', {'rho_s': 10**15, 'Rs': 0.05, 'pos_x': pos_x * 0.006,
+                                                   'pos_y': pos_y * 0.006})
+            self.lensAssembly.add_lens(lensObject)
+        self.multiLens = MultiLens()
+        self.x, self.y = utils.make_grid(20, 0.1)
+        self.beta_x, self.beta_y = self.multiLens.full_ray_tracing(self.lensAssembly, 1.5, self.x, self.y)
+
+    def test_freeze_plane(self):
+        lens_id = self.lensAssembly.freeze_plane(0.6, 3., num_pix=101)
+        assert len(self.lensAssembly.object_array) == 2
+        lensObject = self.lensAssembly.get_lens(lens_id)
+        assert lensObject.type == 'deflection_map'
+        beta_x, beta_y = self.multiLens.full_ray_tracing(self.lensAssembly, 1.5, self.x, self.y)
+        npt.assert_allclose(beta_x, self.beta_x, atol=0.001 * const.arcsec)
+        npt.assert_allclose(beta_y, self.beta_y, atol=0.001 * const.arcsec)
+        with pytest.raises(ValueError):
+            self.lensAssembly.freeze_plane(0.7, 3.)
+
+    def test_born(self):
+        lensObject = LensObject(redshift=0.7, type='NFW', observer_frame=False)
+        lensObject.add_info('kwargs_profile', {'rho_s': 10**15, 'Rs': 0.05, 'pos_x': -0.004, 'pos_y': 0.002})
+        self.lensAssembly.add_lens(lensObject)
+        bornLens = BornLens()
+        beta_x, beta_y = bornLens.ray_shooting(self.lensAssembly, 1.5, self.x, self.y)
+        # two maps of the same type need to be evaluated each with its own profile
+        self.lensAssembly.freeze_plane(0.6, 3., num_pix=101)
+        self.lensAssembly.freeze_plane(0.7, 3., num_pix=101)
+        beta_x_, beta_y_ = bornLens.ray_shooting(self.lensAssembly, 1.5, self.x, self.y)
+        npt.assert_allclose(beta_x_, beta_x, atol=0.001 * const.arcsec)
+        npt.assert_allclose(beta_y_, beta_y, atol=0.001 * const.arcsec)
+
+    def test_persistence(self, tmpdir):
+        self.lensAssembly.freeze_plane(0.6, 3., num_pix=51)
+        beta_x, beta_y = self.multiLens.full_ray_tracing(self.lensAssembly, 1.5, self.x, self.y)
+        filename = os.path.join(str(tmpdir), 'assembly.npz')
+        persistence.save_assembly(self.lensAssembly, filename)
+        lensAssembly = persistence.load_assembly(filename)
+        assert [lensObject.type for lensObject in lensAssembly.object_array] == ['SIS', 'deflection_map']
+        beta_x_, beta_y_ = self.multiLens.full_ray_tracing(lensAssembly, 1.5, self.x, self.y)
+        npt.assert_almost_equal(beta_x_, beta_x, decimal=16)
+        npt.assert_almost_equal(beta_y_, beta_y, decimal=16)
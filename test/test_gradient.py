@@ -0,0 +1,111 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for `gradient` module.
+"""
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from MultiLens.MultiLens import MultiLens
+from MultiLens.lens_assembly import LensAssembly
+from MultiLens.lens_object import LensObject
+from MultiLens.Profiles.nfw import NFW
+from MultiLens.Profiles.point_mass import PointMass
+from MultiLens.Profiles.SIS import SIS
+import MultiLens.Utils.utils as utils
+
+
+def make_assembly(kwargs_list):
+    lensAssembly = LensAssembly()
+    lens_ids = []
+    for redshift, type, kwargs, observer_frame, r_trunc in kwargs_list:
+        lensObject = LensObject(redshift=redshift, type=type, observer_frame=observer_frame, r_trunc=r_trunc)
+        lensObject.add_info('kwargs_profile', dict(kwargs))
+        lens_ids.append(lensAssembly.add_lens(lensObject))
+    return lensAssembly, lens_ids
+
+
+class TestParamDerivative(object):
+
+    def _assert_derivative(self, func, kwargs, x, y):
+        derivatives = func.param_derivative(x, y, **kwargs)
+        for name, (d_x, d_y) in derivatives.items():
+            step = kwargs[name] * 1e-6
+            kwargs_plus, kwargs_minus = dict(kwargs), dict(kwargs)
+            kwargs_plus[name] += step
+            kwargs_minus[name] -= step
+            f_x_plus, f_y_plus = func.derivative(x, y, **kwargs_plus)
+            f_x_minus, f_y_minus = func.derivative(x, y, **kwargs_minus)
+            npt.assert_allclose(d_x, (f_x_plus - f_x_minus) / (2*step), rtol=1e-6)
+            npt.assert_allclose(d_y, (f_y_plus - f_y_minus) / (2*step), rtol=1e-6)
+
+    def test_profiles(self):
+        x, y = np.array([0.01, -0.2, 0.3]), np.array([0.02, 0.1, -0.05])
+        self._assert_derivative(SIS(), {'sigma_v': 200*1000., 'pos_x': 0.001, 'pos_y': 0.}, x, y)
+        self._assert_derivative(PointMass(), {'mass': 10**10, 'pos_x': 0.001, 'pos_y': 0.}, x, y)
+        self._assert_derivative(NFW(), {'rho_s': 10**15, 'Rs': 0.1, 'pos_x': 0.001, 'pos_y': 0.}, x, y)
+        self._assert_derivative(NFW(), {'rho_s': 10**15, 'Rs': 0.1, 'pos_x': 0.001, 'pos_y': 0.}, 0.05, 0.01)
+
+
+class TestGradientLens(object):
+
+    def setup_method(self):
+        self.kwargs_list = [
+            [0.5, 'SIS', {'sigma_v': 200*1000., 'pos_x': 0.2, 'pos_y': 0.3}, True, None],
+            [0.3, 'point_mass', {'mass': 10**11, 'pos_x': 1.2, 'pos_y': -0.7}, True, None],
+            [0.8, 'NFW', {'rho_s': 10**15, 'Rs': 0.1, 'pos_x': 0.001, 'pos_y': 0.002}, False, None],
+            [0.8, 'NFW', {'rho_s': 10**14, 'Rs': 0.05, 'pos_x': 3., 'pos_y': 2.}, True, 0.01],
+        ]
+        self.multiLens = MultiLens()
+        self.x, self.y = utils.make_grid(6, 0.5)
+
+    def _finite_difference(self, k, name, z_source):
+        step = abs(self.kwargs_list[k][2][name]) * 1e-5 or 1e-5
+        beta = []
+        for sign in [1, -1]:
+            kwargs_list = [list(kwargs) for kwargs in self.kwargs_list]
+            kwargs_list[k][2] = dict(kwargs_list[k][2])
+            kwargs_list[k][2][name] += sign*step
+            lensAssembly, _ = make_assembly(kwargs_list)
+            beta.append(self.multiLens.full_ray_tracing(lensAssembly, z_source, self.x, self.y))
+        return (beta[0][0] - beta[1][0]) / (2*step), (beta[0][1] - beta[1][1]) / (2*step)
+
+    def test_gradient(self):
+        lensAssembly, lens_ids = make_assembly(self.kwargs_list)
+        z_source = 1.5
+        beta_x, beta_y, d_beta_x, d_beta_y = self.multiLens.full_ray_tracing_gradient(lensAssembly, z_source,
+                                                                                       self.x, self.y)
+        beta_x_, beta_y_ = self.multiLens.full_ray_tracing(make_assembly(self.kwargs_list)[0], z_source, self.x, self.y)
+        npt.assert_almost_equal(beta_x, beta_x_, decimal=14)
+        npt.assert_almost_equal(beta_y, beta_y_, decimal=14)
+        params = self.multiLens.gradientLens.parameters(lensAssembly)
+        assert len(params) == 14
+        assert d_beta_x.shape == (14, len(self.x))
+        for row, (lens_id, name) in enumerate(params):
+            fd_x, fd_y = self._finite_difference(lens_ids.index(lens_id), name, z_source)
+            scale = np.max(np.abs(fd_x)) + np.max(np.abs(fd_y)) + 1e-30
+            npt.assert_allclose(d_beta_x[row] / scale, fd_x / scale, atol=1e-5)
+            npt.assert_allclose(d_beta_y[row] / scale, fd_y / scale, atol=1e-5)
+
+    def test_params(self):
+        lensAssembly, lens_ids = make_assembly(self.kwargs_list)
+        lens_id = lens_ids[1]
+        beta_x, beta_y, d_beta_x, d_beta_y = self.multiLens.full_ray_tracing_gradient(
+            lensAssembly, 1.5, self.x, self.y, params=[(lens_id, 'mass')])
+        assert d_beta_x.shape == (1, len(self.x))
+        with pytest.raises(ValueError):
+            self.multiLens.full_ray_tracing_gradient(lensAssembly, 1.5, self.x, self.y, params=[(lens_id, 'Rs')])
+
+    def test_adjoint(self):
+        lensAssembly, lens_ids = make_assembly(self.kwargs_list)
+        np.random.seed(41)
+        v_x, v_y = np.random.normal(size=len(self.x)), np.random.normal(size=len(self.x))
+        beta_x, beta_y, d_beta_x, d_beta_y = self.multiLens.full_ray_tracing_gradient(lensAssembly, 1.5, self.x,
+                                                                                       self.y)
+        beta_x_, beta_y_, grad = self.multiLens.full_ray_tracing_adjoint(lensAssembly, 1.5, self.x, self.y, v_x, v_y)
+        npt.assert_almost_equal(beta_x_, beta_x, decimal=16)
+        npt.assert_almost_equal(beta_y_, beta_y, decimal=16)
+        grad_forward = np.dot(d_beta_x, v_x) + np.dot(d_beta_y, v_y)
+        npt.assert_allclose(grad, grad_forward, rtol=1e-8, atol=0)
@@ -0,0 +1,51 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for `image_formation` module.
+"""
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from MultiLens.image_formation import ImageFormation
+
+
+class TestImageFormation(object):
+
+    def setup_method(self):
+        np.random.seed(41)
+        self.kernel = np.random.rand(5, 7)
+        self.imageFormation = ImageFormation(kernel=self.kernel, supersampling_factor=3)
+
+    def _convolve_direct(self, image):
+        kernel = self.kernel / np.sum(self.kernel)
+        k_y, k_x = kernel.shape
+        ny, nx = image.shape
+        full = np.zeros((ny + k_y - 1, nx + k_x - 1))
+        for i in range(k_y):
+            for j in range(k_x):
+                full[i:i+ny, j:j+nx] += kernel[i, j] * image
+        return full[(k_y - 1)//2:(k_y - 1)//2 + ny, (k_x - 1)//2:(k_x - 1)//2 + nx]
+
+    def test_image(self):
+        flux = np.random.rand(24*3*24*3)
+        image = self.imageFormation.image(flux)
+        assert image.shape == (24, 24)
+        image_low = flux.reshape(24, 3, 24, 3).mean(axis=(1, 3))
+        npt.assert_almost_equal(image, self._convolve_direct(image_low), decimal=12)
+
+    def test_batch_rectangular(self):
+        flux = np.random.rand(4, 18*3*12*3)
+        images = self.imageFormation.image(flux, numPix_x=12*3, numPix_y=18*3)
+        assert images.shape == (4, 18, 12)
+        image_low = flux[2].reshape(18, 3, 12, 3).mean(axis=(1, 3))
+        npt.assert_almost_equal(images[2], self._convolve_direct(image_low), decimal=12)
+        self.imageFormation.image(flux, numPix_x=12*3, numPix_y=18*3)
+        assert len(self.imageFormation._fft_cache) == 1
+
+    def test_raise(self):
+        with pytest.raises(ValueError):
+            self.imageFormation.downsample(np.ones((10, 10)))
+        with pytest.raises(ValueError):
+            ImageFormation(supersampling_factor=0)
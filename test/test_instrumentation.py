@@ -0,0 +1,57 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for `instrumentation` module.
+"""
+
+import numpy.testing as npt
+
+from MultiLens.MultiLens import MultiLens
+from MultiLens.numerics import Numerics
+from MultiLens.lens_assembly import LensAssembly
+from MultiLens.lens_object import LensObject
+from MultiLens.Utils.instrumentation import Instrumentation
+import MultiLens.Utils.utils as utils
+
+
+class TestInstrumentation(object):
+
+    def setup_method(self):
+        self.lensAssembly = LensAssembly()
+        lensObject = LensObject(redshift=0.5, type='SIS', main=True)
+        lensObject.add_info('kwargs_profile', {'sigma_v': 200*1000., 'pos_x': 0., 'pos_y': 0.})
+        self.lensAssembly.add_lens(lensObject)
+        lensObject = LensObject(redshift=0.3, type='point_mass')
+        lensObject.add_info('kwargs_profile', {'mass': 10**10, 'pos_x': 1., 'pos_y': -0.5})
+        self.lensAssembly.add_lens(lensObject)
+        self.x, self.y = utils.make_grid(20, 0.1)
+
+    def test_report(self):
+        instrumentation = Instrumentation(track_memory=True)
+        events = []
+        instrumentation.add_callback(events.append)
+        multiLens = MultiLens(instrumentation=instrumentation)
+        beta_x, beta_y = multiLens.full_ray_tracing(self.lensAssembly, 1.5, self.x, self.y)
+        report = instrumentation.report()
+        assert report['sections']['deflection']['calls'] == 4
+        assert report['sections']['deflection']['rays'] == 2*400 + 2*2
+        assert report['sections']['observer_frame']['calls'] == 1
+        assert report['profiles']['SIS']['calls'] == 2
+        assert report['planes'][1]['rays'] == 400 + 2
+        assert report['sections']['observer_frame']['memory'] > 0
+        assert len(events) == sum(entry['calls'] for entry in report['sections'].values())
+
+        multiLens.set_instrumentation(None)
+        beta_x_, beta_y_ = multiLens.full_ray_tracing(self.lensAssembly, 1.5, self.x, self.y)
+        npt.assert_almost_equal(beta_x_, beta_x, decimal=16)
+        assert instrumentation.report()['sections']['deflection']['calls'] == 4
+
+    def test_numerics(self):
+        instrumentation = Instrumentation()
+        numerics = Numerics(tile_size=5, instrumentation=instrumentation)
+        multiLens = MultiLens()
+        beta_x, beta_y = multiLens.full_ray_tracing(self.lensAssembly, 1.5, self.x, self.y)
+        numerics.all(beta_x, beta_y, self.x, self.y)
+        report = instrumentation.report()
+        assert report['sections']['differentials']['calls'] == 4
+        assert report['sections']['differentials']['rays'] == 18*18
@@ -0,0 +1,127 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for `lens_assembly` module.
+"""
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from MultiLens.MultiLens import MultiLens
+from MultiLens.lens_assembly import LensAssembly
+from MultiLens.lens_object import LensObject
+import MultiLens.Utils.constants as const
+import MultiLens.Utils.utils as utils
+
+
+def _point_mass(redshift, pos_x=0., pos_y=0.):
+    lensObject = LensObject(redshift=redshift, type='point_mass')
+    lensObject.add_info('kwargs_profile', {'mass': 10**10, 'pos_x': pos_x, 'pos_y': pos_y})
+    return lensObject
+
+
+class TestLensAssembly(object):
+
+    def setup_method(self):
+        self.redshifts = [0.5, 0.2, 0.8, 0.2, 0.3]
+        self.lenses = [_point_mass(z, pos_x=i) for i, z in enumerate(self.redshifts)]
+
+    def test_add_lens_sorted_stable(self):
+        lensAssembly = LensAssembly()
+        lens_ids = [lensAssembly.add_lens(lensObject) for lensObject in self.lenses]
+        assert lensAssembly.redshift_array == sorted(self.redshifts)
+        # lenses at equal redshift keep the order in which they were added
+        assert lensAssembly.object_array[0] is self.lenses[1]
+        assert lensAssembly.object_array[1] is self.lenses[3]
+        assert lensAssembly.get_lens(lens_ids[2]) is self.lenses[2]
+
+    def test_add_lenses(self):
+        lensAssembly = LensAssembly()
+        lensAssembly.add_lens(self.lenses[0])
+        lens_ids = lensAssembly.add_lenses(self.lenses[1:])
+        lensAssembly_single = LensAssembly()
+        for lensObject in self.lenses:
+            lensAssembly_single.add_lens(lensObject)
+        assert lens_ids == [1, 2, 3, 4]
+        assert lensAssembly.object_array == lensAssembly_single.object_array
+        assert lensAssembly.lens_ids == lensAssembly_single.lens_ids
+
+    def test_remove_lens(self):
+        lensAssembly = LensAssembly()
+        lens_ids = lensAssembly.add_lenses(self.lenses)
+        lensAssembly.remove_lens(0.2)
+        assert lensAssembly.redshift_array == [0.3, 0.5, 0.8]
+        lensAssembly.remove_lens(0.4)
+        assert len(lensAssembly.object_array) == 3
+        lensAssembly.remove_lens_id(lens_ids[0])
+        assert lensAssembly.redshift_array == [0.3, 0.8]
+        assert lensAssembly.object_array == [self.lenses[4], self.lenses[2]]
+        with pytest.raises(ValueError):
+            lensAssembly.remove_lens_id(lens_ids[0])
+
+    def test_visible_positions(self):
+        lensAssembly = LensAssembly()
+        lensAssembly.add_lenses(self.lenses)
+        pos_x, pos_y = lensAssembly.get_visible_positions()
+        npt.assert_almost_equal(pos_x / const.arcsec, [1, 3, 4, 0, 2], decimal=8)
+        npt.assert_almost_equal(lensAssembly.redshifts, sorted(self.redshifts), decimal=16)
+        assert not pos_x.flags.writeable
+        # columns are updated when the lens parameters change
+        self.lenses[1].add_info('kwargs_profile', {'mass': 10**10, 'pos_x': 0., 'pos_y': 1.})
+        pos_x, pos_y = lensAssembly.get_visible_positions()
+        assert pos_x[0] == 0
+        assert pos_y[0] > 0
+        pos_x_, pos_y_ = lensAssembly.get_visible_positions()
+        assert pos_x_ is pos_x
+
+    def test_tracing_unchanged(self):
+        lensAssembly = LensAssembly()
+        lensAssembly.add_lenses(self.lenses)
+        x, y = utils.make_grid(10, 0.1)
+        multiLens = MultiLens()
+        pos_x, pos_y = lensAssembly.get_visible_positions()
+        pos_x_copy = pos_x.copy()
+        beta_x, beta_y = multiLens.full_ray_tracing(lensAssembly, 1.5, x, y)
+        npt.assert_almost_equal(pos_x, pos_x_copy, decimal=16)
+        assert np.all(np.isfinite(beta_x))
+
+    def test_planes(self):
+        lensAssembly = LensAssembly()
+        lensAssembly.add_lenses(self.lenses)
+        planes = lensAssembly.planes()
+        assert [z for z, lens_list in planes] == [0.2, 0.3, 0.5, 0.8]
+        assert planes[0][1] == [self.lenses[1], self.lenses[3]]
+
+
+class TestPlaneGrouping(object):
+
+    def setup_method(self):
+        self.x, self.y = utils.make_grid(10, 0.1)
+        self.multiLens = MultiLens()
+
+    def test_grouped_plane(self):
+        lensAssembly = LensAssembly()
+        lensAssembly.add_lenses([_point_mass(0.5, pos_x=0.2), _point_mass(0.5, pos_x=-0.3)])
+        lensAssembly_split = LensAssembly()
+        lensAssembly_split.add_lenses([_point_mass(0.5, pos_x=0.2), _point_mass(0.5 + 1e-12, pos_x=-0.3)])
+        beta_x, beta_y = self.multiLens.full_ray_tracing(lensAssembly, 1.5, self.x, self.y)
+        beta_x_, beta_y_ = self.multiLens.full_ray_tracing(lensAssembly_split, 1.5, self.x, self.y)
+        npt.assert_allclose(beta_x, beta_x_, rtol=1e-8)
+        npt.assert_allclose(beta_y, beta_y_, rtol=1e-8)
+
+    def test_slabs(self):
+        lensAssembly = LensAssembly()
+        lensAssembly.add_lenses([_point_mass(z, pos_x=2 + z, pos_y=-z) for z in np.linspace(0.1, 1.4, 14)])
+        beta_x, beta_y = self.multiLens.full_ray_tracing(lensAssembly, 1.5, self.x, self.y, n_slabs=100)
+        beta_x_, beta_y_ = self.multiLens.full_ray_tracing(lensAssembly, 1.5, self.x, self.y)
+        npt.assert_almost_equal(beta_x, beta_x_, decimal=10)
+        error_coarse = self.multiLens.slab_tracing_error(lensAssembly, 1.5, self.x, self.y, n_slabs=1)
+        error_fine = self.multiLens.slab_tracing_error(lensAssembly, 1.5, self.x, self.y, n_slabs=7)
+        assert error_coarse['n_planes'] == 14
+        assert error_coarse['n_slabs'] == 1
+        assert error_fine['n_slabs'] == 7
+        assert 0 < error_fine['max'] < error_coarse['max']
+        assert error_fine['rms'] <= error_fine['max']
+        with pytest.raises(ValueError):
+            self.multiLens.full_ray_tracing(lensAssembly, 1.5, self.x, self.y, n_slabs=0)
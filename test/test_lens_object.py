@@ -0,0 +1,66 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for `lens_object` module.
+"""
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from MultiLens.lens_object import LensObject
+
+
+class TestLensObject(object):
+
+    def setup_method(self):
+        self.lensObject = LensObject(redshift=0.5, type='NFW')
+        self.lensObject.add_info('kwargs_profile', {'rho_s': 10**15, 'Rs': 0.05, 'pos_x': 1, 'pos_y': -0.5})
+        self.x, self.y = np.array([0.001, -0.002, 0.004]), np.array([0.003, 0.001, -0.002])
+
+    def test_slots(self):
+        assert not hasattr(self.lensObject, '__dict__')
+        with pytest.raises(AttributeError):
+            self.lensObject.pos = 1
+        assert isinstance(self.lensObject.kwargs_param['rho_s'], float)
+
+    def test_cache(self):
+        f_x0, f_y0 = self.lensObject.func.derivative(0, 0, **self.lensObject.kwargs_param)
+        npt.assert_almost_equal(self.lensObject.reference_deflection(), (f_x0, f_y0), decimal=16)
+        delta_x, delta_y = self.lensObject.deflection(self.x, self.y)
+        # parameter updates drop the cached reference deflection
+        self.lensObject.update_params(rho_s=2*10**15)
+        delta_x_, delta_y_ = self.lensObject.deflection(self.x, self.y)
+        npt.assert_allclose(delta_x_, 2*delta_x, rtol=1e-12)
+        self.lensObject.kwargs_param['rho_s'] = 10**15
+        self.lensObject.params_changed()
+        npt.assert_allclose(self.lensObject.deflection(self.x, self.y)[0], delta_x, rtol=1e-12)
+        # as do the positions of the observer frame
+        self.lensObject.update_position(0., 0.)
+        f_x, f_y = self.lensObject.func.derivative(self.x, self.y, 10**15, 0.05, 0., 0.)
+        npt.assert_allclose(self.lensObject.deflection(self.x, self.y)[0], f_x, rtol=1e-12)
+
+    def test_monopole_cache(self):
+        lensObject = LensObject(redshift=0.5, type='NFW', r_trunc=0.01)
+        lensObject.add_info('kwargs_profile', {'rho_s': 10**15, 'Rs': 0.05, 'pos_x': 1, 'pos_y': -0.5})
+        monopole = lensObject.monopole()
+        # the monopole of the truncation does not depend on the position and is kept by position updates
+        lensObject.update_position(0.001, 0.002)
+        assert lensObject._monopole == monopole
+        lensObject.reset_position()
+        assert lensObject._monopole == monopole
+        npt.assert_allclose(lensObject.deflection(self.x, self.y)[0],
+                            lensObject._derivative(self.x, self.y)[0] - lensObject._derivative(0, 0)[0], rtol=1e-12)
+        lensObject.update_params(rho_s=2*10**15)
+        assert lensObject._monopole is None
+        npt.assert_allclose(lensObject.monopole(), 2*monopole, rtol=1e-12)
+
+    def test_raise(self):
+        lensObject = LensObject(redshift=0.5, type='SIS')
+        lensObject.add_info('kwargs_profile', {'sigma_v': 200*1000., 'Rs': 0.05})
+        with pytest.raises(ValueError):
+            lensObject.deflection(self.x, self.y)
+        lensObject = LensObject(redshift=0.5, type='NFW')
+        lensObject.add_info('kwargs_profile', {'rho_s': 10**15, 'Rs': 0.05})
+        with pytest.raises(ValueError):
+            lensObject.deflection(self.x, self.y)
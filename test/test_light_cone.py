@@ -0,0 +1,105 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for `light_cone` module.
+"""
+
+import os
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from MultiLens.Cosmo.cosmo import get_cosmo
+from MultiLens.MultiLens import MultiLens
+from MultiLens.lens_assembly import LensAssembly
+from MultiLens.lens_object import LensObject
+from MultiLens.light_cone import LightCone
+import MultiLens.persistence as persistence
+import MultiLens.Utils.utils as utils
+
+
+class TestLightCone(object):
+
+    def setup_method(self):
+        np.random.seed(42)
+        n = 200
+        self.halos = []
+        for z, pos_x, pos_y, rho_s in zip(np.random.choice([0.2, 0.4, 0.6, 0.9], n), np.random.uniform(-60, 60, n),
+                                          np.random.uniform(-60, 60, n), 10**np.random.uniform(14, 15, n)):
+            self.halos.append((z, {'rho_s': rho_s, 'Rs': 0.02, 'pos_x': pos_x, 'pos_y': pos_y}))
+        self.catalog = self._assembly(0, 0, 100, r_trunc=0.2)
+        self.lightCone = LightCone(self.catalog, margin=5.)
+        self.sightlines = [(-20., 10., 10.), (15., -25., 10.), (30., 30., 5.)]
+        self.x, self.y = utils.make_grid(10, 1.)
+
+    def _assembly(self, center_x, center_y, width, r_trunc=None):
+        lensAssembly = LensAssembly()
+        for z, kwargs in self.halos:
+            if abs(kwargs['pos_x'] - center_x) <= width and abs(kwargs['pos_y'] - center_y) <= width:
+                lensObject = LensObject(redshift=z, type='NFW', r_trunc=r_trunc)
+                lensObject.add_info('kwargs_profile', {'rho_s': kwargs['rho_s'], 'Rs': kwargs['Rs'],
+                                                       'pos_x': kwargs['pos_x'] - center_x,
+                                                       'pos_y': kwargs['pos_y'] - center_y})
+                lensAssembly.add_lens(lensObject)
+        return lensAssembly
+
+    def test_trace(self):
+        beta_x, beta_y = self.lightCone.trace(self.sightlines, 1.5, self.x, self.y)
+        assert beta_x.shape == (3, 100)
+        for i, (center_x, center_y, half_width) in enumerate(self.sightlines):
+            lensAssembly = self._assembly(center_x, center_y, half_width + 5., r_trunc=0.2)
+            assert len(lensAssembly.object_array) == len(self.lightCone.select(center_x, center_y, half_width))
+            beta_x_, beta_y_ = MultiLens().full_ray_tracing(lensAssembly, 1.5, self.x, self.y)
+            npt.assert_allclose(beta_x[i], beta_x_, rtol=1e-10, atol=1e-20)
+            npt.assert_allclose(beta_y[i], beta_y_, rtol=1e-10, atol=1e-20)
+        # the catalog is not changed by the tracing
+        npt.assert_almost_equal(self.catalog.get_visible_positions(), self._assembly(0, 0, 100).get_visible_positions(),
+                                decimal=16)
+
+    def test_processes(self):
+        beta_x, beta_y = self.lightCone.trace(self.sightlines, 1.5, self.x, self.y, method='born')
+        beta_x_, beta_y_ = self.lightCone.trace(self.sightlines, 1.5, self.x, self.y, method='born', processes=2)
+        npt.assert_almost_equal(beta_x_, beta_x, decimal=16)
+        npt.assert_almost_equal(beta_y_, beta_y, decimal=16)
+        beta_x_, beta_y_ = self.lightCone.trace(self.sightlines[:2], 1.5, [self.x, self.x[:10]], [self.y, self.y[:10]],
+                                                method='born')
+        npt.assert_almost_equal(beta_x_[1], beta_x[1][:10], decimal=16)
+
+    def test_from_file(self, tmpdir):
+        filename = os.path.join(str(tmpdir), 'light_cone.npz')
+        persistence.save_assembly(self.catalog, filename)
+        lightCone = LightCone.from_file(filename, margin=5.)
+        assert len(lightCone) == len(self.lightCone)
+        npt.assert_equal(lightCone.select(-20., 10., 10.), self.lightCone.select(-20., 10., 10.))
+        # the truncation of the halos is kept
+        beta_x, beta_y = self.lightCone.trace(self.sightlines, 1.5, self.x, self.y)
+        beta_x_, beta_y_ = lightCone.trace(self.sightlines, 1.5, self.x, self.y)
+        npt.assert_allclose(beta_x_, beta_x, rtol=1e-12, atol=1e-20)
+        npt.assert_allclose(beta_y_, beta_y, rtol=1e-12, atol=1e-20)
+
+    def test_cosmology(self, tmpdir):
+        filename = os.path.join(str(tmpdir), 'light_cone.npz')
+        persistence.save_assembly(self.catalog, filename)
+        cosmo = get_cosmo(H0=60, Om0=0.25)
+        lightCone = LightCone.from_file(filename, margin=5., cosmo=cosmo)
+        assert lightCone.cosmo is cosmo
+        beta_x, beta_y = lightCone.trace(self.sightlines, 1.5, self.x, self.y, method='born', processes=2)
+        catalog = persistence.load_assembly(filename, cosmo=cosmo)
+        for i, (center_x, center_y, half_width) in enumerate(self.sightlines):
+            lensAssembly = LightCone(catalog, margin=5.).assembly(center_x, center_y, half_width)
+            beta_x_, beta_y_ = MultiLens(cosmo=cosmo).born_ray_tracing(lensAssembly, 1.5, self.x, self.y)
+            npt.assert_allclose(beta_x[i], beta_x_, rtol=1e-10, atol=1e-20)
+            npt.assert_allclose(beta_y[i], beta_y_, rtol=1e-10, atol=1e-20)
+
+    def test_raise(self):
+        with pytest.raises(ValueError):
+            self.lightCone.trace(self.sightlines, 1.5, self.x, self.y, method='tiled')
+        with pytest.raises(ValueError):
+            self.lightCone.trace(self.sightlines, 1.5, [self.x], [self.y])
+        lensAssembly = LensAssembly()
+        lensObject = LensObject(redshift=0.5, type='NFW', observer_frame=False)
+        lensObject.add_info('kwargs_profile', {'rho_s': 10**15, 'Rs': 0.05, 'pos_x': 0.1, 'pos_y': 0.})
+        lensAssembly.add_lens(lensObject)
+        with pytest.raises(ValueError):
+            LightCone(lensAssembly)
@@ -0,0 +1,155 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for `likelihood` module.
+"""
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from MultiLens.Cosmo.cosmo import get_cosmo
+from MultiLens.MultiLens import MultiLens
+from MultiLens.likelihood import LensLikelihood
+from MultiLens.lens_assembly import LensAssembly
+from MultiLens.lens_object import LensObject
+import MultiLens.Utils.constants as const
+import MultiLens.Utils.utils as utils
+
+
+class TestLensLikelihood(object):
+
+    def setup_method(self):
+        self.kwargs_list = [
+            [0.2, 'point_mass', {'mass': 10**10, 'pos_x': -1.3, 'pos_y': 0.4}],
+            [0.5, 'SIS', {'sigma_v': 200*1000., 'pos_x': 0.05, 'pos_y': 0.03}],
+            [0.8, 'NFW', {'rho_s': 10**15, 'Rs': 0.1, 'pos_x': 0.7, 'pos_y': -0.4}],
+        ]
+        self.lensAssembly, self.lens_ids = self._assembly(self.kwargs_list)
+        self.params = [(self.lens_ids[1], 'sigma_v'), (self.lens_ids[1], 'pos_x'), (self.lens_ids[1], 'pos_y'),
+                       (self.lens_ids[2], 'rho_s')]
+        self.theta = np.array([[210*1000., 0.06, 0.02, 1.2*10**15], [190*1000., 0.04, 0.05, 0.8*10**15],
+                               [200*1000., 0.05, 0.03, 10**15]])
+        self.multiLens = MultiLens()
+        self.z_source = 1.5
+
+    def _assembly(self, kwargs_list, theta=None, cosmo=None):
+        kwargs_list = [[z, type, dict(kwargs)] for z, type, kwargs in kwargs_list]
+        if theta is not None:
+            kwargs_list[1][2].update({'sigma_v': theta[0], 'pos_x': theta[1], 'pos_y': theta[2]})
+            kwargs_list[2][2]['rho_s'] = theta[3]
+        lensAssembly = LensAssembly()
+        lens_ids = []
+        for z, type, kwargs in kwargs_list:
+            lensObject = LensObject(redshift=z, type=type)
+            if cosmo is not None:
+                lensObject.cosmo = cosmo
+            lensObject.add_info('kwargs_profile', kwargs)
+            lens_ids.append(lensAssembly.add_lens(lensObject))
+        return lensAssembly, lens_ids
+
+    def test_positions(self):
+        x_image, y_image = np.array([1.1, -0.9, 0.3]), np.array([0.2, -0.3, 1.0])
+        sigma = 0.01
+        likelihood = LensLikelihood(self.lensAssembly, self.z_source, self.params, x_image=x_image, y_image=y_image,
+                                    sigma_source=sigma)
+        logL = likelihood.log_likelihood(self.theta)
+        for k, theta in enumerate(self.theta):
+            lensAssembly, _ = self._assembly(self.kwargs_list, theta)
+            beta_x, beta_y = self.multiLens.full_ray_tracing(lensAssembly, self.z_source, x_image*const.arcsec,
+                                                             y_image*const.arcsec)
+            chi2 = np.sum((beta_x - np.mean(beta_x))**2 + (beta_y - np.mean(beta_y))**2) / (sigma*const.arcsec)**2
+            npt.assert_allclose(likelihood.log_likelihood(theta), -chi2/2, rtol=1e-10)
+            npt.assert_allclose(logL[k], -chi2/2, rtol=1e-10)
+        npt.assert_almost_equal(likelihood.get_params(), self.theta[-1], decimal=8)
+
+    def test_cosmology(self):
+        cosmo = get_cosmo(H0=60, Om0=0.25)
+        lensAssembly, lens_ids = self._assembly(self.kwargs_list, cosmo=cosmo)
+        x_image, y_image = np.array([1.1, -0.9, 0.3]), np.array([0.2, -0.3, 1.0])
+        likelihood = LensLikelihood(lensAssembly, self.z_source, self.params, x_image=x_image, y_image=y_image,
+                                    sigma_source=0.01)
+        assert likelihood.cosmo is cosmo
+        beta_x, beta_y = likelihood._trace()
+        beta_x_, beta_y_ = MultiLens(cosmo=cosmo).full_ray_tracing(lensAssembly, self.z_source, x_image*const.arcsec,
+                                                                   y_image*const.arcsec)
+        npt.assert_allclose(beta_x, beta_x_, rtol=1e-10)
+        npt.assert_allclose(beta_y, beta_y_, rtol=1e-10)
+
+    def test_pixels(self):
+        x_grid, y_grid = utils.make_grid(12, 0.25)
+
+        def source(beta_x, beta_y):
+            return np.exp(-((beta_x - 0.1*const.arcsec)**2 + beta_y**2) / (2*(0.3*const.arcsec)**2))
+
+        beta_x, beta_y = self.multiLens.full_ray_tracing(self._assembly(self.kwargs_list, self.theta[0])[0],
+                                                         self.z_source, x_grid, y_grid)
+        data = source(beta_x, beta_y).reshape(12, 12)
+        likelihood = LensLikelihood(self.lensAssembly, self.z_source, self.params, data=data, x_grid=x_grid,
+                                    y_grid=y_grid, source=source, sigma_pixel=0.1)
+        logL = likelihood.log_likelihood(self.theta)
+        assert logL[0] == pytest.approx(0, abs=1e-16)
+        assert logL[1] < logL[2] < 0
+        for k, theta in enumerate(self.theta):
+            assert likelihood.log_likelihood(theta) == pytest.approx(logL[k], rel=1e-10, abs=1e-20)
+
+    def test_truncated(self):
+        self.lensAssembly.object_array[2].set_truncation(0.05)
+        likelihood = LensLikelihood(self.lensAssembly, self.z_source, self.params, x_image=[1.1, -0.9],
+                                    y_image=[0.2, -0.3], sigma_source=0.01)
+        logL = likelihood.log_likelihood(self.theta)
+        npt.assert_allclose(logL, [likelihood.log_likelihood(theta) for theta in self.theta], rtol=1e-12)
+        # the ensemble call leaves the parameters as they were set
+        likelihood.set_params(self.theta[0])
+        logL_0 = likelihood.log_likelihood(self.theta[0])
+        likelihood.log_likelihood(self.theta[1:])
+        npt.assert_almost_equal(likelihood.get_params(), self.theta[0], decimal=8)
+        assert self.lensAssembly.object_array[1].kwargs_param['sigma_v'] == 210*1000.
+        beta_x, beta_y = likelihood._trace()
+        assert likelihood._log_likelihood(beta_x, beta_y) == pytest.approx(logL_0, rel=1e-12)
+
+    def test_amplitudes(self):
+        x_image, y_image = np.array([1.1, -0.9, 0.3]), np.array([0.2, -0.3, 1.0])
+        params = [(self.lens_ids[0], 'mass'), (self.lens_ids[2], 'rho_s')]
+        theta = np.array([[2*10**10, 1.2*10**15], [0, 0.8*10**15]])
+        likelihood = LensLikelihood(self.lensAssembly, self.z_source, params, x_image=x_image, y_image=y_image,
+                                    sigma_source=0.01)
+        # the point mass is in the first varied plane and only its mass is varied
+        assert self.lensAssembly.get_lens(self.lens_ids[0]) in likelihood._cache
+        assert len(likelihood._cache) == 1
+        logL = likelihood.log_likelihood(theta)
+        for k in range(2):
+            lensAssembly, lens_ids = self._assembly(self.kwargs_list)
+            lensAssembly.get_lens(lens_ids[0]).update_params(mass=theta[k, 0])
+            lensAssembly.get_lens(lens_ids[2]).update_params(rho_s=theta[k, 1])
+            beta_x, beta_y = self.multiLens.full_ray_tracing(lensAssembly, self.z_source, x_image*const.arcsec,
+                                                             y_image*const.arcsec)
+            chi2 = np.sum((beta_x - np.mean(beta_x))**2 + (beta_y - np.mean(beta_y))**2) / (0.01*const.arcsec)**2
+            npt.assert_allclose(logL[k], -chi2/2, rtol=1e-10)
+            npt.assert_allclose(likelihood.log_likelihood(theta[k]), -chi2/2, rtol=1e-10)
+
+    def test_born(self):
+        x_image, y_image = np.array([1.1, -0.9, 0.3]), np.array([0.2, -0.3, 1.0])
+        likelihood = LensLikelihood(self.lensAssembly, self.z_source, self.params, x_image=x_image, y_image=y_image,
+                                    sigma_source=0.01, born=True)
+        # all the lenses but the SIS with varied position are cached
+        assert len(likelihood._cache) == 2
+        logL = likelihood.log_likelihood(self.theta)
+        for k, theta in enumerate(self.theta):
+            lensAssembly, _ = self._assembly(self.kwargs_list, theta)
+            beta_x, beta_y = self.multiLens.born_ray_tracing(lensAssembly, self.z_source, x_image*const.arcsec,
+                                                             y_image*const.arcsec)
+            chi2 = np.sum((beta_x - np.mean(beta_x))**2 + (beta_y - np.mean(beta_y))**2) / (0.01*const.arcsec)**2
+            npt.assert_allclose(logL[k], -chi2/2, rtol=1e-10)
+            npt.assert_allclose(likelihood.log_likelihood(theta), -chi2/2, rtol=1e-10)
+
+    def test_raise(self):
+        with pytest.raises(ValueError):
+            LensLikelihood(self.lensAssembly, self.z_source, self.params)
+        with pytest.raises(ValueError):
+            LensLikelihood(self.lensAssembly, self.z_source, [(self.lens_ids[0], 'Rs')], x_image=[1.], y_image=[0.],
+                           sigma_source=0.01)
+        likelihood = LensLikelihood(self.lensAssembly, self.z_source, self.params, x_image=[1.], y_image=[0.],
+                                    sigma_source=0.01)
+        with pytest.raises(ValueError):
+            likelihood.log_likelihood(np.ones(3))
@@ -0,0 +1,84 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for the multi-resolution evaluation of the full ray-tracing.
+"""
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from MultiLens.MultiLens import MultiLens
+from MultiLens.lens_assembly import LensAssembly
+from MultiLens.lens_object import LensObject
+from MultiLens.ray_set import RaySet, grid_shape
+import MultiLens.Utils.constants as const
+import MultiLens.Utils.utils as utils
+
+
+class TestMultiResolution(object):
+
+    def setup_method(self):
+        random = np.random.RandomState(2)
+        self.lensAssembly = LensAssembly()
+        lensObject = LensObject(redshift=0.5, type='SIS', main=True)
+        lensObject.add_info('kwargs_profile', {'sigma_v': 200*1000., 'pos_x': 0.05, 'pos_y': 0.03})
+        self.lensAssembly.add_lens(lensObject)
+        # planes of halos far from the rays
+        for z in [0.3, 0.8]:
+            for i in range(4):
+                r, phi = random.uniform(20, 60), random.uniform(0, 2*np.pi)
+                lensObject = LensObject(redshift=z, type='NFW')
+                lensObject.add_info('kwargs_profile', {'rho_s': 10**15, 'Rs': 0.05, 'pos_x': r*np.cos(phi),
+                                                       'pos_y': r*np.sin(phi)})
+                self.lensAssembly.add_lens(lensObject)
+        self.multiLens = MultiLens()
+        self.x, self.y = utils.make_grid(40, 0.1)
+        self.beta_x, self.beta_y = self.multiLens.full_ray_tracing(self.lensAssembly, 1.5, self.x, self.y)
+
+    def test_smooth_planes(self):
+        coarse = []
+        _coarse = self.multiLens._coarse
+
+        def record(lens_list, *args):
+            exact, alpha_x, alpha_y = _coarse(lens_list, *args)
+            coarse.append(len(lens_list) - len(exact))
+            return exact, alpha_x, alpha_y
+        self.multiLens._coarse = record
+        beta_x, beta_y = self.multiLens.full_ray_tracing(self.lensAssembly, 1.5, self.x, self.y,
+                                                         multi_resolution=0.001, coarse_factor=4)
+        # the main deflector is evaluated at full resolution
+        assert coarse == [4, 0, 4]
+        npt.assert_allclose(beta_x, self.beta_x, atol=0.001 * const.arcsec)
+        npt.assert_allclose(beta_y, self.beta_y, atol=0.001 * const.arcsec)
+
+    def test_near_lenses(self):
+        lensObject = LensObject(redshift=0.8, type='point_mass')
+        lensObject.add_info('kwargs_profile', {'mass': 10**10, 'pos_x': 0.33, 'pos_y': -0.52})
+        self.lensAssembly.add_lens(lensObject)
+        beta_x, beta_y = self.multiLens.full_ray_tracing(self.lensAssembly, 1.5, self.x, self.y)
+        beta_x_, beta_y_ = self.multiLens.full_ray_tracing(self.lensAssembly, 1.5, self.x, self.y,
+                                                           multi_resolution=0.0001)
+        npt.assert_allclose(beta_x_, beta_x, atol=0.001 * const.arcsec)
+        npt.assert_allclose(beta_y_, beta_y, atol=0.001 * const.arcsec)
+        # a tolerance below the expansion errors evaluates all the lenses at full resolution
+        beta_x_, beta_y_ = self.multiLens.full_ray_tracing(self.lensAssembly, 1.5, self.x, self.y,
+                                                           multi_resolution=10**-12)
+        npt.assert_allclose(beta_x_, beta_x, rtol=1e-12)
+
+    def test_ray_set(self):
+        rays = RaySet.grid(40, 0.1)
+        beta_x, beta_y = self.multiLens.full_ray_tracing(self.lensAssembly, 1.5, rays, multi_resolution=0.0001)
+        npt.assert_allclose(beta_x, self.beta_x, atol=0.001 * const.arcsec)
+        x, y = utils.array2image(self.x), utils.array2image(self.y)
+        beta_x, beta_y = self.multiLens.full_ray_tracing(self.lensAssembly, 1.5, x, y, multi_resolution=0.0001)
+        assert beta_x.shape == (40, 40)
+        npt.assert_allclose(beta_x.ravel(), self.beta_x, atol=0.001 * const.arcsec)
+
+    def test_grid_shape(self):
+        assert grid_shape(self.x, self.y) == (40, 40)
+        assert grid_shape(RaySet.grid(30, 0.1, numPix_y=20)) == (20, 30)
+        with pytest.raises(ValueError):
+            grid_shape(self.x[:-1], self.y[:-1])
+        with pytest.raises(ValueError):
+            grid_shape(RaySet.grid(30, 0.1).annulus(0.5, 1.))
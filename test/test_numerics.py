@@ -0,0 +1,59 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for `numerics` module.
+"""
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from MultiLens.numerics import Numerics
+
+
+class TestNumerics(object):
+
+    def setup_method(self):
+        # lens potential psi = -cos(2x)cos(y)/2 on a rectangular grid
+        self.nx, self.ny = 80, 50
+        x, y = np.meshgrid(np.linspace(-1, 1, self.nx), np.linspace(-0.6, 0.6, self.ny))
+        self.x, self.y = x.ravel(), y.ravel()
+        f_x = np.sin(2*self.x)*np.cos(self.y)
+        f_y = 0.5*np.cos(2*self.x)*np.sin(self.y)
+        self.beta_x, self.beta_y = self.x - f_x, self.y - f_y
+        f_xx = 2*np.cos(2*self.x)*np.cos(self.y)
+        f_yy = 0.5*np.cos(2*self.x)*np.cos(self.y)
+        f_xy = -np.sin(2*self.x)*np.sin(self.y)
+        self.kappa = (f_xx + f_yy)/2.
+        self.mag = 1./((1 - f_xx)*(1 - f_yy) - f_xy**2)
+
+    def _interior(self, array, order):
+        p = order//2
+        return array.reshape(self.ny, self.nx)[p:-p, p:-p]
+
+    def test_order(self):
+        for order, decimal in [(2, 3), (4, 6), (6, 9)]:
+            numerics = Numerics(order=order)
+            kappa = numerics.kappa(self.beta_x, self.beta_y, self.x, self.y, shape=(self.ny, self.nx))
+            npt.assert_almost_equal(kappa, self._interior(self.kappa, order), decimal=decimal)
+
+    def test_all_tiled(self):
+        numerics = Numerics(order=4)
+        shape = (self.ny, self.nx)
+        kappa, gamma1, gamma2, mag = numerics.all(self.beta_x, self.beta_y, self.x, self.y, shape=shape)
+        numerics_tiled = Numerics(order=4, tile_size=7)
+        out = tuple(np.empty_like(kappa) for _ in range(4))
+        result = numerics_tiled.all(self.beta_x, self.beta_y, self.x, self.y, shape=shape, out=out)
+        assert result[0] is out[0]
+        npt.assert_almost_equal(out[0], kappa, decimal=12)
+        npt.assert_almost_equal(out[3], mag, decimal=12)
+        npt.assert_allclose(mag, self._interior(self.mag, 4), rtol=1e-3)
+        gamma1_, gamma2_ = numerics.gamma(self.beta_x, self.beta_y, self.x, self.y, shape=shape)
+        npt.assert_almost_equal(gamma1, gamma1_, decimal=12)
+        npt.assert_almost_equal(gamma2, gamma2_, decimal=12)
+
+    def test_raise(self):
+        with pytest.raises(ValueError):
+            Numerics(order=3)
+        with pytest.raises(ValueError):
+            Numerics().kappa(self.beta_x, self.beta_y, self.x, self.y)
@@ -0,0 +1,77 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for `persistence` module.
+"""
+
+import os
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from MultiLens.MultiLens import MultiLens
+from MultiLens.lens_assembly import LensAssembly
+from MultiLens.lens_object import LensObject
+import MultiLens.persistence as persistence
+import MultiLens.Utils.utils as utils
+
+
+class TestPersistence(object):
+
+    def setup_method(self):
+        self.lensAssembly = LensAssembly()
+        lensObject = LensObject(redshift=0.5, type='SIS', main=True)
+        lensObject.add_info('kwargs_profile', {'sigma_v': 200*1000., 'pos_x': 0., 'pos_y': 0.})
+        self.lensAssembly.add_lens(lensObject)
+        lensObject = LensObject(redshift=0.3, type='point_mass')
+        lensObject.add_info('kwargs_profile', {'mass': 10**10, 'pos_x': 1., 'pos_y': -0.5})
+        self.lensAssembly.add_lens(lensObject)
+        lensObject = LensObject(redshift=0.8, type='NFW', observer_frame=False)
+        lensObject.add_info('kwargs_profile', {'rho_s': 10**15, 'Rs': 0.1, 'pos_x': 0.001, 'pos_y': 0.002})
+        self.lensAssembly.add_lens(lensObject)
+        self.multiLens = MultiLens()
+        self.x, self.y = utils.make_grid(20, 0.1)
+
+    def _assert_equal_tracing(self, lensAssembly):
+        beta_x, beta_y = self.multiLens.full_ray_tracing(self.lensAssembly, 1.5, self.x, self.y)
+        beta_x_, beta_y_ = self.multiLens.full_ray_tracing(lensAssembly, 1.5, self.x, self.y)
+        npt.assert_almost_equal(beta_x_, beta_x, decimal=16)
+        npt.assert_almost_equal(beta_y_, beta_y, decimal=16)
+
+    def test_assembly_npz(self, tmpdir):
+        filename = os.path.join(str(tmpdir), 'assembly.npz')
+        persistence.save_assembly(self.lensAssembly, filename)
+        lensAssembly = persistence.load_assembly(filename)
+        assert [lensObject.type for lensObject in lensAssembly.object_array] == ['point_mass', 'SIS', 'NFW']
+        self._assert_equal_tracing(lensAssembly)
+
+    def test_truncation(self, tmpdir):
+        for lensObject in self.lensAssembly.object_array[1:]:
+            lensObject.set_truncation(0.005)
+        filename = os.path.join(str(tmpdir), 'assembly.npz')
+        persistence.save_assembly(self.lensAssembly, filename)
+        lensAssembly = persistence.load_assembly(filename)
+        assert [lensObject.r_trunc for lensObject in lensAssembly.object_array] == [None, 0.005, 0.005]
+        self._assert_equal_tracing(lensAssembly)
+        x, y = np.array([0.001, 0.02, -0.05]), np.array([0.002, -0.01, 0.03])
+        lensObject, lensObject_ = self.lensAssembly.object_array[2], lensAssembly.object_array[2]
+        npt.assert_almost_equal(lensObject_.deflection(x, y), lensObject.deflection(x, y), decimal=16)
+
+    def test_assembly_hdf5(self, tmpdir):
+        pytest.importorskip('h5py')
+        filename = os.path.join(str(tmpdir), 'assembly.h5')
+        persistence.save_assembly(self.lensAssembly, filename)
+        self._assert_equal_tracing(persistence.load_assembly(filename))
+
+    def test_maps(self, tmpdir):
+        path = os.path.join(str(tmpdir), 'maps')
+        beta_x, beta_y = self.multiLens.full_ray_tracing(self.lensAssembly, 1.5, self.x, self.y)
+        with persistence.MapWriter(path, shape=(20, 20)) as writer:
+            for i in range(0, 20, 5):
+                writer.write('beta_x', utils.array2image(beta_x)[i:i+5], index=slice(i, i+5))
+            writer.write('beta_y', utils.array2image(beta_y))
+        maps = persistence.open_maps(path)
+        assert isinstance(maps['beta_x'], np.memmap)
+        npt.assert_almost_equal(maps['beta_x'], utils.array2image(beta_x), decimal=16)
+        npt.assert_almost_equal(maps['beta_y'], utils.array2image(beta_y), decimal=16)
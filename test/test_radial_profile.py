@@ -0,0 +1,96 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for `radial_profile` module.
+"""
+
+import os
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from MultiLens.MultiLens import MultiLens
+from MultiLens.born import BornLens
+from MultiLens.lens_assembly import LensAssembly
+from MultiLens.lens_object import LensObject
+from MultiLens.Profiles.nfw import NFW
+from MultiLens.Profiles.radial_profile import RadialProfile
+import MultiLens.persistence as persistence
+import MultiLens.Utils.constants as const
+import MultiLens.Utils.utils as utils
+
+
+def nfw_density(r, rho_s, Rs):
+    return rho_s / (r/Rs * (1 + r/Rs)**2)
+
+
+def cored_density(R, sigma_0, r_core):
+    return sigma_0 / (1 + (R/r_core)**2)
+
+
+class TestRadialProfile(object):
+
+    def setup_method(self):
+        self.nfw = NFW()
+        self.profile = RadialProfile.from_density(nfw_density, z_max=1000., num_r=512, rho_s=10**15, Rs=0.05)
+        self.x = np.array([0.0001, 0.003, 0.02, 0.05, 0.2, 1., 5.])
+        self.y = 0.5 * self.x
+
+    def test_nfw(self):
+        f_x, f_y = self.nfw.derivative(self.x, self.y, 10**15, 0.05, 0, 0)
+        d_x, d_y = self.profile.derivative(self.x, self.y)
+        npt.assert_allclose(d_x, f_x, rtol=0.001)
+        npt.assert_allclose(d_y, f_y, rtol=0.001)
+        for f, d in zip(self.nfw.hessian(self.x, self.y, 10**15, 0.05, 0, 0), self.profile.hessian(self.x, self.y)):
+            npt.assert_allclose(d, f, rtol=0.01)
+        # the tables are computed once per parameter set
+        assert RadialProfile.from_density(nfw_density, z_max=1000., num_r=512, rho_s=10**15, Rs=0.05) is self.profile
+
+    def test_potential(self):
+        profile = RadialProfile.from_density(cored_density, projected=True, sigma_0=10**15, r_core=0.01)
+        x, y = np.array([0.000001, 0.002, 0.03, 20.]), np.array([0., 0.001, -0.02, 1.])
+        h = 10**-7
+        f_x = (profile.function(x + h, y) - profile.function(x - h, y)) / (2*h)
+        d_x, d_y = profile.derivative(x, y)
+        npt.assert_allclose(f_x, d_x, rtol=0.001)
+
+    def test_lens_object(self):
+        lensAssembly = LensAssembly()
+        for pos_x, pos_y in [(0.4, -0.3), (-0.9, 0.6)]:
+            lensObject = LensObject(redshift=0.5, type='NFW')
+            lensObject.add_info('kwargs_profile', {'rho_s': 10**15, 'Rs': 0.05, 'pos_x': pos_x, 'pos_y': pos_y})
+            lensAssembly.add_lens(lensObject)
+        x, y = utils.make_grid(10, 0.3)
+        multiLens = MultiLens()
+        beta_x, beta_y = multiLens.full_ray_tracing(lensAssembly, 1.5, x, y)
+        beta_x_born, beta_y_born = BornLens().ray_shooting(lensAssembly, 1.5, x, y)
+        lensAssembly_ = LensAssembly()
+        for pos_x, pos_y in [(0.4, -0.3), (-0.9, 0.6)]:
+            lensObject = LensObject(redshift=0.5, type='tabulated')
+            lensObject.add_info('kwargs_profile', {'pos_x': pos_x, 'pos_y': pos_y})
+            lensObject.add_info('radial_profile', self.profile)
+            lensAssembly_.add_lens(lensObject)
+        beta_x_, beta_y_ = multiLens.full_ray_tracing(lensAssembly_, 1.5, x, y)
+        npt.assert_allclose(beta_x_, beta_x, atol=0.0001 * const.arcsec)
+        npt.assert_allclose(beta_y_, beta_y, atol=0.0001 * const.arcsec)
+        beta_x_, beta_y_ = BornLens().ray_shooting(lensAssembly_, 1.5, x, y)
+        npt.assert_allclose(beta_x_, beta_x_born, atol=0.0001 * const.arcsec)
+
+    def test_persistence(self, tmpdir):
+        lensAssembly = LensAssembly()
+        lensObject = LensObject(redshift=0.5, type='tabulated')
+        lensObject.add_info('kwargs_profile', {'pos_x': 0.4, 'pos_y': -0.3})
+        lensObject.add_info('radial_profile', self.profile)
+        lensAssembly.add_lens(lensObject)
+        filename = os.path.join(str(tmpdir), 'assembly.npz')
+        persistence.save_assembly(lensAssembly, filename)
+        lensObject_ = persistence.load_assembly(filename).object_array[0]
+        npt.assert_almost_equal(lensObject_.deflection(self.x, self.y), lensObject.deflection(self.x, self.y),
+                                decimal=16)
+
+    def test_raise(self):
+        with pytest.raises(ValueError):
+            RadialProfile([0.1, 0.05], [1., 1.])
+        with pytest.raises(ValueError):
+            RadialProfile([0.01, 0.1], [0., 1.])
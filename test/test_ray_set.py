@@ -0,0 +1,60 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for `ray_set` module.
+"""
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from MultiLens.ray_set import RaySet
+from MultiLens.MultiLens import MultiLens
+from MultiLens.lens_assembly import LensAssembly
+from MultiLens.lens_object import LensObject
+import MultiLens.Utils.utils as utils
+import MultiLens.Utils.constants as const
+
+
+class TestRaySet(object):
+
+    def test_grid(self):
+        x, y = utils.make_grid(20, 0.1)
+        rays = RaySet.grid(20, 0.1)
+        npt.assert_almost_equal(rays.x, x, decimal=16)
+        npt.assert_almost_equal(rays.y, y, decimal=16)
+        image = rays.image(rays.x)
+        assert np.shares_memory(image, rays.x)
+        rays = RaySet.grid(30, 0.1, numPix_y=10)
+        assert rays.shape == (10, 30)
+        assert rays.region(0, 1, 0, 1).num_rays == 11*5
+
+    def test_masked(self):
+        rays = RaySet.grid(40, 0.1).annulus(0.5, 1.5)
+        r = np.sqrt(rays.x**2 + rays.y**2)/const.arcsec
+        assert np.all(r >= 0.5 - 1e-10) and np.all(r <= 1.5 + 1e-10)
+        image = rays.image(r, fill_value=-1)
+        assert image.shape == (40, 40)
+        npt.assert_almost_equal(rays.array(image), r, decimal=10)
+        assert np.sum(image < 0) == 40*40 - rays.num_rays
+
+    def test_polar(self):
+        rays = RaySet.polar(0.1, 2., 10, 36, center_x=0.5, log=True)
+        assert rays.shape == (10, 36)
+        r = np.sqrt((rays.x - 0.5*const.arcsec)**2 + rays.y**2)/const.arcsec
+        npt.assert_almost_equal(r[::36], np.logspace(-1, np.log10(2), 10), decimal=10)
+        with pytest.raises(ValueError):
+            RaySet.polar(0, 2., 10, 36, log=True)
+
+    def test_tracing(self):
+        lensAssembly = LensAssembly()
+        lensObject = LensObject(redshift=0.5, type='SIS', main=True)
+        lensObject.add_info('kwargs_profile', {'sigma_v': 200*1000., 'pos_x': 0., 'pos_y': 0.})
+        lensAssembly.add_lens(lensObject)
+        multiLens = MultiLens()
+        x, y = utils.make_grid(30, 0.1)
+        beta_x, beta_y = multiLens.full_ray_tracing(lensAssembly, 1., x, y)
+        rays = RaySet.grid(30, 0.1).annulus(0.5, 1.2)
+        beta_x_, beta_y_ = multiLens.full_ray_tracing(lensAssembly, 1., rays)
+        npt.assert_almost_equal(beta_x_, beta_x[rays.index], decimal=16)
+        npt.assert_almost_equal(beta_y_, beta_y[rays.index], decimal=16)
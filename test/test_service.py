@@ -0,0 +1,121 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for `service` module.
+"""
+
+import json
+import os
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from MultiLens.Cosmo.cosmo import get_cosmo
+from MultiLens.MultiLens import MultiLens
+from MultiLens.lens_assembly import LensAssembly
+from MultiLens.lens_object import LensObject
+from MultiLens.service import TracingClient, TracingService
+import MultiLens.persistence as persistence
+import MultiLens.service as service
+import MultiLens.Utils.utils as utils
+
+
+class TestService(object):
+
+    def setup_method(self):
+        self.lensAssembly = LensAssembly()
+        lensObject = LensObject(redshift=0.5, type='SIS', main=True)
+        lensObject.add_info('kwargs_profile', {'sigma_v': 200*1000., 'pos_x': 0.05, 'pos_y': 0.03})
+        self.lensAssembly.add_lens(lensObject)
+        lensObject = LensObject(redshift=0.3, type='NFW')
+        lensObject.add_info('kwargs_profile', {'rho_s': 10**15, 'Rs': 0.05, 'pos_x': 1., 'pos_y': -0.5})
+        self.lensAssembly.add_lens(lensObject)
+        self.x, self.y = utils.make_grid(10, 0.1)
+
+    def _config(self, tmpdir, processes=1):
+        filename = os.path.join(str(tmpdir), 'assembly.npz')
+        persistence.save_assembly(self.lensAssembly, filename)
+        return {'assembly': {'los': filename}, 'processes': processes}
+
+    def test_unix_socket(self, tmpdir):
+        tracingService = TracingService(self._config(tmpdir))
+        address = tracingService.start_background(path=os.path.join(str(tmpdir), 'service.sock'))
+        try:
+            with TracingClient(address) as client:
+                assert client.ping() == ['los']
+                multiLens = MultiLens()
+                beta_x, beta_y = multiLens.full_ray_tracing(self.lensAssembly, 1.5, self.x, self.y)
+                beta_x_, beta_y_ = client.full_ray_tracing('los', 1.5, self.x, self.y)
+                npt.assert_allclose(beta_x_, beta_x, rtol=1e-12)
+                npt.assert_allclose(beta_y_, beta_y, rtol=1e-12)
+                outputs = client.full_ray_tracing('los', 1.5, self.x, self.y, fermat=True)
+                assert len(outputs) == 3
+                beta_x, beta_y = multiLens.born_ray_tracing(self.lensAssembly, 1.5, self.x, self.y)
+                npt.assert_allclose(client.born_ray_tracing('los', 1.5, self.x, self.y)[0], beta_x, rtol=1e-12)
+                gamma_A, gamma_BC = multiLens.analytic_matrices(self.lensAssembly, 1.5)
+                gamma_A_, gamma_BC_ = client.analytic_matrices('los', 1.5)
+                npt.assert_allclose(gamma_A_, gamma_A, rtol=1e-12)
+                npt.assert_allclose(gamma_BC_, gamma_BC, rtol=1e-12)
+                with pytest.raises(ValueError):
+                    client.full_ray_tracing('missing', 1.5, self.x, self.y)
+                with pytest.raises(ValueError):
+                    client.full_ray_tracing('los', 1.5, self.x, self.y, n_slabs='many')
+                # the connection stays usable after an error
+                npt.assert_allclose(client.full_ray_tracing('los', 1.5, self.x, self.y)[0],
+                                    beta_x_, rtol=1e-12)
+        finally:
+            tracingService.stop()
+
+    def test_processes(self, tmpdir):
+        tracingService = TracingService(self._config(tmpdir, processes=2))
+        address = tracingService.start_background()
+        try:
+            clients = [TracingClient(address) for _ in range(2)]
+            beta_x, beta_y = MultiLens().analytic_mapping(self.lensAssembly, 1.5, self.x, self.y)
+            for client in clients:
+                beta_x_, beta_y_ = client.analytic_mapping('los', 1.5, self.x, self.y)
+                npt.assert_allclose(beta_x_, beta_x, rtol=1e-12)
+                client.close()
+        finally:
+            tracingService.stop()
+
+    def test_cosmology(self, tmpdir):
+        config = self._config(tmpdir)
+        config_ = dict(config, cosmology={'H0': 65, 'Om0': 0.25})
+        tracingServices = [TracingService(config), TracingService(config_)]
+        addresses = [tracingService.start_background() for tracingService in tracingServices]
+        try:
+            # the services keep their own workers with their own cosmology
+            filename = config['assembly']['los']
+            for address, cosmology in zip(addresses, [{}, config_['cosmology']]):
+                cosmo = get_cosmo(**cosmology)
+                lensAssembly = persistence.load_assembly(filename, cosmo=cosmo)
+                beta_x, beta_y = MultiLens(cosmo=cosmo).full_ray_tracing(lensAssembly, 1.5, self.x, self.y)
+                with TracingClient(address) as client:
+                    beta_x_, beta_y_ = client.full_ray_tracing('los', 1.5, self.x, self.y)
+                npt.assert_allclose(beta_x_, beta_x, rtol=1e-12)
+                npt.assert_allclose(beta_y_, beta_y, rtol=1e-12)
+            assert not np.allclose(beta_x, MultiLens().full_ray_tracing(self.lensAssembly, 1.5, self.x, self.y)[0],
+                                   rtol=1e-6, atol=0)
+        finally:
+            for tracingService in tracingServices:
+                tracingService.stop()
+
+    def test_encode(self):
+        arrays = [np.arange(6.).reshape(2, 3), np.array([1, 2], dtype=np.int32)]
+        message = service._encode({'op': 'ping'}, arrays)
+        header, specs = service._decode_header(message[1])
+        assert header == {'op': 'ping'}
+        for (dtype, shape, size), data, array in zip(specs, message[2:], arrays):
+            npt.assert_equal(service._decode_array(data, dtype, shape), array)
+        with pytest.raises(ValueError):
+            service._encode({}, [np.array([None])])
+
+    def test_config(self, tmpdir):
+        filename = os.path.join(str(tmpdir), 'service.json')
+        with open(filename, 'w') as f:
+            json.dump({'assembly': {'los': 'assembly.npz'}}, f)
+        assert service.load_config(filename)['processes'] == 1
+        with pytest.raises(ValueError):
+            service.check_config({'assembly': ['assembly.npz']})
@@ -0,0 +1,31 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for `spatial` module.
+"""
+
+import numpy as np
+import numpy.testing as npt
+
+from MultiLens.Utils.spatial import GridIndex
+
+
+class TestGridIndex(object):
+
+    def setup_method(self):
+        random = np.random.RandomState(42)
+        self.x, self.y = random.uniform(-10, 10, (2, 1000))
+        self.gridIndex = GridIndex(self.x, self.y)
+
+    def test_query_box(self):
+        for box in [(-1, 2, -3, 0.5), (-20, -15, 0, 1), (5, 30, 5, 30), (-30, 30, -30, 30), (3, 2, 0, 1)]:
+            x_min, x_max, y_min, y_max = box
+            index = self.gridIndex.query_box(x_min, x_max, y_min, y_max)
+            inside = (self.x >= x_min) & (self.x <= x_max) & (self.y >= y_min) & (self.y <= y_max)
+            npt.assert_equal(index, np.where(inside)[0])
+
+    def test_empty(self):
+        gridIndex = GridIndex([], [])
+        assert len(gridIndex.query_box(-1, 1, -1, 1)) == 0
+        gridIndex = GridIndex([1.], [1.])
+        npt.assert_equal(gridIndex.query_box(0, 2, 0, 2), [0])
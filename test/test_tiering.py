@@ -0,0 +1,84 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for `tiering` module and the tiered full ray-tracing.
+"""
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from MultiLens.born import BornLens
+from MultiLens.MultiLens import MultiLens
+from MultiLens.lens_assembly import LensAssembly
+from MultiLens.lens_object import LensObject
+from MultiLens.tiering import Tiering
+import MultiLens.Utils.constants as const
+import MultiLens.Utils.utils as utils
+
+
+class TestTiering(object):
+
+    def setup_method(self):
+        self.lensAssembly = LensAssembly()
+        kwargs_list = [(0.5, 'SIS', True, {'sigma_v': 250*1000., 'pos_x': 0., 'pos_y': 0.}),
+                       (0.3, 'point_mass', False, {'mass': 10**6, 'pos_x': 50., 'pos_y': 40.}),
+                       (0.8, 'NFW', False, {'rho_s': 10**14, 'Rs': 0.05, 'pos_x': 10., 'pos_y': -8.}),
+                       (0.9, 'point_mass', False, {'mass': 10**7, 'pos_x': 0.5, 'pos_y': 0.3}),
+                       (2.5, 'point_mass', False, {'mass': 10**12, 'pos_x': 0., 'pos_y': 0.})]
+        for z, lens_type, main, kwargs in kwargs_list:
+            lensObject = LensObject(redshift=z, type=lens_type, main=main)
+            lensObject.add_info('kwargs_profile', kwargs)
+            self.lensAssembly.add_lens(lensObject)
+        self.x, self.y = utils.make_grid(30, 0.1)
+        self.multiLens = MultiLens()
+        self.z_source = 1.5
+
+    def _set(self, approximation):
+        for lensObject in self.lensAssembly.object_array:
+            lensObject.approximation = approximation
+
+    def test_tier(self):
+        assert LensObject(redshift=0.5).tier == 'born'
+        assert LensObject(redshift=0.5, approximation='strong').tier == 'full'
+        assert LensObject(redshift=0.5, approximation='tidal').tier == 'tidal'
+        with pytest.raises(ValueError):
+            LensObject(redshift=0.5, approximation='exact')
+
+    def test_full_and_born(self):
+        beta_x, beta_y = self.multiLens.full_ray_tracing(self.lensAssembly, self.z_source, self.x, self.y)
+        self._set('full')
+        beta_x_, beta_y_ = self.multiLens.full_ray_tracing(self.lensAssembly, self.z_source, self.x, self.y,
+                                                           tiered=True)
+        npt.assert_almost_equal(beta_x_, beta_x, decimal=16)
+        npt.assert_almost_equal(beta_y_, beta_y, decimal=16)
+        self._set('born')
+        self.lensAssembly.reset_observer_frame()
+        beta_x_, beta_y_ = self.multiLens.full_ray_tracing(self.lensAssembly, self.z_source, self.x, self.y,
+                                                           observer_frame=False, tiered=True)
+        beta_x_born, beta_y_born = BornLens().ray_shooting(self.lensAssembly, self.z_source, self.x, self.y)
+        npt.assert_allclose(beta_x_, beta_x_born, rtol=1e-10, atol=1e-20)
+        npt.assert_allclose(beta_y_, beta_y_born, rtol=1e-10, atol=1e-20)
+
+    def test_tidal_and_skip(self):
+        self._set('skip')
+        beta_x, beta_y = self.multiLens.full_ray_tracing(self.lensAssembly, self.z_source, self.x, self.y, tiered=True)
+        npt.assert_almost_equal(beta_x, self.x, decimal=16)
+        self._set('tidal')
+        self.lensAssembly.reset_observer_frame()
+        beta_x, beta_y = self.multiLens.full_ray_tracing(self.lensAssembly, self.z_source, self.x, self.y,
+                                                         observer_frame=False, tiered=True)
+        f_xx, f_yy, f_xy = BornLens().hessian(self.lensAssembly, self.z_source, np.zeros(1), np.zeros(1))
+        npt.assert_allclose(beta_x, self.x - f_xx[0]*self.x - f_xy[0]*self.y, rtol=1e-10, atol=1e-20)
+        npt.assert_allclose(beta_y, self.y - f_xy[0]*self.x - f_yy[0]*self.y, rtol=1e-10, atol=1e-20)
+
+    def test_assign(self):
+        counts = Tiering(tolerance=0.001).assign(self.lensAssembly, self.z_source, self.x, self.y)
+        tiers = [lensObject.tier for lensObject in self.lensAssembly.object_array]
+        assert tiers == ['skip', 'full', 'tidal', 'born', 'skip']
+        assert counts == {'full': 1, 'born': 1, 'tidal': 1, 'skip': 2}
+        beta_x, beta_y = self.multiLens.full_ray_tracing(self.lensAssembly, self.z_source, self.x, self.y)
+        beta_x_, beta_y_ = self.multiLens.full_ray_tracing(self.lensAssembly, self.z_source, self.x, self.y,
+                                                           tiered=True)
+        error = np.sqrt((beta_x_ - beta_x)**2 + (beta_y_ - beta_y)**2) / const.arcsec
+        assert np.max(error) < 0.01
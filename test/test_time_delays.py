@@ -0,0 +1,88 @@
+# Copyright (C) 2016 ETH Zurich, Institute for Astronomy
+
+"""
+Tests for the arrival times and time delays of the full ray-tracing.
+"""
+
+import numpy as np
+import numpy.testing as npt
+import pytest
+
+from MultiLens.MultiLens import MultiLens
+from MultiLens.Cosmo.cosmo import CosmoBatch
+from MultiLens.lens_assembly import LensAssembly
+from MultiLens.lens_object import LensObject
+import MultiLens.Utils.constants as const
+import MultiLens.Utils.utils as utils
+
+
+class TestTimeDelays(object):
+
+    def setup_method(self):
+        self.lensAssembly = LensAssembly()
+        lensObject = LensObject(redshift=0.5, type='SIS', main=True)
+        lensObject.add_info('kwargs_profile', {'sigma_v': 250*1000., 'pos_x': 0., 'pos_y': 0.})
+        self.lensAssembly.add_lens(lensObject)
+        self.multiLens = MultiLens()
+        cosmo = self.multiLens.cosmo
+        self.theta_E = 4*np.pi*(250*1000./const.c)**2 * cosmo.D_xy(0.5, 1.5)/cosmo.D_xy(0, 1.5) / const.arcsec
+        self.tau = 1.5 * cosmo.D_xy(0, 0.5)*cosmo.D_xy(0, 1.5)/cosmo.D_xy(0.5, 1.5) * const.Mpc/const.c/const.day_s
+
+    def test_single_plane(self):
+        beta = 0.2
+        x_image = np.array([beta + self.theta_E, beta - self.theta_E])
+        y_image = np.zeros(2)
+        dt = self.multiLens.time_delays(self.lensAssembly, 1.5, x_image, y_image)
+        dt_analytic = self.tau * (x_image[0]**2 - x_image[1]**2) / 2. * const.arcsec**2
+        npt.assert_allclose(dt, [0, dt_analytic], rtol=1e-8)
+        # batch of sources
+        dt = self.multiLens.time_delays(self.lensAssembly, 1.5, [x_image, -x_image], [y_image, y_image])
+        assert dt.shape == (2, 2)
+        npt.assert_allclose(dt[1], [0, dt_analytic], rtol=1e-8)
+
+    def test_massless_plane(self):
+        lensObject = LensObject(redshift=0.3, type='NFW')
+        lensObject.add_info('kwargs_profile', {'rho_s': 10**15, 'Rs': 0.05, 'pos_x': 0.4, 'pos_y': -0.3})
+        self.lensAssembly.add_lens(lensObject)
+        x, y = utils.make_grid(10, 0.3)
+        beta_x, beta_y, t = self.multiLens.full_ray_tracing(self.lensAssembly, 1.5, x, y, fermat=True)
+        # the geometric delays of an additional plane without deflection add up to the ones without it
+        lensObject = LensObject(redshift=0.8, type='SIS')
+        lensObject.add_info('kwargs_profile', {'sigma_v': 0., 'pos_x': 0., 'pos_y': 0.})
+        self.lensAssembly.add_lens(lensObject)
+        beta_x_, beta_y_, t_ = self.multiLens.full_ray_tracing(self.lensAssembly, 1.5, x, y, fermat=True)
+        npt.assert_allclose(beta_x_, beta_x, rtol=1e-10)
+        npt.assert_allclose(t_ - t_[0], t - t[0], rtol=1e-8, atol=1e-8)
+
+    def test_potential(self):
+        for lensObject in [LensObject(redshift=0.3, type='NFW'), LensObject(redshift=0.3, type='point_mass')]:
+            if lensObject.type == 'NFW':
+                lensObject.add_info('kwargs_profile', {'rho_s': 10**15, 'Rs': 0.05, 'pos_x': 0.4, 'pos_y': -0.3})
+            else:
+                lensObject.add_info('kwargs_profile', {'mass': 10**12, 'pos_x': 0.4, 'pos_y': -0.3})
+            lensObject.set_truncation(0.02)
+            pos_x, pos_y = lensObject.kwargs_param['pos_x'], lensObject.kwargs_param['pos_y']
+            x = pos_x + np.array([0.01, -0.005, 0.03, -0.05])
+            y = pos_y + np.array([0.004, 0.01, -0.02, 0.01])
+            h = 10**-7
+            f_x = (lensObject.potential(x + h, y) - lensObject.potential(x - h, y)) / (2*h)
+            f_y = (lensObject.potential(x, y + h) - lensObject.potential(x, y - h)) / (2*h)
+            alpha_x, alpha_y = lensObject.deflection(x, y)
+            npt.assert_allclose(f_x, alpha_x, rtol=1e-5)
+            npt.assert_allclose(f_y, alpha_y, rtol=1e-5)
+
+    def test_batch(self):
+        cosmoBatch = CosmoBatch(H0=[65, 75], Om0=0.3, Ob0=0.05)
+        x_image, y_image = np.array([1.5, -0.9]), np.array([0.2, 0.1])
+        dt = MultiLens(cosmo=cosmoBatch).time_delays(self.lensAssembly, 1.5, x_image, y_image)
+        assert dt.shape == (2, 2)
+        for i in range(2):
+            dt_ = MultiLens(cosmo=cosmoBatch[i]).time_delays(self.lensAssembly, 1.5, x_image, y_image)
+            npt.assert_allclose(dt[i], dt_, rtol=1e-8)
+
+    def test_raise(self):
+        x, y = utils.make_grid(10, 0.3)
+        with pytest.raises(ValueError):
+            self.multiLens.full_ray_tracing(self.lensAssembly, 1.5, x, y, fermat=True, cull_tolerance=0.01)
+        with pytest.raises(ValueError):
+            self.multiLens.time_delays(self.lensAssembly, 1.5, np.zeros(3), np.zeros(2))